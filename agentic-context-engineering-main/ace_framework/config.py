@@ -67,6 +67,36 @@ class ExperimentConfig:
         os.makedirs(self.output_dir, exist_ok=True)
 
 
+@dataclass
+class PlaybookConfig:
+    """Playbook store configuration
+
+    dedup_threshold: cosine similarity at or above which a curated bullet is
+        treated as a duplicate of an existing one (<= 0 disables dedup)
+    token_budget: approximate token limit for the playbook text in prompts;
+        the top bullets by score are kept (0 renders every bullet)
+
+    Both can be overridden with ACE_PLAYBOOK_DEDUP_THRESHOLD and
+    ACE_PLAYBOOK_TOKEN_BUDGET.
+    """
+    dedup_threshold: float = 0.92
+    token_budget: int = 2000
+
+    def __post_init__(self):
+        env_threshold = os.environ.get("ACE_PLAYBOOK_DEDUP_THRESHOLD")
+        if env_threshold:
+            try:
+                self.dedup_threshold = float(env_threshold)
+            except ValueError:
+                pass
+        env_budget = os.environ.get("ACE_PLAYBOOK_TOKEN_BUDGET")
+        if env_budget:
+            try:
+                self.token_budget = int(env_budget)
+            except ValueError:
+                pass
+
+
 @dataclass
 class PromptConfig:
     """Prompt templates configuration"""
@@ -94,11 +124,13 @@ class Config:
         self,
         model_config: Optional[ModelConfig] = None,
         experiment_config: Optional[ExperimentConfig] = None,
-        prompt_config: Optional[PromptConfig] = None
+        prompt_config: Optional[PromptConfig] = None,
+        playbook_config: Optional[PlaybookConfig] = None
     ):
         self.model = model_config or ModelConfig()
         self.experiment = experiment_config or ExperimentConfig()
         self.prompt = prompt_config or PromptConfig()
+        self.playbook = playbook_config or PlaybookConfig()
     
     @classmethod
     def default(cls) -> "Config":
@@ -111,5 +143,6 @@ class Config:
         return cls(
             model_config=ModelConfig(**config_dict.get("model", {})),
             experiment_config=ExperimentConfig(**config_dict.get("experiment", {})),
-            prompt_config=PromptConfig(**config_dict.get("prompt", {}))
+            prompt_config=PromptConfig(**config_dict.get("prompt", {})),
+            playbook_config=PlaybookConfig(**config_dict.get("playbook", {}))
         )
\ No newline at end of file
@@ -27,7 +27,10 @@ class ACEFramework:
         self.config = config or Config.default()
         
         # Initialize components
-        self.playbook = Playbook()
+        self.playbook = Playbook(
+            dedup_threshold=self.config.playbook.dedup_threshold,
+            token_budget=self.config.playbook.token_budget
+        )
         self.metrics = MetricsTracker()
         
         # Initialize agents
@@ -90,7 +93,11 @@ class ACEFramework:
         operations = self.curator.curate(reflection, self.playbook)
         for op in operations:
             if op["type"] == "ADD":
-                bullet = self.playbook.add_bullet(op["section"], op["content"])
+                bullet, added = self.playbook.merge_bullet(op["section"], op["content"])
+                if not added:
+                    if verbose:
+                        print(f"  ♻️ Duplicate of [{bullet.id}], skipped: {op['content'][:60]}...")
+                    continue
                 self.metrics.record_playbook_update()
                 if verbose:
                     print(f"  ➕ Added: [{bullet.id}] {op['content'][:60]}...")
@@ -155,7 +162,11 @@ class ACEFramework:
         operations = self.curator.curate(reflection, self.playbook)
         for op in operations:
             if op["type"] == "ADD":
-                bullet = self.playbook.add_bullet(op["section"], op["content"])
+                bullet, added = self.playbook.merge_bullet(op["section"], op["content"])
+                if not added:
+                    if verbose:
+                        print(f"  ♻️ Duplicate of [{bullet.id}], skipped: {op['content'][:60]}...")
+                    continue
                 self.metrics.record_playbook_update()
                 if verbose:
                     print(f"  ➕ Added: [{bullet.id}] {op['content'][:60]}...")
@@ -1,17 +1,103 @@
-"""Playbook model - manages collection of bullets"""
+"""Playbook model - manages collection of bullets
+
+Bullets are indexed by id and by section (insertion-ordered dicts), so lookups,
+feedback updates and removals do not scan the whole playbook. The formatted
+prompt text is cached per token budget and dropped on every mutation. Curated
+strategies go through `merge_bullet`, which skips a new bullet when an existing
+one is a near-duplicate by embedding cosine similarity.
+"""
 import json
-from typing import List, Dict, Any, Optional
+import logging
+import math
+import re
+import zlib
+from typing import Callable, List, Dict, Any, Optional, Sequence, Set, Tuple
 from pathlib import Path
 from .bullet import Bullet
 
+logger = logging.getLogger(__name__)
+
+# Maps a batch of texts to one vector per text (same order)
+Embedder = Callable[[List[str]], List[Sequence[float]]]
+
+EMPTY_PLAYBOOK_TEXT = "No strategies yet. This is your first attempt."
+HASHED_EMBEDDING_DIM = 512
+
+_CJK_RE = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: one per CJK character, one per ~4 other characters"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def hashed_embedding(texts: List[str]) -> List[List[float]]:
+    """Dependency-free fallback embedder: hashed character trigram counts"""
+    vectors = []
+    for text in texts:
+        norm = " " + re.sub(r"\s+", " ", (text or "").lower()).strip() + " "
+        vec = [0.0] * HASHED_EMBEDDING_DIM
+        for i in range(len(norm) - 2):
+            vec[zlib.crc32(norm[i:i + 3].encode("utf-8")) % HASHED_EMBEDDING_DIM] += 1.0
+        vectors.append(vec)
+    return vectors
+
+
+def _unit(vec: Sequence[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vec))
+    if norm == 0:
+        return [0.0] * len(vec)
+    return [x / norm for x in vec]
+
 
 class Playbook:
     """Dynamic playbook that accumulates strategies"""
-    
-    def __init__(self):
-        self.bullets: List[Bullet] = []
+
+    def __init__(
+        self,
+        dedup_threshold: float = 0.92,
+        token_budget: int = 0,
+        embedder: Optional[Embedder] = None
+    ):
+        """
+        Args:
+            dedup_threshold: Cosine similarity at or above which a merged bullet
+                counts as a duplicate (<= 0 disables deduplication)
+            token_budget: Approximate token limit for the formatted playbook
+                (0 renders every bullet)
+            embedder: Batch text embedder used for deduplication
+                (defaults to hashed character trigrams)
+        """
+        self._by_id: Dict[str, Bullet] = {}
+        self._sections: Dict[str, Dict[str, Bullet]] = {}
         self.next_id: int = 1
-    
+        self.dedup_threshold = dedup_threshold
+        self.token_budget = token_budget
+        self._embedder: Embedder = embedder or hashed_embedding
+        # bullet id -> unit vector from the current embedder
+        self._vectors: Dict[str, List[float]] = {}
+        # token budget -> formatted text
+        self._format_cache: Dict[int, str] = {}
+        self.duplicates_skipped = 0
+
+    @property
+    def bullets(self) -> List[Bullet]:
+        """All bullets in insertion order"""
+        return list(self._by_id.values())
+
+    def _index(self, bullet: Bullet) -> None:
+        self._by_id[bullet.id] = bullet
+        self._sections.setdefault(bullet.section, {})[bullet.id] = bullet
+        self._format_cache.clear()
+
+    def set_embedder(self, embedder: Optional[Embedder], dedup_threshold: Optional[float] = None) -> None:
+        """Switch the deduplication embedder (cached vectors are dropped)"""
+        self._embedder = embedder or hashed_embedding
+        self._vectors.clear()
+        if dedup_threshold is not None:
+            self.dedup_threshold = dedup_threshold
+
     def add_bullet(self, section: str, content: str) -> Bullet:
         """Add a new bullet to the playbook"""
         bullet = Bullet(
@@ -19,102 +105,204 @@ class Playbook:
             section=section,
             content=content
         )
-        self.bullets.append(bullet)
+        self._index(bullet)
         self.next_id += 1
         return bullet
-    
+
+    def _embed_query(self, content: str) -> List[float]:
+        """Embed content together with any bullets that have no cached vector yet"""
+        missing = [b for b in self._by_id.values() if b.id not in self._vectors]
+        vectors = self._embedder([b.content for b in missing] + [content])
+        if len(vectors) != len(missing) + 1:
+            raise ValueError(f"embedder returned {len(vectors)} vectors for {len(missing) + 1} texts")
+        for bullet, vec in zip(missing, vectors):
+            self._vectors[bullet.id] = _unit(vec)
+        return _unit(vectors[-1])
+
+    def _most_similar(self, query: List[float]) -> Tuple[Optional[Bullet], float]:
+        best_id, best_sim = None, -1.0
+        for bullet_id, vec in self._vectors.items():
+            if len(vec) != len(query):
+                continue
+            sim = sum(a * b for a, b in zip(query, vec))
+            if sim > best_sim:
+                best_id, best_sim = bullet_id, sim
+        return self._by_id.get(best_id) if best_id else None, best_sim
+
+    def find_duplicate(self, content: str) -> Optional[Bullet]:
+        """Return an existing bullet that is a near-duplicate of content, if any"""
+        if self.dedup_threshold <= 0 or not self._by_id:
+            return None
+        bullet, sim = self._most_similar(self._embed_query(content))
+        return bullet if sim >= self.dedup_threshold else None
+
+    def merge_bullet(self, section: str, content: str) -> Tuple[Bullet, bool]:
+        """
+        Add a bullet unless a near-duplicate already exists
+
+        Returns:
+            (bullet, added): the new bullet, or the existing duplicate with added=False
+        """
+        query = None
+        if self.dedup_threshold > 0 and self._by_id:
+            try:
+                query = self._embed_query(content)
+            except Exception as e:
+                logger.warning(f"Playbook dedup skipped, embedding failed: {e}")
+            if query is not None:
+                existing, sim = self._most_similar(query)
+                if existing is not None and sim >= self.dedup_threshold:
+                    self.duplicates_skipped += 1
+                    logger.info(f"Skipped near-duplicate of [{existing.id}] (similarity {sim:.3f})")
+                    return existing, False
+        bullet = self.add_bullet(section, content)
+        if query is not None:
+            self._vectors[bullet.id] = query
+        return bullet, True
+
     def get_bullet_by_id(self, bullet_id: str) -> Optional[Bullet]:
         """Retrieve bullet by ID"""
-        for bullet in self.bullets:
-            if bullet.id == bullet_id:
-                return bullet
-        return None
-    
+        return self._by_id.get(bullet_id)
+
     def update_feedback(self, bullet_id: str, is_helpful: bool) -> bool:
         """Update helpful/harmful counts for a bullet"""
         bullet = self.get_bullet_by_id(bullet_id)
         if bullet:
             bullet.update_feedback(is_helpful)
+            self._format_cache.clear()
             return True
         return False
 
     def remove_bullet(self, bullet_id: str) -> bool:
         """Remove a bullet from the playbook."""
-        before = len(self.bullets)
-        self.bullets = [b for b in self.bullets if b.id != bullet_id]
-        return len(self.bullets) < before
-    
+        bullet = self._by_id.pop(bullet_id, None)
+        if bullet is None:
+            return False
+        section = self._sections.get(bullet.section)
+        if section is not None:
+            section.pop(bullet_id, None)
+            if not section:
+                del self._sections[bullet.section]
+        self._vectors.pop(bullet_id, None)
+        self._format_cache.clear()
+        return True
+
     def get_bullets_by_section(self, section: str) -> List[Bullet]:
         """Get all bullets in a section"""
-        return [b for b in self.bullets if b.section == section]
-    
-    def get_formatted_playbook(self) -> str:
-        """Get formatted playbook text for prompts"""
-        if not self.bullets:
-            return "No strategies yet. This is your first attempt."
-        
-        sections = {}
-        for bullet in self.bullets:
-            if bullet.section not in sections:
-                sections[bullet.section] = []
-            sections[bullet.section].append(bullet)
-        
+        return list(self._sections.get(section, {}).values())
+
+    @staticmethod
+    def _section_header(section: str) -> str:
+        return f"\n## {section.replace('_', ' ').title()}\n"
+
+    def _ordered_sections(self, order: Dict[str, int]) -> List[Tuple[str, Dict[str, Bullet]]]:
+        """Sections ordered by their earliest remaining bullet"""
+        return sorted(self._sections.items(), key=lambda item: order[next(iter(item[1]))])
+
+    def _select_within_budget(self, token_budget: int, order: Dict[str, int]) -> Set[str]:
+        """Ids of the top-scoring bullets whose rendering fits the budget"""
+        ranked = sorted(
+            self._by_id.values(),
+            key=lambda b: (-b.get_score(), -b.helpful, order[b.id])
+        )
+        selected: Set[str] = set()
+        opened: Set[str] = set()
+        used = 0
+        for bullet in ranked:
+            cost = estimate_tokens(str(bullet))
+            if bullet.section not in opened:
+                cost += estimate_tokens(self._section_header(bullet.section))
+            if used + cost > token_budget:
+                continue
+            used += cost
+            selected.add(bullet.id)
+            opened.add(bullet.section)
+        return selected
+
+    def get_formatted_playbook(self, token_budget: Optional[int] = None) -> str:
+        """
+        Get formatted playbook text for prompts
+
+        Args:
+            token_budget: Approximate token limit (defaults to self.token_budget;
+                0 renders every bullet). Over budget, the top bullets by
+                get_score() are kept in their usual section order.
+        """
+        if not self._by_id:
+            return EMPTY_PLAYBOOK_TEXT
+
+        budget = self.token_budget if token_budget is None else token_budget
+        budget = max(0, int(budget or 0))
+        cached = self._format_cache.get(budget)
+        if cached is not None:
+            return cached
+
+        order = {bullet_id: i for i, bullet_id in enumerate(self._by_id)}
+        selected = self._select_within_budget(budget, order) if budget else None
         formatted = []
-        for section, bullets in sections.items():
-            formatted.append(f"\n## {section.replace('_', ' ').title()}\n")
-            for bullet in bullets:
+        for section, bullets in self._ordered_sections(order):
+            chosen = [b for b in bullets.values() if selected is None or b.id in selected]
+            if not chosen:
+                continue
+            formatted.append(self._section_header(section))
+            for bullet in chosen:
                 formatted.append(str(bullet))
-        
-        return "\n".join(formatted)
-    
+
+        text = "\n".join(formatted)
+        self._format_cache[budget] = text
+        return text
+
     def get_statistics(self) -> Dict[str, Any]:
         """Get playbook statistics"""
-        if not self.bullets:
+        if not self._by_id:
             return {
                 "total_bullets": 0,
                 "sections": {},
-                "avg_score": 0.0
+                "avg_score": 0.0,
+                "duplicates_skipped": self.duplicates_skipped
             }
-        
-        sections = {}
-        total_score = 0.0
-        
-        for bullet in self.bullets:
-            if bullet.section not in sections:
-                sections[bullet.section] = 0
-            sections[bullet.section] += 1
-            total_score += bullet.get_score()
-        
+
+        total_score = sum(bullet.get_score() for bullet in self._by_id.values())
+
         return {
-            "total_bullets": len(self.bullets),
-            "sections": sections,
-            "avg_score": total_score / len(self.bullets) if self.bullets else 0.0
+            "total_bullets": len(self._by_id),
+            "sections": {
+                section: len(bullets)
+                for section, bullets in self._ordered_sections({b: i for i, b in enumerate(self._by_id)})
+            },
+            "avg_score": total_score / len(self._by_id),
+            "duplicates_skipped": self.duplicates_skipped
         }
-    
+
     def save(self, filepath: str) -> None:
         """Save playbook to JSON file"""
         Path(filepath).parent.mkdir(parents=True, exist_ok=True)
         with open(filepath, 'w') as f:
-            json.dump([b.to_dict() for b in self.bullets], f, indent=2)
-    
+            json.dump([b.to_dict() for b in self._by_id.values()], f, indent=2)
+
     def load(self, filepath: str) -> None:
         """Load playbook from JSON file"""
         with open(filepath, 'r') as f:
             data = json.load(f)
-        
-        self.bullets = [Bullet.from_dict(b) for b in data]
-        
+
+        self._by_id = {}
+        self._sections = {}
+        self._vectors.clear()
+        self._format_cache.clear()
+        for item in data:
+            self._index(Bullet.from_dict(item))
+
         # Update next_id based on loaded bullets
-        if self.bullets:
-            max_id = max(int(b.id.split('-')[1]) for b in self.bullets)
+        if self._by_id:
+            max_id = max(int(bullet_id.split('-')[1]) for bullet_id in self._by_id)
             self.next_id = max_id + 1
         else:
             self.next_id = 1
-    
+
     def __len__(self) -> int:
         """Get number of bullets"""
-        return len(self.bullets)
-    
+        return len(self._by_id)
+
     def __iter__(self):
         """Iterate over bullets"""
-        return iter(self.bullets)
\ No newline at end of file
+        return iter(list(self._by_id.values()))
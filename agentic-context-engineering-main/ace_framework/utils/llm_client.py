@@ -14,6 +14,13 @@ from typing import Dict, Any, Optional
 
 from litellm import completion
 
+try:
+    # Inside the backend the shared gateway adds provider concurrency limits,
+    # coalescing and metrics; standalone ACE runs call litellm directly.
+    from src.llm_gateway import llm_gateway
+except ImportError:  # pragma: no cover
+    llm_gateway = None
+
 
 logger = logging.getLogger(__name__)
 
@@ -70,16 +77,20 @@ class LLMClient:
         understands both DashScope and Ollama-compatible endpoints.
         """
 
-        resp = completion(
-            model=self.model_name,
-            api_base=self.api_base,
-            api_key=self.api_key,
-            messages=[
+        kwargs = {
+            "model": self.model_name,
+            "api_base": self.api_base,
+            "api_key": self.api_key,
+            "messages": [
                 {"role": "user", "content": prompt},
             ],
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        if llm_gateway is not None:
+            resp = llm_gateway.complete(kwargs, tag="ace")
+        else:
+            resp = completion(**kwargs)
 
         # litellm returns an OpenAI-style response with choices.
         try:
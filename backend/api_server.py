@@ -8,6 +8,7 @@ import json
 import re
 import mimetypes
 import time
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Literal
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Query, Body
@@ -25,6 +26,12 @@ if str(project_root) not in sys.path:
 load_dotenv(project_root / ".env")
 
 from src.kb_chat.routes import router as kb_chat_router
+from src import graph_version
+from src.kb_chat import conversations_store as kb_conversations_store
+from src.kb_chat.cypher_cache import cypher_cache as kb_cypher_cache
+from src.kb_chat.service import entity_index as kb_entity_index, schema_service as kb_schema_service
+from src.kb_chat.evidence_cache import evidence_cache as kb_evidence_cache
+from src.kb_chat.session_state import session_state as kb_session_state
 from src.dingtalk_auth import router as dingtalk_auth_router
 from src.image_library import router as image_library_router
 
@@ -91,7 +98,16 @@ from src.specsheet_storage import (
     save_specsheet_for_session,
     load_specsheet_for_session,
 )
-from src.ace_integration import get_ace_manager, save_pending_sample, load_pending_sample, store_ace_sample, clear_pending_sample
+from src.ace_integration import (
+    PLOT_KINDS as ACE_PLOT_KINDS,
+    ace_persistence_stats,
+    clear_pending_sample,
+    get_ace_manager,
+    load_pending_sample,
+    save_pending_sample,
+    shutdown_ace_persistence,
+    store_ace_sample,
+)
 from src.poster_image_edit import PosterImageEditInputs, generate_poster_image_edit as run_poster_image_edit
 from src.bom_models import (
     BomGenerationRequest,
@@ -114,6 +130,13 @@ from src.manual_ocr import (
     clear_manual_history,
 )
 from src.manual_progress import progress_manager
+from src.neo4j_pool import neo4j_pool
+from src.embedding_cache import embedding_cache
+from src.ocr_worker import ocr_worker, ocr_worker_enabled, ocr_worker_preload_enabled
+from src.executors import executor_stats, run_cpu, run_db, run_llm, shutdown_executors
+from src.llm_gateway import llm_gateway
+from src.job_queue import JobHandle, JobType, job_manager
+from src.context_bundle import context_bundles
 from src.manual_book import (
     MANUAL_BOOK_SYSTEM_PROMPT,
     generate_manual_book_from_ocr as run_manual_book_from_ocr,
@@ -192,8 +215,39 @@ def _write_prompt_snapshot_files(
 
 load_dotenv()
 
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    try:
+        neo4j_pool.start()
+    except Exception as exc:  # noqa: BLE001
+        # Neo4j 不可用时不阻塞启动，首次查询时会再尝试创建 driver
+        print(f"[Neo4jPool] Failed to start shared driver: {exc}")
+    if ocr_worker_enabled() and ocr_worker_preload_enabled():
+        # 预热 OCR 进程，模型加载在子进程中进行，不阻塞启动
+        ocr_worker.start()
+    # kb_chat schema 在后台线程里加载和定期刷新，请求不再同步扫描全图
+    kb_schema_service.start()
+    kb_entity_index.mark_dirty("startup")
+    # 恢复上次进程未完成的生成任务
+    job_manager.start()
+    try:
+        yield
+    finally:
+        # 未完成的任务保留在 SQLite 中，重启后继续执行
+        job_manager.stop()
+        kb_schema_service.stop()
+        # 把还在写回队列里的对话消息落盘
+        kb_conversations_store.stop_writer()
+        # 写完 ACE 指标日志/规则快照，并压缩 metrics.json
+        shutdown_ace_persistence()
+        ocr_worker.stop()
+        shutdown_executors()
+        neo4j_pool.stop()
+
+
 # Create FastAPI app
-app = FastAPI(title="Product Specsheet API", version="1.0.0")
+app = FastAPI(title="Product Specsheet API", version="1.0.0", lifespan=lifespan)
 
 app.include_router(kb_chat_router)
 app.include_router(dingtalk_auth_router)
@@ -359,6 +413,94 @@ async def root():
     return {"message": "Product Specsheet API", "version": "1.0.0"}
 
 
+@app.get("/api/admin/neo4j/pool")
+async def get_neo4j_pool_metrics():
+    """Shared Neo4j driver pool metrics: in-use leases, acquisition wait, churn."""
+    return neo4j_pool.metrics()
+
+
+@app.get("/api/admin/embedding/cache")
+async def get_embedding_cache_stats():
+    """Embedding cache size and hit/miss counters."""
+    return embedding_cache.stats()
+
+
+@app.get("/api/admin/executors")
+async def get_executor_stats():
+    """Worker pool utilisation for db / llm / cpu work."""
+    return executor_stats()
+
+
+@app.get("/api/admin/llm/gateway")
+async def get_llm_gateway_stats():
+    """Per-provider LLM concurrency and per-call-site latency/token metrics."""
+    return llm_gateway.stats()
+
+
+@app.get("/api/admin/kb/schema")
+async def get_kb_schema_stats():
+    """kb_chat schema service state, usage ranking and the current prompt digest."""
+    stats = kb_schema_service.stats()
+    stats["digest"] = await run_db(kb_schema_service.digest)
+    return stats
+
+
+@app.get("/api/admin/kb/entity_index")
+async def get_kb_entity_index_stats():
+    """kb_chat entity n-gram index size, age and rebuild state."""
+    return kb_entity_index.stats()
+
+
+@app.get("/api/admin/kb/cypher_cache")
+async def get_kb_cypher_cache_stats():
+    """Text2Cypher plan/result cache hit ratios and graph version bumps."""
+    return {"cache": kb_cypher_cache.stats(), "graph_version": graph_version.stats()}
+
+
+@app.get("/api/admin/kb/session_state")
+async def get_kb_session_state_stats():
+    """kb_chat per-session state store size, evictions and SQLite activity, plus evidence cache hits."""
+    stats = kb_session_state.stats()
+    stats["evidence_cache"] = kb_evidence_cache.stats()
+    return stats
+
+
+@app.get("/api/admin/kb/conversations_store")
+async def get_kb_conversations_store_stats():
+    """kb_chat conversation DB connections and write-behind queue state."""
+    return kb_conversations_store.store_stats()
+
+
+@app.post("/api/admin/kb/cypher_cache/clear")
+async def clear_kb_cypher_cache():
+    kb_cypher_cache.clear()
+    return {"ok": True}
+
+
+@app.get("/api/admin/jobs")
+async def get_job_stats():
+    """Generation job queue: pending/running per type, caps, recoveries."""
+    return job_manager.stats()
+
+
+@app.get("/api/admin/context_bundles")
+async def get_context_bundle_stats():
+    """Per-session OCR context bundle hits, disk loads and invalidations."""
+    return context_bundles.stats()
+
+
+@app.get("/api/admin/ace/persistence")
+async def get_ace_persistence_stats():
+    """ACE background writer per playbook type: queued ops, batches, compactions."""
+    return ace_persistence_stats()
+
+
+@app.get("/api/admin/ocr/worker")
+async def get_ocr_worker_stats():
+    """OCR worker process state: queue depth, batch sizes, failures."""
+    return ocr_worker.stats()
+
+
 @app.get("/api/products")
 async def get_products():
     """
@@ -368,7 +510,7 @@ async def get_products():
         JSON object with list of product names
     """
     try:
-        products = get_all_product_names()
+        products = await run_db(get_all_product_names)
         return {"products": products}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch products: {str(e)}")
@@ -378,7 +520,7 @@ async def get_products():
 async def get_accessories():
     """Get all unique accessory names."""
     try:
-        accessories = get_all_accessory_names()
+        accessories = await run_db(get_all_accessory_names)
         return {"accessories": accessories}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch accessories: {str(e)}")
@@ -388,7 +530,7 @@ async def get_accessories():
 async def get_materials():
     """Get all material codes."""
     try:
-        materials = get_all_material_codes()
+        materials = await run_db(get_all_material_codes)
         return {"materials": materials}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch materials: {str(e)}")
@@ -398,7 +540,7 @@ async def get_materials():
 async def get_material_boms(material_code: str):
     """Get BOM ids for a material_code."""
     try:
-        boms = get_boms_by_material_code(material_code)
+        boms = await run_db(get_boms_by_material_code, material_code)
         return {"boms": boms}
     except Exception as e:
         raise HTTPException(
@@ -410,7 +552,7 @@ async def get_material_boms(material_code: str):
 @app.get("/api/materials/{material_code}/image")
 async def get_material_image(material_code: str):
     try:
-        data = get_material_image_by_material_code(material_code)
+        data = await run_db(get_material_image_by_material_code, material_code)
         return data
     except Exception as e:
         raise HTTPException(
@@ -422,7 +564,7 @@ async def get_material_image(material_code: str):
 @app.get("/api/products/{product_name}/image")
 async def get_product_image(product_name: str):
     try:
-        data = get_product_image_by_product_name(product_name)
+        data = await run_db(get_product_image_by_product_name, product_name)
         return data
     except Exception as e:
         raise HTTPException(
@@ -435,7 +577,7 @@ async def get_product_image(product_name: str):
 async def get_material_bom_accessories(material_code: str, bom_id: str):
     """Get accessory Chinese names for a material_code + bom_id."""
     try:
-        accessories = get_accessories_zh_by_material_bom(material_code, bom_id)
+        accessories = await run_db(get_accessories_zh_by_material_bom, material_code, bom_id)
         return {"accessories": accessories}
     except Exception as e:
         raise HTTPException(
@@ -456,7 +598,7 @@ async def get_product_boms(product_name: str):
         JSON object with list of BOM versions
     """
     try:
-        boms = get_boms_by_product_id(product_name)
+        boms = await run_db(get_boms_by_product_id, product_name)
         if not boms:
             raise HTTPException(
                 status_code=404,
@@ -476,7 +618,7 @@ async def get_product_boms(product_name: str):
 async def get_product_bom_accessories(product_name: str, bom_version: str):
     """Get accessories connected to a product and BOM."""
     try:
-        accessories = get_accessories_by_product_bom_id(product_name, bom_version)
+        accessories = await run_db(get_accessories_by_product_bom_id, product_name, bom_version)
         return {"accessories": accessories}
     except Exception as e:
         raise HTTPException(
@@ -491,7 +633,7 @@ async def get_product_bom_accessories(product_name: str, bom_version: str):
 async def get_product_bom_documents(product_name: str, bom_version: str):
     """Get documents linked to a product BOM."""
     try:
-        documents = get_documents_by_product_bom(product_name, bom_version)
+        documents = await run_db(get_documents_by_product_bom, product_name, bom_version)
         return {"documents": documents}
     except Exception as e:
         raise HTTPException(
@@ -506,7 +648,7 @@ async def get_product_bom_documents(product_name: str, bom_version: str):
 async def get_product_kb_overview(product_id: str):
     """Get KB overview for a product_id using Dataset/Folder/Document + HAS_DOC schema."""
     try:
-        data = get_kb_overview_by_product_id(product_id)
+        data = await run_db(get_kb_overview_by_product_id, product_id)
         return data
     except Exception as e:
         raise HTTPException(
@@ -519,7 +661,7 @@ async def get_product_kb_overview(product_id: str):
 async def update_product_config(product_id: str, payload: ProductConfigUpdateRequest):
     """Update product config_text_zh and persist to Neo4j ProductConfig."""
     try:
-        return update_product_config_text_zh(product_id, payload.config_text_zh)
+        return await run_db(update_product_config_text_zh, product_id, payload.config_text_zh)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -530,7 +672,7 @@ async def update_product_config(product_id: str, payload: ProductConfigUpdateReq
 async def get_accessory_documents(accessory_name: str):
     """Get documents linked to a specific accessory."""
     try:
-        documents = get_documents_by_accessory(accessory_name)
+        documents = await run_db(get_documents_by_accessory, accessory_name)
         return {"documents": documents}
     except Exception as e:
         raise HTTPException(
@@ -543,7 +685,7 @@ async def get_accessory_documents(accessory_name: str):
 async def list_unmatched_documents():
     """List documents that are not attached to any product/accessory."""
     try:
-        return get_unmatched_documents()
+        return await run_db(get_unmatched_documents)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch unmatched documents: {str(e)}")
 
@@ -552,7 +694,8 @@ async def list_unmatched_documents():
 async def attach_document(payload: DocumentAttachRequest):
     """Attach an unmatched document to a product or accessory."""
     try:
-        attached = attach_document_to_owner(
+        attached = await run_db(
+            attach_document_to_owner,
             payload.doc_path,
             target_type=payload.target_type,
             product_name=payload.product_name,
@@ -570,7 +713,7 @@ async def attach_document(payload: DocumentAttachRequest):
 async def fetch_unmatched_document_detail(doc_path: str):
     """Return content for an unmatched document (Document or Unknown)."""
     try:
-        return get_unmatched_document_detail(doc_path)
+        return await run_db(get_unmatched_document_detail, doc_path)
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except ValueError as e:
@@ -583,7 +726,7 @@ async def fetch_unmatched_document_detail(doc_path: str):
 async def fetch_document_detail(doc_path: str):
     """Return metadata plus file content for a specific document path."""
     try:
-        return get_document_detail(doc_path)
+        return await run_db(get_document_detail, doc_path)
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except ValueError as e:
@@ -596,7 +739,8 @@ async def fetch_document_detail(doc_path: str):
 async def update_document(doc_path: str, payload: DocumentUpdateRequest):
     """Update document content (and optionally rename) while refreshing embeddings."""
     try:
-        updated = update_document_content(doc_path, payload.content, payload.new_name)
+        # 变更的 chunk 需要重新 embedding，走 llm 池
+        updated = await run_llm(update_document_content, doc_path, payload.content, payload.new_name)
         return updated
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -610,7 +754,7 @@ async def update_document(doc_path: str, payload: DocumentUpdateRequest):
 async def remove_document(doc_path: str):
     """Delete a document and its derived data."""
     try:
-        metadata = delete_document(doc_path)
+        metadata = await run_db(delete_document, doc_path)
         return {"deleted": metadata}
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -624,7 +768,8 @@ async def remove_document(doc_path: str):
 async def move_document(doc_path: str, payload: DocumentMoveRequest):
     """Move a document to a new product or accessory owner."""
     try:
-        moved = move_document_owner(
+        moved = await run_db(
+            move_document_owner,
             doc_path,
             target_type=payload.target_type,
             product_name=payload.product_name,
@@ -700,18 +845,18 @@ async def generate_poster_copy(
         raise HTTPException(status_code=500, detail=f"海报文案生成失败: {exc}") from exc
 
 
-@app.post("/api/poster/generate_image_edit")
-async def generate_poster_image_edit_endpoint(
-    payload: PosterGenerateImageEditRequest = Body(...),
-):
+def _validate_poster_image_edit_job(payload: PosterGenerateImageEditRequest) -> None:
+    if not (payload.reference_image_url or "").strip():
+        raise ValueError("请提供 reference_image_url")
+    if not (payload.product_image_url or "").strip():
+        raise ValueError("请提供 product_image_url")
+    if not isinstance(payload.step1_result, dict) or not payload.step1_result:
+        raise ValueError("请提供 step1_result")
+
+
+def _poster_image_edit_job(payload: PosterGenerateImageEditRequest, job: JobHandle) -> Dict[str, Any]:
     ref_url = (payload.reference_image_url or "").strip()
     prod_url = (payload.product_image_url or "").strip()
-    if not ref_url:
-        raise HTTPException(status_code=400, detail="请提供 reference_image_url")
-    if not prod_url:
-        raise HTTPException(status_code=400, detail="请提供 product_image_url")
-    if not isinstance(payload.step1_result, dict) or not payload.step1_result:
-        raise HTTPException(status_code=400, detail="请提供 step1_result")
 
     try:
         W = int(payload.output_width or 0)
@@ -737,25 +882,46 @@ async def generate_poster_image_edit_endpoint(
     if H <= 0:
         H = 1500
 
+    inputs = PosterImageEditInputs(
+        reference_image_url=ref_url,
+        product_image_url=prod_url,
+        background_image_url=(payload.background_image_url or None),
+        step1_result=payload.step1_result,
+        product_name=(payload.product_name or None),
+        bom_code=(payload.bom_code or None),
+        title=str(payload.title or ""),
+        subtitle=str(payload.subtitle or ""),
+        sellpoints=[str(s or "") for s in (payload.sellpoints or [])],
+        output_width=W,
+        output_height=H,
+        watermark=bool(payload.watermark) if payload.watermark is not None else True,
+        negative_prompt=str(payload.negative_prompt or ""),
+    )
+    return run_poster_image_edit(payload=inputs)
+
+
+job_manager.register(
+    JobType(
+        "poster_image_edit",
+        PosterGenerateImageEditRequest,
+        _poster_image_edit_job,
+        validate=_validate_poster_image_edit_job,
+        max_concurrency=1,
+    )
+)
+
+
+@app.post("/api/poster/generate_image_edit")
+async def generate_poster_image_edit_endpoint(
+    payload: PosterGenerateImageEditRequest = Body(...),
+):
+    """Synchronous wrapper over the "poster_image_edit" job; prefer POST /api/jobs/poster_image_edit."""
     try:
-        inputs = PosterImageEditInputs(
-            reference_image_url=ref_url,
-            product_image_url=prod_url,
-            background_image_url=(payload.background_image_url or None),
-            step1_result=payload.step1_result,
-            product_name=(payload.product_name or None),
-            bom_code=(payload.bom_code or None),
-            title=str(payload.title or ""),
-            subtitle=str(payload.subtitle or ""),
-            sellpoints=[str(s or "") for s in (payload.sellpoints or [])],
-            output_width=W,
-            output_height=H,
-            watermark=bool(payload.watermark) if payload.watermark is not None else True,
-            negative_prompt=str(payload.negative_prompt or ""),
-        )
-        return run_poster_image_edit(payload=inputs)
+        return await job_manager.run("poster_image_edit", payload)
     except HTTPException:
         raise
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"海报生成失败: {exc}") from exc
 
@@ -774,10 +940,10 @@ async def insert_manual_product(payload: InsertProductRequest):
     truth_documents = []
     session_record = None
     if payload.session_id:
-        session_record = load_session_record(payload.session_id)
+        session_record = await run_db(load_session_record, payload.session_id)
         if session_record:
             session_documents = extract_documents_from_session(session_record)
-        truth_documents = extract_truth_documents(payload.session_id)
+        truth_documents = await run_db(extract_truth_documents, payload.session_id)
 
     combined_documents = provided_documents + session_documents + truth_documents
 
@@ -787,7 +953,8 @@ async def insert_manual_product(payload: InsertProductRequest):
         )
 
     try:
-        result = insert_product_with_documents(
+        result = await run_llm(
+            insert_product_with_documents,
             product_name,
             display_name=payload.display_name,
             bom_code=payload.bom_code,
@@ -831,7 +998,8 @@ async def create_manual_session(
 @app.post("/api/manual-sessions/init")
 async def init_manual_session(payload: ManualSessionInitRequest):
     try:
-        return init_manual_session_entry(
+        return await run_db(
+            init_manual_session_entry,
             payload.product_name,
             payload.bom_code,
             payload.bom_type,
@@ -873,7 +1041,7 @@ async def append_manual_session_files(
 async def delete_manual_session_file(session_id: str, path: str = Query(...)):
     """Delete one original upload file from a manual session."""
     try:
-        return delete_manual_session_upload(session_id, path)
+        return await run_db(delete_manual_session_upload, session_id, path)
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
     except Exception as exc:  # noqa: BLE001
@@ -897,7 +1065,7 @@ async def trigger_prompt_reverse(session_id: str, payload: dict | None = Body(de
 async def manual_ocr_history(limit: int = 50):
     safe_limit = max(1, min(limit, 200))
     try:
-        history = list_session_records(safe_limit)
+        history = await run_db(list_session_records, safe_limit)
         return {"history": history}
     except Exception as exc:  # noqa: BLE001
         raise HTTPException(status_code=500, detail=f"Failed to fetch manual OCR history: {exc}") from exc
@@ -905,12 +1073,57 @@ async def manual_ocr_history(limit: int = 50):
 
 @app.get("/api/manual-sessions/{session_id}")
 async def get_manual_session(session_id: str):
-    record = load_session_record(session_id)
+    record = await run_db(load_session_record, session_id)
     if not record:
         raise HTTPException(status_code=404, detail="Manual OCR session not found")
     return record
 
 
+@app.post("/api/jobs/{job_type}")
+async def submit_job(job_type: str, payload: Dict[str, Any] = Body(...)):
+    """Submit a long-running generation job; returns its state (job_id, status, stage, percent)."""
+    if job_manager.job_type(job_type) is None:
+        raise HTTPException(status_code=404, detail=f"未知的任务类型: {job_type}")
+    try:
+        return await run_db(job_manager.submit, job_type, payload)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    state = await run_db(job_manager.get_state, job_id)
+    if not state:
+        raise HTTPException(status_code=404, detail="未找到任务")
+    return state
+
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    state = await run_db(job_manager.get_state, job_id)
+    if not state:
+        raise HTTPException(status_code=404, detail="未找到任务")
+    status = state.get("status")
+    if status == "exception":
+        raise HTTPException(status_code=int(state.get("error_status") or 500), detail=state.get("error") or "任务失败")
+    if status == "cancelled":
+        raise HTTPException(status_code=410, detail="任务已取消")
+    if status != "success":
+        raise HTTPException(status_code=409, detail="任务尚未完成")
+    result = await run_db(job_manager.get_result, job_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="任务结果已过期")
+    return result
+
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    state = await run_db(job_manager.cancel, job_id)
+    if not state:
+        raise HTTPException(status_code=404, detail="未找到任务")
+    return state
+
+
 @app.get("/api/manual-sessions/{session_id}/progress")
 async def get_manual_session_progress(session_id: str):
     state = progress_manager.get_state(session_id)
@@ -922,7 +1135,7 @@ async def get_manual_session_progress(session_id: str):
 @app.delete("/api/manual-sessions/{session_id}")
 async def delete_manual_session_endpoint(session_id: str):
     try:
-        removed = delete_manual_session(session_id)
+        removed = await run_db(delete_manual_session, session_id)
     except Exception as exc:  # noqa: BLE001
         raise HTTPException(status_code=500, detail=f"Failed to delete OCR session: {exc}") from exc
 
@@ -941,7 +1154,7 @@ async def delete_manual_session_legacy(session_id: str):
 @app.delete("/api/manual-sessions/history")
 async def delete_manual_session_history():
     try:
-        removed = clear_manual_history()
+        removed = await run_db(clear_manual_history)
     except Exception as exc:  # noqa: BLE001
         raise HTTPException(status_code=500, detail=f"Failed to clear manual OCR history: {exc}") from exc
 
@@ -954,7 +1167,8 @@ async def get_prompt_playbooks_endpoint(
     playbook_type: str | None = Query(default=None),
 ):
     try:
-        items = list_prompt_playbooks(
+        items = await run_db(
+            list_prompt_playbooks,
             product_names=product_names,
             playbook_type=playbook_type,
         )
@@ -1007,7 +1221,8 @@ async def run_prompt_playbook_ace(payload: PromptPlaybookAceRequest):
 
         try:
             if sample.playbook_type == "spec":
-                specsheet_data, _chunks_unused, _prompt_text_unused, _system_prompt_unused = _extract_specsheet_from_context(
+                specsheet_data, _chunks_unused, _prompt_text_unused, _system_prompt_unused = await run_llm(
+                    _extract_specsheet_from_context,
                     context_text,
                     chunks=None,
                     title_hint=sample.product_name,
@@ -1019,7 +1234,8 @@ async def run_prompt_playbook_ace(payload: PromptPlaybookAceRequest):
 
                 algo_eval = evaluate_specsheet(prediction_text, ground_truth_text)
                 if algo_eval.is_correct:
-                    response = ace_manager.store_external_result(
+                    response = await run_llm(
+                        ace_manager.store_external_result,
                         question=question_text or f"优化 {sample.product_name} 的 {sample.playbook_type} 提示词",
                         prediction=prediction_text,
                         ground_truth=ground_truth_text,
@@ -1030,7 +1246,8 @@ async def run_prompt_playbook_ace(payload: PromptPlaybookAceRequest):
                     response["correct"] = True
                     response["skipped_llm_reflection"] = True
                 else:
-                    response = ace_manager.adapt_with_prediction(
+                    response = await run_llm(
+                        ace_manager.adapt_with_prediction,
                         question=question_text or f"优化 {sample.product_name} 的 {sample.playbook_type} 提示词",
                         context=context_text,
                         prediction=prediction_text,
@@ -1047,7 +1264,8 @@ async def run_prompt_playbook_ace(payload: PromptPlaybookAceRequest):
                     response["reflection"]["is_correct"] = False
                     response["correct"] = False
             else:
-                response = ace_manager.adapt_single_sample(
+                response = await run_llm(
+                    ace_manager.adapt_single_sample,
                     question=question_text or f"优化 {sample.product_name} 的 {sample.playbook_type} 提示词",
                     context=context_text,
                     ground_truth=ground_truth_text,
@@ -1096,7 +1314,7 @@ async def run_prompt_playbook_ace(payload: PromptPlaybookAceRequest):
 @app.get("/api/prompt-playbooks/datasets")
 async def list_prompt_playbook_datasets(limit: int = 20):
     try:
-        datasets = list_saved_datasets(limit)
+        datasets = await run_db(list_saved_datasets, limit)
         return {"datasets": datasets}
     except Exception as exc:  # noqa: BLE001
         raise HTTPException(status_code=500, detail=f"Failed to fetch ACE datasets: {exc}") from exc
@@ -1120,7 +1338,7 @@ async def delete_prompt_playbook_dataset(payload: PromptPlaybookDatasetDeleteReq
 @app.get("/api/prompt-playbooks/rules")
 async def get_prompt_playbook_rules(limit: int | None = None, playbook_type: str = "spec"):
     try:
-        rules = get_playbook_rules(limit, playbook_type=playbook_type)
+        rules = await run_db(get_playbook_rules, limit, playbook_type=playbook_type)
         return {"rules": rules}
     except Exception as exc:  # noqa: BLE001
         raise HTTPException(status_code=500, detail=f"Failed to fetch prompt playbook rules: {exc}") from exc
@@ -1131,57 +1349,68 @@ async def delete_prompt_playbook_rule(rule_id: str, playbook_type: str = "spec")
     if not rule_id:
         raise HTTPException(status_code=400, detail="rule_id 不能为空")
 
-    removed = delete_playbook_rule(rule_id, playbook_type=playbook_type)
+    removed = await run_db(delete_playbook_rule, rule_id, playbook_type=playbook_type)
     if not removed:
         raise HTTPException(status_code=404, detail="未找到对应规则或删除失败")
 
     return {"deleted": True}
 
 
-@app.post("/api/specsheet/from_ocr_docs", response_model=SpecsheetWithChunksResponse)
-async def generate_specsheet_from_ocr(payload: SpecsheetFromOcrRequest):
+@app.get("/api/prompt-playbooks/plots/{kind}")
+async def get_prompt_playbook_plot(kind: str, playbook_type: str = "spec"):
+    """Render an ACE metrics plot on demand (accuracy | comprehensive); reused until metrics change."""
+    if kind not in ACE_PLOT_KINDS:
+        raise HTTPException(status_code=404, detail=f"未知图表类型: {kind}")
+    try:
+        manager = await run_db(get_ace_manager, playbook_type)
+        path = await run_cpu(manager.render_plot, kind)
+    except Exception as exc:  # noqa: BLE001
+        raise HTTPException(status_code=500, detail=f"Failed to render ACE plot: {exc}") from exc
+    return FileResponse(path, media_type="image/png", headers={"Cache-Control": "no-cache"})
+
+
+def _validate_specsheet_job(payload: SpecsheetFromOcrRequest) -> None:
     if not payload.documents and not (payload.bom_code and payload.bom_code.strip()):
-        raise HTTPException(status_code=400, detail="请至少提供一个 OCR 文档，或提供 bom_code")
+        raise ValueError("请至少提供一个 OCR 文档，或提供 bom_code")
+
 
+def _specsheet_job(payload: SpecsheetFromOcrRequest, job: JobHandle) -> SpecsheetWithChunksResponse:
+    specsheet_data, chunks, prompt_text, system_prompt, context_text = generate_specsheet_from_ocr_request(payload)
+    job.check_cancelled()
+    job.update(stage="保存结果", detail="写入规格页与提示词快照", percent=90)
     try:
-        specsheet_data, chunks, prompt_text, system_prompt, context_text = generate_specsheet_from_ocr_request(payload)
-        try:
-            _persist_generated_specsheet(specsheet_data, payload)
-        except Exception as exc:  # noqa: BLE001
-            print(f"[Specsheet] Failed to persist generated specsheet: {exc}")
+        _persist_generated_specsheet(specsheet_data, payload)
+    except Exception as exc:  # noqa: BLE001
+        print(f"[Specsheet] Failed to persist generated specsheet: {exc}")
+    try:
+        product_dir = _resolve_manual_product_dir(
+            payload.product_name or specsheet_data.productTitle,
+            payload.bom_code,
+        )
+        _write_prompt_snapshot_files(
+            product_dir,
+            "spec",
+            system_prompt,
+            prompt_text,
+        )
+    except Exception as exc:  # noqa: BLE001
+        print(f"[PromptSnapshot] Skipped writing spec prompts: {exc}")
+    if payload.session_id:
         try:
-            product_dir = _resolve_manual_product_dir(
-                payload.product_name or specsheet_data.productTitle,
-                payload.bom_code,
+            question = (
+                specsheet_data.productTitle
+                or payload.product_name
+                or f"{payload.session_id} 规格页"
             )
-            _write_prompt_snapshot_files(
-                product_dir,
-                "spec",
-                system_prompt,
-                prompt_text,
+            save_pending_sample(
+                payload.session_id,
+                payload.bom_code,
+                question=question,
+                context=context_text,
+                prediction=specsheet_data.dict(),
             )
         except Exception as exc:  # noqa: BLE001
-            print(f"[PromptSnapshot] Skipped writing spec prompts: {exc}")
-        if payload.session_id:
-            try:
-                question = (
-                    specsheet_data.productTitle
-                    or payload.product_name
-                    or f"{payload.session_id} 规格页"
-                )
-                save_pending_sample(
-                    payload.session_id,
-                    payload.bom_code,
-                    question=question,
-                    context=context_text,
-                    prediction=specsheet_data.dict(),
-                )
-            except Exception as exc:  # noqa: BLE001
-                print(f"[ACE] Failed to persist pending sample: {exc}")
-    except ValueError as exc:
-        raise HTTPException(status_code=400, detail=str(exc))
-    except Exception as exc:  # noqa: BLE001
-        raise HTTPException(status_code=500, detail=f"Failed to generate specsheet from OCR docs: {exc}") from exc
+            print(f"[ACE] Failed to persist pending sample: {exc}")
 
     chunk_models = [ChunkInfo(**chunk) for chunk in chunks]
     return SpecsheetWithChunksResponse(
@@ -1191,21 +1420,32 @@ async def generate_specsheet_from_ocr(payload: SpecsheetFromOcrRequest):
         system_prompt=system_prompt,
     )
 
-@app.post(
-    "/api/manual/book/from_ocr_docs",
-    response_model=ManualBookResponse,
-    response_model_exclude_none=True,
+
+job_manager.register(
+    JobType("specsheet", SpecsheetFromOcrRequest, _specsheet_job, validate=_validate_specsheet_job)
 )
-async def generate_manual_book_from_ocr(payload: ManualBookFromOcrRequest):
-    """Generate manual/instruction book from OCR docs using LLM with dedicated prompt."""
+
+
+@app.post("/api/specsheet/from_ocr_docs", response_model=SpecsheetWithChunksResponse)
+async def generate_specsheet_from_ocr(payload: SpecsheetFromOcrRequest):
+    """Synchronous wrapper over the "specsheet" job; prefer POST /api/jobs/specsheet for long runs."""
     try:
-        manual_book, user_prompt = run_manual_book_from_ocr(payload)
+        return await job_manager.run("specsheet", payload)
     except ValueError as exc:
-        raise HTTPException(status_code=400, detail=str(exc)) from exc
+        raise HTTPException(status_code=400, detail=str(exc))
     except Exception as exc:  # noqa: BLE001
-        raise HTTPException(status_code=500, detail=f"生成说明书失败: {exc}") from exc
+        raise HTTPException(status_code=500, detail=f"Failed to generate specsheet from OCR docs: {exc}") from exc
+
+
+def _manual_book_job(payload: ManualBookFromOcrRequest, job: JobHandle) -> ManualBookResponse:
+    def _on_group_done(done: int, total: int) -> None:
+        job.update(detail=f"已生成 {done}/{total} 个章节组", percent=5 + int(85 * done / max(1, total)))
+
+    manual_book, user_prompt = run_manual_book_from_ocr(payload, progress=_on_group_done)
+    job.check_cancelled()
 
     if payload.product_name and payload.bom_code:
+        job.update(stage="保存结果", detail="写入提示词快照", percent=95)
         try:
             product_dir = _resolve_manual_product_dir(payload.product_name, payload.bom_code)
             _write_prompt_snapshot_files(
@@ -1224,6 +1464,26 @@ async def generate_manual_book_from_ocr(payload: ManualBookFromOcrRequest):
     )
 
 
+job_manager.register(
+    JobType("manual_book", ManualBookFromOcrRequest, _manual_book_job, exclude_none=True)
+)
+
+
+@app.post(
+    "/api/manual/book/from_ocr_docs",
+    response_model=ManualBookResponse,
+    response_model_exclude_none=True,
+)
+async def generate_manual_book_from_ocr(payload: ManualBookFromOcrRequest):
+    """Generate manual/instruction book from OCR docs using LLM with dedicated prompt (wrapper over the "manual_book" job)."""
+    try:
+        return await job_manager.run("manual_book", payload)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    except Exception as exc:  # noqa: BLE001
+        raise HTTPException(status_code=500, detail=f"生成说明书失败: {exc}") from exc
+
+
 @app.post(
     "/api/manual/book/variant_plan",
     response_model=ManualBookVariantPlanResponse,
@@ -1232,7 +1492,7 @@ async def generate_manual_book_from_ocr(payload: ManualBookFromOcrRequest):
 async def plan_manual_book_variants(payload: ManualBookVariantPlanRequest):
     """Plan which A/B/C template variant to use for each section group, and generate pages only when uncertain."""
     try:
-        variants, generated_pages, user_prompt = plan_manual_variants_from_context(payload)
+        variants, generated_pages, user_prompt = await run_llm(plan_manual_variants_from_context, payload)
         try:
             if payload.product_name and payload.bom_code:
                 product_dir = _resolve_manual_product_dir(payload.product_name, payload.bom_code)
@@ -1261,50 +1521,61 @@ async def plan_manual_book_variants(payload: ManualBookVariantPlanRequest):
         raise HTTPException(status_code=500, detail=f"生成说明书版本规划失败: {exc}") from exc
 
 
+def _manual_one_shot_job(payload: ManualBookOneShotRequest, job: JobHandle) -> ManualBookOneShotResponse:
+    variants, fixed_pages, user_prompt = generate_manual_one_shot(payload)
+    job.check_cancelled()
+    job.update(stage="保存结果", detail="写入提示词快照", percent=95)
+
+    try:
+        cover = fixed_pages.get("Cover") if isinstance(fixed_pages, dict) else None
+        if cover is not None:
+            blocks = getattr(cover, "blocks", None) or []
+            for blk in blocks:
+                if isinstance(blk, dict):
+                    if blk.get("type") == "cover":
+                        blk.pop("model", None)
+                else:
+                    if getattr(blk, "type", None) == "cover":
+                        try:
+                            if getattr(blk, "model", None) is not None:
+                                delattr(blk, "model")
+                        except Exception:
+                            pass
+    except Exception:
+        pass
+    try:
+        if payload.product_name and payload.bom_code:
+            product_dir = _resolve_manual_product_dir(payload.product_name, payload.bom_code)
+            question_path = product_dir / "question_manual.txt"
+            context_path = product_dir / "context_manual.txt"
+            question_text = "# MANUAL_ONE_SHOT_SYSTEM_PROMPT\n" + (MANUAL_ONE_SHOT_SYSTEM_PROMPT or "") + "\n"
+            question_path.write_text(question_text, encoding="utf-8")
+            context_path.write_text(user_prompt or "", encoding="utf-8")
+    except Exception as exc:  # noqa: BLE001
+        print(f"[ManualBook] Skipped writing one-shot manual prompt snapshots: {exc}")
+
+    return ManualBookOneShotResponse(
+        variants=variants,
+        fixed_pages=fixed_pages,
+        prompt_text=user_prompt,
+        system_prompt=MANUAL_ONE_SHOT_SYSTEM_PROMPT,
+    )
+
+
+job_manager.register(
+    JobType("manual_one_shot", ManualBookOneShotRequest, _manual_one_shot_job, exclude_none=True)
+)
+
+
 @app.post(
     "/api/manual/book/one_shot",
     response_model=ManualBookOneShotResponse,
     response_model_exclude_none=True,
 )
 async def generate_manual_book_one_shot(payload: ManualBookOneShotRequest):
-    """One-shot: single LLM call to decide variants (A/B/C) + generate fixed non-variant pages."""
+    """One-shot: single LLM call to decide variants (A/B/C) + generate fixed non-variant pages (wrapper over the "manual_one_shot" job)."""
     try:
-        variants, fixed_pages, user_prompt = generate_manual_one_shot(payload)
-
-        try:
-            cover = fixed_pages.get("Cover") if isinstance(fixed_pages, dict) else None
-            if cover is not None:
-                blocks = getattr(cover, "blocks", None) or []
-                for blk in blocks:
-                    if isinstance(blk, dict):
-                        if blk.get("type") == "cover":
-                            blk.pop("model", None)
-                    else:
-                        if getattr(blk, "type", None) == "cover":
-                            try:
-                                if getattr(blk, "model", None) is not None:
-                                    delattr(blk, "model")
-                            except Exception:
-                                pass
-        except Exception:
-            pass
-        try:
-            if payload.product_name and payload.bom_code:
-                product_dir = _resolve_manual_product_dir(payload.product_name, payload.bom_code)
-                question_path = product_dir / "question_manual.txt"
-                context_path = product_dir / "context_manual.txt"
-                question_text = "# MANUAL_ONE_SHOT_SYSTEM_PROMPT\n" + (MANUAL_ONE_SHOT_SYSTEM_PROMPT or "") + "\n"
-                question_path.write_text(question_text, encoding="utf-8")
-                context_path.write_text(user_prompt or "", encoding="utf-8")
-        except Exception as exc:  # noqa: BLE001
-            print(f"[ManualBook] Skipped writing one-shot manual prompt snapshots: {exc}")
-
-        return ManualBookOneShotResponse(
-            variants=variants,
-            fixed_pages=fixed_pages,
-            prompt_text=user_prompt,
-            system_prompt=MANUAL_ONE_SHOT_SYSTEM_PROMPT,
-        )
+        return await job_manager.run("manual_one_shot", payload)
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
     except Exception as exc:  # noqa: BLE001
@@ -1513,7 +1784,8 @@ async def save_manual_book_truth(payload: ManualBookTruthSaveRequest):
         if folder == "truth":
             rel = target_path.resolve().relative_to(BACKEND_ROOT.resolve()).as_posix()
             product_id = f"{payload.product_name.strip()}_{payload.bom_code.strip()}".strip("_")
-            upsert_product_has_doc(
+            await run_db(
+                upsert_product_has_doc,
                 product_id=product_id,
                 role="manual",
                 doc_path=rel,
@@ -1592,7 +1864,8 @@ async def save_manual_specsheet_truth(payload: ManualSpecsheetTruthSaveRequest):
         )
         rel = target_path.resolve().relative_to(BACKEND_ROOT.resolve()).as_posix()
         product_id = f"{payload.product_name.strip()}_{payload.bom_code.strip()}".strip("_")
-        upsert_product_has_doc(
+        await run_db(
+            upsert_product_has_doc,
             product_id=product_id,
             role="specsheet",
             doc_path=rel,
@@ -1612,7 +1885,7 @@ async def save_manual_specsheet_truth(payload: ManualSpecsheetTruthSaveRequest):
 
 @app.get("/api/manual/specsheet/{session_id}", response_model=SpecsheetResponse)
 async def get_manual_specsheet(session_id: str, bom_code: str | None = None):
-    specsheet = load_specsheet_for_session(session_id, bom_code)
+    specsheet = await run_db(load_specsheet_for_session, session_id, bom_code)
     if not specsheet:
         raise HTTPException(status_code=404, detail="未找到该会话的规格页文件")
     return SpecsheetResponse(specsheet=specsheet)
@@ -1623,7 +1896,8 @@ async def save_manual_specsheet(session_id: str, payload: ManualSpecsheetSaveReq
     if not session_id:
         raise HTTPException(status_code=400, detail="session_id 不能为空")
     try:
-        saved = save_specsheet_for_session(
+        saved = await run_db(
+            save_specsheet_for_session,
             session_id,
             payload.specsheet,
             bom_code=payload.bom_code,
@@ -1663,7 +1937,7 @@ async def run_manual_specsheet_ace(session_id: str, payload: ManualSpecsheetAceR
 
     prediction_specsheet = _load_specsheet_json(generate_path)
 
-    pending_sample = load_pending_sample(resolved_session, payload.bom_code)
+    pending_sample = await run_db(load_pending_sample, resolved_session, payload.bom_code)
 
     if pending_sample:
         prediction_payload = pending_sample.get("prediction") or {}
@@ -1687,7 +1961,8 @@ async def run_manual_specsheet_ace(session_id: str, payload: ManualSpecsheetAceR
     try:
         prediction_text = json.dumps(prediction_payload, ensure_ascii=False)
         ground_truth_text = json.dumps(ground_truth_obj.dict(), ensure_ascii=False)
-        result = ace_manager.adapt_with_prediction(
+        result = await run_llm(
+            ace_manager.adapt_with_prediction,
             question=question,
             context=context,
             prediction=prediction_text,
@@ -1720,17 +1995,25 @@ async def run_manual_specsheet_ace(session_id: str, payload: ManualSpecsheetAceR
     }
 
 
-@app.post("/api/bom/from_ocr_docs", response_model=BomGenerationResponse)
-async def generate_bom_from_ocr(payload: BomGenerationRequest):
+def _validate_bom_job(payload: BomGenerationRequest) -> None:
     if not payload.documents:
-        raise HTTPException(status_code=400, detail="请至少提供一个 OCR 文档")
-
+        raise ValueError("请至少提供一个 OCR 文档")
     if payload.bom_type not in {"outdoor", "pool"}:
-        raise HTTPException(status_code=400, detail="bomType 仅支持 outdoor / pool")
+        raise ValueError("bomType 仅支持 outdoor / pool")
+
+
+def _bom_job(payload: BomGenerationRequest, job: JobHandle) -> BomGenerationResponse:
+    return generate_bom_from_ocr_request(payload)
 
+
+job_manager.register(JobType("bom", BomGenerationRequest, _bom_job, validate=_validate_bom_job))
+
+
+@app.post("/api/bom/from_ocr_docs", response_model=BomGenerationResponse)
+async def generate_bom_from_ocr(payload: BomGenerationRequest):
+    """Synchronous wrapper over the "bom" job; prefer POST /api/jobs/bom for long runs."""
     try:
-        response = generate_bom_from_ocr_request(payload)
-        return response
+        return await job_manager.run("bom", payload)
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc))
     except Exception as exc:  # noqa: BLE001
@@ -1747,7 +2030,8 @@ async def save_bom(payload: BomSaveRequest):
         raise HTTPException(status_code=400, detail="BOM 编码不能为空")
 
     try:
-        save_result = save_bom_code_to_file(
+        save_result = await run_db(
+            save_bom_code_to_file,
             code=code,
             product_name=payload.product_name,
             bom_type=payload.bom_type,
@@ -1768,7 +2052,7 @@ async def get_bom_by_session(session_id: str):
     if not session_id:
         raise HTTPException(status_code=400, detail="Session ID 不能为空")
 
-    saved = load_bom_code_for_session(session_id)
+    saved = await run_db(load_bom_code_for_session, session_id)
     if not saved:
         raise HTTPException(status_code=404, detail="未找到对应会话的 BOM")
 
@@ -1786,7 +2070,7 @@ async def get_product_specsheet(product_name: str, bom_version: str):
         SpecsheetResponse with specsheet data
     """
     try:
-        specsheet_data = get_specsheet_by_product_bom(product_name, bom_version)
+        specsheet_data = await run_llm(get_specsheet_by_product_bom, product_name, bom_version)
         return SpecsheetResponse(specsheet=specsheet_data)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -1,4 +1,25 @@
-"""Helper utilities for running ACE adaptation from the backend API."""
+"""Helper utilities for running ACE adaptation from the backend API.
+
+Persistence is kept off the request path. Each mutation only queues work under
+the manager lock; a per-manager background writer batches it after a short
+debounce:
+
+  - metrics_log.jsonl   append-only log of metrics changes ("record" / "update"
+                        ops with a sequence number and the counters after the op)
+  - metrics.json        compacted every ACE_METRICS_COMPACT_EVERY ops (and on
+                        shutdown) by replaying the log; `log_seq` marks the last
+                        op it contains, so startup replays only newer log lines
+  - ace_playbook.json   replaced atomically from a snapshot taken at mutation time
+
+Plots are no longer rendered on every save; `ACEManager.render_plot` draws them
+on demand (cached until the metrics change).
+
+Env knobs (all optional):
+  - ACE_PERSIST_DEBOUNCE_SECONDS   batch window of the writer (default 2)
+  - ACE_METRICS_COMPACT_EVERY      log ops between metrics.json compactions (default 200)
+  - ACE_PLAYBOOK_EMBEDDER          "backend" (default) dedups curated rules with the cached
+                                   chunk embedding model; "hashed" uses the built-in trigram vectors
+"""
 
 from __future__ import annotations
 
@@ -6,10 +27,12 @@ import json
 import os
 import sys
 import threading
+import time
 from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, Optional, List
 
+from .env import env_float, env_int
 from .manual_ocr import MANUAL_OCR_ROOT
 
 ACE_ROOT = Path(__file__).resolve().parents[2] / "agentic-context-engineering-main"
@@ -25,6 +48,74 @@ EMPTY_DATASET_DIR.mkdir(parents=True, exist_ok=True)
 from ace_framework.config import Config, ExperimentConfig  # type: ignore  # noqa: E402
 from ace_framework.config import ModelConfig  # type: ignore  # noqa: E402
 from ace_framework.core.ace_framework import ACEFramework  # type: ignore  # noqa: E402
+from ace_framework.utils.metrics import MetricsTracker  # type: ignore  # noqa: E402
+
+METRICS_LOG_FILENAME = "metrics_log.jsonl"
+COMPREHENSIVE_PLOT_FILENAME = "comprehensive_metrics.png"
+PLOT_KINDS = ("accuracy", "comprehensive")
+
+# pyplot keeps global state and is not thread-safe
+_PLOT_LOCK = threading.Lock()
+
+
+def _atomic_write_text(path: Path, text: str) -> None:
+    tmp = path.with_name(f".{path.name}.tmp-{os.getpid()}-{threading.get_ident()}")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _backend_embedder(texts: List[str]) -> List[List[float]]:
+    """Playbook dedup embedder backed by the cached embedding pipeline used for chunks."""
+    from .neo4j_file_add_neo4j import embed_texts
+    from .rag_specsheet import get_embedding_config
+
+    return embed_texts(texts, get_embedding_config())
+
+
+def _metrics_counters(metrics: Any) -> Dict[str, int]:
+    return {
+        "processed": int(metrics.processed),
+        "correct": int(metrics.correct),
+        "playbook_updates": int(metrics.playbook_updates),
+    }
+
+
+def _apply_metrics_op(metrics: Any, op: Dict[str, Any]) -> None:
+    """Replay one metrics_log.jsonl entry onto a MetricsTracker."""
+    history = metrics.history
+    kind = op.get("op")
+    if kind == "record":
+        record = op.get("record")
+        if isinstance(record, dict):
+            history.append(record)
+    elif kind == "update":
+        index, fields = op.get("index"), op.get("fields")
+        if isinstance(index, int) and 0 <= index < len(history) and isinstance(fields, dict):
+            history[index].update(fields)
+    counters = op.get("counters")
+    if isinstance(counters, dict):
+        for name in ("processed", "correct", "playbook_updates"):
+            if isinstance(counters.get(name), int):
+                setattr(metrics, name, counters[name])
+
+
+def _read_metrics_log(path: Path, after_seq: int) -> List[Dict[str, Any]]:
+    """Ops with seq > after_seq, in order; torn or repeated lines are skipped."""
+    if not path.exists():
+        return []
+    ops: List[Dict[str, Any]] = []
+    last = after_seq
+    with open(path, "r", encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                op = json.loads(line)
+            except Exception:
+                continue
+            seq = op.get("seq") if isinstance(op, dict) else None
+            if isinstance(seq, int) and seq > last:
+                ops.append(op)
+                last = seq
+    return ops
 
 
 def _sanitize_part(value: Optional[str], fallback: str) -> str:
@@ -70,20 +161,261 @@ class ACEManager:
         )
         self.config = Config(model_config=model_config, experiment_config=experiment_config)
         self.framework = ACEFramework(self.config)
+        if (os.getenv("ACE_PLAYBOOK_EMBEDDER", "backend") or "backend").strip().lower() == "backend":
+            self.framework.playbook.set_embedder(_backend_embedder)
         self.lock = threading.Lock()
 
+        self._output_dir = Path(self.config.experiment.output_dir)
+        self._playbook_path = self._output_dir / self.config.experiment.playbook_filename
+        self._metrics_path = self._output_dir / self.config.experiment.metrics_filename
+        self._log_path = self._output_dir / METRICS_LOG_FILENAME
+
+        # Background writer state, guarded by _persist_cond
+        self._persist_cond = threading.Condition()
+        self._pending_ops: List[Dict[str, Any]] = []
+        self._playbook_snapshot: Optional[List[Dict[str, Any]]] = None
+        self._flush_requested = False
+        self._compact_requested = False
+        self._writing = False
+        self._closed = False
+        self._log_seq = 0
+        self._compacted_seq = 0
+        self._ops_since_compact = 0
+        self._persist_stats: Dict[str, Any] = {
+            "batches": 0,
+            "ops_written": 0,
+            "playbook_writes": 0,
+            "compactions": 0,
+            "errors": 0,
+            "last_batch_ms": 0.0,
+        }
+        # Bumped (under self.lock) on every metrics change; plots are cached per version
+        self._metrics_version = 0
+        self._plot_versions: Dict[str, int] = {}
+
         # Load previous checkpoint if available so playbook persists between requests
-        output_dir = Path(self.config.experiment.output_dir)
-        if output_dir.exists():
+        if self._output_dir.exists():
             try:
-                self.framework.load_checkpoint(str(output_dir))
+                self.framework.load_checkpoint(str(self._output_dir))
             except Exception:
                 pass
+            try:
+                self._replay_metrics_log()
+            except Exception as exc:  # noqa: BLE001
+                print(f"[ACE] Failed to replay metrics log for {self.playbook_type}: {exc}")
+
+        self._writer = threading.Thread(
+            target=self._writer_loop,
+            name=f"ace-persist-{self.playbook_type}",
+            daemon=True,
+        )
+        self._writer.start()
 
     def unlock(self):
         # Backward-compatible no-op. Kept to avoid breaking any external callers.
         return
 
+    # ---- persistence ----
+
+    def _replay_metrics_log(self) -> None:
+        base_seq = 0
+        if self._metrics_path.exists():
+            data = json.loads(self._metrics_path.read_text(encoding="utf-8"))
+            base_seq = int(data.get("log_seq") or 0) if isinstance(data, dict) else 0
+        ops = _read_metrics_log(self._log_path, base_seq)
+        for op in ops:
+            _apply_metrics_op(self.framework.metrics, op)
+        self._compacted_seq = base_seq
+        self._log_seq = ops[-1]["seq"] if ops else base_seq
+        self._ops_since_compact = len(ops)
+        if ops:
+            print(f"[ACE] Replayed {len(ops)} metrics log ops for {self.playbook_type}")
+
+    def _queue_persist_locked(self, ops: List[Dict[str, Any]], *, playbook_changed: bool = False) -> None:
+        """Hand metrics ops / a playbook snapshot to the writer. Caller holds self.lock."""
+        snapshot = [bullet.to_dict() for bullet in self.framework.playbook] if playbook_changed else None
+        if ops:
+            self._metrics_version += 1
+            counters = _metrics_counters(self.framework.metrics)
+            for op in ops:
+                op["counters"] = counters
+        with self._persist_cond:
+            for op in ops:
+                self._log_seq += 1
+                op["seq"] = self._log_seq
+                self._pending_ops.append(op)
+            if snapshot is not None:
+                self._playbook_snapshot = snapshot
+            self._persist_cond.notify_all()
+
+    def _queue_new_records_locked(self, before: int, *, playbook_changed: bool = False) -> None:
+        history = self.framework.metrics.history
+        ops = [{"op": "record", "record": dict(record)} for record in history[before:]]
+        self._queue_persist_locked(ops, playbook_changed=playbook_changed)
+
+    def _writer_loop(self) -> None:
+        while True:
+            with self._persist_cond:
+                while not (self._pending_ops or self._playbook_snapshot is not None or self._flush_requested or self._closed):
+                    self._persist_cond.wait()
+                # Debounce: collect everything that arrives within the window into one batch
+                deadline = time.monotonic() + max(0.0, env_float("ACE_PERSIST_DEBOUNCE_SECONDS", 2.0))
+                while not (self._flush_requested or self._closed):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._persist_cond.wait(remaining)
+                ops, self._pending_ops = self._pending_ops, []
+                snapshot, self._playbook_snapshot = self._playbook_snapshot, None
+                compact = self._compact_requested or self._closed
+                closing = self._closed
+                self._flush_requested = False
+                self._compact_requested = False
+                self._writing = True
+            ok = False
+            try:
+                self._write_batch(ops, snapshot, compact)
+                ok = True
+            except Exception as exc:  # noqa: BLE001
+                self._persist_stats["errors"] += 1
+                print(f"[ACE] Failed to persist {self.playbook_type} results: {exc}")
+            with self._persist_cond:
+                if not ok:
+                    # Retry with the next batch; replay skips log lines that were already written
+                    self._pending_ops[:0] = ops
+                    if self._playbook_snapshot is None:
+                        self._playbook_snapshot = snapshot
+                self._writing = False
+                self._persist_cond.notify_all()
+            if closing:
+                return
+            if not ok:
+                time.sleep(1.0)
+
+    def _write_batch(
+        self,
+        ops: List[Dict[str, Any]],
+        snapshot: Optional[List[Dict[str, Any]]],
+        compact: bool,
+    ) -> None:
+        started = time.perf_counter()
+        self._output_dir.mkdir(parents=True, exist_ok=True)
+        if ops:
+            lines = "".join(json.dumps(op, ensure_ascii=False, default=str) + "\n" for op in ops)
+            with open(self._log_path, "a", encoding="utf-8") as fh:
+                fh.write(lines)
+                fh.flush()
+                os.fsync(fh.fileno())
+            self._ops_since_compact += len(ops)
+            self._persist_stats["ops_written"] += len(ops)
+        if snapshot is not None:
+            _atomic_write_text(self._playbook_path, json.dumps(snapshot, indent=2))
+            self._persist_stats["playbook_writes"] += 1
+        compact_every = max(1, env_int("ACE_METRICS_COMPACT_EVERY", 200))
+        if self._ops_since_compact and (compact or self._ops_since_compact >= compact_every):
+            self._compact_metrics()
+        self._persist_stats["batches"] += 1
+        self._persist_stats["last_batch_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    def _compact_metrics(self) -> None:
+        """Fold the log into metrics.json. Runs on the writer thread only and never touches live state."""
+        tracker = MetricsTracker()
+        base_seq = 0
+        if self._metrics_path.exists():
+            try:
+                tracker.load(str(self._metrics_path))
+                data = json.loads(self._metrics_path.read_text(encoding="utf-8"))
+                base_seq = int(data.get("log_seq") or 0)
+            except Exception as exc:  # noqa: BLE001
+                print(f"[ACE] Ignoring unreadable {self._metrics_path}: {exc}")
+                tracker = MetricsTracker()
+        last_seq = base_seq
+        for op in _read_metrics_log(self._log_path, base_seq):
+            _apply_metrics_op(tracker, op)
+            last_seq = op["seq"]
+        payload = {
+            "summary": tracker.get_summary(),
+            "detailed_history": tracker.history,
+            "log_seq": last_seq,
+        }
+        _atomic_write_text(self._metrics_path, json.dumps(payload, indent=2, default=str))
+        # Only this thread appends to the log, so everything in it is now in metrics.json
+        self._log_path.unlink(missing_ok=True)
+        self._compacted_seq = last_seq
+        self._ops_since_compact = 0
+        self._persist_stats["compactions"] += 1
+
+    def flush(self, timeout: float = 10.0, *, compact: bool = False) -> bool:
+        """Write everything queued so far; returns False if it did not finish within timeout."""
+        deadline = time.monotonic() + timeout
+        with self._persist_cond:
+            if not self._writer.is_alive():
+                return not (self._pending_ops or self._playbook_snapshot is not None)
+            self._flush_requested = True
+            self._compact_requested = self._compact_requested or compact
+            self._persist_cond.notify_all()
+            while self._pending_ops or self._playbook_snapshot is not None or self._writing or self._flush_requested:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._persist_cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Flush, compact metrics.json and stop the writer thread."""
+        with self._persist_cond:
+            self._closed = True
+            self._persist_cond.notify_all()
+        self._writer.join(timeout)
+        if self._writer.is_alive() or self._pending_ops:
+            print(f"[ACE] {self.playbook_type}: writer did not drain before shutdown")
+
+    def persistence_stats(self) -> Dict[str, Any]:
+        with self._persist_cond:
+            return {
+                **self._persist_stats,
+                "pending_ops": len(self._pending_ops),
+                "playbook_pending": self._playbook_snapshot is not None,
+                "log_seq": self._log_seq,
+                "compacted_seq": self._compacted_seq,
+                "ops_since_compact": self._ops_since_compact,
+                "writer_alive": self._writer.is_alive(),
+            }
+
+    def render_plot(self, kind: str) -> Path:
+        """Render (or reuse) one of the metrics plots under the results directory."""
+        filenames = {
+            "accuracy": self.config.experiment.plot_filename,
+            "comprehensive": COMPREHENSIVE_PLOT_FILENAME,
+        }
+        if kind not in filenames:
+            raise ValueError(f"unknown plot kind: {kind}")
+        path = self._output_dir / filenames[kind]
+        with self.lock:
+            version = self._metrics_version
+            if self._plot_versions.get(kind) == version and path.exists():
+                return path
+            metrics = self.framework.metrics
+            series = {
+                "accuracy_history": metrics.get_accuracy_history(),
+                "playbook_size_history": metrics.get_playbook_size_history(),
+                "algo_score_history": metrics.get_algo_score_history(),
+            }
+        self._output_dir.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.stem}.tmp-{os.getpid()}-{threading.get_ident()}{path.suffix}")
+        with _PLOT_LOCK:
+            if kind == "accuracy":
+                self.framework.plotter.plot_accuracy(**series, save_path=str(tmp))
+            else:
+                self.framework.plotter.plot_comprehensive_metrics(**series, save_path=str(tmp))
+        os.replace(tmp, path)
+        with self.lock:
+            if self._metrics_version == version:
+                self._plot_versions[kind] = version
+        return path
+
+    # ---- adaptation ----
+
     def store_external_result(
         self,
         *,
@@ -101,6 +433,7 @@ class ACEManager:
         """
 
         with self.lock:
+            before = len(self.framework.metrics.history)
             self.framework.metrics.record_result(
                 question=question,
                 predicted=prediction,
@@ -109,7 +442,7 @@ class ACEManager:
                 playbook_size=len(self.framework.playbook),
                 algo_evaluation=algo_evaluation,
             )
-            self.framework.save_results(self.config.experiment.output_dir)
+            self._queue_new_records_locked(before)
 
             return {
                 "generation": {
@@ -133,7 +466,9 @@ class ACEManager:
             if not history:
                 return
             history[-1]["algo_evaluation"] = algo_evaluation
-            self.framework.save_results(self.config.experiment.output_dir)
+            self._queue_persist_locked(
+                [{"op": "update", "index": len(history) - 1, "fields": {"algo_evaluation": algo_evaluation}}]
+            )
 
     def force_last_metrics_correctness(self, is_correct: bool) -> None:
         """Force the correctness of the latest metrics record and recompute accuracy.
@@ -144,36 +479,36 @@ class ACEManager:
         """
 
         with self.lock:
-            history = getattr(self.framework.metrics, "history", None)
+            metrics = self.framework.metrics
+            history = getattr(metrics, "history", None)
             if not history:
                 return
-            history[-1]["correct"] = bool(is_correct)
+            last = history[-1]
+            was_correct = bool(last.get("correct"))
+            last["correct"] = bool(is_correct)
 
-            # Recompute counters
-            self.framework.metrics.processed = len(history)
-            self.framework.metrics.correct = sum(1 for r in history if r.get("correct"))
+            # Earlier records are untouched, so only the counters and the last
+            # record's step/accuracy move.
+            metrics.processed = len(history)
+            metrics.correct = max(0, int(metrics.correct) + int(bool(is_correct)) - int(was_correct))
+            last["step"] = len(history)
+            last["accuracy"] = (metrics.correct / len(history)) * 100
 
-            # Recompute accuracy field per record
-            correct_so_far = 0
-            for idx, record in enumerate(history, start=1):
-                if record.get("correct"):
-                    correct_so_far += 1
-                record["step"] = idx
-                record["accuracy"] = (correct_so_far / idx) * 100 if idx else 0.0
-
-            self.framework.save_results(self.config.experiment.output_dir)
+            fields = {"correct": last["correct"], "step": last["step"], "accuracy": last["accuracy"]}
+            self._queue_persist_locked([{"op": "update", "index": len(history) - 1, "fields": fields}])
 
     def adapt_single_sample(self, question: str, context: str, ground_truth: str, verbose: bool = False) -> Dict[str, Any]:
-        """Run ACE adaptation on a single sample and persist updated playbook/metrics."""
+        """Run ACE adaptation on a single sample and queue the updated playbook/metrics for persistence."""
         with self.lock:
+            before = len(self.framework.metrics.history)
             result = self.framework.adapt_online(
                 question=question,
                 context=context,
                 ground_truth=ground_truth,
                 verbose=verbose,
             )
-            # Persist state after each adaptation so generator can use latest playbook
-            self.framework.save_results(self.config.experiment.output_dir)
+            # Generators read the in-memory playbook, so the write can happen in the background
+            self._queue_new_records_locked(before, playbook_changed=True)
             return result
 
     def adapt_with_prediction(
@@ -186,6 +521,7 @@ class ACEManager:
     ) -> Dict[str, Any]:
         """Run ACE adaptation with an externally supplied prediction."""
         with self.lock:
+            before = len(self.framework.metrics.history)
             result = self.framework.adapt_with_prediction(
                 question=question,
                 context=context,
@@ -193,7 +529,7 @@ class ACEManager:
                 ground_truth=ground_truth,
                 verbose=verbose,
             )
-            self.framework.save_results(self.config.experiment.output_dir)
+            self._queue_new_records_locked(before, playbook_changed=True)
             return result
 
     def get_playbook_size(self) -> int:
@@ -212,7 +548,7 @@ class ACEManager:
         with self.lock:
             removed = self.framework.playbook.remove_bullet(rule_id)
             if removed:
-                self.framework.save_results(self.config.experiment.output_dir)
+                self._queue_persist_locked([], playbook_changed=True)
             return removed
 
 
@@ -230,6 +566,20 @@ def get_ace_manager(playbook_type: str) -> ACEManager:
         return manager
 
 
+def ace_persistence_stats() -> Dict[str, Any]:
+    with _ACE_MANAGERS_LOCK:
+        managers = dict(_ACE_MANAGERS)
+    return {name: manager.persistence_stats() for name, manager in managers.items()}
+
+
+def shutdown_ace_persistence(timeout: float = 10.0) -> None:
+    """Drain every manager's writer and compact metrics.json (call on shutdown)."""
+    with _ACE_MANAGERS_LOCK:
+        managers = list(_ACE_MANAGERS.values())
+    for manager in managers:
+        manager.close(timeout)
+
+
 # Backward-compatible alias (defaults to spec)
 ace_manager = get_ace_manager("spec")
 
@@ -21,12 +21,14 @@ if str(project_root) not in sys.path:
 from src.dataclass import Neo4jConfig, LLMConfig
 from src.models_litellm import Ollama_BASE_URL, Ollama_QWEN3_EMBEDDING
 from src.neo4j_file_add_neo4j import (
-    get_neo4j_driver,
     md_chunker,
     embed_texts,
-    create_chunk_nodes,
+    stable_chunk_id,
     create_unknown_node,
+    write_chunk_nodes_bulk,
 )
+from src.neo4j_pool import get_pooled_driver
+from src.graph_version import bumps_graph_version
 
 load_dotenv()
 
@@ -74,7 +76,7 @@ def get_material_image_by_material_code(material_code: str) -> Dict[str, Any]:
         return {"material_code": "", "found": False, "image_url": "", "score": None, "sheet": ""}
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
     try:
         with driver.session() as session:
             res = session.run(
@@ -167,6 +169,7 @@ def get_product_image_by_product_name(product_name: str) -> Dict[str, Any]:
     return {"product_name": pn, "found": True, "image_url": url}
 
 
+@bumps_graph_version
 def upsert_manual_dataset(
     *,
     product_id: str,
@@ -180,7 +183,7 @@ def upsert_manual_dataset(
         return
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
     try:
         with driver.session() as session:
             session.run(
@@ -202,6 +205,7 @@ def upsert_manual_dataset(
         driver.close()
 
 
+@bumps_graph_version
 def upsert_manual_folder(*, dataset_id: str, folder_path: str, kind: str) -> None:
     did = (dataset_id or "").strip()
     fpath = (folder_path or "").strip()
@@ -209,7 +213,7 @@ def upsert_manual_folder(*, dataset_id: str, folder_path: str, kind: str) -> Non
         return
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
     try:
         with driver.session() as session:
             session.run(
@@ -229,6 +233,7 @@ def upsert_manual_folder(*, dataset_id: str, folder_path: str, kind: str) -> Non
         driver.close()
 
 
+@bumps_graph_version
 def upsert_manual_document(
     *,
     doc_path: str,
@@ -245,7 +250,7 @@ def upsert_manual_document(
         return
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
     try:
         with driver.session() as session:
             session.run(
@@ -274,6 +279,7 @@ def upsert_manual_document(
         driver.close()
 
 
+@bumps_graph_version
 def upsert_manual_contains(*, folder_path: str, doc_path: str) -> None:
     fpath = (folder_path or "").strip()
     dpath = (doc_path or "").strip()
@@ -281,7 +287,7 @@ def upsert_manual_contains(*, folder_path: str, doc_path: str) -> None:
         return
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
     try:
         with driver.session() as session:
             session.run(
@@ -296,6 +302,7 @@ def upsert_manual_contains(*, folder_path: str, doc_path: str) -> None:
         driver.close()
 
 
+@bumps_graph_version
 def delete_manual_contains_and_gc_document(*, folder_path: str, doc_path: str) -> None:
     """Remove CONTAINS edge and delete Document if it has no remaining CONTAINS refs."""
 
@@ -305,7 +312,7 @@ def delete_manual_contains_and_gc_document(*, folder_path: str, doc_path: str) -
         return
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
     try:
         with driver.session() as session:
             session.run(
@@ -346,7 +353,7 @@ def get_all_product_names() -> List[Dict[str, Any]]:
         List of unique product English names, sorted alphabetically.
     """
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
     
     products: List[Dict[str, Any]] = []
     try:
@@ -389,7 +396,7 @@ def get_all_product_names() -> List[Dict[str, Any]]:
 def get_boms_by_product_id(product_id: str) -> List[str]:
     """Get BOM ids for a specific product_id."""
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     boms: List[str] = []
     pid = (product_id or "").strip()
@@ -419,7 +426,7 @@ def get_boms_by_product_id(product_id: str) -> List[str]:
 def get_all_material_codes() -> List[str]:
     """Get all unique material_code values."""
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     materials: List[str] = []
     try:
@@ -449,7 +456,7 @@ def get_boms_by_material_code(material_code: str) -> List[str]:
         return []
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     boms: List[str] = []
     try:
@@ -481,7 +488,7 @@ def get_accessories_zh_by_material_bom(material_code: str, bom_id: str) -> List[
         return []
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     names: List[str] = []
     try:
@@ -535,7 +542,7 @@ def get_accessories_zh_by_material_bom(material_code: str, bom_id: str) -> List[
 def get_accessories_by_product_bom_id(product_id: str, bom_id: str) -> List[str]:
     """Get accessories connected to a product_id. bom_id is used as a safety filter."""
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     pid = (product_id or "").strip()
     bid = (bom_id or "").strip()
@@ -599,7 +606,7 @@ def get_kb_overview_by_product_id(product_id: str) -> Dict[str, Any]:
         return {"product": {"product_id": ""}, "special_docs": {}, "datasets": []}
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     special_docs: Dict[str, Dict[str, Any]] = {}
     datasets_by_id: Dict[str, Dict[str, Any]] = {}
@@ -781,6 +788,7 @@ def get_kb_overview_by_product_id(product_id: str) -> Dict[str, Any]:
     }
 
 
+@bumps_graph_version
 def update_product_config_text_zh(product_id: str, config_text_zh: str) -> Dict[str, Any]:
     pid = (product_id or "").strip()
     if not pid:
@@ -789,7 +797,7 @@ def update_product_config_text_zh(product_id: str, config_text_zh: str) -> Dict[
     text = (config_text_zh or "").strip()
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
     try:
         with driver.session() as session:
             record = session.run(
@@ -812,6 +820,7 @@ def update_product_config_text_zh(product_id: str, config_text_zh: str) -> Dict[
         driver.close()
 
 
+@bumps_graph_version
 def upsert_product_has_doc(
     *,
     product_id: str,
@@ -840,7 +849,7 @@ def upsert_product_has_doc(
     dk = (doc_kind or "").strip()
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
     try:
         with driver.session() as session:
             record = session.run(
@@ -1156,6 +1165,7 @@ def _deduplicate_documents(documents: Iterable[Dict[str, Any]]) -> List[Dict[str
     return list(by_path.values())
 
 
+@bumps_graph_version
 def insert_product_with_documents(
     product_name: str,
     *,
@@ -1173,7 +1183,7 @@ def insert_product_with_documents(
     product_identifier = f"{product_name}_{bom_code}" if bom_code else product_name
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     attached = 0
     try:
@@ -1254,7 +1264,7 @@ def get_boms_by_product_name(product_name: str) -> List[str]:
         List of BOM versions for the product, sorted.
     """
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
     
     boms = []
     try:
@@ -1283,7 +1293,7 @@ def get_boms_by_product_name(product_name: str) -> List[str]:
 def get_all_accessory_names() -> List[Dict[str, Any]]:
     """Get all unique accessory names from Neo4j."""
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     accessory_items: List[Dict[str, Any]] = []
     try:
@@ -1319,7 +1329,7 @@ def get_all_accessory_names() -> List[Dict[str, Any]]:
 def get_accessories_by_product_bom(product_name: str, bom_version: str) -> List[str]:
     """Get accessory names connected to a specific product BOM."""
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     accessories: List[str] = []
     try:
@@ -1353,7 +1363,7 @@ def get_accessories_by_product_bom(product_name: str, bom_version: str) -> List[
 def get_documents_by_product_bom(product_name: str, bom_version: str) -> List[Dict[str, Any]]:
     """Get files linked directly to a product (documents + images, exclude accessory files)."""
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     documents: List[Dict[str, Any]] = []
     try:
@@ -1483,6 +1493,7 @@ def get_documents_by_product_bom(product_name: str, bom_version: str) -> List[Di
     return documents
 
 
+@bumps_graph_version
 def move_document_owner(
     doc_path: str,
     target_type: str,
@@ -1498,7 +1509,7 @@ def move_document_owner(
     metadata = _fetch_document_metadata(doc_path)
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     try:
         with driver.session() as session:
@@ -1587,7 +1598,7 @@ def get_unmatched_documents() -> List[Dict[str, Any]]:
     """Return documents that do not have any owner relationship."""
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     documents: List[Dict[str, Any]] = []
     try:
@@ -1644,6 +1655,7 @@ def get_unmatched_documents() -> List[Dict[str, Any]]:
     return documents
 
 
+@bumps_graph_version
 def attach_document_to_owner(
     doc_path: str,
     target_type: str,
@@ -1665,7 +1677,7 @@ def attach_document_to_owner(
         raise ValueError("该文件已关联到其它节点，无需再次增加")
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     try:
         with driver.session() as session:
@@ -1761,7 +1773,7 @@ def get_unmatched_document_detail(doc_path: str) -> Dict[str, Any]:
         pass
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     try:
         with driver.session() as session:
@@ -1797,6 +1809,7 @@ def get_unmatched_document_detail(doc_path: str) -> Dict[str, Any]:
         driver.close()
 
 
+@bumps_graph_version
 def update_unmatched_document_content(
     doc_path: str,
     content: str,
@@ -1813,7 +1826,7 @@ def update_unmatched_document_content(
         raise ValueError("暂不支持重命名 Unknown 类型文件")
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     try:
         with driver.session() as session:
@@ -1902,7 +1915,7 @@ def _get_embedding_config() -> LLMConfig:
 def _fetch_document_metadata(doc_path: str) -> Dict[str, Any]:
     """Fetch document metadata and owner info from Neo4j."""
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     try:
         with driver.session() as session:
@@ -1962,6 +1975,7 @@ def get_document_detail(doc_path: str) -> Dict[str, Any]:
     return metadata
 
 
+@bumps_graph_version
 def update_document_content(doc_path: str, content: str, new_name: Optional[str] = None) -> Dict[str, Any]:
     """Update a stored document's content (and optionally rename it)."""
     if new_name:
@@ -2022,7 +2036,7 @@ def update_document_content(doc_path: str, content: str, new_name: Optional[str]
         return metadata
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     try:
         with driver.session() as session:
@@ -2044,9 +2058,10 @@ def update_document_content(doc_path: str, content: str, new_name: Optional[str]
                 },
             ).single()
 
-            _refresh_text_description(session, updated_path_value, content)
+            chunk_stats = _refresh_text_description(session, updated_path_value, content)
 
         metadata.update(record or {})
+        metadata["chunk_refresh"] = chunk_stats
         metadata["content"] = content
         metadata["path"] = updated_path_value
         metadata["name"] = metadata.get("name") or resolved_path.name
@@ -2055,8 +2070,14 @@ def update_document_content(doc_path: str, content: str, new_name: Optional[str]
         driver.close()
 
 
-def _refresh_text_description(session, doc_path: str, content: str) -> None:
-    """Refresh TextDescription summary and chunk embeddings for a document."""
+def _refresh_text_description(session, doc_path: str, content: str) -> Dict[str, int]:
+    """Refresh TextDescription summary and chunk embeddings for a document.
+
+    Chunks are diffed against the stored ones: a chunk whose stable_chunk_id is
+    unchanged is left alone, a chunk whose text already exists under another id
+    (e.g. shifted index or renamed file) reuses the stored vector, and only the
+    remaining chunks are embedded. Returns reuse/recompute counters.
+    """
     normalized_content = content or ""
     summary = _build_summary(normalized_content)
 
@@ -2064,17 +2085,6 @@ def _refresh_text_description(session, doc_path: str, content: str) -> None:
     if not chunks and normalized_content:
         chunks = [normalized_content[:3000]]
 
-    vectors: List[List[float]] = []
-    embedding_config = None
-    if chunks:
-        embedding_config = _get_embedding_config()
-        try:
-            vectors = embed_texts(chunks, embedding_config)
-        except Exception as exc:  # pragma: no cover - runtime safeguard
-            print(f"Warning: Failed to embed document '{doc_path}': {exc}")
-            chunks = []
-            vectors = []
-
     record = session.run(
         """
         MATCH (doc:Document {path: $path})
@@ -2111,24 +2121,115 @@ def _refresh_text_description(session, doc_path: str, content: str) -> None:
         },
     )
 
-    session.run(
+    stored_rows = session.run(
         """
-        MATCH (td:TextDescription {id: $td_id})-[:HAS_CHUNK]->(chunk:Chunk)
-        DETACH DELETE chunk
+        MATCH (td:TextDescription {id: $td_id})-[:HAS_CHUNK]->(c:Chunk)
+        RETURN c.id AS id, c.text AS text, c.embedding_model AS embedding_model
         """,
         {"td_id": text_desc_id},
     )
+    stored = [
+        {"id": r.get("id"), "text": r.get("text") or "", "embedding_model": r.get("embedding_model")}
+        for r in stored_rows
+        if r.get("id")
+    ]
+
+    stats = {
+        "chunks_total": len(chunks),
+        "chunks_reused": 0,
+        "chunks_recomputed": 0,
+        "chunks_deleted": 0,
+    }
+
+    embedding_config = _get_embedding_config() if chunks else None
+    model = embedding_config.model if embedding_config else ""
+    new_ids = [stable_chunk_id(doc_path, idx, text) for idx, text in enumerate(chunks)]
+
+    # Only chunks embedded with the current model are candidates for reuse.
+    reusable_ids = {row["id"] for row in stored if row["embedding_model"] == model}
+    reusable_by_hash: Dict[str, str] = {}
+    for row in stored:
+        if row["id"] in reusable_ids:
+            reusable_by_hash.setdefault(_text_sha256(row["text"]), row["id"])
+
+    unchanged = 0
+    reuse_from: Dict[int, str] = {}
+    to_embed: List[int] = []
+    for idx, (cid, text) in enumerate(zip(new_ids, chunks)):
+        if cid in reusable_ids:
+            unchanged += 1
+            continue
+        src_id = reusable_by_hash.get(_text_sha256(text))
+        if src_id:
+            reuse_from[idx] = src_id
+        else:
+            to_embed.append(idx)
 
-    if chunks and vectors and embedding_config:
-        create_chunk_nodes(
-            session,
-            text_desc_id,
-            "TextDescription",
-            chunks,
-            vectors,
-            embedding_config.model,
-            doc_path,
+    vectors_by_idx: Dict[int, List[float]] = {}
+    if reuse_from:
+        vec_rows = session.run(
+            """
+            UNWIND $ids AS cid
+            MATCH (c:Chunk {id: cid})
+            RETURN c.id AS id, c.embedding AS embedding
+            """,
+            {"ids": list(set(reuse_from.values()))},
         )
+        stored_vecs = {r.get("id"): r.get("embedding") for r in vec_rows}
+        for idx, src_id in list(reuse_from.items()):
+            vec = stored_vecs.get(src_id)
+            if vec:
+                vectors_by_idx[idx] = list(vec)
+            else:
+                to_embed.append(idx)
+                reuse_from.pop(idx)
+
+    embed_failed = False
+    if to_embed and embedding_config:
+        to_embed.sort()
+        try:
+            fresh = embed_texts([chunks[i] for i in to_embed], embedding_config)
+            vectors_by_idx.update(zip(to_embed, fresh))
+        except Exception as exc:  # pragma: no cover - runtime safeguard
+            print(f"Warning: Failed to embed document '{doc_path}': {exc}")
+            embed_failed = True
+
+    if embed_failed:
+        # Keep previous behaviour: drop stale chunks rather than leave them mismatched.
+        write_chunk_nodes_bulk(session, text_desc_id, "TextDescription", [], [], "", doc_path, replace=True)
+        stats["chunks_deleted"] = len(stored)
+        stats["chunks_total"] = 0
+        return stats
+
+    new_id_set = set(new_ids)
+    delete_ids = [row["id"] for row in stored if row["id"] not in new_id_set]
+    write_idx = sorted(vectors_by_idx)
+    # 删除过期 Chunk 与写入新 Chunk 在同一事务内完成
+    write_chunk_nodes_bulk(
+        session,
+        text_desc_id,
+        "TextDescription",
+        [chunks[i] for i in write_idx],
+        [vectors_by_idx[i] for i in write_idx],
+        model,
+        doc_path,
+        indices=write_idx,
+        delete_ids=delete_ids,
+    )
+
+    stats["chunks_reused"] = unchanged + len(reuse_from)
+    stats["chunks_recomputed"] = len(to_embed)
+    stats["chunks_deleted"] = len(delete_ids)
+    print(
+        f"[DocumentRefresh] {doc_path}: {stats['chunks_total']} chunks, "
+        f"reused={stats['chunks_reused']}, recomputed={stats['chunks_recomputed']}, "
+        f"deleted={stats['chunks_deleted']}"
+    )
+    return stats
+
+
+def _text_sha256(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
 
 
 def _build_summary(content: str) -> str:
@@ -2208,6 +2309,7 @@ def _cleanup_saved_paths(paths: List[Optional[str]]) -> None:
                 pass
 
 
+@bumps_graph_version
 def delete_document(doc_path: str) -> Dict[str, Any]:
     """Detach a document from owners and downgrade it to an Unknown node."""
     normalized_doc_path = _normalize_document_path(doc_path)
@@ -2234,7 +2336,7 @@ def delete_document(doc_path: str) -> Dict[str, Any]:
         }
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     try:
         with driver.session() as session:
@@ -2291,7 +2393,7 @@ def delete_document(doc_path: str) -> Dict[str, Any]:
 def get_documents_by_accessory(accessory_name: str) -> List[Dict[str, Any]]:
     """Get documents and images linked to a specific accessory."""
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     documents: List[Dict[str, Any]] = []
     try:
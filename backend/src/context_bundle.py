@@ -0,0 +1,224 @@
+"""
+Per-session "context bundle" for OCR-based generation (specsheet / manual book).
+
+Building the generation context from OCR documents reads every `.mmd`, probes
+the prompt-reverse `.txt` next to every image, scans the session's
+`reverse_prompts/products` directory and runs the markdown sanitizer over each
+document. Users regenerate the same session many times, so the per-document
+results are kept in a bundle:
+
+  - docs:               document key -> {"kind": "text", "path", "body": [...]} or
+                        {"kind": "image", "path", "segment": {...} | None};
+                        the key includes the mtime/size of the file that was
+                        read, so an edited .mmd or reverse .txt gets a new entry
+                        (older entries for the same path are dropped on merge)
+  - original_segments:  candidate segments for the session's original uploads
+
+The bundle is prebuilt when OCR / prompt reverse finishes, extended with any
+document a later request adds, and dropped by upload/delete events in
+`manual_ocr`. It is kept in memory and as a JSON file; a memory copy is only
+used while the file it was loaded from is unchanged, so an invalidation in
+another worker is seen on the next read.
+
+Bundles returned by `get` are shared and must be treated as read-only; changes
+go through `update`, which merges into a copy under a per-session lock.
+`invalidate` takes the same lock and bumps the session's generation; callers
+that build data before merging pass the generation they started from, so the
+merge is dropped if an invalidation happened in between.
+
+Env knobs (all optional):
+  - CONTEXT_BUNDLE_CACHE           set to 0 to disable
+  - CONTEXT_BUNDLE_DIR             bundle files (default: data_storage/context_bundles)
+  - CONTEXT_BUNDLE_MAX_SESSIONS    bundles kept in memory (default 32)
+"""
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from src.env import env_int
+
+BUNDLE_VERSION = 2
+_LOCK_STRIPES = 64
+
+
+def context_bundle_enabled() -> bool:
+    v = (os.getenv("CONTEXT_BUNDLE_CACHE", "1") or "1").strip().lower()
+    return v not in {"0", "false", "no", "n", "off"}
+
+
+def _bundle_dir() -> Path:
+    p = (os.getenv("CONTEXT_BUNDLE_DIR") or "").strip()
+    base = Path(p) if p else Path(__file__).resolve().parents[1] / "data_storage" / "context_bundles"
+    base.mkdir(parents=True, exist_ok=True)
+    return base
+
+
+def _bundle_path(session_id: str) -> Path:
+    safe = re.sub(r"[^A-Za-z0-9_.\-]", "_", session_id)[:80]
+    digest = hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:10]
+    return _bundle_dir() / f"{safe}-{digest}.json"
+
+
+def _file_mtime(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+class ContextBundleStore:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # session_id -> (file mtime_ns the copy matches, bundle)
+        self._data: "OrderedDict[str, Tuple[Optional[int], Dict[str, Any]]]" = OrderedDict()
+        # Serialize read-merge-write per session (striped so the lock set stays bounded)
+        self._session_locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+        # Bumped by invalidate(), per stripe
+        self._generations = [0] * _LOCK_STRIPES
+        self.hits = 0
+        self.disk_loads = 0
+        self.misses = 0
+        self.saves = 0
+        self.invalidations = 0
+        self.stale_updates = 0
+
+    @staticmethod
+    def empty(session_id: str) -> Dict[str, Any]:
+        return {
+            "version": BUNDLE_VERSION,
+            "session_id": session_id,
+            "built_at": time.time(),
+            "docs": {},
+            "original_segments": None,
+        }
+
+    def get(self, session_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        sid = (session_id or "").strip()
+        if not sid or not context_bundle_enabled():
+            return None
+        path = _bundle_path(sid)
+        mtime = _file_mtime(path)
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is not None and mtime is not None and entry[0] == mtime:
+                self._data.move_to_end(sid)
+                self.hits += 1
+                return entry[1]
+            self._data.pop(sid, None)
+        if mtime is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            bundle = json.loads(path.read_text(encoding="utf-8"))
+        except Exception as exc:  # noqa: BLE001
+            print(f"[ContextBundle] Failed to load bundle for {sid}: {exc}")
+            return None
+        if not isinstance(bundle, dict) or bundle.get("version") != BUNDLE_VERSION:
+            return None
+        with self._lock:
+            self.disk_loads += 1
+            self._remember_locked(sid, mtime, bundle)
+        return bundle
+
+    def put(self, session_id: Optional[str], bundle: Dict[str, Any]) -> None:
+        sid = (session_id or "").strip()
+        if not sid or not context_bundle_enabled():
+            return
+        path = _bundle_path(sid)
+        bundle["version"] = BUNDLE_VERSION
+        bundle["session_id"] = sid
+        try:
+            tmp = path.with_suffix(f".tmp-{os.getpid()}-{threading.get_ident()}")
+            tmp.write_text(json.dumps(bundle, ensure_ascii=False), encoding="utf-8")
+            tmp.replace(path)
+        except Exception as exc:  # noqa: BLE001
+            print(f"[ContextBundle] Failed to save bundle for {sid}: {exc}")
+            return
+        with self._lock:
+            self.saves += 1
+            self._remember_locked(sid, _file_mtime(path), bundle)
+
+    @staticmethod
+    def _stripe(sid: str) -> int:
+        return int(hashlib.sha1(sid.encode("utf-8")).hexdigest()[:8], 16) % _LOCK_STRIPES
+
+    def generation(self, session_id: Optional[str]) -> int:
+        """Token to pass to `update` for data built from the session's current files."""
+        return self._generations[self._stripe((session_id or "").strip())]
+
+    def update(
+        self,
+        session_id: Optional[str],
+        mutate: Callable[[Dict[str, Any]], None],
+        generation: Optional[int] = None,
+    ) -> None:
+        """Apply mutate to a private copy of the current bundle (or a new one) and save it.
+
+        With `generation`, nothing is saved if the session was invalidated since.
+        """
+        sid = (session_id or "").strip()
+        if not sid or not context_bundle_enabled():
+            return
+        stripe = self._stripe(sid)
+        with self._session_locks[stripe]:
+            if generation is not None and self._generations[stripe] != generation:
+                with self._lock:
+                    self.stale_updates += 1
+                return
+            current = self.get(sid)
+            bundle = copy.deepcopy(current) if current is not None else self.empty(sid)
+            mutate(bundle)
+            self.put(sid, bundle)
+
+    def invalidate(self, session_id: Optional[str], reason: str = "") -> None:
+        sid = (session_id or "").strip()
+        if not sid:
+            return
+        # Same lock as update(), so an in-flight merge cannot re-save what it read before this.
+        stripe = self._stripe(sid)
+        with self._session_locks[stripe]:
+            self._generations[stripe] += 1
+            with self._lock:
+                self._data.pop(sid, None)
+                self.invalidations += 1
+            try:
+                _bundle_path(sid).unlink()
+            except FileNotFoundError:
+                pass
+            except Exception as exc:  # noqa: BLE001
+                print(f"[ContextBundle] Failed to remove bundle for {sid}: {exc}")
+                return
+        print(f"[ContextBundle] Invalidated {sid} ({reason or 'unknown'})")
+
+    def _remember_locked(self, sid: str, mtime: Optional[int], bundle: Dict[str, Any]) -> None:
+        self._data[sid] = (mtime, bundle)
+        self._data.move_to_end(sid)
+        limit = max(1, env_int("CONTEXT_BUNDLE_MAX_SESSIONS", 32))
+        while len(self._data) > limit:
+            self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": context_bundle_enabled(),
+                "sessions_in_memory": len(self._data),
+                "hits": self.hits,
+                "disk_loads": self.disk_loads,
+                "misses": self.misses,
+                "saves": self.saves,
+                "invalidations": self.invalidations,
+                "stale_updates": self.stale_updates,
+            }
+
+
+context_bundles = ContextBundleStore()
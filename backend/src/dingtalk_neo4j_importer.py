@@ -9,6 +9,8 @@ from typing import Dict, Any, Optional, List
 from datetime import datetime
 from neo4j import GraphDatabase
 
+from src.graph_version import bumps_graph_version
+
 
 class DingTalkNeo4jImporter:
     """钉盘文件 Neo4j 导入器"""
@@ -50,6 +52,7 @@ class DingTalkNeo4jImporter:
         """关闭数据库连接"""
         self.driver.close()
     
+    @bumps_graph_version
     def import_file(self, file_result: Dict[str, Any]) -> bool:
         """
         导入单个文件到 Neo4j
@@ -0,0 +1,199 @@
+"""
+Content-addressed embedding cache keyed by (embedding_model, sha256(text)).
+
+Vectors are stored as float32 blobs in a local SQLite file so re-ingesting or
+editing a document only embeds the chunks whose text actually changed. The
+cache is size-bounded: once it grows past the entry limit, the least recently
+used rows are evicted.
+
+Env knobs (all optional):
+  - EMBEDDING_CACHE                 "0" to disable the cache (default enabled)
+  - EMBEDDING_CACHE_DB_PATH         SQLite path (default backend/data_storage/embedding_cache.sqlite3)
+  - EMBEDDING_CACHE_MAX_ENTRIES     entry limit before LRU eviction (default 50000)
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Sequence
+
+
+def embedding_cache_enabled() -> bool:
+    v = (os.getenv("EMBEDDING_CACHE", "1") or "1").strip().lower()
+    return v not in {"0", "false", "no", "n", "off"}
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def _db_path() -> str:
+    p = (os.getenv("EMBEDDING_CACHE_DB_PATH") or "").strip()
+    if not p:
+        p = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data_storage", "embedding_cache.sqlite3")
+    os.makedirs(os.path.dirname(p), exist_ok=True)
+    return p
+
+
+def _max_entries() -> int:
+    try:
+        return max(1, int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000")))
+    except Exception:
+        return 50000
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _pack(vec: Sequence[float]) -> bytes:
+    return array("f", vec).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    arr = array("f")
+    arr.frombytes(blob)
+    return arr.tolist()
+
+
+class EmbeddingCache:
+    """Thread-safe SQLite-backed LRU cache of embedding vectors."""
+
+    def __init__(self, db_path: Optional[str] = None, max_entries: Optional[int] = None) -> None:
+        self._db_path = db_path
+        self._max_entries = max_entries
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        self._evictions = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self._db_path or _db_path(), timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    vector BLOB NOT NULL,
+                    created_at_ms INTEGER NOT NULL,
+                    last_used_ms INTEGER NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used_ms)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Return cached vectors aligned with `texts` (None where missing)."""
+
+        if not texts:
+            return []
+        hashes = [text_hash(t) for t in texts]
+        found: Dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            conn = self._connection()
+            for start in range(0, len(unique), 500):
+                part = unique[start : start + 500]
+                marks = ",".join("?" * len(part))
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({marks})",
+                    [model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = _unpack(blob)
+            if found:
+                now = _now_ms()
+                conn.executemany(
+                    "UPDATE embeddings SET last_used_ms = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in found],
+                )
+                conn.commit()
+            out = [found.get(h) for h in hashes]
+            hit = sum(1 for v in out if v is not None)
+            self._hits += hit
+            self._misses += len(out) - hit
+        return out
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        if not texts:
+            return
+        now = _now_ms()
+        rows = [
+            (model, text_hash(t), len(v), _pack(v), now, now)
+            for t, v in zip(texts, vectors)
+            if v
+        ]
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                """
+                INSERT INTO embeddings(model, text_hash, dim, vector, created_at_ms, last_used_ms)
+                VALUES(?,?,?,?,?,?)
+                ON CONFLICT(model, text_hash) DO UPDATE SET
+                    dim = excluded.dim, vector = excluded.vector, last_used_ms = excluded.last_used_ms
+                """,
+                rows,
+            )
+            self._writes += len(rows)
+            self._evict_locked(conn)
+            conn.commit()
+
+    def _evict_locked(self, conn: sqlite3.Connection) -> None:
+        limit = self._max_entries or _max_entries()
+        count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= limit:
+            return
+        # Evict down to 90% so we don't run DELETE on every subsequent insert.
+        target = int(limit * 0.9)
+        excess = count - target
+        conn.execute(
+            """
+            DELETE FROM embeddings WHERE rowid IN (
+                SELECT rowid FROM embeddings ORDER BY last_used_ms ASC LIMIT ?
+            )
+            """,
+            (excess,),
+        )
+        self._evictions += excess
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._hits + self._misses
+            entries: Optional[int] = None
+            try:
+                entries = self._connection().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            except Exception:
+                entries = None
+            return {
+                "enabled": embedding_cache_enabled(),
+                "entries": entries,
+                "max_entries": self._max_entries or _max_entries(),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / total, 4) if total else 0.0,
+                "writes": self._writes,
+                "evictions": self._evictions,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM embeddings")
+            conn.commit()
+
+
+embedding_cache = EmbeddingCache()
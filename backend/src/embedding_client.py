@@ -0,0 +1,148 @@
+"""
+Batched embedding client.
+
+`embed_texts` used to send one `litellm.embedding` request per text. This client
+groups texts into batches (one request carries a list `input`), keeps a bounded
+number of batches in flight, retries failed or short batches with exponential
+backoff and returns vectors in the original input order.
+
+Env knobs (all optional):
+  - EMBEDDING_BATCH_SIZE       texts per request (default 32)
+  - EMBEDDING_MAX_INFLIGHT     concurrent batch requests (default 4)
+  - EMBEDDING_MAX_RETRIES      retries per batch (default 3)
+  - EMBEDDING_RETRY_BACKOFF    base backoff seconds (default 0.5)
+  - EMBEDDING_SERIAL           "1" to use the legacy one-request-per-text path
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from litellm import embedding
+
+from src.dataclass import LLMConfig
+from src.env import env_float, env_int
+
+
+def embedding_serial_mode_enabled() -> bool:
+    v = (os.getenv("EMBEDDING_SERIAL", "0") or "0").strip().lower()
+    return v in {"1", "true", "yes", "y", "on"}
+
+
+def _response_items(resp: Any) -> List[Any]:
+    try:
+        data = resp["data"]
+    except Exception:
+        data = getattr(resp, "data", None)
+    return list(data or [])
+
+
+def _item_field(item: Any, key: str) -> Any:
+    if isinstance(item, dict):
+        return item.get(key)
+    return getattr(item, key, None)
+
+
+class BatchEmbeddingClient:
+    """Embed many texts with batched, bounded-concurrency requests."""
+
+    def __init__(
+        self,
+        embedding_config: LLMConfig,
+        *,
+        batch_size: Optional[int] = None,
+        max_inflight: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        backoff_base: Optional[float] = None,
+        embed_fn: Optional[Callable[..., Any]] = None,
+    ) -> None:
+        self.config = embedding_config
+        self.batch_size = max(1, batch_size or env_int("EMBEDDING_BATCH_SIZE", 32))
+        self.max_inflight = max(1, max_inflight or env_int("EMBEDDING_MAX_INFLIGHT", 4))
+        self.max_retries = max(0, max_retries if max_retries is not None else env_int("EMBEDDING_MAX_RETRIES", 3))
+        self.backoff_base = max(0.0, backoff_base if backoff_base is not None else env_float("EMBEDDING_RETRY_BACKOFF", 0.5))
+        self._embed_fn = embed_fn or embedding
+
+    def _request(self, inputs: List[str]) -> Any:
+        kwargs: Dict[str, Any] = {"model": self.config.model, "input": inputs}
+        if self.config.api_key:
+            kwargs["api_key"] = self.config.api_key
+        if self.config.base_url:
+            kwargs["api_base"] = self.config.base_url
+        return self._embed_fn(**kwargs)
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        """Embed one batch; retry only the positions that are still missing."""
+
+        out: List[Optional[List[float]]] = [None] * len(batch)
+        pending = list(range(len(batch)))
+        last_error: Optional[Exception] = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff_base * (2 ** (attempt - 1)))
+            try:
+                resp = self._request([batch[i] for i in pending])
+            except Exception as exc:  # noqa: BLE001
+                last_error = exc
+                continue
+
+            # Providers normally echo `index`; fall back to positional order.
+            by_index: Dict[int, Any] = {}
+            for i, item in enumerate(_response_items(resp)):
+                idx = _item_field(item, "index")
+                by_index[idx if isinstance(idx, int) else i] = _item_field(item, "embedding")
+            still_missing: List[int] = []
+            for pos, orig_idx in enumerate(pending):
+                vec = by_index.get(pos)
+                if vec:
+                    out[orig_idx] = list(vec)
+                else:
+                    still_missing.append(orig_idx)
+            pending = still_missing
+            if not pending:
+                return [v for v in out if v is not None]
+            last_error = RuntimeError(f"embedding response missing {len(pending)} of {len(batch)} vectors")
+
+        raise RuntimeError(
+            f"Embedding batch failed after {self.max_retries + 1} attempts ({self.config.model}): {last_error}"
+        )
+
+    def embed(
+        self,
+        texts: Sequence[str],
+        on_progress: Optional[Callable[[int, int], None]] = None,
+    ) -> List[List[float]]:
+        texts = list(texts)
+        total = len(texts)
+        if total == 0:
+            return []
+
+        batches = [(start, texts[start : start + self.batch_size]) for start in range(0, total, self.batch_size)]
+        results: List[Optional[List[float]]] = [None] * total
+        done = 0
+        done_lock = threading.Lock()
+
+        def _run(start: int, batch: List[str]) -> None:
+            nonlocal done
+            vecs = self._embed_batch(batch)
+            for offset, vec in enumerate(vecs):
+                results[start + offset] = vec
+            if on_progress:
+                with done_lock:
+                    done += len(batch)
+                    on_progress(done, total)
+
+        if len(batches) == 1 or self.max_inflight == 1:
+            for start, batch in batches:
+                _run(start, batch)
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_inflight, len(batches))) as pool:
+                futures = [pool.submit(_run, start, batch) for start, batch in batches]
+                for fut in futures:
+                    fut.result()
+
+        return [v for v in results if v is not None]
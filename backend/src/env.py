@@ -0,0 +1,28 @@
+"""
+Env knob readers shared by the backend modules.
+
+Unset or malformed values fall back to the default, so a typo in a tuning
+variable never stops the server from starting.
+"""
+from __future__ import annotations
+
+import os
+
+
+def env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def env_flag(name: str, default: str) -> bool:
+    v = (os.getenv(name, default) or default).strip().lower()
+    return v in {"1", "true", "yes", "y", "on"}
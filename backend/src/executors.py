@@ -0,0 +1,153 @@
+"""
+Sized worker pools for blocking work called from async FastAPI routes.
+
+Most routes are ``async def`` but call synchronous Neo4j / litellm / file code;
+running that directly on the event loop means one 60s specsheet generation
+stalls every other request. Routes hand blocking calls to one of four
+separate pools instead, so long LLM calls can never starve database reads:
+
+  - db       Neo4j queries and small filesystem reads/writes
+  - llm      remote model calls (litellm, DashScope, ACE adaptation)
+  - cpu      local CPU-bound work called from routes (plot rendering)
+  - session  manual OCR session orchestrators; they run for minutes but mostly
+             wait on the OCR worker and LLM calls, so they get their own pool
+             instead of holding cpu threads
+
+Env knobs (all optional):
+  - API_DB_WORKERS    threads for db work (default 16)
+  - API_LLM_WORKERS   threads for llm work (default 8)
+  - API_CPU_WORKERS   threads for cpu work (default min(4, cpu_count))
+  - API_SESSION_WORKERS  concurrent manual OCR sessions (default 4)
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from src.env import env_int
+
+T = TypeVar("T")
+
+
+class _Pool:
+    """ThreadPoolExecutor plus the counters exposed by the admin endpoint."""
+
+    def __init__(self, name: str, env_name: str, default_workers: int) -> None:
+        self.name = name
+        self.env_name = env_name
+        self.default_workers = default_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        self._completed = 0
+        self._failed = 0
+        self._wait_ms_total = 0.0
+        self._wait_ms_max = 0.0
+        self._run_ms_total = 0.0
+
+    @property
+    def max_workers(self) -> int:
+        return max(1, env_int(self.env_name, self.default_workers))
+
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=f"api-{self.name}",
+                )
+            return self._executor
+
+    def _wrap(self, fn: Callable[[], T]) -> Callable[[], T]:
+        submitted = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+
+        def _run() -> T:
+            started = time.perf_counter()
+            wait_ms = (started - submitted) * 1000
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+                self._wait_ms_total += wait_ms
+                self._wait_ms_max = max(self._wait_ms_max, wait_ms)
+            ok = False
+            try:
+                result = fn()
+                ok = True
+                return result
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._run_ms_total += (time.perf_counter() - started) * 1000
+                    if ok:
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+
+        return _run
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        loop = asyncio.get_running_loop()
+        # Same as asyncio.to_thread: keep contextvars visible inside the worker.
+        ctx = contextvars.copy_context()
+        call = functools.partial(ctx.run, fn, *args, **kwargs)
+        return await loop.run_in_executor(self.executor(), self._wrap(call))
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            done = self._completed + self._failed
+            return {
+                "max_workers": self.max_workers,
+                "active": self._active,
+                "queued": self._queued,
+                "completed": self._completed,
+                "failed": self._failed,
+                "wait_ms_avg": round(self._wait_ms_total / done, 2) if done else 0.0,
+                "wait_ms_max": round(self._wait_ms_max, 2),
+                "run_ms_avg": round(self._run_ms_total / done, 2) if done else 0.0,
+            }
+
+
+db_pool = _Pool("db", "API_DB_WORKERS", 16)
+llm_pool = _Pool("llm", "API_LLM_WORKERS", 8)
+cpu_pool = _Pool("cpu", "API_CPU_WORKERS", min(4, os.cpu_count() or 1))
+session_pool = _Pool("session", "API_SESSION_WORKERS", 4)
+
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    return await db_pool.run(fn, *args, **kwargs)
+
+
+async def run_llm(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    return await llm_pool.run(fn, *args, **kwargs)
+
+
+async def run_cpu(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    return await cpu_pool.run(fn, *args, **kwargs)
+
+
+async def run_session(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    return await session_pool.run(fn, *args, **kwargs)
+
+
+def executor_stats() -> Dict[str, Any]:
+    return {pool.name: pool.stats() for pool in (db_pool, llm_pool, cpu_pool, session_pool)}
+
+
+def shutdown_executors() -> None:
+    for pool in (db_pool, llm_pool, cpu_pool, session_pool):
+        pool.shutdown()
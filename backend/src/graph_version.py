@@ -0,0 +1,177 @@
+"""
+Graph version counter shared by every process that writes to Neo4j.
+
+Write helpers in `api_queries` (product import, document attach/move/edit/
+delete, manual dataset upserts, ...) and the importers (`neo4j_file_add_neo4j`,
+`neo4j_import_node_names`, the material image and DingTalk importers) are
+wrapped with `@bumps_graph_version`. Caches that hold query results compare the version they
+were filled at with `current()`; components that rebuild derived state (kb_chat
+schema service, entity index) `subscribe()` to be told about writes.
+
+The version lives in a one-row SQLite table, so bumps from other uvicorn workers
+and CLI runs are seen too. `current()` re-reads the row at most once per
+GRAPH_VERSION_SYNC_SECONDS; that interval is the cross-process staleness bound
+(bumps in this process are seen at once). When the row has moved, listeners are
+notified with reason "external". If SQLite is unavailable the counter falls back
+to process-local.
+
+Env knobs (all optional):
+  - GRAPH_VERSION_DB_PATH          SQLite file (default: data_storage/graph_version.sqlite3)
+  - GRAPH_VERSION_SYNC_SECONDS     how often current() re-reads the shared row (default 2)
+"""
+from __future__ import annotations
+
+import functools
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from src.env import env_float
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+_lock = threading.Lock()
+_version = 0
+_synced_at = 0.0
+_bumps_by_reason: Dict[str, int] = {}
+_external_changes = 0
+_listeners: List[Callable[[int, str], None]] = []
+_db: Optional[sqlite3.Connection] = None
+_db_failed = False
+
+
+def _db_path() -> str:
+    p = os.getenv("GRAPH_VERSION_DB_PATH")
+    if not p:
+        p = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data_storage", "graph_version.sqlite3")
+    return p
+
+
+def _conn() -> Optional[sqlite3.Connection]:
+    """Shared connection (caller holds _lock); None once SQLite has failed."""
+    global _db, _db_failed
+    if _db is not None or _db_failed:
+        return _db
+    try:
+        path = _db_path()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS graph_version ("
+            "id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL, "
+            "reason TEXT, updated_at REAL)"
+        )
+        conn.execute("INSERT OR IGNORE INTO graph_version (id, version, reason, updated_at) VALUES (1, 0, '', 0)")
+        _db = conn
+    except Exception as exc:  # noqa: BLE001
+        _db_failed = True
+        print(f"[GraphVersion] sqlite unavailable, version is process-local: {exc}")
+    return _db
+
+
+def _read_shared() -> Optional[int]:
+    conn = _conn()
+    if conn is None:
+        return None
+    try:
+        row = conn.execute("SELECT version FROM graph_version WHERE id = 1").fetchone()
+        return int(row[0]) if row else None
+    except Exception as exc:  # noqa: BLE001
+        print(f"[GraphVersion] sqlite read failed: {exc}")
+        return None
+
+
+def _bump_shared(reason: str) -> Optional[int]:
+    conn = _conn()
+    if conn is None:
+        return None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE graph_version SET version = version + 1, reason = ?, updated_at = ? WHERE id = 1",
+                (reason, time.time()),
+            )
+            row = conn.execute("SELECT version FROM graph_version WHERE id = 1").fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return int(row[0]) if row else None
+    except Exception as exc:  # noqa: BLE001
+        print(f"[GraphVersion] sqlite write failed: {exc}")
+        return None
+
+
+def _notify(listeners: List[Callable[[int, str], None]], version: int, reason: str) -> None:
+    for fn in listeners:
+        try:
+            fn(version, reason)
+        except Exception as exc:  # noqa: BLE001
+            print(f"[GraphVersion] listener failed for {reason}: {exc}")
+
+
+def current() -> int:
+    global _version, _synced_at, _external_changes
+    now = time.monotonic()
+    if now - _synced_at < max(0.0, env_float("GRAPH_VERSION_SYNC_SECONDS", 2.0)):
+        return _version
+    with _lock:
+        if now - _synced_at < max(0.0, env_float("GRAPH_VERSION_SYNC_SECONDS", 2.0)):
+            return _version
+        _synced_at = now
+        shared = _read_shared()
+        if shared is None or shared == _version:
+            return _version
+        _version = shared
+        _external_changes += 1
+        listeners = list(_listeners)
+    _notify(listeners, shared, "external")
+    return shared
+
+
+def bump(reason: str = "") -> int:
+    global _version, _synced_at
+    with _lock:
+        shared = _bump_shared(reason or "unknown")
+        _version = shared if shared is not None else _version + 1
+        _synced_at = time.monotonic()
+        version = _version
+        key = reason or "unknown"
+        _bumps_by_reason[key] = _bumps_by_reason.get(key, 0) + 1
+        listeners = list(_listeners)
+    _notify(listeners, version, reason)
+    return version
+
+
+def subscribe(fn: Callable[[int, str], None]) -> None:
+    with _lock:
+        if fn not in _listeners:
+            _listeners.append(fn)
+
+
+def bumps_graph_version(fn: F) -> F:
+    """Bump the version after the wrapped write returns (or fails part-way)."""
+
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            bump(fn.__name__)
+
+    return wrapper  # type: ignore[return-value]
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "version": _version,
+            "bumps": dict(_bumps_by_reason),
+            "external_changes": _external_changes,
+            "shared": _db is not None,
+            "sync_seconds": max(0.0, env_float("GRAPH_VERSION_SYNC_SECONDS", 2.0)),
+        }
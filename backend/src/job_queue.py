@@ -0,0 +1,584 @@
+"""
+Background jobs for long-running generation endpoints (specsheet / manual book /
+BOM / poster image edit).
+
+A request is submitted as a job and the HTTP call returns a job id right away;
+the client polls status/progress (same state shape as
+`ManualOcrProgressManager`) and fetches the result when it is done. The old
+synchronous endpoints submit a job and await it, so both paths share the same
+limits:
+
+  - bounded worker pool: at most JOB_WORKERS jobs run at once;
+  - per-type caps: at most JOB_MAX_CONCURRENCY_<TYPE> jobs of one type run at
+    once; a capped type does not hold back queued jobs of other types;
+  - duplicate submissions (same type + same payload) while a job is queued or
+    running return that job instead of starting another one, so a client or
+    proxy retry does not double the load;
+  - job records (payload, state, result) are persisted in SQLite. Each process
+    heartbeats the jobs it owns; queued/running jobs whose owner stopped
+    heartbeating (restart, crash, another worker died) are claimed again and
+    re-run, up to JOB_MAX_ATTEMPTS times.
+
+Cancel is cooperative: a queued job is dropped immediately, a running job is
+marked and its handler stops at the next `job.check_cancelled()`; a model call
+already in flight is not interrupted, its result is discarded.
+
+Env knobs (all optional):
+  - JOB_WORKERS                     jobs running at once per process (default 4)
+  - JOB_MAX_CONCURRENCY_<TYPE>      e.g. JOB_MAX_CONCURRENCY_POSTER_IMAGE_EDIT=1
+  - JOB_DB_PATH                     SQLite file (default: data_storage/jobs.sqlite3)
+  - JOB_HEARTBEAT_SECONDS           owner heartbeat / recovery sweep interval (default 15)
+  - JOB_MAX_ATTEMPTS                runs per job before it is failed after restarts (default 2)
+  - JOB_RETENTION_HOURS             finished job records kept (default 72)
+  - JOB_MEMORY_MAX                  finished jobs kept in memory (default 500)
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from copy import deepcopy
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Optional
+
+from src.env import env_int
+from src.executors import run_db
+
+
+def _job_db_path() -> str:
+    p = (os.getenv("JOB_DB_PATH") or "").strip()
+    if not p:
+        p = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data_storage", "jobs.sqlite3")
+    os.makedirs(os.path.dirname(p) or ".", exist_ok=True)
+    return p
+
+
+FINISHED = {"success", "exception", "cancelled"}
+
+
+def _dedup_key(job_type: str, payload_json: str) -> str:
+    return hashlib.sha1(f"{job_type}\n{payload_json}".encode("utf-8")).hexdigest()
+
+
+class JobCancelled(Exception):
+    """Raised by `JobHandle.check_cancelled()` inside a handler."""
+
+
+@dataclass
+class JobType:
+    name: str
+    model: Any  # pydantic request model
+    handler: Callable[[Any, "JobHandle"], Any]
+    validate: Optional[Callable[[Any], None]] = None
+    max_concurrency: int = 2
+    exclude_none: bool = False
+
+    def cap(self) -> int:
+        return max(1, env_int(f"JOB_MAX_CONCURRENCY_{self.name.upper()}", self.max_concurrency))
+
+
+class JobHandle:
+    """Passed to handlers: progress updates and cooperative cancel checks."""
+
+    def __init__(self, manager: "JobManager", job_id: str) -> None:
+        self._manager = manager
+        self.job_id = job_id
+
+    def update(self, **payload: Any) -> None:
+        self._manager._update(self.job_id, **payload)
+
+    def cancelled(self) -> bool:
+        return self._manager._cancel_requested(self.job_id)
+
+    def check_cancelled(self) -> None:
+        if self.cancelled():
+            raise JobCancelled()
+
+
+def _error_status(exc: BaseException) -> int:
+    if isinstance(exc, ValueError):
+        return 400
+    code = getattr(exc, "status_code", None)
+    return code if isinstance(code, int) else 500
+
+
+def _error_text(exc: BaseException) -> str:
+    detail = getattr(exc, "detail", None)
+    return str(detail if detail is not None else exc)
+
+
+def _to_jsonable(value: Any, exclude_none: bool) -> Any:
+    if hasattr(value, "dict"):
+        value = value.dict(exclude_none=exclude_none)
+    return json.loads(json.dumps(value, ensure_ascii=False, default=str))
+
+
+class JobManager:
+    def __init__(self) -> None:
+        self._types: Dict[str, JobType] = {}
+        self._lock = threading.Lock()
+        self._states: "OrderedDict[str, dict]" = OrderedDict()
+        self._results: Dict[str, Any] = {}
+        self._waiters: Dict[str, Future] = {}
+        self._payloads: Dict[str, Any] = {}
+        self._dedup: Dict[str, str] = {}
+        self._pending: Deque[str] = deque()
+        self._running: Dict[str, int] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+        self._counters = {"submitted": 0, "deduplicated": 0, "recovered": 0, "succeeded": 0, "failed": 0, "cancelled": 0}
+
+    # ---- registry ----
+
+    def register(self, job_type: JobType) -> None:
+        self._types[job_type.name] = job_type
+
+    def job_type(self, name: str) -> Optional[JobType]:
+        return self._types.get(name)
+
+    @staticmethod
+    def _workers() -> int:
+        return max(1, env_int("JOB_WORKERS", 4))
+
+    # ---- sqlite ----
+
+    def _conn(self) -> Optional[sqlite3.Connection]:
+        if self._db is not None:
+            return self._db
+        try:
+            conn = sqlite3.connect(_job_db_path(), timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    job_type TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload_json TEXT NOT NULL,
+                    state_json TEXT NOT NULL,
+                    result_json TEXT,
+                    owner TEXT,
+                    heartbeat_at REAL NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, heartbeat_at)")
+            conn.commit()
+        except Exception as exc:  # noqa: BLE001
+            print(f"[Jobs] sqlite unavailable, jobs are kept in memory only: {exc}")
+            return None
+        self._db = conn
+        return conn
+
+    def _db_exec(self, sql: str, params: tuple = ()) -> int:
+        with self._db_lock:
+            conn = self._conn()
+            if conn is None:
+                return 0
+            try:
+                cur = conn.execute(sql, params)
+                conn.commit()
+                return cur.rowcount
+            except Exception as exc:  # noqa: BLE001
+                print(f"[Jobs] sqlite write failed: {exc}")
+                return 0
+
+    def _db_query(self, sql: str, params: tuple = ()) -> list:
+        with self._db_lock:
+            conn = self._conn()
+            if conn is None:
+                return []
+            try:
+                return conn.execute(sql, params).fetchall()
+            except Exception as exc:  # noqa: BLE001
+                print(f"[Jobs] sqlite read failed: {exc}")
+                return []
+
+    def _persist_state(self, state: dict, result: Any = None) -> None:
+        now = time.time()
+        if result is None:
+            self._db_exec(
+                "UPDATE jobs SET status = ?, state_json = ?, heartbeat_at = ?, updated_at = ? WHERE job_id = ?",
+                (state["status"], json.dumps(state, ensure_ascii=False, default=str), now, now, state["job_id"]),
+            )
+        else:
+            self._db_exec(
+                "UPDATE jobs SET status = ?, state_json = ?, result_json = ?, heartbeat_at = ?, updated_at = ? WHERE job_id = ?",
+                (
+                    state["status"],
+                    json.dumps(state, ensure_ascii=False, default=str),
+                    json.dumps(result, ensure_ascii=False, default=str),
+                    now,
+                    now,
+                    state["job_id"],
+                ),
+            )
+
+    # ---- lifecycle ----
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._conn()
+        self._purge()
+        self._recover()
+        if self._sweeper is None or not self._sweeper.is_alive():
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="job-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def stop(self) -> None:
+        """Stop launching jobs. Queued/running records stay in SQLite and are re-run after restart."""
+        self._stop.set()
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._pending.clear()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _executor_locked(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers(), thread_name_prefix="job")
+        return self._executor
+
+    def _sweep_loop(self) -> None:
+        interval = max(1, env_int("JOB_HEARTBEAT_SECONDS", 15))
+        while not self._stop.wait(interval):
+            try:
+                with self._lock:
+                    owned = [jid for jid, st in self._states.items() if st["status"] not in FINISHED]
+                now = time.time()
+                for jid in owned:
+                    self._db_exec("UPDATE jobs SET heartbeat_at = ? WHERE job_id = ? AND owner = ?", (now, jid, self._owner))
+                self._recover()
+                self._purge()
+            except Exception as exc:  # noqa: BLE001
+                print(f"[Jobs] sweep failed: {exc}")
+
+    def _purge(self) -> None:
+        cutoff = time.time() - max(1, env_int("JOB_RETENTION_HOURS", 72)) * 3600
+        self._db_exec(
+            "DELETE FROM jobs WHERE status IN ('success', 'exception', 'cancelled') AND updated_at < ?",
+            (cutoff,),
+        )
+
+    def _recover(self) -> None:
+        """Claim queued/running jobs whose owner stopped heartbeating and queue them again."""
+        stale_before = time.time() - 3 * max(1, env_int("JOB_HEARTBEAT_SECONDS", 15))
+        rows = self._db_query(
+            "SELECT job_id, job_type, payload_json, state_json, owner, attempts, cancel_requested FROM jobs "
+            "WHERE status IN ('queued', 'running') AND heartbeat_at < ? AND (owner IS NULL OR owner != ?)",
+            (stale_before, self._owner),
+        )
+        max_attempts = max(1, env_int("JOB_MAX_ATTEMPTS", 2))
+        for job_id, job_type, payload_json, state_json, owner, attempts, cancel_requested in rows:
+            jt = self._types.get(job_type)
+            if jt is None:
+                continue
+            claimed = self._db_exec(
+                "UPDATE jobs SET owner = ?, heartbeat_at = ? WHERE job_id = ? AND owner IS ? AND heartbeat_at < ?",
+                (self._owner, time.time(), job_id, owner, stale_before),
+            )
+            if claimed != 1:
+                continue  # another worker got it first
+            try:
+                state = json.loads(state_json)
+                payload = jt.model(**json.loads(payload_json))
+            except Exception as exc:  # noqa: BLE001
+                state = {"job_id": job_id, "type": job_type, "stages": {}}
+                self._finish_recovered(state, "exception", f"任务记录无法恢复: {exc}")
+                continue
+            if cancel_requested:
+                self._finish_recovered(state, "cancelled", "任务已取消")
+            elif int(attempts or 0) >= max_attempts:
+                self._finish_recovered(state, "exception", "服务重启次数过多，任务已中断")
+            else:
+                state.update({"status": "queued", "stage": "排队中", "detail": "服务重启后重新排队", "percent": 0})
+                state["updated_at"] = time.time()
+                dedup_key = _dedup_key(job_type, payload_json)
+                with self._lock:
+                    self._states[job_id] = state
+                    self._payloads[job_id] = payload
+                    # Identical requests after the restart join this job instead of starting another
+                    if dedup_key not in self._dedup:
+                        self._dedup[dedup_key] = job_id
+                        state["_dedup"] = dedup_key
+                    self._pending.append(job_id)
+                    self._counters["recovered"] += 1
+                    snapshot = self._public(state)
+                self._persist_state(snapshot)
+                print(f"[Jobs] Recovered {job_type} job {job_id} (attempt {int(attempts or 0) + 1})")
+        self._pump()
+
+    def _finish_recovered(self, state: dict, status: str, detail: str) -> None:
+        state.update({"status": status, "stage": "出错" if status == "exception" else "已取消", "detail": detail})
+        if status == "exception":
+            state["error"] = detail
+            state["error_status"] = 500
+        state["updated_at"] = time.time()
+        self._persist_state(state)
+
+    # ---- submit / run ----
+
+    def submit(self, job_type: str, payload: Any) -> dict:
+        """Queue a job (payload: the type's request model or a dict). Returns its state."""
+        return self._submit(job_type, payload)[0]
+
+    def _submit(self, job_type: str, payload: Any) -> "tuple[dict, Future]":
+        jt = self._types.get(job_type)
+        if jt is None:
+            raise KeyError(job_type)
+        if not isinstance(payload, jt.model):
+            payload = jt.model(**(payload or {}))
+        if jt.validate is not None:
+            jt.validate(payload)
+        payload_json = json.dumps(payload.dict(by_alias=True), ensure_ascii=False, sort_keys=True, default=str)
+        dedup_key = _dedup_key(job_type, payload_json)
+        now = time.time()
+        with self._lock:
+            existing = self._dedup.get(dedup_key)
+            if existing and self._states.get(existing, {}).get("status") not in FINISHED | {None}:
+                self._counters["deduplicated"] += 1
+                return self._public(self._states[existing]), self._waiter_locked(existing)
+            job_id = uuid.uuid4().hex
+            state = {
+                "job_id": job_id,
+                "type": job_type,
+                "status": "queued",
+                "stage": "排队中",
+                "detail": "等待空闲的生成任务槽位",
+                "percent": 0,
+                "error": None,
+                "error_status": None,
+                "stages": {},
+                "created_at": now,
+                "started_at": None,
+                "finished_at": None,
+                "updated_at": now,
+            }
+            self._states[job_id] = state
+            self._payloads[job_id] = payload
+            waiter = self._waiter_locked(job_id)
+            self._dedup[dedup_key] = job_id
+            state["_dedup"] = dedup_key
+            self._pending.append(job_id)
+            self._counters["submitted"] += 1
+            snapshot = self._public(state)
+        self._db_exec(
+            "INSERT INTO jobs(job_id, job_type, status, payload_json, state_json, owner, heartbeat_at, created_at, updated_at) "
+            "VALUES(?,?,?,?,?,?,?,?,?)",
+            (job_id, job_type, "queued", payload_json, json.dumps(snapshot, ensure_ascii=False), self._owner, now, now, now),
+        )
+        self._pump()
+        return snapshot, waiter
+
+    def _waiter_locked(self, job_id: str) -> Future:
+        """Future resolved when the job finishes (created on demand, e.g. for recovered jobs)."""
+        waiter = self._waiters.get(job_id)
+        if waiter is None:
+            waiter = Future()
+            self._waiters[job_id] = waiter
+        return waiter
+
+    async def run(self, job_type: str, payload: Any) -> Any:
+        """Submit and await the job in-process; returns the handler's return value or re-raises its error."""
+        _state, fut = await run_db(self._submit, job_type, payload)
+        # shield: a dropped client connection must not cancel the job for other waiters
+        return await asyncio.shield(asyncio.wrap_future(fut))
+
+    def _pump(self) -> None:
+        if self._stop.is_set():
+            return
+        launch = []
+        with self._lock:
+            total = sum(self._running.values())
+            skipped: Deque[str] = deque()
+            while self._pending and total < self._workers():
+                job_id = self._pending.popleft()
+                state = self._states.get(job_id)
+                if state is None or state["status"] != "queued":
+                    continue
+                jt = self._types[state["type"]]
+                if self._running.get(jt.name, 0) >= jt.cap():
+                    skipped.append(job_id)
+                    continue
+                self._running[jt.name] = self._running.get(jt.name, 0) + 1
+                total += 1
+                launch.append(job_id)
+            skipped.extend(self._pending)
+            self._pending = skipped
+            executor = self._executor_locked() if launch else None
+        for job_id in launch:
+            executor.submit(self._execute, job_id)
+
+    def _execute(self, job_id: str) -> None:
+        with self._lock:
+            state = self._states[job_id]
+            payload = self._payloads.get(job_id)
+            jt = self._types[state["type"]]
+        outcome: Any = None
+        error: Optional[BaseException] = None
+        try:
+            if self._cancel_requested(job_id):
+                raise JobCancelled()
+            self._update(job_id, status="running", stage="生成中", detail="正在调用模型生成", percent=5, started_at=time.time())
+            self._db_exec("UPDATE jobs SET attempts = attempts + 1 WHERE job_id = ?", (job_id,))
+            outcome = jt.handler(payload, JobHandle(self, job_id))
+            if self._cancel_requested(job_id):
+                raise JobCancelled()
+        except BaseException as exc:  # noqa: BLE001
+            error = exc
+        finally:
+            with self._lock:
+                self._running[jt.name] = max(0, self._running.get(jt.name, 0) - 1)
+            self._complete(job_id, jt, outcome, error)
+            self._pump()
+
+    def _complete(self, job_id: str, jt: JobType, outcome: Any, error: Optional[BaseException]) -> None:
+        now = time.time()
+        result_json = None
+        if error is None:
+            try:
+                result_json = _to_jsonable(outcome, jt.exclude_none)
+            except Exception as exc:  # noqa: BLE001
+                error = exc
+        with self._lock:
+            state = self._states[job_id]
+            if isinstance(error, JobCancelled):
+                state.update({"status": "cancelled", "stage": "已取消", "detail": "任务已取消"})
+                self._counters["cancelled"] += 1
+            elif error is not None:
+                state.update({
+                    "status": "exception",
+                    "stage": "出错",
+                    "detail": _error_text(error),
+                    "error": _error_text(error),
+                    "error_status": _error_status(error),
+                })
+                self._counters["failed"] += 1
+            else:
+                state.update({"status": "success", "stage": "完成", "detail": "生成完成", "percent": 100})
+                self._results[job_id] = result_json
+                self._counters["succeeded"] += 1
+            state["finished_at"] = now
+            state["updated_at"] = now
+            self._dedup.pop(state.pop("_dedup", ""), None)
+            self._payloads.pop(job_id, None)
+            waiter = self._waiters.pop(job_id, None)
+            snapshot = self._public(state)
+            self._trim_locked()
+        self._persist_state(snapshot, result_json)
+        if waiter is not None and not waiter.done():
+            if error is None:
+                waiter.set_result(outcome)
+            else:
+                waiter.set_exception(error)
+
+    def _trim_locked(self) -> None:
+        limit = max(1, env_int("JOB_MEMORY_MAX", 500))
+        finished = [jid for jid, st in self._states.items() if st["status"] in FINISHED]
+        for jid in finished[: max(0, len(finished) - limit)]:
+            self._states.pop(jid, None)
+            self._results.pop(jid, None)
+
+    # ---- state ----
+
+    @staticmethod
+    def _public(state: dict) -> dict:
+        return {k: deepcopy(v) for k, v in state.items() if not k.startswith("_")}
+
+    def _update(self, job_id: str, **payload: Any) -> None:
+        with self._lock:
+            state = self._states.get(job_id)
+            if not state:
+                return
+            state.update(payload)
+            state["updated_at"] = time.time()
+            snapshot = self._public(state)
+        self._persist_state(snapshot)
+
+    def _cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            state = self._states.get(job_id)
+            if state and state.get("cancel_requested"):
+                return True
+        # the cancel may have been posted to another worker
+        rows = self._db_query("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,))
+        return bool(rows and rows[0][0])
+
+    def get_state(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            state = self._states.get(job_id)
+            if state is not None:
+                return self._public(state)
+        rows = self._db_query("SELECT state_json FROM jobs WHERE job_id = ?", (job_id,))
+        if not rows:
+            return None
+        try:
+            return json.loads(rows[0][0])
+        except Exception:
+            return None
+
+    def get_result(self, job_id: str) -> Any:
+        with self._lock:
+            if job_id in self._results:
+                return deepcopy(self._results[job_id])
+        rows = self._db_query("SELECT result_json FROM jobs WHERE job_id = ?", (job_id,))
+        if not rows or rows[0][0] is None:
+            return None
+        return json.loads(rows[0][0])
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            state = self._states.get(job_id)
+            queued_here = state is not None and state["status"] == "queued"
+            if state is not None and state["status"] not in FINISHED:
+                state["cancel_requested"] = True
+                state["detail"] = "正在取消"
+                state["updated_at"] = time.time()
+            if queued_here:
+                try:
+                    self._pending.remove(job_id)
+                except ValueError:
+                    queued_here = False
+        self._db_exec(
+            "UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status IN ('queued', 'running')",
+            (job_id,),
+        )
+        if queued_here:
+            jt = self._types[state["type"]]
+            self._complete(job_id, jt, None, JobCancelled())
+        return self.get_state(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            by_status: Dict[str, int] = {}
+            for st in self._states.values():
+                by_status[st["status"]] = by_status.get(st["status"], 0) + 1
+            return {
+                "owner": self._owner,
+                "workers": self._workers(),
+                "pending": len(self._pending),
+                "running": dict(self._running),
+                "caps": {name: jt.cap() for name, jt in self._types.items()},
+                "in_memory": by_status,
+                **self._counters,
+            }
+
+
+job_manager = JobManager()
@@ -1,9 +1,34 @@
+"""
+SQLite store for kb_chat conversations and messages.
+
+Connections are kept per thread (the route pools are bounded, so this is a
+small fixed set) in WAL mode, and the schema is created/migrated once per DB
+path instead of on every call. Message sequence numbers are allocated inside a
+`BEGIN IMMEDIATE` transaction, so concurrent appends to one conversation never
+get the same seq.
+
+`append_message_async` hands messages to a single background writer that
+commits them in small batches; the SSE route uses it so persistence never sits
+between the model's last token and the `done` event. Reads of a conversation
+(and synchronous appends) wait for its pending writes first.
+
+Env knobs (all optional):
+  - KBCHAT_CONV_DB_PATH           database file
+  - KBCHAT_CONV_DB_SYNCHRONOUS    PRAGMA synchronous (default NORMAL; WAL keeps this crash-safe)
+  - KBCHAT_CONV_WRITE_BEHIND      set to 0 to make append_message_async write inline
+  - KBCHAT_CONV_WRITE_BATCH       max messages per background commit (default 64)
+"""
 import json
 import os
+import queue
 import sqlite3
+import threading
 import time
 import uuid
-from typing import Any, Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from src.env import env_int
 
 
 def _db_path() -> str:
@@ -14,19 +39,69 @@ def _db_path() -> str:
     return p
 
 
-def _connect() -> sqlite3.Connection:
-    conn = sqlite3.connect(_db_path(), timeout=30, check_same_thread=False)
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready: set = set()
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {"connections": 0, "async_enqueued": 0, "async_written": 0, "async_failed": 0, "batches": 0}
+
+
+def _bump_stat(key: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[key] = _stats.get(key, 0) + n
+
+
+def _open(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    sync = (os.getenv("KBCHAT_CONV_DB_SYNCHRONOUS") or "NORMAL").strip().upper()
+    if sync not in {"OFF", "NORMAL", "FULL", "EXTRA"}:
+        sync = "NORMAL"
+    conn.execute(f"PRAGMA synchronous={sync}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    _bump_stat("connections")
     return conn
 
 
-def _now_ms() -> int:
-    return int(time.time() * 1000)
+def _connect() -> sqlite3.Connection:
+    """This thread's connection to the current DB path (schema guaranteed)."""
+    path = _db_path()
+    cached = getattr(_local, "conn", None)
+    if cached is not None and cached[0] == path:
+        return cached[1]
+    if cached is not None:
+        try:
+            cached[1].close()
+        except Exception:
+            pass
+    conn = _open(path)
+    _local.conn = (path, conn)
+    _ensure_schema(conn, path)
+    return conn
 
 
-def init_db() -> None:
+@contextmanager
+def _connection() -> Iterator[sqlite3.Connection]:
     conn = _connect()
     try:
+        yield conn
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _ensure_schema(conn: sqlite3.Connection, path: str) -> None:
+    if path in _schema_ready:
+        return
+    with _schema_lock:
+        if path in _schema_ready:
+            return
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS conversations (
@@ -61,32 +136,30 @@ def init_db() -> None:
         conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_conv_seq ON messages(conversation_id, seq)")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_owner ON conversations(owner_userid)")
         conn.commit()
-    finally:
-        conn.close()
+        _schema_ready.add(path)
+
+
+def init_db() -> None:
+    _connect()
 
 
 def create_conversation(owner_userid: str, initial_title: Optional[str] = None) -> Dict[str, Any]:
-    init_db()
     ou = (owner_userid or "").strip()
     if not ou:
         raise ValueError("owner_userid required")
     cid = str(uuid.uuid4())
     now = _now_ms()
     title = (initial_title or "新对话").strip() or "新对话"
-    conn = _connect()
-    try:
+    with _connection() as conn:
         conn.execute(
             "INSERT INTO conversations(id, owner_userid, title, created_at_ms, updated_at_ms) VALUES(?,?,?,?,?)",
             (cid, ou, title, now, now),
         )
         conn.commit()
-    finally:
-        conn.close()
     return {"id": cid, "title": title, "created_at_ms": now, "updated_at_ms": now}
 
 
 def list_conversations(owner_userid: str, limit: int = 50, offset: int = 0, q: str = "") -> List[Dict[str, Any]]:
-    init_db()
     ou = (owner_userid or "").strip()
     if not ou:
         return []
@@ -94,8 +167,7 @@ def list_conversations(owner_userid: str, limit: int = 50, offset: int = 0, q: s
     off = max(0, int(offset or 0))
     query = (q or "").strip()
 
-    conn = _connect()
-    try:
+    with _connection() as conn:
         if query:
             rows = conn.execute(
                 "SELECT id, title, created_at_ms, updated_at_ms FROM conversations WHERE owner_userid = ? AND title LIKE ? ORDER BY updated_at_ms DESC LIMIT ? OFFSET ?",
@@ -107,27 +179,21 @@ def list_conversations(owner_userid: str, limit: int = 50, offset: int = 0, q: s
                 (ou, lim, off),
             ).fetchall()
         return [dict(r) for r in rows]
-    finally:
-        conn.close()
 
 
 def get_conversation(owner_userid: str, conversation_id: str) -> Optional[Dict[str, Any]]:
-    init_db()
     ou = (owner_userid or "").strip()
     if not ou:
         return None
     cid = (conversation_id or "").strip()
     if not cid:
         return None
-    conn = _connect()
-    try:
+    with _connection() as conn:
         row = conn.execute(
             "SELECT id, title, created_at_ms, updated_at_ms FROM conversations WHERE id = ? AND owner_userid = ?",
             (cid, ou),
         ).fetchone()
         return dict(row) if row else None
-    finally:
-        conn.close()
 
 
 def _assert_owns_conversation(conn: sqlite3.Connection, owner_userid: str, conversation_id: str) -> None:
@@ -144,6 +210,7 @@ def _assert_owns_conversation(conn: sqlite3.Connection, owner_userid: str, conve
 
 
 def _next_seq(conn: sqlite3.Connection, conversation_id: str) -> int:
+    # Callers hold the write lock (BEGIN IMMEDIATE), so MAX+1 cannot race.
     row = conn.execute(
         "SELECT COALESCE(MAX(seq), 0) AS m FROM messages WHERE conversation_id = ?",
         (conversation_id,),
@@ -152,7 +219,7 @@ def _next_seq(conn: sqlite3.Connection, conversation_id: str) -> int:
     return m + 1
 
 
-def append_message(
+def _prepare_message(
     owner_userid: str,
     conversation_id: str,
     role: str,
@@ -160,7 +227,6 @@ def append_message(
     reasoning: str = "",
     citations: Optional[List[Dict[str, Any]]] = None,
 ) -> Dict[str, Any]:
-    init_db()
     cid = (conversation_id or "").strip()
     if not cid:
         raise ValueError("conversation_id required")
@@ -171,41 +237,196 @@ def append_message(
     if not txt:
         raise ValueError("empty content")
 
-    now = _now_ms()
-    mid = str(uuid.uuid4())
     citations_json = ""
     if citations is not None:
         try:
             citations_json = json.dumps(citations, ensure_ascii=False, default=str)
         except Exception:
             citations_json = ""
+    return {
+        "id": str(uuid.uuid4()),
+        "owner_userid": owner_userid,
+        "conversation_id": cid,
+        "seq": None,
+        "role": r,
+        "content": txt,
+        "reasoning": (reasoning or "").strip(),
+        "citations": citations or [],
+        "citations_json": citations_json,
+        "created_at_ms": _now_ms(),
+    }
 
-    conn = _connect()
-    try:
-        _assert_owns_conversation(conn, owner_userid, cid)
-        seq = _next_seq(conn, cid)
-        conn.execute(
-            "INSERT INTO messages(id, conversation_id, seq, role, content, reasoning, citations_json, created_at_ms) VALUES(?,?,?,?,?,?,?,?)",
-            (mid, cid, seq, r, txt, (reasoning or "").strip() or None, citations_json or None, now),
-        )
-        conn.execute("UPDATE conversations SET updated_at_ms = ? WHERE id = ?", (now, cid))
+
+def _insert_message(conn: sqlite3.Connection, msg: Dict[str, Any]) -> None:
+    cid = msg["conversation_id"]
+    _assert_owns_conversation(conn, msg["owner_userid"], cid)
+    msg["seq"] = _next_seq(conn, cid)
+    conn.execute(
+        "INSERT INTO messages(id, conversation_id, seq, role, content, reasoning, citations_json, created_at_ms) VALUES(?,?,?,?,?,?,?,?)",
+        (msg["id"], cid, msg["seq"], msg["role"], msg["content"], msg["reasoning"] or None, msg["citations_json"] or None, msg["created_at_ms"]),
+    )
+    conn.execute("UPDATE conversations SET updated_at_ms = ? WHERE id = ?", (msg["created_at_ms"], cid))
+
+
+def _public_message(msg: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in msg.items() if k not in {"owner_userid", "citations_json"}}
+
+
+def append_message(
+    owner_userid: str,
+    conversation_id: str,
+    role: str,
+    content: str,
+    reasoning: str = "",
+    citations: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    msg = _prepare_message(owner_userid, conversation_id, role, content, reasoning, citations)
+    # Keep ordering with messages still queued for this conversation.
+    flush_pending(msg["conversation_id"])
+    with _connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _insert_message(conn, msg)
         conn.commit()
-        return {
-            "id": mid,
-            "conversation_id": cid,
-            "seq": seq,
-            "role": r,
-            "content": txt,
-            "reasoning": (reasoning or "").strip(),
-            "citations": citations or [],
-            "created_at_ms": now,
-        }
-    finally:
-        conn.close()
+    return _public_message(msg)
+
+
+# ---- write-behind queue ----
+
+_write_queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+_pending_cond = threading.Condition()
+_pending: Dict[str, int] = {}
+_writer_lock = threading.Lock()
+_writer: Optional[threading.Thread] = None
+
+
+def write_behind_enabled() -> bool:
+    v = (os.getenv("KBCHAT_CONV_WRITE_BEHIND", "1") or "1").strip().lower()
+    return v not in {"0", "false", "no", "n", "off"}
+
+
+def _ensure_writer() -> None:
+    global _writer
+    with _writer_lock:
+        if _writer is not None and _writer.is_alive():
+            return
+        _writer = threading.Thread(target=_writer_loop, name="kbchat-conv-writer", daemon=True)
+        _writer.start()
+
+
+def _done_pending(msgs: List[Dict[str, Any]]) -> None:
+    with _pending_cond:
+        for m in msgs:
+            cid = m["conversation_id"]
+            left = _pending.get(cid, 0) - 1
+            if left > 0:
+                _pending[cid] = left
+            else:
+                _pending.pop(cid, None)
+        _pending_cond.notify_all()
+
+
+def _write_batch(batch: List[Dict[str, Any]]) -> None:
+    try:
+        with _connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for msg in batch:
+                try:
+                    conn.execute("SAVEPOINT msg")
+                    _insert_message(conn, msg)
+                    conn.execute("RELEASE SAVEPOINT msg")
+                    _bump_stat("async_written")
+                except ValueError as exc:
+                    conn.execute("ROLLBACK TO SAVEPOINT msg")
+                    conn.execute("RELEASE SAVEPOINT msg")
+                    _bump_stat("async_failed")
+                    print(f"[KBCHAT][ConvStore] dropped message for {msg['conversation_id']}: {exc}")
+            conn.commit()
+            _bump_stat("batches")
+    except Exception as exc:  # noqa: BLE001
+        _bump_stat("async_failed", len(batch))
+        print(f"[KBCHAT][ConvStore] batch write failed ({len(batch)} messages): {exc}")
+
+
+def _writer_loop() -> None:
+    stop = False
+    while not stop:
+        item = _write_queue.get()
+        if item is None:
+            break
+        batch = [item]
+        limit = max(1, env_int("KBCHAT_CONV_WRITE_BATCH", 64))
+        while len(batch) < limit:
+            try:
+                nxt = _write_queue.get_nowait()
+            except queue.Empty:
+                break
+            if nxt is None:
+                stop = True
+                break
+            batch.append(nxt)
+        try:
+            _write_batch(batch)
+        finally:
+            _done_pending(batch)
+
+
+def append_message_async(
+    owner_userid: str,
+    conversation_id: str,
+    role: str,
+    content: str,
+    reasoning: str = "",
+    citations: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """Validate now, persist on the background writer (seq is assigned at write time)."""
+    msg = _prepare_message(owner_userid, conversation_id, role, content, reasoning, citations)
+    if not write_behind_enabled():
+        with _connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            _insert_message(conn, msg)
+            conn.commit()
+        return _public_message(msg)
+    with _pending_cond:
+        _pending[msg["conversation_id"]] = _pending.get(msg["conversation_id"], 0) + 1
+    _ensure_writer()
+    _write_queue.put(msg)
+    _bump_stat("async_enqueued")
+    return _public_message(msg)
+
+
+def flush_pending(conversation_id: Optional[str] = None, timeout: float = 10.0) -> bool:
+    """Wait until queued writes (for one conversation, or all) are committed."""
+    deadline = time.time() + max(0.0, timeout)
+    with _pending_cond:
+        while (_pending.get(conversation_id, 0) if conversation_id else sum(_pending.values())) > 0:
+            left = deadline - time.time()
+            if left <= 0:
+                return False
+            _pending_cond.wait(left)
+    return True
+
+
+def stop_writer(timeout: float = 10.0) -> None:
+    """Drain the write-behind queue; called on application shutdown."""
+    flush_pending(None, timeout=timeout)
+    with _writer_lock:
+        w = _writer
+    if w is not None and w.is_alive():
+        _write_queue.put(None)
+        w.join(timeout=timeout)
+
+
+def store_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        out: Dict[str, Any] = dict(_stats)
+    with _pending_cond:
+        out["pending"] = sum(_pending.values())
+    out["write_behind"] = write_behind_enabled()
+    out["db_path"] = _db_path()
+    return out
 
 
 def list_messages(owner_userid: str, conversation_id: str, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
-    init_db()
     ou = (owner_userid or "").strip()
     if not ou:
         return []
@@ -215,8 +436,8 @@ def list_messages(owner_userid: str, conversation_id: str, limit: int = 50, offs
     lim = max(1, min(int(limit or 50), 500))
     off = max(0, int(offset or 0))
 
-    conn = _connect()
-    try:
+    flush_pending(cid)
+    with _connection() as conn:
         try:
             _assert_owns_conversation(conn, ou, cid)
         except Exception:
@@ -241,12 +462,9 @@ def list_messages(owner_userid: str, conversation_id: str, limit: int = 50, offs
                 d["reasoning"] = ""
             out.append(d)
         return out
-    finally:
-        conn.close()
 
 
 def set_conversation_title(owner_userid: str, conversation_id: str, title: str) -> None:
-    init_db()
     ou = (owner_userid or "").strip()
     if not ou:
         return
@@ -257,27 +475,23 @@ def set_conversation_title(owner_userid: str, conversation_id: str, title: str)
     if not t:
         return
     now = _now_ms()
-    conn = _connect()
-    try:
+    with _connection() as conn:
         conn.execute(
             "UPDATE conversations SET title = ?, updated_at_ms = ? WHERE id = ? AND owner_userid = ?",
             (t, now, cid, ou),
         )
         conn.commit()
-    finally:
-        conn.close()
 
 
 def delete_conversation(owner_userid: str, conversation_id: str) -> None:
-    init_db()
     ou = (owner_userid or "").strip()
     if not ou:
         return
     cid = (conversation_id or "").strip()
     if not cid:
         return
-    conn = _connect()
-    try:
+    flush_pending(cid)
+    with _connection() as conn:
         # Only delete if conversation belongs to user.
         row = conn.execute("SELECT id FROM conversations WHERE id = ? AND owner_userid = ?", (cid, ou)).fetchone()
         if not row:
@@ -285,5 +499,3 @@ def delete_conversation(owner_userid: str, conversation_id: str) -> None:
         conn.execute("DELETE FROM messages WHERE conversation_id = ?", (cid,))
         conn.execute("DELETE FROM conversations WHERE id = ? AND owner_userid = ?", (cid, ou))
         conn.commit()
-    finally:
-        conn.close()
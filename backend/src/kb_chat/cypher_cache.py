@@ -0,0 +1,193 @@
+"""
+Two-level cache for the kb_chat Text2Cypher path.
+
+  - plan cache:   normalized question (+ schema fingerprint) -> validated (cypher, params)
+                  Saves the generate_cypher / repair_cypher LLM round trips for
+                  repeated and lightly rephrased questions. Entries are only stored
+                  after the Cypher ran successfully.
+  - result cache: (cypher, params) -> rows, tagged with `graph_version.current()`.
+                  Any write helper that bumps the graph version makes older rows stale.
+
+Questions that refer back to the conversation (这个/它/上面/第N个...) include a
+hash of the recent history in their key, since the same words mean different
+entities in different chats.
+
+Env knobs (all optional):
+  - KBCHAT_CYPHER_CACHE                  set to 0 to disable both levels
+  - KBCHAT_CYPHER_PLAN_CACHE_MAX         plan entries (default 1024)
+  - KBCHAT_CYPHER_PLAN_CACHE_TTL_SECONDS plan entry lifetime (default 86400)
+  - KBCHAT_CYPHER_RESULT_CACHE_MAX       result entries (default 512)
+  - KBCHAT_CYPHER_RESULT_TTL_SECONDS     result entry lifetime even without writes (default 600)
+  - KBCHAT_CYPHER_RESULT_MAX_ROWS        larger results are not cached (default 1000)
+"""
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from src import graph_version
+from src.env import env_int
+
+
+def cypher_cache_enabled() -> bool:
+    v = (os.getenv("KBCHAT_CYPHER_CACHE", "1") or "1").strip().lower()
+    return v not in {"0", "false", "no", "n", "off"}
+
+
+_FILLERS_RE = re.compile(r"请问|请|帮我|帮忙|麻烦|一下|可以|能不能|能否|告诉我|查一下|查询|看看|呢|吗|呀|啊|吧|please|pls")
+_PUNCT_RE = re.compile(r"[\s\W_]+", flags=re.UNICODE)
+_REFERENTIAL_RE = re.compile(r"这个|那个|这款|那款|它|他们|它们|上面|上述|刚才|前面|第\s*\d+\s*个|第[一二三四五六七八九十]+个|this|that|it\b", re.IGNORECASE)
+
+
+def normalize_question(text: str) -> str:
+    t = unicodedata.normalize("NFKC", text or "").lower()
+    t = _FILLERS_RE.sub("", t)
+    return _PUNCT_RE.sub("", t)
+
+
+def _history_digest(history: Optional[List[Dict[str, str]]]) -> str:
+    tail = [
+        {"role": m.get("role"), "content": m.get("content")}
+        for m in (history or [])[-6:]
+        if isinstance(m, dict)
+    ]
+    return hashlib.sha1(json.dumps(tail, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _params_key(params: Dict[str, Any]) -> str:
+    return json.dumps(params or {}, ensure_ascii=False, sort_keys=True, default=str)
+
+
+class _Level:
+    """Bounded LRU with TTL and hit/miss counters."""
+
+    def __init__(self, name: str, max_env: str, max_default: int, ttl_env: str, ttl_default: int) -> None:
+        self.name = name
+        self._max_env, self._max_default = max_env, max_default
+        self._ttl_env, self._ttl_default = ttl_env, ttl_default
+        self._data: "OrderedDict[Any, Tuple[float, int, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get(self, key: Any, version: Optional[int] = None) -> Any:
+        ttl = max(1, env_int(self._ttl_env, self._ttl_default))
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, stored_version, value = entry
+            if (now - stored_at) > ttl or (version is not None and stored_version != version):
+                self._data.pop(key, None)
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Any, value: Any, version: int = 0) -> None:
+        limit = max(1, env_int(self._max_env, self._max_default))
+        with self._lock:
+            self._data[key] = (time.time(), version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > limit:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Any) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+class CypherCache:
+    def __init__(self) -> None:
+        self.plans = _Level(
+            "plan",
+            "KBCHAT_CYPHER_PLAN_CACHE_MAX", 1024,
+            "KBCHAT_CYPHER_PLAN_CACHE_TTL_SECONDS", 86400,
+        )
+        self.results = _Level(
+            "result",
+            "KBCHAT_CYPHER_RESULT_CACHE_MAX", 512,
+            "KBCHAT_CYPHER_RESULT_TTL_SECONDS", 600,
+        )
+
+    @staticmethod
+    def plan_key(question: str, history: Optional[List[Dict[str, str]]], schema_fingerprint: str) -> Optional[Tuple[str, str, str]]:
+        q = normalize_question(question)
+        if not q:
+            return None
+        hist = _history_digest(history) if _REFERENTIAL_RE.search(question or "") else ""
+        return (q, hist, schema_fingerprint)
+
+    def get_plan(self, key: Optional[Tuple[str, str, str]]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        if key is None or not cypher_cache_enabled():
+            return None
+        hit = self.plans.get(key)
+        if hit is None:
+            return None
+        cypher, params = hit
+        return cypher, copy.deepcopy(params)
+
+    def put_plan(self, key: Optional[Tuple[str, str, str]], cypher: str, params: Dict[str, Any]) -> None:
+        if key is None or not cypher_cache_enabled() or not cypher:
+            return
+        self.plans.put(key, (cypher, copy.deepcopy(params or {})))
+
+    def forget_plan(self, key: Optional[Tuple[str, str, str]]) -> None:
+        if key is not None:
+            self.plans.pop(key)
+
+    def get_rows(self, cypher: str, params: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        if not cypher_cache_enabled():
+            return None
+        rows = self.results.get((cypher, _params_key(params)), version=graph_version.current())
+        return copy.deepcopy(rows) if rows is not None else None
+
+    def put_rows(self, cypher: str, params: Dict[str, Any], rows: List[Dict[str, Any]], version: int) -> None:
+        if not cypher_cache_enabled():
+            return
+        if len(rows) > max(0, env_int("KBCHAT_CYPHER_RESULT_MAX_ROWS", 1000)):
+            return
+        self.results.put((cypher, _params_key(params)), copy.deepcopy(rows), version=version)
+
+    def clear(self) -> None:
+        self.plans.clear()
+        self.results.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": cypher_cache_enabled(),
+            "graph_version": graph_version.current(),
+            "plan": self.plans.stats(),
+            "result": self.results.stats(),
+        }
+
+
+cypher_cache = CypherCache()
@@ -0,0 +1,321 @@
+"""
+In-process n-gram index for kb_chat entity lookups.
+
+`_list_products` / `_list_material_codes` / `_list_accessories` used
+`toLower(coalesce(...)) CONTAINS toLower($kw)` over several properties, which
+is a label scan per call, and `_agent_prefetch_entity_hints` repeated it for
+every keyword variant. Here the searchable fields of Product / Material /
+Accessory nodes are loaded once, normalized (NFKC, lower-case, separators
+stripped) and indexed by character 2-/3-grams. A lookup takes one or more
+keyword variants and returns rows ranked exact > prefix > substring > fuzzy
+(gram Dice similarity), in the same row shape as the Cypher path.
+
+The index is rebuilt in the background when it gets older than the refresh
+interval or shortly after a write calls `mark_dirty()`; readers keep using the
+previous build meanwhile.
+
+Env knobs (all optional):
+  - KBCHAT_ENTITY_INDEX                  set to 0 to fall back to CONTAINS queries
+  - KBCHAT_ENTITY_INDEX_REFRESH_SECONDS  max age before a background rebuild (default 300)
+  - KBCHAT_ENTITY_INDEX_DEBOUNCE_SECONDS wait after mark_dirty() before rebuilding (default 3)
+  - KBCHAT_ENTITY_FUZZY_MIN              minimum fuzzy similarity to return a match (default 0.45)
+"""
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from src.env import env_float, env_int
+
+
+def entity_index_enabled() -> bool:
+    v = (os.getenv("KBCHAT_ENTITY_INDEX", "1") or "1").strip().lower()
+    return v not in {"0", "false", "no", "n", "off"}
+
+
+# kind -> (label, row key, searchable fields, sort fields)
+ENTITY_KINDS: Dict[str, Tuple[str, str, Tuple[str, ...], Tuple[str, ...]]] = {
+    "product": (
+        "Product",
+        "product",
+        ("product_id", "name", "display_name_en", "display_name_zh", "english_name", "chinese_name"),
+        ("product_id", "name", "display_name_en", "display_name_zh"),
+    ),
+    "material": (
+        "Material",
+        "material",
+        ("material_code", "name", "name_zh", "name_en"),
+        ("material_code", "name", "name_zh"),
+    ),
+    "accessory": (
+        "Accessory",
+        "accessory",
+        ("name", "name_zh", "name_en"),
+        ("name", "name_zh"),
+    ),
+}
+
+_SEPARATORS_RE = re.compile(r"[\s_\-./·]+")
+
+
+def normalize(text: Any) -> str:
+    return unicodedata.normalize("NFKC", str(text or "")).lower().strip()
+
+
+def compact(text: str) -> str:
+    return _SEPARATORS_RE.sub("", text)
+
+
+def grams(text: str, n: int) -> Set[str]:
+    if not text:
+        return set()
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+SUBSTRING_SCORE = 0.8
+
+
+def match_score(
+    query: str,
+    query_compact: str,
+    value: str,
+    value_compact: str,
+    fuzzy_min: float,
+    query_grams: Optional[Set[str]] = None,
+    value_grams: Optional[Set[str]] = None,
+) -> float:
+    """1.0 exact, ~0.9 prefix, ~0.8 substring, <=0.7 fuzzy, 0 no match."""
+    if not value:
+        return 0.0
+    if query == value or (query_compact and query_compact == value_compact):
+        return 1.0
+    ratio = len(query_compact) / max(1, len(value_compact))
+    if value.startswith(query) or (query_compact and value_compact.startswith(query_compact)):
+        return 0.9 + 0.05 * ratio
+    if query in value or (query_compact and query_compact in value_compact):
+        return SUBSTRING_SCORE + 0.05 * ratio
+    if len(query_compact) < 3:
+        return 0.0
+    gq = query_grams if query_grams is not None else grams(query_compact, 3)
+    gv = value_grams if value_grams is not None else grams(value_compact, 3)
+    if not gq or not gv:
+        return 0.0
+    dice = 2 * len(gq & gv) / (len(gq) + len(gv))
+    # Recall of the query's grams matters more than the value's length.
+    recall = len(gq & gv) / len(gq)
+    sim = 0.5 * dice + 0.5 * recall
+    return 0.7 * sim if sim >= fuzzy_min else 0.0
+
+
+@dataclass
+class _KindIndex:
+    rows: List[Dict[str, Any]] = field(default_factory=list)
+    # per row: list of (normalized, compact, compact 3-grams) field values
+    values: List[List[Tuple[str, str, Set[str]]]] = field(default_factory=list)
+    sort_keys: List[str] = field(default_factory=list)
+    postings2: Dict[str, Set[int]] = field(default_factory=dict)
+    postings3: Dict[str, Set[int]] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, rows: Sequence[Dict[str, Any]], fields: Sequence[str], sort_fields: Sequence[str]) -> "_KindIndex":
+        idx = cls()
+        for props in rows:
+            if not isinstance(props, dict):
+                continue
+            vals: List[Tuple[str, str, Set[str]]] = []
+            for f in fields:
+                v = props.get(f)
+                if v is None or str(v).strip() == "":
+                    continue
+                n = normalize(v)
+                c = compact(n)
+                vals.append((n, c, grams(c, 3)))
+            if not vals:
+                continue
+            i = len(idx.rows)
+            idx.rows.append(props)
+            idx.values.append(vals)
+            idx.sort_keys.append(next((str(props.get(f)) for f in sort_fields if props.get(f) is not None), ""))
+            for _n, c, g3 in vals:
+                for g in grams(c, 2):
+                    idx.postings2.setdefault(g, set()).add(i)
+                for g in g3:
+                    idx.postings3.setdefault(g, set()).add(i)
+        return idx
+
+    def candidates(self, query_compact: str) -> Optional[Set[int]]:
+        """Rows containing every gram of the query (None: too short, score every row).
+
+        Substring matches can only be in this set, and they always outrank fuzzy
+        ones, so `partial_candidates` is only needed when it does not fill the limit.
+        """
+        if len(query_compact) < 2:
+            return None
+        if len(query_compact) == 2:
+            return set(self.postings2.get(query_compact, set()))
+        gq = grams(query_compact, 3)
+        postings = sorted((self.postings3.get(g, set()) for g in gq), key=len)
+        full = set(postings[0]) if postings and postings[0] else set()
+        for p in postings[1:]:
+            if not full:
+                break
+            full &= p
+        return full
+
+    def partial_candidates(self, query_compact: str, fuzzy_min: float, exclude: Set[int]) -> Set[int]:
+        gq = grams(query_compact, 3)
+        hits: Counter = Counter()
+        for g in gq:
+            hits.update(self.postings3.get(g, ()))
+        # A fuzzy match needs a fair share of the query's grams.
+        need = max(1, int(len(gq) * fuzzy_min + 0.5))
+        return {i for i, cnt in hits.items() if cnt >= need and i not in exclude}
+
+
+class EntityIndex:
+    """Background-rebuilt n-gram indexes for Product / Material / Accessory."""
+
+    def __init__(self, loader: Callable[[str], List[Dict[str, Any]]]) -> None:
+        # loader(label) -> list of node property dicts
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._kinds: Optional[Dict[str, _KindIndex]] = None
+        self._built_at = 0.0
+        self._build_ms = 0.0
+        self._builds = 0
+        self._dirty_at = 0.0
+        self._rebuilding = False
+        self._last_error = ""
+        self._searches = 0
+
+    @property
+    def refresh_seconds(self) -> int:
+        return max(10, env_int("KBCHAT_ENTITY_INDEX_REFRESH_SECONDS", 300))
+
+    def rebuild(self) -> None:
+        with self._build_lock:
+            t0 = time.perf_counter()
+            kinds: Dict[str, _KindIndex] = {}
+            for kind, (label, _key, fields, sort_fields) in ENTITY_KINDS.items():
+                kinds[kind] = _KindIndex.build(self._loader(label), fields, sort_fields)
+            with self._lock:
+                self._kinds = kinds
+                self._built_at = time.time()
+                self._build_ms = (time.perf_counter() - t0) * 1000
+                self._builds += 1
+                self._last_error = ""
+
+    def mark_dirty(self, reason: str = "") -> None:
+        """Entities changed; rebuild in the background after the debounce window."""
+        with self._lock:
+            self._dirty_at = time.time()
+        self._rebuild_async()
+
+    def _rebuild_async(self) -> None:
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild_bg, name="kbchat-entity-index", daemon=True).start()
+
+    def _rebuild_bg(self) -> None:
+        try:
+            debounce = max(0, env_int("KBCHAT_ENTITY_INDEX_DEBOUNCE_SECONDS", 3))
+            while True:
+                wait = self._dirty_at + debounce - time.time()
+                if wait <= 0:
+                    break
+                time.sleep(wait)
+            self.rebuild()
+        except Exception as exc:  # noqa: BLE001
+            self._last_error = str(exc)
+            print(f"[KBCHAT][EntityIndex] rebuild failed: {exc}")
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def _current(self) -> Dict[str, _KindIndex]:
+        kinds = self._kinds
+        if kinds is None:
+            # First lookup builds synchronously; later ones never wait.
+            self.rebuild()
+            kinds = self._kinds or {}
+        else:
+            stale = (time.time() - self._built_at) > self.refresh_seconds or self._dirty_at > self._built_at
+            if stale:
+                self._rebuild_async()
+        return kinds
+
+    def search(
+        self,
+        kind: str,
+        keywords: Union[str, Sequence[str]],
+        limit: int = 50,
+        fuzzy_min: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        """Ranked lookup over one or more keyword variants; rows shaped like the Cypher path."""
+        _label, row_key, _fields, _sort = ENTITY_KINDS[kind]
+        idx = self._current().get(kind)
+        if idx is None or not idx.rows:
+            return []
+        fmin = env_float("KBCHAT_ENTITY_FUZZY_MIN", 0.45) if fuzzy_min is None else fuzzy_min
+        variants = [keywords] if isinstance(keywords, str) else list(keywords)
+
+        best: Dict[int, float] = {}
+        lim = max(1, int(limit or 50))
+
+        def score_rows(ids, q: str, qc: str, gq: Set[str], penalty: float) -> None:
+            for i in ids:
+                score = max(match_score(q, qc, n, c, fmin, gq, g3) for n, c, g3 in idx.values[i])
+                if score <= 0:
+                    continue
+                score -= penalty
+                if score > best.get(i, 0.0):
+                    best[i] = score
+
+        parsed = []
+        for rank, kw in enumerate(variants):
+            q = normalize(kw)
+            if q:
+                # Later variants (e.g. "Atlantic" for "Atlantic18") rank slightly below the original.
+                parsed.append((q, compact(q), 0.02 * rank))
+
+        for q, qc, penalty in parsed:
+            full = idx.candidates(qc)
+            score_rows(range(len(idx.rows)) if full is None else full, q, qc, grams(qc, 3), penalty)
+
+        strong = sum(1 for s in best.values() if s >= SUBSTRING_SCORE - 0.1)
+        if strong < lim:
+            for q, qc, penalty in parsed:
+                if len(qc) >= 3:
+                    score_rows(idx.partial_candidates(qc, fmin, set(best)), q, qc, grams(qc, 3), penalty)
+
+        with self._lock:
+            self._searches += 1
+        ranked = sorted(best.items(), key=lambda kv: (-kv[1], idx.sort_keys[kv[0]]))
+        return [{row_key: idx.rows[i], "score": round(s, 4)} for i, s in ranked[:lim]]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            kinds = self._kinds or {}
+            return {
+                "built": self._kinds is not None,
+                "built_at": self._built_at,
+                "age_seconds": round(time.time() - self._built_at, 1) if self._built_at else None,
+                "build_ms": round(self._build_ms, 1),
+                "builds": self._builds,
+                "rebuilding": self._rebuilding,
+                "last_error": self._last_error,
+                "searches": self._searches,
+                "entities": {k: len(v.rows) for k, v in kinds.items()},
+                "grams": {k: len(v.postings3) for k, v in kinds.items()},
+            }
@@ -0,0 +1,122 @@
+"""
+Per-conversation evidence cache for the non-agent kb_chat flow.
+
+Rows (and their citations) retrieved for a BOM identifier or a material's BOM
+candidates are kept with the conversation, so ordinal follow-ups ("第2个"),
+re-asks and switching back to an earlier candidate are answered without
+re-querying Neo4j. Entries live in `session_state` (namespace "evidence"), so
+they share its LRU/TTL/memory bounds and SQLite persistence across workers.
+
+An entry is stale when it is older than the TTL, or when it was written at an
+older `graph_version` (shared across workers, see `src.graph_version`).
+
+Env knobs (all optional):
+  - KBCHAT_EVIDENCE_CACHE              set to 0 to disable
+  - KBCHAT_EVIDENCE_TTL_SECONDS        entry lifetime (default 1800)
+  - KBCHAT_EVIDENCE_MAX_KEYS           identifiers kept per conversation (default 32)
+  - KBCHAT_EVIDENCE_MAX_ROWS           rows kept per identifier (default 200)
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from src import graph_version
+from src.env import env_int
+
+from .session_state import session_state
+
+_NAMESPACE = "evidence"
+
+
+def evidence_cache_enabled() -> bool:
+    v = (os.getenv("KBCHAT_EVIDENCE_CACHE", "1") or "1").strip().lower()
+    return v not in {"0", "false", "no", "n", "off"}
+
+
+def _key(kind: str, ident: str) -> str:
+    return f"{kind}:{(ident or '').strip()}"
+
+
+class EvidenceCache:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def _fresh(self, entry: Any) -> bool:
+        if not isinstance(entry, dict):
+            return False
+        ttl = max(1, env_int("KBCHAT_EVIDENCE_TTL_SECONDS", 1800))
+        if time.time() - float(entry.get("at") or 0) > ttl:
+            return False
+        if entry.get("graph_version") != graph_version.current():
+            return False
+        return isinstance(entry.get("rows"), list)
+
+    def get_many(self, session_id: str, kind: str, idents: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Fresh entries ({"rows", "citations"}) for the identifiers that have one."""
+        if not session_id or not evidence_cache_enabled():
+            return {}
+        state = session_state.get(_NAMESPACE, session_id)
+        out: Dict[str, Dict[str, Any]] = {}
+        hits = misses = stale = 0
+        for ident in idents:
+            entry = state.get(_key(kind, ident))
+            if entry is None:
+                misses += 1
+            elif not self._fresh(entry):
+                stale += 1
+                misses += 1
+            else:
+                hits += 1
+                out[ident] = {"rows": entry.get("rows") or [], "citations": entry.get("citations") or []}
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.stale += stale
+        return out
+
+    def get(self, session_id: str, kind: str, ident: str) -> Optional[Dict[str, Any]]:
+        return self.get_many(session_id, kind, [ident]).get(ident)
+
+    def put_many(self, session_id: str, kind: str, entries: Dict[str, Dict[str, Any]]) -> None:
+        """entries: ident -> {"rows": [...], "citations": [...]} (empty rows are cached too)."""
+        if not session_id or not entries or not evidence_cache_enabled():
+            return
+        max_rows = max(1, env_int("KBCHAT_EVIDENCE_MAX_ROWS", 200))
+        now = time.time()
+        state = session_state.get(_NAMESPACE, session_id)
+        for ident, ev in entries.items():
+            state[_key(kind, ident)] = {
+                "rows": list(ev.get("rows") or [])[:max_rows],
+                "citations": list(ev.get("citations") or []),
+                "at": now,
+                "graph_version": graph_version.current(),
+            }
+        max_keys = max(1, env_int("KBCHAT_EVIDENCE_MAX_KEYS", 32))
+        if len(state) > max_keys:
+            newest = sorted(state.items(), key=lambda kv: float((kv[1] or {}).get("at") or 0), reverse=True)[:max_keys]
+            state = dict(newest)
+        # Replace the whole namespace so pruned identifiers are dropped.
+        session_state.replace(_NAMESPACE, session_id, state)
+
+    def put(self, session_id: str, kind: str, ident: str, rows: List[Any], citations: Optional[List[Any]] = None) -> None:
+        self.put_many(session_id, kind, {ident: {"rows": rows, "citations": citations or []}})
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": evidence_cache_enabled(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+evidence_cache = EvidenceCache()
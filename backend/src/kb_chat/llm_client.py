@@ -1,7 +1,10 @@
 import os
 from typing import Any, Dict, Iterator, List, Optional
 
-from litellm import completion
+try:
+    from src.llm_gateway import llm_gateway
+except ImportError:  # pragma: no cover - run with backend/src on sys.path (python spa_classify.py)
+    from llm_gateway import llm_gateway  # type: ignore
 
 
 def _build_kwargs(messages: List[Dict[str, str]], model: Optional[str] = None, stream: bool = False) -> Dict[str, Any]:
@@ -48,9 +51,10 @@ def _build_kwargs(messages: List[Dict[str, str]], model: Optional[str] = None, s
 
 
 def chat_json(messages: List[Dict[str, str]], model: Optional[str] = None) -> Any:
-    resp = completion(**_build_kwargs(messages=messages, model=model, stream=False))
-    return resp
+    kwargs = _build_kwargs(messages=messages, model=model, stream=False)
+    # litellm's own timeout covers the request; the gateway adds a little slack as a hard stop.
+    return llm_gateway.complete(kwargs, timeout=float(kwargs["timeout"]) + 15, tag="kbchat")
 
 
 def chat_stream(messages: List[Dict[str, str]], model: Optional[str] = None) -> Iterator[Any]:
-    return completion(**_build_kwargs(messages=messages, model=model, stream=True))
+    return llm_gateway.stream(_build_kwargs(messages=messages, model=model, stream=True), tag="kbchat.stream")
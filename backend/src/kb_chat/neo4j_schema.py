@@ -2,7 +2,7 @@ import time
 from typing import Any, Dict, List, Optional
 
 from src.api_queries import get_neo4j_config
-from src.neo4j_file_add_neo4j import get_neo4j_driver
+from src.neo4j_pool import get_pooled_driver
 
 
 _SCHEMA_CACHE: Optional[Dict[str, Any]] = None
@@ -23,7 +23,7 @@ def probe_schema(force: bool = False) -> Dict[str, Any]:
         return _SCHEMA_CACHE
 
     cfg = get_neo4j_config()
-    driver = get_neo4j_driver(cfg)
+    driver = get_pooled_driver(cfg)
     try:
         with driver.session() as session:
             labels_rows = _run(session, "CALL db.labels()")
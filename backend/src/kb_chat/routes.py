@@ -1,7 +1,7 @@
 import json
 import os
 import uuid
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 import time
 import re
 
@@ -10,7 +10,6 @@ from fastapi.responses import StreamingResponse
 
 from src.dingtalk_auth import _COOKIE_NAME, _get_session
 
-from .neo4j_schema import probe_schema
 from .service import (
     answer_smalltalk_llm,
     answer_bom_candidates,
@@ -19,6 +18,7 @@ from .service import (
     answer_products_list,
     build_citations,
     decide_clarify,
+    forget_cypher,
     generate_cypher,
     generate_suggestions,
     is_smalltalk,
@@ -27,7 +27,11 @@ from .service import (
     route_intent,
     agent_mode_enabled,
     agent_orchestrate,
+    agent_orchestrate_events,
+    remember_cypher,
     run_cypher,
+    run_cypher_cached,
+    schema_service,
     smalltalk_reply,
     stream_smalltalk_llm,
     stream_material_codes_list,
@@ -38,6 +42,7 @@ from .service import (
 
 from .conversations_store import (
     append_message,
+    append_message_async,
     create_conversation,
     delete_conversation,
     get_conversation,
@@ -45,6 +50,8 @@ from .conversations_store import (
     list_messages,
     set_conversation_title,
 )
+from .evidence_cache import evidence_cache
+from .session_state import session_state
 
 router = APIRouter()
 
@@ -66,10 +73,6 @@ def _require_userid(request: Request) -> str:
         raise HTTPException(status_code=401, detail="not logged in")
     return uid
 
-# In-memory per-session state for UX flows (best-effort). This avoids LLM hallucinating
-# candidate selections and allows deterministic mapping of "1/2" to actual DB candidates.
-_SESSION_STATE: Dict[str, Dict[str, Any]] = {}
-
 
 @router.post("/api/kb/conversations")
 async def kb_create_conversation(request: Request, payload: Dict[str, Any] = Body(default={})):  # type: ignore
@@ -153,16 +156,13 @@ def _extract_candidate_index(message: str) -> Optional[int]:
 def _set_last_bom_candidates(session_id: str, material_code: str, candidates: list) -> None:
     if not session_id:
         return
-    st = _SESSION_STATE.setdefault(session_id, {})
-    st["last_bom_material_code"] = material_code
-    st["last_bom_candidates"] = candidates
+    session_state.update("ui", session_id, {"last_bom_material_code": material_code, "last_bom_candidates": candidates})
 
 
 def _get_last_bom_candidates(session_id: str) -> list:
     if not session_id:
         return []
-    st = _SESSION_STATE.get(session_id) or {}
-    cands = st.get("last_bom_candidates")
+    cands = session_state.get("ui", session_id).get("last_bom_candidates")
     return cands if isinstance(cands, list) else []
 
 
@@ -212,6 +212,89 @@ def _query_config_for_bom_identifier(identifier: str, limit: int = 200) -> list:
     return run_cypher(cypher, {"ident": ident, "limit": limit})
 
 
+def _query_config_for_bom_identifiers(identifiers: list, limit: int = 200) -> Dict[str, list]:
+    """Batched `_query_config_for_bom_identifier`: one UNWIND query, rows grouped per identifier."""
+    idents = [i for i in dict.fromkeys((str(x or "").strip() for x in identifiers)) if i]
+    if not idents:
+        return {}
+    # Per-identifier subquery so LIMIT applies before the rows are collected.
+    cypher = (
+        "UNWIND $idents AS ident "
+        "CALL { "
+        "  WITH ident "
+        "  MATCH (b) "
+        "  WHERE (b.bom_id = ident OR b.bom_code = ident OR b.bomId = ident OR b.bomCode = ident "
+        "     OR b.code = ident OR b.id = ident OR b.name = ident OR b.title = ident "
+        "     OR toString(b.bom_id) = ident OR toString(b.bom_code) = ident OR toString(b.id) = ident) "
+        "  WITH b "
+        "  OPTIONAL MATCH (b)-[r1]-(x) "
+        "  OPTIONAL MATCH (x)-[r2]-(y) "
+        "  WITH b, r1, x, r2, y "
+        "  WHERE x IS NOT NULL AND ("
+        "    any(l IN labels(x) WHERE toUpper(l) CONTAINS 'CONFIG') "
+        "    OR any(l IN labels(x) WHERE toUpper(l) CONTAINS 'BOM') "
+        "    OR x.bom_id IS NOT NULL OR x.bom_code IS NOT NULL OR x.bomId IS NOT NULL OR x.bomCode IS NOT NULL"
+        "  ) "
+        "  RETURN {b_labels: labels(b), bom: b{.*}, r1_type: type(r1), x_labels: labels(x), node1: x{.*}, "
+        "  r2_type: type(r2), y_labels: labels(y), node2: y{.*}} AS row "
+        "  LIMIT $limit "
+        "} "
+        "RETURN ident, collect(row) AS rows"
+    )
+    out: Dict[str, list] = {i: [] for i in idents}
+    for r in run_cypher(cypher, {"idents": idents, "limit": limit}):
+        ident = str(r.get("ident") or "")
+        if ident in out and isinstance(r.get("rows"), list):
+            out[ident] = r["rows"]
+    return out
+
+
+def _config_rows_for_selected_candidate(session_id: str, cands: list, idx: int) -> Tuple[str, list]:
+    """Config rows for candidate `idx` (1-based), else for the first other candidate that has any.
+
+    Served from the conversation's evidence cache where possible; whatever is
+    missing is fetched with one query for the chosen BOM and, only if that is
+    empty, one batched query for all remaining candidates.
+    """
+    chosen_ident = _candidate_identifier(cands[idx - 1])
+    others = [_candidate_identifier(c) for j, c in enumerate(cands) if j != idx - 1]
+    others = [i for i in others if i and i != chosen_ident]
+
+    cached = evidence_cache.get_many(session_id, "bom_config", [chosen_ident] + others)
+    if chosen_ident in cached:
+        rows = cached[chosen_ident]["rows"]
+    else:
+        rows = _query_config_for_bom_identifier(chosen_ident)
+        evidence_cache.put(session_id, "bom_config", chosen_ident, rows, build_citations(rows))
+    if rows:
+        return chosen_ident, rows
+
+    # Auto-pick another candidate with config, in candidate order.
+    missing = [i for i in others if i not in cached]
+    fetched = _query_config_for_bom_identifiers(missing) if missing else {}
+    if fetched:
+        evidence_cache.put_many(
+            session_id,
+            "bom_config",
+            {i: {"rows": r, "citations": build_citations(r)} for i, r in fetched.items()},
+        )
+    for ident in others:
+        r2 = cached[ident]["rows"] if ident in cached else fetched.get(ident) or []
+        if r2:
+            return ident, r2
+    return chosen_ident, []
+
+
+def _boms_for_material_cached(session_id: str, material_code: str, limit: int) -> list:
+    key = f"{material_code}|{limit}"
+    hit = evidence_cache.get(session_id, "material_boms", key)
+    if hit is not None:
+        return hit["rows"]
+    rows = _query_boms_for_material(material_code, limit=limit)
+    evidence_cache.put(session_id, "material_boms", key, rows)
+    return rows
+
+
 def _strict_no_candidates_text(material_code: str) -> str:
     mc = (material_code or "").strip()
     head = f"未在知识库中查到 {mc} 的BOM候选。" if mc else "未在知识库中查到BOM候选。"
@@ -252,7 +335,7 @@ def _query_boms_for_material(material_code: str, limit: int) -> list:
         # Neo4j allows backticks for escaping. Double backticks inside.
         return "`" + t.replace("`", "``") + "`"
 
-    schema = probe_schema()
+    schema = schema_service.probed()
     rel_types = schema.get("relationshipTypes") or []
     bom_like = [rt for rt in rel_types if isinstance(rt, str) and "BOM" in rt.upper()]
     bom_like = bom_like[:20]
@@ -398,7 +481,8 @@ async def kb_chat_schema():
     This is intended for integration/debugging.
     """
 
-    return probe_schema(force=True)
+    schema_service.refresh()
+    return schema_service.probed()
 
 
 @router.post("/api/kb/chat")
@@ -473,23 +557,7 @@ async def kb_chat(request: Request, payload: Dict[str, Any] = Body(...)):
     if idx is not None:
         cands = _get_last_bom_candidates(session_id)
         if cands and 1 <= idx <= len(cands):
-            chosen = cands[idx - 1]
-            chosen_ident = _candidate_identifier(chosen)
-            rows = _query_config_for_bom_identifier(chosen_ident)
-            used_ident = chosen_ident
-            if not rows:
-                # Auto-pick another candidate with config
-                for j, cand in enumerate(cands):
-                    if j == idx - 1:
-                        continue
-                    ident = _candidate_identifier(cand)
-                    if not ident:
-                        continue
-                    r2 = _query_config_for_bom_identifier(ident)
-                    if r2:
-                        rows = r2
-                        used_ident = ident
-                        break
+            used_ident, rows = _config_rows_for_selected_candidate(session_id, cands, idx)
             if rows:
                 citations = build_citations(rows)
                 q = f"请解释 BOM {used_ident} 的产品配置"
@@ -569,7 +637,7 @@ async def kb_chat(request: Request, payload: Dict[str, Any] = Body(...)):
         material_code = str(args.get("material_code") or "").strip()
         if material_code:
             limit = _bom_candidates_limit()
-            rows = _query_boms_for_material(material_code, limit=limit)
+            rows = _boms_for_material_cached(session_id, material_code, limit=limit)
             _set_last_bom_candidates(session_id, material_code, rows)
             if not rows:
                 reflect_failure(message, stage="list_boms_for_material_empty", detail=f"material_code={material_code}", history=history)
@@ -607,15 +675,18 @@ async def kb_chat(request: Request, payload: Dict[str, Any] = Body(...)):
         reflect_failure(message, stage="generate_cypher", detail=str(exc), history=history)
         raise HTTPException(status_code=502, detail=f"Cypher生成失败: {exc}")
     try:
-        rows = run_cypher(cypher, params)
+        rows = run_cypher_cached(cypher, params)
     except Exception as exc:
+        forget_cypher(message, history)
         reflect_failure(message, stage="run_cypher", detail=f"{exc}; cypher={cypher}; params={params}", history=history)
         new_cypher, new_params = repair_cypher(message, cypher, params, str(exc), history=history)
         try:
-            rows = run_cypher(new_cypher, new_params)
+            rows = run_cypher_cached(new_cypher, new_params)
         except Exception as exc2:
             reflect_failure(message, stage="run_cypher_after_repair", detail=f"{exc2}; cypher={new_cypher}; params={new_params}", history=history)
             raise HTTPException(status_code=502, detail=f"Neo4j查询失败: {exc2}")
+        cypher, params = new_cypher, new_params
+    remember_cypher(message, history, cypher, params)
 
     citations = build_citations(rows)
     try:
@@ -690,16 +761,31 @@ async def kb_chat_stream(
 
         if agent_mode_enabled():
             if not local_mode:
-                append_message(owner_userid, conversation_id, role="user", content=message)
-            out = agent_orchestrate(message, history=history, context=context, session_id=session_id)
+                append_message_async(owner_userid, conversation_id, role="user", content=message)
+            out: Dict[str, Any] = {}
+            reasoning_seen: list = []
+            try:
+                for ev in agent_orchestrate_events(message, history=history, context=context, session_id=session_id):
+                    name = ev.get("event")
+                    if name == "result":
+                        out = ev
+                        continue
+                    if name == "reasoning_delta":
+                        reasoning_seen.append(ev.get("delta") or "")
+                    yield _sse(str(name), {k: v for k, v in ev.items() if k != "event"})
+                    last_ping = time.time()
+            except Exception as exc:
+                reflect_failure(message, stage="agent_orchestrate", detail=str(exc), history=history)
+                yield _sse("error", {"message": f"LLM输出失败: {exc}"})
+                yield _sse("done", {"ok": False})
+                return
             typ = out.get("type") or "answer"
-            reasoning = out.get("reasoning") or ""
+            # Persist the reasoning the user actually saw (all steps), falling back to the final step.
+            reasoning = "".join(reasoning_seen).strip() or (out.get("reasoning") or "")
             if typ == "clarify":
-                if reasoning:
-                    yield _sse("reasoning_delta", {"delta": reasoning})
                 yield _sse("clarify", {"content": out.get("content") or ""})
                 if not local_mode:
-                    append_message(
+                    append_message_async(
                         owner_userid,
                         conversation_id,
                         role="assistant",
@@ -709,12 +795,9 @@ async def kb_chat_stream(
                     )
                 yield _sse("done", {"ok": True})
                 return
-            if reasoning:
-                yield _sse("reasoning_delta", {"delta": reasoning})
-            yield _sse("answer_delta", {"delta": out.get("content") or ""})
             yield _sse("citations", {"citations": out.get("citations") or []})
             if not local_mode:
-                append_message(
+                append_message_async(
                     owner_userid,
                     conversation_id,
                     role="assistant",
@@ -729,22 +812,7 @@ async def kb_chat_stream(
         if idx is not None:
             cands = _get_last_bom_candidates(session_id)
             if cands and 1 <= idx <= len(cands):
-                chosen = cands[idx - 1]
-                chosen_ident = _candidate_identifier(chosen)
-                rows = _query_config_for_bom_identifier(chosen_ident)
-                used_ident = chosen_ident
-                if not rows:
-                    for j, cand in enumerate(cands):
-                        if j == idx - 1:
-                            continue
-                        ident = _candidate_identifier(cand)
-                        if not ident:
-                            continue
-                        r2 = _query_config_for_bom_identifier(ident)
-                        if r2:
-                            rows = r2
-                            used_ident = ident
-                            break
+                used_ident, rows = _config_rows_for_selected_candidate(session_id, cands, idx)
                 if rows:
                     yield _sse("retrieval", {"count": len(rows)})
                     stream = stream_answer(f"请解释 BOM {used_ident} 的产品配置", history, rows)
@@ -881,7 +949,7 @@ async def kb_chat_stream(
             material_code = str(args.get("material_code") or "").strip()
             if material_code:
                 limit = _bom_candidates_limit()
-                rows = _query_boms_for_material(material_code, limit=limit)
+                rows = _boms_for_material_cached(session_id, material_code, limit=limit)
                 _set_last_bom_candidates(session_id, material_code, rows)
                 if not rows:
                     reflect_failure(message, stage="list_boms_for_material_empty", detail=f"material_code={material_code}", history=history)
@@ -939,18 +1007,20 @@ async def kb_chat_stream(
 
         rows = []
         try:
-            rows = run_cypher(cypher, params)
+            rows = run_cypher_cached(cypher, params)
         except Exception as exc:
+            forget_cypher(message, history)
             try:
                 reflect_failure(message, stage="run_cypher", detail=f"{exc}; cypher={cypher}; params={params}", history=history)
                 new_cypher, new_params = repair_cypher(message, cypher, params, str(exc), history=history)
-                rows = run_cypher(new_cypher, new_params)
+                rows = run_cypher_cached(new_cypher, new_params)
                 cypher, params = new_cypher, new_params
             except Exception as exc2:
                 reflect_failure(message, stage="run_cypher_after_repair", detail=f"{exc2}; cypher={cypher}; params={params}", history=history)
                 yield _sse("error", {"message": f"Neo4j查询失败: {exc2}"})
                 yield _sse("done", {"ok": False})
                 return
+        remember_cypher(message, history, cypher, params)
 
         yield _sse("retrieval", {"count": len(rows)})
 
@@ -0,0 +1,360 @@
+"""
+Single cached schema service for kb_chat.
+
+`probe_schema()` and `build_agent_schema_snapshot()` used to keep their own TTL
+caches and re-scan the graph inside whichever request found them expired; the
+agent then pasted the whole snapshot (every label's properties plus
+sampleTriples) into every step's system prompt. This service owns one snapshot,
+refreshes it from a background thread (on a schedule, or shortly after a
+graph-changing write calls `mark_dirty()`), and renders a compact digest that
+fits a token budget. Labels, relationship patterns and properties the agent
+actually queries are ranked first; the digest is cached per snapshot version.
+
+Env knobs (all optional):
+  - KBCHAT_SCHEMA_REFRESH_SECONDS        background refresh interval (default 600)
+  - KBCHAT_SCHEMA_DIRTY_DEBOUNCE_SECONDS wait after mark_dirty() before refreshing (default 5)
+  - KBCHAT_SCHEMA_DIGEST_TOKENS          digest token budget (default 800)
+  - KBCHAT_SCHEMA_DIGEST_MAX_PROPS       properties listed per label unless used (default 10)
+  - KBCHAT_SCHEMA_DIGEST_RERANK_SECONDS  how long a digest is reused before re-ranking (default 60)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from src.env import env_int
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: ~4 ASCII chars per token, 1 token per CJK char."""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+_LABEL_RE = re.compile(r":\s*`?([A-Za-z_][A-Za-z0-9_]*)`?")
+_PROP_RE = re.compile(r"\.\s*`?([A-Za-z_][A-Za-z0-9_]*)`?")
+
+# Tools that imply which labels the agent is interested in.
+_TOOL_LABELS = {
+    "list_products": ("Product",),
+    "list_material_codes": ("Material",),
+    "list_boms_for_material": ("Material", "BOM"),
+    "list_accessories": ("Accessory",),
+    "list_products_for_accessory": ("Accessory", "Product"),
+    "find_products_with_specsheet": ("Product", "Document"),
+    "list_product_files": ("Product", "Document"),
+}
+
+
+class SchemaService:
+    """Background-refreshed schema snapshot plus a usage-ranked digest."""
+
+    def __init__(
+        self,
+        probe_loader: Callable[[], Dict[str, Any]],
+        snapshot_loader: Callable[[], Dict[str, Any]],
+    ) -> None:
+        self._probe_loader = probe_loader
+        self._snapshot_loader = snapshot_loader
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._probed: Optional[Dict[str, Any]] = None
+        self._full: Optional[Dict[str, Any]] = None
+        self._version = 0
+        self._refreshed_at = 0.0
+        self._refresh_ms = 0.0
+        self._refreshes = 0
+        self._last_error = ""
+        self._usage: Counter = Counter()
+        self._digests: Dict[int, Tuple[int, float, str]] = {}
+        self._fingerprint: Tuple[int, str] = (-1, "")
+        self._digest_hits = 0
+        self._digest_builds = 0
+        self._dirty = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- lifecycle -------------------------------------------------------
+
+    @property
+    def refresh_seconds(self) -> int:
+        return max(30, env_int("KBCHAT_SCHEMA_REFRESH_SECONDS", 600))
+
+    @property
+    def debounce_seconds(self) -> int:
+        return max(0, env_int("KBCHAT_SCHEMA_DIRTY_DEBOUNCE_SECONDS", 5))
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="kbchat-schema", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._dirty.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def mark_dirty(self, reason: str = "") -> None:
+        """Graph changed; refresh in the background after the debounce window."""
+        if reason:
+            print(f"[KBCHAT][Schema] marked dirty: {reason}")
+        self._dirty.set()
+        self.start()
+
+    def _loop(self) -> None:
+        if self._full is None:
+            self._safe_refresh()
+        while not self._stop.is_set():
+            triggered = self._dirty.wait(timeout=self.refresh_seconds)
+            if self._stop.is_set():
+                return
+            if triggered:
+                self._dirty.clear()
+                if self._stop.wait(self.debounce_seconds):
+                    return
+                # Writes that landed during the debounce are covered by this refresh.
+                self._dirty.clear()
+            self._safe_refresh()
+
+    def _safe_refresh(self) -> None:
+        try:
+            self.refresh()
+        except Exception as exc:  # noqa: BLE001
+            self._last_error = str(exc)
+            print(f"[KBCHAT][Schema] background refresh failed: {exc}")
+
+    def refresh(self) -> Dict[str, Any]:
+        """Reload both snapshots now (single-flight) and return the full one."""
+        with self._refresh_lock:
+            return self._refresh_locked()
+
+    def _refresh_locked(self) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        probed = self._probe_loader()
+        full = self._snapshot_loader()
+        with self._lock:
+            self._probed = probed
+            self._full = full
+            self._version += 1
+            self._refreshed_at = time.time()
+            self._refresh_ms = (time.perf_counter() - t0) * 1000
+            self._refreshes += 1
+            self._last_error = ""
+            self._digests.clear()
+        return full
+
+    def _ensure_loaded(self) -> None:
+        if self._full is None or self._probed is None:
+            # Cold start: only the very first request waits for the scan.
+            with self._refresh_lock:
+                if self._full is None or self._probed is None:
+                    self._refresh_locked()
+        self.start()
+
+    # ---- accessors -------------------------------------------------------
+
+    def probed(self) -> Dict[str, Any]:
+        self._ensure_loaded()
+        return self._probed or {}
+
+    def full(self) -> Dict[str, Any]:
+        self._ensure_loaded()
+        return self._full or {}
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def fingerprint(self) -> str:
+        """Hash of labels / relationship types / properties; unchanged by no-op refreshes."""
+        full = self.full()
+        with self._lock:
+            if self._fingerprint[0] == self._version:
+                return self._fingerprint[1]
+            version = self._version
+        payload = {
+            "labels": sorted(full.get("labels") or []),
+            "relationshipTypes": sorted(full.get("relationshipTypes") or []),
+            "labelProperties": full.get("labelProperties") or {},
+            "relProperties": full.get("relProperties") or {},
+        }
+        fp = hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            self._fingerprint = (version, fp)
+        return fp
+
+    # ---- usage tracking --------------------------------------------------
+
+    def record_usage(self, cypher: str = "", tool: str = "") -> None:
+        """Credit the labels/relationships/properties a successful agent call touched."""
+        full = self._full or {}
+        labels = set(full.get("labels") or [])
+        rels = set(full.get("relationshipTypes") or [])
+        label_props: Dict[str, List[str]] = full.get("labelProperties") or {}
+        hits: Counter = Counter()
+
+        for lab in _TOOL_LABELS.get(tool, ()):
+            if lab in labels:
+                hits[f"L:{lab}"] += 1
+
+        if cypher:
+            used_labels = set()
+            for name in _LABEL_RE.findall(cypher):
+                if name in labels:
+                    hits[f"L:{name}"] += 1
+                    used_labels.add(name)
+                elif name in rels:
+                    hits[f"R:{name}"] += 1
+            for prop in set(_PROP_RE.findall(cypher)):
+                for lab in used_labels:
+                    if prop in (label_props.get(lab) or []):
+                        hits[f"P:{lab}.{prop}"] += 1
+
+        if hits:
+            with self._lock:
+                self._usage.update(hits)
+
+    # ---- digest ----------------------------------------------------------
+
+    def digest(self, budget_tokens: Optional[int] = None) -> str:
+        """Compact schema text for prompts, cached per (version, budget)."""
+        budget = budget_tokens or max(100, env_int("KBCHAT_SCHEMA_DIGEST_TOKENS", 800))
+        self._ensure_loaded()
+        rerank = max(0, env_int("KBCHAT_SCHEMA_DIGEST_RERANK_SECONDS", 60))
+        now = time.time()
+        with self._lock:
+            cached = self._digests.get(budget)
+            if cached and cached[0] == self._version and (now - cached[1]) < rerank:
+                self._digest_hits += 1
+                return cached[2]
+            version = self._version
+            usage = Counter(self._usage)
+        text = self._render_digest(self._full or {}, self._probed or {}, usage, budget)
+        with self._lock:
+            self._digests[budget] = (version, now, text)
+            self._digest_builds += 1
+        return text
+
+    @staticmethod
+    def _triples(full: Dict[str, Any], probed: Dict[str, Any]) -> List[Tuple[str, str, str, int]]:
+        merged: Dict[Tuple[str, str, str], int] = {}
+        for src in (full.get("sampleTriples") or [], probed.get("sampleTriples") or []):
+            for row in src:
+                if not isinstance(row, dict):
+                    continue
+                a, r, b = row.get("aLabel"), row.get("rt"), row.get("bLabel")
+                if not (a and r and b):
+                    continue
+                try:
+                    cnt = int(row.get("cnt") or 0)
+                except Exception:
+                    cnt = 0
+                key = (str(a), str(r), str(b))
+                merged[key] = max(merged.get(key, 0), cnt)
+        return [(a, r, b, c) for (a, r, b), c in merged.items()]
+
+    def _render_digest(
+        self,
+        full: Dict[str, Any],
+        probed: Dict[str, Any],
+        usage: Counter,
+        budget: int,
+    ) -> str:
+        max_props = max(1, env_int("KBCHAT_SCHEMA_DIGEST_MAX_PROPS", 10))
+        labels: List[str] = list(full.get("labels") or probed.get("labels") or [])
+        rel_types: List[str] = list(full.get("relationshipTypes") or probed.get("relationshipTypes") or [])
+        label_props: Dict[str, List[str]] = full.get("labelProperties") or probed.get("labelProperties") or {}
+        rel_props: Dict[str, List[str]] = full.get("relProperties") or {}
+        triples = self._triples(full, probed)
+
+        volume: Counter = Counter()
+        for a, _r, b, cnt in triples:
+            volume[a] += cnt
+            volume[b] += cnt
+
+        def label_score(lab: str) -> float:
+            return usage[f"L:{lab}"] * 10 + math.log1p(volume[lab])
+
+        def triple_score(t: Tuple[str, str, str, int]) -> float:
+            a, r, b, cnt = t
+            return usage[f"R:{r}"] * 10 + (usage[f"L:{a}"] + usage[f"L:{b}"]) * 2 + math.log1p(cnt)
+
+        def label_line(lab: str) -> str:
+            props = list(label_props.get(lab) or [])
+            props.sort(key=lambda p: (-usage[f"P:{lab}.{p}"], p))
+            used = [p for p in props if usage[f"P:{lab}.{p}"]]
+            shown = props[: max(max_props, len(used))]
+            more = f",+{len(props) - len(shown)}" if len(props) > len(shown) else ""
+            return f"{lab}({','.join(shown)}{more})"
+
+        label_items = [label_line(lab) for lab in sorted(labels, key=lambda x: (-label_score(x), x))]
+        rel_items: List[str] = []
+        seen_rels = set()
+        for a, r, b, _cnt in sorted(triples, key=lambda t: (-triple_score(t), t[1])):
+            props = rel_props.get(r) or []
+            tail = f"{{{','.join(props[:5])}}}" if props else ""
+            rel_items.append(f"({a})-[:{r}{tail}]->({b})")
+            seen_rels.add(r)
+        for r in sorted((x for x in rel_types if x not in seen_rels), key=lambda x: (-usage[f"R:{x}"], x)):
+            rel_items.append(f"[:{r}]")
+
+        header = "SCHEMA(digest; labels(props) and (a)-[:REL]->(b) patterns, most used first):"
+        used = estimate_tokens(header)
+
+        def take(candidates: List[str], limit: int) -> List[str]:
+            nonlocal used
+            out: List[str] = []
+            for line in candidates:
+                cost = estimate_tokens(line) + 1
+                if used + cost > limit:
+                    break
+                out.append(line)
+                used += cost
+            return out
+
+        # Labels get most of the budget, but patterns are what path-finding needs,
+        # so reserve a share for them and give labels whatever is left over.
+        labels_shown = take(label_items, int(budget * 0.65))
+        rels_shown = take(rel_items, budget)
+        labels_shown += take(label_items[len(labels_shown):], budget)
+
+        lines = [header] + labels_shown + rels_shown
+        dropped_labels = len(label_items) - len(labels_shown)
+        dropped_rels = len(rel_items) - len(rels_shown)
+        if dropped_labels or dropped_rels:
+            lines.append(
+                f"(+{dropped_labels} labels, +{dropped_rels} patterns omitted; call probe_schema for the full schema)"
+            )
+        return "\n".join(lines)
+
+    # ---- admin -----------------------------------------------------------
+
+    def top_usage(self, n: int = 20) -> Iterable[Tuple[str, int]]:
+        with self._lock:
+            return self._usage.most_common(n)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "version": self._version,
+                "refreshed_at": self._refreshed_at,
+                "age_seconds": round(time.time() - self._refreshed_at, 1) if self._refreshed_at else None,
+                "refreshes": self._refreshes,
+                "refresh_ms": round(self._refresh_ms, 1),
+                "last_error": self._last_error,
+                "background": bool(self._thread is not None and self._thread.is_alive()),
+                "digest_hits": self._digest_hits,
+                "digest_builds": self._digest_builds,
+                "top_usage": self._usage.most_common(20),
+            }
@@ -1,22 +1,26 @@
 import json
 import os
 import re
-from typing import Any, Dict, Iterator, List, Optional, Tuple
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 import time
 
 from fastapi import HTTPException
 
+from src import graph_version
 from src.api_queries import get_neo4j_config
-from src.neo4j_file_add_neo4j import get_neo4j_driver
+from src.neo4j_pool import get_pooled_driver
 
 from .llm_client import chat_json, chat_stream
 from .neo4j_schema import probe_schema
+from .cypher_cache import cypher_cache
+from .entity_index import EntityIndex, entity_index_enabled
+from .schema_service import SchemaService
+from .session_state import session_state
 from .utils import extract_json_object
 
 
-_AGENT_STATE: Dict[str, Dict[str, Any]] = {}
-
-
 def _to_public_file_url(path: str) -> str:
     p = (path or "").strip()
     if not p:
@@ -128,17 +132,6 @@ def _agent_schema_scan_limits() -> Tuple[int, int]:
     return max(1000, min(node_limit, 500000)), max(1000, min(rel_limit, 500000))
 
 
-def _agent_schema_cache_ttl_seconds() -> int:
-    try:
-        v = int(os.getenv("KBCHAT_AGENT_SCHEMA_CACHE_TTL_SECONDS", "60"))
-        return max(5, min(v, 3600))
-    except Exception:
-        return 60
-
-
-_AGENT_SCHEMA_CACHE: Dict[str, Any] = {"ts": 0.0, "value": None}
-
-
 def _build_agent_schema_snapshot_via_call() -> Dict[str, Any]:
     """Schema snapshot using Neo4j built-in db.schema procedures.
 
@@ -202,20 +195,14 @@ def _build_agent_schema_snapshot_via_call() -> Dict[str, Any]:
     return out
 
 
-def build_agent_schema_snapshot() -> Dict[str, Any]:
+def _scan_agent_schema_snapshot() -> Dict[str, Any]:
     """Best-effort schema snapshot without using CALL/apoc.
 
     We derive labels/relationship types and property keys by scanning existing data.
     This is data-driven: it reflects what exists in the graph right now.
+    Uncached; `schema_service` calls it from its background refresh.
     """
 
-    ttl = _agent_schema_cache_ttl_seconds()
-    now = time.time()
-    cached = _AGENT_SCHEMA_CACHE.get("value")
-    ts = float(_AGENT_SCHEMA_CACHE.get("ts") or 0.0)
-    if cached and (now - ts) <= ttl:
-        return cached
-
     node_limit, rel_limit = _agent_schema_scan_limits()
     out: Dict[str, Any] = {
         "source": "scan",
@@ -232,10 +219,7 @@ def build_agent_schema_snapshot() -> Dict[str, Any]:
     allow_call = (os.getenv("KBCHAT_AGENT_ALLOW_SCHEMA_CALL", "1") or "1").strip().lower()
     if allow_call not in {"0", "false", "no", "n", "off"}:
         try:
-            out = _build_agent_schema_snapshot_via_call()
-            _AGENT_SCHEMA_CACHE["ts"] = now
-            _AGENT_SCHEMA_CACHE["value"] = out
-            return out
+            return _build_agent_schema_snapshot_via_call()
         except Exception as exc:
             out["callSchemaError"] = str(exc)
 
@@ -308,11 +292,22 @@ def build_agent_schema_snapshot() -> Dict[str, Any]:
     except Exception as exc:
         out["tripleScanError"] = str(exc)
 
-    _AGENT_SCHEMA_CACHE["ts"] = now
-    _AGENT_SCHEMA_CACHE["value"] = out
     return out
 
 
+schema_service = SchemaService(
+    probe_loader=lambda: probe_schema(force=True),
+    snapshot_loader=_scan_agent_schema_snapshot,
+)
+
+
+def build_agent_schema_snapshot() -> Dict[str, Any]:
+    return schema_service.full()
+
+
+graph_version.subscribe(lambda _version, reason: schema_service.mark_dirty(reason))
+
+
 _CYTHER_DENY_PATTERNS = [
     r"\bCALL\b",
     r"\bAPOC\b",
@@ -363,12 +358,42 @@ def _sanitize_readonly_cypher(cypher: str, params: Dict[str, Any]) -> Tuple[str,
 
 def run_cypher_readonly(cypher: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
     c, p = _sanitize_readonly_cypher(cypher, params)
-    return run_cypher(c, p)
+    return run_cypher_cached(c, p)
+
+
+def _load_entity_rows(label: str) -> List[Dict[str, Any]]:
+    rows = run_cypher(f"MATCH (n:`{label}`) RETURN n{{.*}} AS props", {})
+    out: List[Dict[str, Any]] = []
+    for r in rows or []:
+        props = r.get("props")
+        if isinstance(props, dict):
+            props.pop("embedding", None)
+            out.append(props)
+    return out
+
+
+entity_index = EntityIndex(loader=_load_entity_rows)
+graph_version.subscribe(lambda _version, reason: entity_index.mark_dirty(reason))
+
+
+def _entity_search(kind: str, keywords: Union[str, List[str]], limit: int) -> Optional[List[Dict[str, Any]]]:
+    """Ranked n-gram lookup; None means the caller should use its CONTAINS query."""
+    if not entity_index_enabled():
+        return None
+    try:
+        return entity_index.search(kind, keywords, limit=limit)
+    except Exception as exc:
+        print(f"[KBCHAT][EntityIndex] {kind} search failed, falling back to CONTAINS: {exc}")
+        return None
 
 
 def _list_material_codes(keyword: str = "", limit: int = 50) -> List[Dict[str, Any]]:
     kw = (keyword or "").strip()
     lim = max(1, min(int(limit or 50), 200))
+    if kw:
+        hits = _entity_search("material", kw, lim)
+        if hits is not None:
+            return hits
     where = ""
     params: Dict[str, Any] = {"limit": lim}
     if kw:
@@ -391,6 +416,10 @@ def _list_material_codes(keyword: str = "", limit: int = 50) -> List[Dict[str, A
 def _list_products(keyword: str = "", limit: int = 50) -> List[Dict[str, Any]]:
     kw = (keyword or "").strip()
     lim = max(1, min(int(limit or 50), 200))
+    if kw:
+        hits = _entity_search("product", kw, lim)
+        if hits is not None:
+            return hits
     where = ""
     params: Dict[str, Any] = {"limit": lim}
     if kw:
@@ -476,6 +505,10 @@ def _list_boms_for_material(material_code: str, limit: int = 50) -> List[Dict[st
 def _list_accessories(keyword: str = "", limit: int = 20) -> List[Dict[str, Any]]:
     kw = (keyword or "").strip()
     lim = max(1, min(int(limit or 20), 200))
+    if kw:
+        hits = _entity_search("accessory", kw, lim)
+        if hits is not None:
+            return hits
     where = ""
     params: Dict[str, Any] = {"limit": lim}
     if kw:
@@ -575,21 +608,11 @@ def _list_product_files(product_key: str, limit: int = 50) -> List[Dict[str, Any
 
 
 def _agent_state_get(session_id: str) -> Dict[str, Any]:
-    sid = (session_id or "").strip()
-    if not sid:
-        return {}
-    return _AGENT_STATE.get(sid, {})
+    return session_state.get("agent", session_id)
 
 
 def _agent_state_set(session_id: str, patch: Dict[str, Any]) -> Dict[str, Any]:
-    sid = (session_id or "").strip()
-    if not sid:
-        return {}
-    st = _AGENT_STATE.setdefault(sid, {})
-    if isinstance(patch, dict):
-        for k, v in patch.items():
-            st[k] = v
-    return st
+    return session_state.update("agent", session_id, patch)
 
 
 def _extract_reasoning_from_resp(resp: Any) -> str:
@@ -673,80 +696,399 @@ def _keyword_variants(keyword: str) -> List[str]:
     return out[:3]
 
 
-def _agent_prefetch_entity_hints(session_id: str, user_message: str) -> None:
+_PREFETCH_POOL: Optional[ThreadPoolExecutor] = None
+_PREFETCH_POOL_LOCK = threading.Lock()
+
+
+def _prefetch_pool() -> ThreadPoolExecutor:
+    global _PREFETCH_POOL
+    with _PREFETCH_POOL_LOCK:
+        if _PREFETCH_POOL is None:
+            workers = max(1, int(os.getenv("KBCHAT_PREFETCH_WORKERS", "8") or 8))
+            _PREFETCH_POOL = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kbchat-prefetch")
+        return _PREFETCH_POOL
+
+
+def _agent_prefetch_wait_seconds() -> float:
+    try:
+        return max(0.0, float(os.getenv("KBCHAT_AGENT_PREFETCH_WAIT_SECONDS", "8")))
+    except Exception:
+        return 8.0
+
+
+def _agent_prefetch_overlap() -> bool:
+    v = (os.getenv("KBCHAT_AGENT_PREFETCH_OVERLAP", "1") or "1").strip().lower()
+    return v not in {"0", "false", "no", "n", "off"}
+
+
+class _FirstHit:
+    """Run lookups for ranked keyword variants concurrently; keep the best-ranked non-empty one.
+
+    Once variant i returned rows and every variant before it came back empty,
+    the remaining (lower-ranked) lookups are cancelled if they have not started.
+    """
+
+    def __init__(self, calls: List[Callable[[], Any]], on_settled: Callable[[], None]) -> None:
+        self._lock = threading.Lock()
+        self._results: List[Optional[list]] = [None] * len(calls)
+        self._finished = [False] * len(calls)
+        self._on_settled = on_settled
+        self.value: list = []
+        self.settled = False
+        self._futures: List[Future] = []
+        if not calls:
+            self._settle([])
+            return
+        for i, call in enumerate(calls):
+            fut = _prefetch_pool().submit(call)
+            self._futures.append(fut)
+            fut.add_done_callback(lambda f, i=i: self._done(i, f))
+
+    def _done(self, i: int, fut: Future) -> None:
+        rows: list = []
+        if not fut.cancelled():
+            try:
+                res = fut.result()
+                rows = res if isinstance(res, list) else []
+            except Exception:
+                rows = []
+        with self._lock:
+            if self.settled:
+                return
+            self._results[i] = rows
+            self._finished[i] = True
+            winner: Optional[list] = None
+            for j, ok in enumerate(self._finished):
+                if not ok:
+                    break
+                if self._results[j]:
+                    winner = self._results[j]
+                    break
+            if winner is None and not all(self._finished):
+                return
+        for f in self._futures:
+            f.cancel()
+        self._settle(winner or [])
+
+    def _settle(self, value: list) -> None:
+        with self._lock:
+            if self.settled:
+                return
+            self.settled = True
+            self.value = value
+        self._on_settled()
+
+
+class _AgentPrefetch:
+    """Speculative entity lookups for one agent turn.
+
+    All keyword variants and entity kinds (products, materials and, for BOM
+    questions, BOM candidates) are looked up at once on a small pool; the Neo4j
+    calls share the pooled driver. The agent starts its first LLM call without
+    waiting, later steps wait (bounded) for the results, and a list_* tool call
+    the model makes for the same keyword is answered from here.
+    """
+
+    _TOOL_KINDS = {
+        "list_products": ("prefetch_products", "keyword"),
+        "list_material_codes": ("prefetch_materials", "keyword"),
+        "list_boms_for_material": ("prefetch_boms", "material_code"),
+    }
+    _LIMIT = 20
+
+    def __init__(self, session_id: str, user_message: str) -> None:
+        self.session_id = session_id
+        self.user_message = user_message
+        self.keyword = ""
+        self.variants: List[str] = []
+        self.patch: Dict[str, Any] = {}
+        self._groups: Dict[str, _FirstHit] = {}
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self.t0 = time.time()
+        self.ms = 0
+
+    def start(self) -> "_AgentPrefetch":
+        sid = self.session_id
+        if not sid:
+            self._event.set()
+            return self
+        if _agent_state_get(sid).get("_prefetch_for") == self.user_message:
+            self._event.set()
+            return self
+        ids = _extract_identifier_candidates(self.user_message)
+        if not ids:
+            self._event.set()
+            return self
+
+        self.keyword = ids[0]
+        self.variants = _keyword_variants(self.keyword)
+        lim = self._LIMIT
+        variants = list(self.variants)
+
+        def indexed(kind: str, fallback: Callable[..., Any]) -> List[Callable[[], Any]]:
+            if not entity_index_enabled():
+                return [lambda v=v: fallback(keyword=v, limit=lim) for v in variants]
+
+            # With the entity index all variants are ranked in one lookup.
+            def run() -> Any:
+                rows = _entity_search(kind, variants, lim)
+                if rows is not None:
+                    return rows
+                for v in variants:
+                    rows = fallback(keyword=v, limit=lim)
+                    if rows:
+                        return rows
+                return []
+
+            return [run]
+
+        groups: Dict[str, List[Callable[[], Any]]] = {
+            "prefetch_products": indexed("product", _list_products),
+            "prefetch_materials": indexed("material", _list_material_codes),
+        }
+        # If user explicitly asks BOM for this token, also prefetch BOM candidates.
+        if re.search(r"\bBOM\b|版本|物料清单", self.user_message, flags=re.IGNORECASE):
+            groups["prefetch_boms"] = [lambda v=v: _list_boms_for_material(material_code=v, limit=lim) for v in variants]
+
+        # Lookups may finish (and call back) before every group exists; publish them together.
+        built = {key: _FirstHit(calls, self._maybe_finish) for key, calls in groups.items()}
+        with self._lock:
+            self._groups = built
+        self._maybe_finish()
+        return self
+
+    def _maybe_finish(self) -> None:
+        with self._lock:
+            if self._event.is_set() or not self._groups or not all(g.settled for g in self._groups.values()):
+                return
+            patch: Dict[str, Any] = {
+                "_prefetch_for": self.user_message,
+                "prefetch_keyword": self.keyword,
+            }
+            for key, g in self._groups.items():
+                patch[key] = g.value[: self._LIMIT]
+            self.patch = patch
+            self.ms = int((time.time() - self.t0) * 1000)
+        boms = patch.get("prefetch_boms")
+        try:
+            # Also prime last_bom_candidates so ordinal reference like "第5个" works.
+            if boms:
+                patch = dict(patch, last_bom_candidates=boms[:50])
+            _agent_state_set(self.session_id, patch)
+        finally:
+            self._event.set()
+
+    def ready(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._event.wait(_agent_prefetch_wait_seconds() if timeout is None else timeout)
+
+    def rows_for_tool(self, tool: str, args: Dict[str, Any]) -> Optional[list]:
+        """Prefetched rows for a list_* tool call on one of our keyword variants, else None."""
+        spec = self._TOOL_KINDS.get(tool)
+        if spec is None or not self.variants:
+            return None
+        key, arg_name = spec
+        asked = str(args.get(arg_name) or "").strip().lower()
+        if not asked or asked not in {v.strip().lower() for v in self.variants}:
+            return None
+        if key not in self._groups or not self.wait():
+            return None
+        rows = self.patch.get(key) or []
+        limit = int(args.get("limit") or 50)
+        # Empty or possibly truncated (asked for more than we fetched): let the tool run.
+        if not rows or (len(rows) >= self._LIMIT and limit > self._LIMIT):
+            return None
+        return rows[:limit]
+
+
+def _agent_prefetch_entity_hints(session_id: str, user_message: str) -> "_AgentPrefetch":
     """Best-effort prefetch to reduce 'not found' hallucinations.
 
     If the user mentions an identifier-like token (e.g. Atlantic18), we pre-search
-    Product/Material and cache candidates into state so the agent can ground next steps.
+    Product/Material (and BOMs) concurrently and cache candidates into state so
+    the agent can ground next steps. Returns the running prefetch; callers that
+    need the results call `.wait()`.
     """
-    if not session_id:
-        return
-    st = _agent_state_get(session_id)
-    if st.get("_prefetch_for") == user_message:
-        return
-    ids = _extract_identifier_candidates(user_message)
-    if not ids:
-        return
+    return _AgentPrefetch(session_id, user_message).start()
+
+
+_FINAL_ACTION_RE = re.compile(r'"action"\s*:\s*"final_answer"')
+_CONTENT_KEY_RE = re.compile(r'"content"\s*:\s*"')
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
 
-    # Keep it cheap, but try a few variants for better hit rate.
-    kw = ids[0]
-    variants = _keyword_variants(kw)
 
-    prod: List[Dict[str, Any]] = []
-    mats: List[Dict[str, Any]] = []
-    for v in variants:
-        if not prod:
+class _FinalAnswerStreamer:
+    """Incrementally decode the `content` string of a streamed final_answer JSON.
+
+    The agent must answer with {"action":"final_answer","content":"..."}; feeding
+    the raw model deltas here yields the decoded answer text as it arrives, so the
+    client sees tokens instead of waiting for the whole JSON object.
+    """
+
+    def __init__(self) -> None:
+        self.buf = ""
+        self.emitted = ""
+        self.done = False
+        self._is_final = False
+        self._pos: Optional[int] = None
+
+    def feed(self, text: str) -> str:
+        self.buf += text or ""
+        if self.done:
+            return ""
+        if not self._is_final:
+            if not _FINAL_ACTION_RE.search(self.buf):
+                return ""
+            self._is_final = True
+        if self._pos is None:
+            m = _CONTENT_KEY_RE.search(self.buf)
+            if not m:
+                return ""
+            self._pos = m.end()
+
+        buf = self.buf
+        i = self._pos
+        out: List[str] = []
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self.done = True
+                i += 1
+                break
+            if ch != "\\":
+                out.append(ch)
+                i += 1
+                continue
+            if i + 1 >= len(buf):
+                break
+            esc = buf[i + 1]
+            if esc != "u":
+                out.append(_JSON_ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            if i + 6 > len(buf):
+                break
             try:
-                prod = _list_products(keyword=v, limit=20)
+                code = int(buf[i + 2:i + 6], 16)
+            except ValueError:
+                i += 6
+                continue
+            if 0xD800 <= code <= 0xDBFF:
+                # Surrogate pair: wait for the low half before emitting anything.
+                if i + 12 > len(buf):
+                    break
+                try:
+                    low = int(buf[i + 8:i + 12], 16)
+                    code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                    i += 6
+                except ValueError:
+                    pass
+            out.append(chr(code))
+            i += 6
+        self._pos = i
+        delta = "".join(out)
+        self.emitted += delta
+        return delta
+
+
+def _agent_step_chunks(messages: List[Dict[str, str]], stream: bool) -> Iterator[Tuple[str, str]]:
+    """Yield ("reasoning"|"content", text) pieces of one agent LLM step."""
+
+    if not stream:
+        resp, content, reasoning = _chat_json_with_optional_thinking(messages)
+        reasoning = reasoning or _extract_reasoning_from_resp(resp)
+        if reasoning:
+            yield "reasoning", reasoning
+        yield "content", content
+        return
+
+    got_any = False
+    try:
+        for chunk in chat_stream(messages):
+            delta = {}
+            try:
+                delta = chunk["choices"][0].get("delta") or {}
             except Exception:
-                prod = []
-        if not mats:
+                try:
+                    delta = chunk.choices[0].delta or {}
+                except Exception:
+                    delta = {}
             try:
-                mats = _list_material_codes(keyword=v, limit=20)
+                rc = delta.get("reasoning_content")
+                c = delta.get("content")
             except Exception:
-                mats = []
-        if prod and mats:
-            break
-
-    patch: Dict[str, Any] = {
-        "_prefetch_for": user_message,
-        "prefetch_keyword": kw,
-        "prefetch_products": prod[:20] if isinstance(prod, list) else [],
-        "prefetch_materials": mats[:20] if isinstance(mats, list) else [],
-    }
-
-    # If user explicitly asks BOM for this token, also prefetch BOM candidates.
-    if re.search(r"\bBOM\b|版本|物料清单", user_message, flags=re.IGNORECASE):
-        try:
-            # Use the best variant first.
-            boms: List[Dict[str, Any]] = []
-            for v in variants:
-                boms = _list_boms_for_material(material_code=v, limit=20)
-                if boms:
-                    break
-        except Exception:
-            boms = []
-        patch["prefetch_boms"] = boms[:20] if isinstance(boms, list) else []
-
-        # Also prime last_bom_candidates so ordinal reference like "第5个" works.
-        if isinstance(boms, list) and boms:
-            _agent_state_set(session_id, {"last_bom_candidates": boms[:50]})
-
-    _agent_state_set(session_id, patch)
+                rc = None
+                c = None
+            if isinstance(rc, str) and rc:
+                got_any = True
+                yield "reasoning", rc
+            if isinstance(c, str) and c:
+                got_any = True
+                yield "content", c
+    except Exception:
+        if got_any:
+            raise
+        resp = chat_json(messages)
+        reasoning = _extract_reasoning_from_resp(resp)
+        if reasoning:
+            yield "reasoning", reasoning
+        yield "content", str((resp.get("choices", [{}])[0].get("message") or {}).get("content") or "")
+
+
+def _tool_result_preview(tool_result: Any, limit: int = 3) -> Dict[str, Any]:
+    """Small JSON-safe summary of a tool result for the tool_result event."""
+
+    out: Dict[str, Any] = {}
+    if isinstance(tool_result, list):
+        out["count"] = len(tool_result)
+        sample: Any = tool_result[:limit]
+    elif isinstance(tool_result, dict):
+        out["keys"] = list(tool_result.keys())[:20]
+        sample = tool_result
+    else:
+        sample = tool_result
+    try:
+        text = json.dumps(sample, ensure_ascii=False, default=str)
+        if len(text) > 2000:
+            out["preview"] = text[:2000] + "..."
+        else:
+            out["preview"] = json.loads(text)
+    except Exception:
+        out["preview"] = str(sample)[:2000]
+    return out
 
 
-def agent_orchestrate(user_message: str, history: Optional[List[Dict[str, str]]], context: Optional[Dict[str, Any]], session_id: str) -> Dict[str, Any]:
-    """LLM-led agent loop.
+def agent_orchestrate_events(
+    user_message: str,
+    history: Optional[List[Dict[str, str]]],
+    context: Optional[Dict[str, Any]],
+    session_id: str,
+    stream: bool = True,
+) -> Iterator[Dict[str, Any]]:
+    """LLM-led agent loop as an incremental event producer.
 
     The model can propose tool calls (including Cypher) and update state.
-    We execute in a read-only sandbox and feed results back.
+    We execute in a read-only sandbox and feed results back. Every event is a
+    dict with an "event" key:
+
+      - reasoning_delta  {"delta"}                        model reasoning as it streams
+      - tool_call        {"step", "tool", "args"}         before a tool runs
+      - tool_result      {"step", "tool", "ok", "error", "ms", "count"/"keys", "preview"}
+      - answer_delta     {"delta"}                        final_answer content tokens
+      - result           {"type", "content", "citations", "reasoning"}  always last
     """
 
-    schema = probe_schema()
-    schema_full = build_agent_schema_snapshot()
+    # Compact, usage-ranked digest; cached by schema_service and shared by all steps.
+    schema_digest = schema_service.digest()
 
     # Prefetch entity hints to avoid answering "not found" without any lookup.
-    _agent_prefetch_entity_hints(session_id=session_id, user_message=user_message)
+    # It runs alongside the first LLM call; later steps wait for it.
+    prefetch = _agent_prefetch_entity_hints(session_id=session_id, user_message=user_message)
+    if not _agent_prefetch_overlap():
+        prefetch.wait()
     tool_defs = {
         "tools": [
             {
@@ -754,7 +1096,7 @@ def agent_orchestrate(user_message: str, history: Optional[List[Dict[str, str]]]
                 "args": {"cypher": "string", "params": "object"},
                 "desc": "Execute a read-only Cypher query. CALL/CREATE/MERGE/SET/DELETE are forbidden. LIMIT is enforced.",
             },
-            {"name": "probe_schema", "args": {}, "desc": "Return current Neo4j schema snapshot."},
+            {"name": "probe_schema", "args": {}, "desc": "Return the full Neo4j schema snapshot (all labels/properties/patterns)."},
             {"name": "state_get", "args": {}, "desc": "Get current session state JSON."},
             {"name": "state_set", "args": {"patch": "object"}, "desc": "Merge patch into session state."},
             {"name": "list_products", "args": {"keyword": "string", "limit": "number"}, "desc": "List Product nodes (best-effort fuzzy match by common fields)."},
@@ -776,6 +1118,7 @@ def agent_orchestrate(user_message: str, history: Optional[List[Dict[str, str]]]
         "2) {\"action\":\"final_answer\", \"content\":string}\n"
         "3) {\"action\":\"clarify\", \"content\":string}\n"
         "规则：\n"
+        "- 输出JSON时 action 字段必须写在最前面。\n"
         "- 需要事实时优先工具查询，不要编造BOM号/配置项。\n"
         "- 对于‘某某是否存在/某某的BOM/某某的配置’这类问题：如果 STATE 里没有可用候选，必须先调用 list_products/list_material_codes/list_boms_for_material 做检索，再基于结果回答；不要在未检索的情况下直接说‘数据库不存在’。\n"
         "- 系统会提供 PREFETCH(JSON)（基于用户输入自动检索的候选产品/物料/BOM）。优先使用这些候选继续查询与回答，并把候选列表写入 state_set（例如 last_bom_candidates），以便支持用户的‘第N个/这个/它’指代。\n"
@@ -784,8 +1127,7 @@ def agent_orchestrate(user_message: str, history: Optional[List[Dict[str, str]]]
         "- 若用户要求‘从候选里选一个’，请先把候选列表写入 state_set（例如 selected_product/selected_material/last_candidates），再继续查询细节。\n"
         "- 若工具查询结果为空，也要用 final_answer 解释‘数据库未找到证据’，并给出下一步可查询的方向；不要陷入重复 tool_call。\n"
         f"可用工具: {json.dumps(tool_defs, ensure_ascii=False)}\n"
-        f"schema.probed(labels/relationshipTypes): {json.dumps({'labels': schema.get('labels', []), 'relationshipTypes': schema.get('relationshipTypes', [])}, ensure_ascii=False, default=str)}\n"
-        f"schema.full(data_scanned): {json.dumps(schema_full, ensure_ascii=False, default=str)}\n"
+        f"{schema_digest}\n"
     )
 
     base_msgs: List[Dict[str, str]] = [{"role": "system", "content": sys}]
@@ -794,6 +1136,8 @@ def agent_orchestrate(user_message: str, history: Optional[List[Dict[str, str]]]
 
     max_steps = _agent_max_tool_calls()
     for step in range(max_steps):
+        if step > 0 and not prefetch.ready():
+            prefetch.wait()
         st_now = _agent_state_get(session_id)
         step_msgs: List[Dict[str, str]] = list(base_msgs)
         step_msgs.append({
@@ -808,6 +1152,10 @@ def agent_orchestrate(user_message: str, history: Optional[List[Dict[str, str]]]
             "boms": st_now.get("prefetch_boms") or [],
             "last_bom_candidates": st_now.get("last_bom_candidates") or [],
         }
+        if not prefetch.ready():
+            # First step overlaps the lookups; list_* calls on this keyword reuse them.
+            # The persisted rows belong to the previous turn's keyword, so leave them out.
+            prefetch_obj.update({"keyword": prefetch.keyword, "products": [], "materials": [], "boms": [], "pending": True})
         step_msgs.append({
             "role": "system",
             "content": f"PREFETCH(JSON): {json.dumps(prefetch_obj, ensure_ascii=False, default=str)}",
@@ -818,28 +1166,51 @@ def agent_orchestrate(user_message: str, history: Optional[List[Dict[str, str]]]
                 "content": f"TOOL_TRACE(JSON): {json.dumps(scratch[-8:], ensure_ascii=False, default=str)}",
             })
 
-        resp, raw, reasoning = _chat_json_with_optional_thinking(step_msgs)
-        raw = (raw or "").strip()
+        streamer = _FinalAnswerStreamer()
+        reasoning_buf: List[str] = []
+        for kind, text in _agent_step_chunks(step_msgs, stream=stream):
+            if kind == "reasoning":
+                reasoning_buf.append(text)
+                yield {"event": "reasoning_delta", "delta": text}
+                continue
+            delta = streamer.feed(text)
+            if delta:
+                yield {"event": "answer_delta", "delta": delta}
+        reasoning = "".join(reasoning_buf).strip()
+        raw = streamer.buf.strip()
         _print_llm_io(f"agent_step_{step}", step_msgs, raw)
         obj = extract_json_object(raw)
         if not isinstance(obj, dict):
-            return {"type": "clarify", "content": "我需要你再描述清楚一点你的查询目标（比如物料编码/型号/BOM号）。"}
+            if streamer.emitted:
+                # Answer was already streamed but the JSON got truncated; keep what the user saw.
+                yield {"event": "result", "type": "answer", "content": streamer.emitted.strip(), "citations": [], "reasoning": reasoning}
+                return
+            yield {"event": "result", "type": "clarify", "content": "我需要你再描述清楚一点你的查询目标（比如物料编码/型号/BOM号）。", "citations": [], "reasoning": reasoning}
+            return
 
         action = (obj.get("action") or "").strip()
         if action == "final_answer":
-            return {
+            content = str(obj.get("content") or "")
+            # Flush whatever the incremental decoder could not attribute (e.g. content before action).
+            if content.startswith(streamer.emitted) and len(content) > len(streamer.emitted):
+                yield {"event": "answer_delta", "delta": content[len(streamer.emitted):]}
+            yield {
+                "event": "result",
                 "type": "answer",
-                "content": (obj.get("content") or "").strip(),
+                "content": content.strip(),
                 "citations": [],
-                "reasoning": reasoning or _extract_reasoning_from_resp(resp),
+                "reasoning": reasoning,
             }
+            return
         if action == "clarify":
-            return {
+            yield {
+                "event": "result",
                 "type": "clarify",
                 "content": (obj.get("content") or "").strip(),
                 "citations": [],
-                "reasoning": reasoning or _extract_reasoning_from_resp(resp),
+                "reasoning": reasoning,
             }
+            return
 
         if action != "tool_call":
             scratch.append({"error": "unknown_action", "raw": obj})
@@ -849,10 +1220,13 @@ def agent_orchestrate(user_message: str, history: Optional[List[Dict[str, str]]]
         args = obj.get("args") if isinstance(obj.get("args"), dict) else {}
         tool_result: Any = None
         tool_error: str = ""
+        yield {"event": "tool_call", "step": step, "tool": tool, "args": json.loads(json.dumps(args, ensure_ascii=False, default=str))}
+        t0 = time.time()
 
         try:
+            prefetched = prefetch.rows_for_tool(tool, args)
             if tool == "probe_schema":
-                tool_result = probe_schema()
+                tool_result = schema_service.full()
             elif tool == "state_get":
                 tool_result = _agent_state_get(session_id)
             elif tool == "state_set":
@@ -862,6 +1236,8 @@ def agent_orchestrate(user_message: str, history: Optional[List[Dict[str, str]]]
                 cypher = args.get("cypher") or ""
                 params = args.get("params") if isinstance(args.get("params"), dict) else {}
                 tool_result = run_cypher_readonly(str(cypher), params)
+            elif prefetched is not None:
+                tool_result = prefetched
             elif tool == "list_products":
                 tool_result = _list_products(str(args.get("keyword") or ""), int(args.get("limit") or 50))
             elif tool == "list_material_codes":
@@ -882,6 +1258,18 @@ def agent_orchestrate(user_message: str, history: Optional[List[Dict[str, str]]]
             tool_error = str(exc)
             tool_result = None
 
+        result_event: Dict[str, Any] = {
+            "event": "tool_result",
+            "step": step,
+            "tool": tool,
+            "ok": tool_error == "",
+            "error": tool_error,
+            "ms": int((time.time() - t0) * 1000),
+        }
+        if tool_error == "":
+            result_event.update(_tool_result_preview(tool_result))
+        yield result_event
+
         scratch.append({
             "step": step,
             "tool": tool,
@@ -892,8 +1280,13 @@ def agent_orchestrate(user_message: str, history: Optional[List[Dict[str, str]]]
 
         if tool_error == "":
             _auto_update_agent_state_from_tool(session_id, tool, tool_result)
+            schema_service.record_usage(
+                cypher=str(args.get("cypher") or "") if tool == "run_cypher_readonly" else "",
+                tool=tool,
+            )
 
-    return {
+    yield {
+        "event": "result",
         "type": "clarify",
         "content": "我尝试多步查询仍未得到稳定结果。请你提供更具体的物料编码/型号/BOM号，或说明你想看的配置字段。",
         "citations": [],
@@ -901,6 +1294,16 @@ def agent_orchestrate(user_message: str, history: Optional[List[Dict[str, str]]]
     }
 
 
+def agent_orchestrate(user_message: str, history: Optional[List[Dict[str, str]]], context: Optional[Dict[str, Any]], session_id: str) -> Dict[str, Any]:
+    """Run the agent loop to completion and return the final result (non-streaming)."""
+
+    out: Dict[str, Any] = {}
+    for ev in agent_orchestrate_events(user_message, history, context, session_id, stream=False):
+        if ev.get("event") == "result":
+            out = {k: v for k, v in ev.items() if k != "event"}
+    return out
+
+
 def smalltalk_reply(message: str) -> str:
     text = (message or "").strip().lower()
     if re.search(r"(bye|再见|拜拜)", text, flags=re.IGNORECASE):
@@ -1008,7 +1411,7 @@ def route_intent(user_message: str, history: Optional[List[Dict[str, str]]] = No
     Returns JSON-like dict with at least: {"action": str, "args": object}
     """
 
-    schema = probe_schema()
+    schema = schema_service.probed()
     labels = schema.get("labels", [])
     rels = schema.get("relationshipTypes", [])
     ctx = context or {}
@@ -1097,7 +1500,7 @@ def stream_bom_candidates(user_message: str, history: Optional[List[Dict[str, st
 
 
 def decide_clarify(user_message: str, history: Optional[List[Dict[str, str]]], context: Optional[Dict[str, Any]] = None) -> Tuple[bool, str]:
-    schema = probe_schema()
+    schema = schema_service.probed()
     sys = (
         "你是一个知识库问答助手。你需要判断用户的问题是否缺少关键实体信息。\n"
         "若需要澄清，输出简短的澄清问题（1-3个，用换行分隔）。\n"
@@ -1243,8 +1646,19 @@ LIMIT $limit
     return msgs
 
 
+def _cypher_plan_key(user_message: str, history: Optional[List[Dict[str, str]]]) -> Optional[Tuple[str, str, str]]:
+    try:
+        return cypher_cache.plan_key(user_message, history, schema_service.fingerprint())
+    except Exception:
+        return None
+
+
 def generate_cypher(user_message: str, history: Optional[List[Dict[str, str]]] = None) -> Tuple[str, Dict[str, Any]]:
-    schema = probe_schema()
+    cached = cypher_cache.get_plan(_cypher_plan_key(user_message, history))
+    if cached is not None:
+        return cached
+
+    schema = schema_service.probed()
     resp = chat_json(_cypher_prompt(schema=schema, user_message=user_message, history=history))
     raw = (resp["choices"][0]["message"]["content"] or "").strip()
     obj = extract_json_object(raw)
@@ -1266,7 +1680,7 @@ def generate_cypher(user_message: str, history: Optional[List[Dict[str, str]]] =
 
 
 def repair_cypher(user_message: str, cypher: str, params: Dict[str, Any], error: str, history: Optional[List[Dict[str, str]]] = None) -> Tuple[str, Dict[str, Any]]:
-    schema = probe_schema()
+    schema = schema_service.probed()
     sys = (
         "你是Neo4j Cypher 修复助手。给定用户问题、schema、原cypher、错误信息，请修复cypher。\n"
         "只输出JSON：{\"cypher\": string, \"params\": object}，不要输出其他内容。\n"
@@ -1291,9 +1705,31 @@ def repair_cypher(user_message: str, cypher: str, params: Dict[str, Any], error:
     return new_cypher, new_params
 
 
+def remember_cypher(user_message: str, history: Optional[List[Dict[str, str]]], cypher: str, params: Dict[str, Any]) -> None:
+    """Store a Cypher plan once it has run successfully for this question."""
+    cypher_cache.put_plan(_cypher_plan_key(user_message, history), cypher, params)
+
+
+def forget_cypher(user_message: str, history: Optional[List[Dict[str, str]]]) -> None:
+    """Drop a cached plan that failed to run (e.g. the schema moved under it)."""
+    cypher_cache.forget_plan(_cypher_plan_key(user_message, history))
+
+
+def run_cypher_cached(cypher: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """run_cypher with a result cache invalidated by graph_version bumps."""
+    rows = cypher_cache.get_rows(cypher, params)
+    if rows is not None:
+        return rows
+    # Read the version before querying so a concurrent write leaves the entry stale.
+    version = graph_version.current()
+    rows = run_cypher(cypher, params)
+    cypher_cache.put_rows(cypher, params, rows, version)
+    return rows
+
+
 def run_cypher(cypher: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
     cfg = get_neo4j_config()
-    driver = get_neo4j_driver(cfg)
+    driver = get_pooled_driver(cfg)
     try:
         with driver.session() as session:
             timeout_s = int(os.getenv("KBCHAT_NEO4J_QUERY_TIMEOUT_SECONDS", 10))
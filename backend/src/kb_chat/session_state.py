@@ -0,0 +1,249 @@
+"""
+Bounded per-session state for kb_chat (agent STATE, last BOM candidates for "第N个").
+
+The in-memory layer is an LRU keyed by (namespace, session_id) with a TTL, a
+max entry count and an approximate byte ceiling (size of the JSON encoding).
+When persistence is on, every update is also written to a small SQLite table
+next to the conversations DB, and reads pick up newer rows written by other
+uvicorn workers, so ordinal references still resolve behind a load balancer
+and after a restart.
+
+Env knobs (all optional):
+  - KBCHAT_SESSION_STATE_PERSIST       set to 0 to keep state in memory only
+  - KBCHAT_SESSION_STATE_DB_PATH       SQLite file (default: next to kbchat_conversations.sqlite3)
+  - KBCHAT_SESSION_STATE_MAX           max sessions kept in memory per process (default 2000)
+  - KBCHAT_SESSION_STATE_MAX_MB        approximate memory ceiling (default 64)
+  - KBCHAT_SESSION_STATE_TTL_SECONDS   idle lifetime of a session's state (default 86400)
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from src.env import env_int
+
+from .conversations_store import _db_path as _conversations_db_path
+
+
+def session_state_persist_enabled() -> bool:
+    v = (os.getenv("KBCHAT_SESSION_STATE_PERSIST", "1") or "1").strip().lower()
+    return v not in {"0", "false", "no", "n", "off"}
+
+
+def _state_db_path() -> str:
+    p = (os.getenv("KBCHAT_SESSION_STATE_DB_PATH") or "").strip()
+    if not p:
+        p = os.path.join(os.path.dirname(_conversations_db_path()), "kbchat_session_state.sqlite3")
+    os.makedirs(os.path.dirname(p) or ".", exist_ok=True)
+    return p
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class SessionStateStore:
+    """LRU/TTL session state with a memory ceiling and optional SQLite write-through.
+
+    Holds per-session state for the UX flows in `routes` (e.g. the last BOM
+    candidates), so "1/2" maps deterministically to actual DB candidates instead
+    of relying on the LLM to remember its own selections.
+    """
+
+    _PURGE_EVERY = 200
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # (namespace, sid) -> (updated_at_ms, state, approx bytes)
+        self._data: "OrderedDict[Tuple[str, str], Tuple[int, Dict[str, Any], int]]" = OrderedDict()
+        self._bytes = 0
+        self._evicted = 0
+        self._expired = 0
+        self._db_reads = 0
+        self._db_errors = 0
+        self._writes = 0
+        self._local = threading.local()
+        self._db_ready = False
+        self._db_init_lock = threading.Lock()
+
+    # ---- limits ----
+
+    @staticmethod
+    def _ttl_ms() -> int:
+        return max(60, env_int("KBCHAT_SESSION_STATE_TTL_SECONDS", 86400)) * 1000
+
+    @staticmethod
+    def _max_entries() -> int:
+        return max(1, env_int("KBCHAT_SESSION_STATE_MAX", 2000))
+
+    @staticmethod
+    def _max_bytes() -> int:
+        return max(1, env_int("KBCHAT_SESSION_STATE_MAX_MB", 64)) * 1024 * 1024
+
+    # ---- sqlite ----
+
+    def _conn(self) -> Optional[sqlite3.Connection]:
+        if not session_state_persist_enabled():
+            return None
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        try:
+            conn = sqlite3.connect(_state_db_path(), timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if not self._db_ready:
+                with self._db_init_lock:
+                    if not self._db_ready:
+                        conn.execute(
+                            """
+                            CREATE TABLE IF NOT EXISTS session_state (
+                                namespace TEXT NOT NULL,
+                                session_id TEXT NOT NULL,
+                                state_json TEXT NOT NULL,
+                                updated_at_ms INTEGER NOT NULL,
+                                PRIMARY KEY(namespace, session_id)
+                            )
+                            """
+                        )
+                        conn.execute("CREATE INDEX IF NOT EXISTS idx_session_state_updated ON session_state(updated_at_ms)")
+                        conn.commit()
+                        self._db_ready = True
+        except Exception as exc:  # noqa: BLE001
+            self._db_errors += 1
+            print(f"[KBCHAT][SessionState] sqlite unavailable: {exc}")
+            return None
+        self._local.conn = conn
+        return conn
+
+    def _db_load(self, ns: str, sid: str, newer_than_ms: int) -> Optional[Tuple[int, Dict[str, Any]]]:
+        conn = self._conn()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute(
+                "SELECT state_json, updated_at_ms FROM session_state WHERE namespace = ? AND session_id = ? AND updated_at_ms > ?",
+                (ns, sid, newer_than_ms),
+            ).fetchone()
+        except Exception as exc:  # noqa: BLE001
+            self._db_errors += 1
+            print(f"[KBCHAT][SessionState] load failed: {exc}")
+            return None
+        self._db_reads += 1
+        if not row:
+            return None
+        try:
+            state = json.loads(row[0])
+        except Exception:
+            return None
+        return int(row[1]), state if isinstance(state, dict) else {}
+
+    def _db_save(self, ns: str, sid: str, payload: str, updated_at_ms: int) -> None:
+        conn = self._conn()
+        if conn is None:
+            return
+        try:
+            conn.execute(
+                "INSERT INTO session_state(namespace, session_id, state_json, updated_at_ms) VALUES(?,?,?,?) "
+                "ON CONFLICT(namespace, session_id) DO UPDATE SET state_json = excluded.state_json, updated_at_ms = excluded.updated_at_ms",
+                (ns, sid, payload, updated_at_ms),
+            )
+            self._writes += 1
+            if self._writes % self._PURGE_EVERY == 0:
+                conn.execute("DELETE FROM session_state WHERE updated_at_ms < ?", (updated_at_ms - self._ttl_ms(),))
+            conn.commit()
+        except Exception as exc:  # noqa: BLE001
+            self._db_errors += 1
+            print(f"[KBCHAT][SessionState] save failed: {exc}")
+
+    # ---- memory ----
+
+    def _put_locked(self, key: Tuple[str, str], updated_at_ms: int, state: Dict[str, Any], size: int) -> None:
+        old = self._data.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+        self._data[key] = (updated_at_ms, state, size)
+        self._bytes += size
+        max_entries, max_bytes = self._max_entries(), self._max_bytes()
+        while self._data and (len(self._data) > max_entries or self._bytes > max_bytes):
+            _k, (_t, _s, sz) = self._data.popitem(last=False)
+            self._bytes -= sz
+            self._evicted += 1
+
+    def _get_locked(self, key: Tuple[str, str]) -> Optional[Tuple[int, Dict[str, Any], int]]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if _now_ms() - entry[0] > self._ttl_ms():
+            self._data.pop(key, None)
+            self._bytes -= entry[2]
+            self._expired += 1
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    # ---- public API ----
+
+    def get(self, namespace: str, session_id: str) -> Dict[str, Any]:
+        sid = (session_id or "").strip()
+        if not sid:
+            return {}
+        key = (namespace, sid)
+        with self._lock:
+            entry = self._get_locked(key)
+        local_ts = entry[0] if entry else 0
+        # Another worker (or a previous process) may hold a newer copy.
+        loaded = self._db_load(namespace, sid, max(local_ts, _now_ms() - self._ttl_ms()))
+        if loaded is not None:
+            ts, state = loaded
+            size = len(json.dumps(state, ensure_ascii=False, default=str))
+            with self._lock:
+                self._put_locked(key, ts, state, size)
+            return dict(state)
+        return dict(entry[1]) if entry else {}
+
+    def update(self, namespace: str, session_id: str, patch: Dict[str, Any]) -> Dict[str, Any]:
+        sid = (session_id or "").strip()
+        if not sid:
+            return {}
+        state = self.get(namespace, sid)
+        if isinstance(patch, dict):
+            state.update(patch)
+        return self._write(namespace, sid, state)
+
+    def replace(self, namespace: str, session_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
+        sid = (session_id or "").strip()
+        if not sid:
+            return {}
+        return self._write(namespace, sid, dict(state or {}))
+
+    def _write(self, namespace: str, sid: str, state: Dict[str, Any]) -> Dict[str, Any]:
+        payload = json.dumps(state, ensure_ascii=False, default=str)
+        ts = _now_ms()
+        with self._lock:
+            self._put_locked((namespace, sid), ts, state, len(payload))
+        self._db_save(namespace, sid, payload, ts)
+        return dict(state)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self._data),
+                "approx_bytes": self._bytes,
+                "max_sessions": self._max_entries(),
+                "max_bytes": self._max_bytes(),
+                "evicted": self._evicted,
+                "expired": self._expired,
+                "persist": session_state_persist_enabled(),
+                "db_reads": self._db_reads,
+                "db_writes": self._writes,
+                "db_errors": self._db_errors,
+            }
+
+
+session_state = SessionStateStore()
@@ -0,0 +1,450 @@
+"""
+Shared gateway for blocking LLM calls (litellm completions and raw provider HTTP calls).
+
+Every call goes through the same path:
+
+  - per-provider concurrency: a semaphore per provider ("dashscope", "ollama",
+    "openai", ... taken from the model prefix or passed explicitly) caps the
+    requests in flight across all call sites;
+  - timeouts without signals: with a timeout the call runs on the gateway pool
+    and the caller waits on a future, so it works from any thread (SIGALRM
+    only works on the main thread). The timeout starts once the provider slot
+    is acquired, so queueing behind other calls never uses it up and a call
+    nobody waits for is never sent. A timed-out call keeps its slot until the
+    underlying request actually returns;
+  - coalescing: identical requests already in flight share one upstream call;
+  - optional response cache for deterministic (temperature 0) requests;
+  - metrics per call tag: calls, errors, timeouts, coalesced, cache hits,
+    latency, queue wait and token usage (see `stats()`).
+
+Responses shared by coalescing or the cache are the same object; callers
+must treat them as read-only (all current callers only read
+`choices[0].message.content`).
+
+Env knobs (all optional):
+  - LLM_MAX_CONCURRENCY                 default per-provider limit (default 8)
+  - LLM_MAX_CONCURRENCY_<PROVIDER>      e.g. LLM_MAX_CONCURRENCY_OLLAMA=2
+  - LLM_GATEWAY_WORKERS                 threads used for calls with a timeout (default 64)
+  - LLM_GATEWAY_TIMEOUT_SECONDS         hard timeout when the caller passes none (default 0 = none)
+  - LLM_GATEWAY_COALESCE                set to 0 to disable in-flight coalescing
+  - LLM_RESPONSE_CACHE                  set to 1 to cache temperature-0 responses
+  - LLM_RESPONSE_CACHE_MAX              cached responses (default 256)
+  - LLM_RESPONSE_CACHE_TTL_SECONDS      cache entry lifetime (default 3600)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, TypeVar
+
+from src.env import env_flag, env_float, env_int
+
+T = TypeVar("T")
+
+# Never part of a request fingerprint.
+_SECRET_KEYS = {"api_key", "headers", "extra_headers"}
+
+
+def provider_for_model(model: str, api_base: str = "") -> str:
+    m = (model or "").strip().lower()
+    if "/" in m:
+        return m.split("/", 1)[0]
+    base = (api_base or "").lower()
+    if "dashscope" in base:
+        return "dashscope"
+    if "11434" in base or "ollama" in base:
+        return "ollama"
+    return "default"
+
+
+def request_fingerprint(payload: Any) -> str:
+    if isinstance(payload, dict):
+        payload = {k: v for k, v in payload.items() if k not in _SECRET_KEYS}
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _usage_tokens(resp: Any) -> Tuple[int, int]:
+    usage: Any = None
+    if isinstance(resp, dict):
+        usage = resp.get("usage")
+    else:
+        usage = getattr(resp, "usage", None)
+    if usage is None:
+        return 0, 0
+
+    def _get(*names: str) -> int:
+        for n in names:
+            v = usage.get(n) if isinstance(usage, dict) else getattr(usage, n, None)
+            if isinstance(v, (int, float)):
+                return int(v)
+        return 0
+
+    return _get("prompt_tokens", "input_tokens"), _get("completion_tokens", "output_tokens")
+
+
+class _TagStats:
+    __slots__ = (
+        "calls", "errors", "timeouts", "coalesced", "cache_hits",
+        "latency_ms_total", "latency_ms_max", "wait_ms_total", "prompt_tokens", "completion_tokens",
+    )
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+        self.latency_ms_total = 0.0
+        self.latency_ms_max = 0.0
+        self.wait_ms_total = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        upstream = max(1, self.calls - self.coalesced - self.cache_hits)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "coalesced": self.coalesced,
+            "cache_hits": self.cache_hits,
+            "latency_ms_avg": round(self.latency_ms_total / upstream, 1),
+            "latency_ms_max": round(self.latency_ms_max, 1),
+            "wait_ms_avg": round(self.wait_ms_total / upstream, 1),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+
+class _Provider:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        env = f"LLM_MAX_CONCURRENCY_{name.upper().replace('-', '_')}"
+        self.limit = max(1, env_int(env, env_int("LLM_MAX_CONCURRENCY", 8)))
+        self.sem = threading.BoundedSemaphore(self.limit)
+        self.in_flight = 0
+
+
+class _Call(Future):
+    """Future of one upstream call; `acquired` is set once it holds a provider slot."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.acquired = threading.Event()
+
+
+class _MeteredStream:
+    """Iterator over a streaming response that frees the provider slot when done."""
+
+    def __init__(self, gateway: "LLMGateway", inner: Any, provider: _Provider, tag: str, t0: float, wait_ms: float) -> None:
+        self._gw = gateway
+        self._it = iter(inner)
+        self._provider = provider
+        self._tag = tag
+        self._t0 = t0
+        self._wait_ms = wait_ms
+        self._usage: Tuple[int, int] = (0, 0)
+        self._closed = False
+        self._error = False
+
+    def __iter__(self) -> "_MeteredStream":
+        return self
+
+    def __next__(self) -> Any:
+        try:
+            chunk = next(self._it)
+        except StopIteration:
+            self.close()
+            raise
+        except Exception:
+            self._error = True
+            self.close()
+            raise
+        p, c = _usage_tokens(chunk)
+        if p or c:
+            self._usage = (p, c)
+        return chunk
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        inner_close = getattr(self._it, "close", None)
+        if callable(inner_close):
+            try:
+                inner_close()
+            except Exception:
+                pass
+        self._gw._release(self._provider)
+        self._gw._record(
+            self._tag,
+            latency_ms=(time.perf_counter() - self._t0) * 1000,
+            wait_ms=self._wait_ms,
+            usage=self._usage,
+            error=self._error,
+        )
+
+    def __del__(self) -> None:
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class LLMGateway:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._providers: Dict[str, _Provider] = {}
+        self._tags: Dict[str, _TagStats] = {}
+        self._inflight: Dict[str, _Call] = {}
+        self._cache: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    # ---- plumbing ----
+
+    def _provider(self, name: str) -> _Provider:
+        with self._lock:
+            p = self._providers.get(name)
+            if p is None:
+                p = _Provider(name)
+                self._providers[name] = p
+            return p
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=max(1, env_int("LLM_GATEWAY_WORKERS", 64)),
+                    thread_name_prefix="llm-gateway",
+                )
+            return self._pool
+
+    def _acquire(self, provider: _Provider) -> float:
+        t = time.perf_counter()
+        provider.sem.acquire()
+        with self._lock:
+            provider.in_flight += 1
+        return (time.perf_counter() - t) * 1000
+
+    def _release(self, provider: _Provider) -> None:
+        with self._lock:
+            provider.in_flight -= 1
+        provider.sem.release()
+
+    def _stats_for(self, tag: str) -> _TagStats:
+        st = self._tags.get(tag)
+        if st is None:
+            st = _TagStats()
+            self._tags[tag] = st
+        return st
+
+    def _record(
+        self,
+        tag: str,
+        *,
+        latency_ms: float = 0.0,
+        wait_ms: float = 0.0,
+        usage: Tuple[int, int] = (0, 0),
+        error: bool = False,
+        timeout: bool = False,
+        coalesced: bool = False,
+        cache_hit: bool = False,
+    ) -> None:
+        with self._lock:
+            st = self._stats_for(tag or "default")
+            if timeout:
+                # The caller gave up; the upstream call is still counted when it returns.
+                st.timeouts += 1
+                return
+            st.calls += 1
+            st.errors += int(error)
+            st.coalesced += int(coalesced)
+            st.cache_hits += int(cache_hit)
+            if not coalesced and not cache_hit:
+                st.latency_ms_total += latency_ms
+                st.latency_ms_max = max(st.latency_ms_max, latency_ms)
+                st.wait_ms_total += wait_ms
+            st.prompt_tokens += usage[0]
+            st.completion_tokens += usage[1]
+
+    # ---- cache ----
+
+    def _cache_get(self, key: str) -> Any:
+        ttl = max(1, env_int("LLM_RESPONSE_CACHE_TTL_SECONDS", 3600))
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is None:
+                return None
+            if time.time() - hit[0] > ttl:
+                self._cache.pop(key, None)
+                return None
+            self._cache.move_to_end(key)
+            return hit[1]
+
+    def _cache_put(self, key: str, value: Any) -> None:
+        limit = max(1, env_int("LLM_RESPONSE_CACHE_MAX", 256))
+        with self._lock:
+            self._cache[key] = (time.time(), value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > limit:
+                self._cache.popitem(last=False)
+
+    # ---- public API ----
+
+    def call(
+        self,
+        fn: Callable[[], T],
+        *,
+        provider: str = "default",
+        key: Optional[str] = None,
+        timeout: Optional[float] = None,
+        tag: str = "",
+        cacheable: bool = False,
+    ) -> T:
+        """Run one blocking LLM request `fn()` under the gateway's limits.
+
+        `key` identifies identical requests (for coalescing and caching); without
+        it the call is neither coalesced nor cached. `timeout` is a hard limit in
+        seconds for this caller (None: LLM_GATEWAY_TIMEOUT_SECONDS), counted from
+        the moment the request holds its provider slot.
+        """
+        if timeout is None:
+            timeout = env_float("LLM_GATEWAY_TIMEOUT_SECONDS", 0.0)
+        use_cache = bool(key) and cacheable and env_flag("LLM_RESPONSE_CACHE", "0")
+        if use_cache:
+            cached = self._cache_get(key)  # type: ignore[arg-type]
+            if cached is not None:
+                self._record(tag, cache_hit=True)
+                return cached
+
+        coalesce = bool(key) and env_flag("LLM_GATEWAY_COALESCE", "1")
+        leader = True
+        fut: Optional[_Call] = None
+        if coalesce:
+            with self._lock:
+                fut = self._inflight.get(key)  # type: ignore[arg-type]
+                if fut is None:
+                    fut = _Call()
+                    self._inflight[key] = fut  # type: ignore[index]
+                else:
+                    leader = False
+        if fut is None:
+            fut = _Call()
+
+        if leader:
+            self._start(fn, self._provider(provider), fut, key if coalesce else None, key if use_cache else None, tag, timeout)
+        try:
+            if timeout and timeout > 0:
+                # Time spent queueing for the provider slot does not count.
+                fut.acquired.wait()
+            result = fut.result(timeout=timeout if timeout and timeout > 0 else None)
+        except FutureTimeoutError:
+            self._record(tag, timeout=True)
+            raise TimeoutError(f"LLM call timed out after {timeout}s ({tag or provider})") from None
+        except Exception:
+            if not leader:
+                self._record(tag, error=True, coalesced=True)
+            raise
+        if not leader:
+            self._record(tag, coalesced=True)
+        return result
+
+    def _start(
+        self,
+        fn: Callable[[], Any],
+        provider: _Provider,
+        fut: _Call,
+        inflight_key: Optional[str],
+        cache_key: Optional[str],
+        tag: str,
+        timeout: Optional[float],
+    ) -> None:
+        def run() -> None:
+            wait_ms = self._acquire(provider)
+            fut.acquired.set()
+            t0 = time.perf_counter()
+            try:
+                result = fn()
+            except BaseException as exc:  # noqa: BLE001
+                self._record(tag, latency_ms=(time.perf_counter() - t0) * 1000, wait_ms=wait_ms, error=True)
+                self._finish(inflight_key, fut, exc=exc)
+                if not isinstance(exc, Exception):
+                    raise
+                return
+            finally:
+                self._release(provider)
+            self._record(tag, latency_ms=(time.perf_counter() - t0) * 1000, wait_ms=wait_ms, usage=_usage_tokens(result))
+            if cache_key is not None:
+                self._cache_put(cache_key, result)
+            self._finish(inflight_key, fut, result=result)
+
+        if timeout and timeout > 0:
+            self._executor().submit(run)
+        else:
+            run()
+
+    def _finish(self, inflight_key: Optional[str], fut: _Call, result: Any = None, exc: Optional[BaseException] = None) -> None:
+        if inflight_key is not None:
+            with self._lock:
+                if self._inflight.get(inflight_key) is fut:
+                    self._inflight.pop(inflight_key, None)
+        if exc is not None:
+            fut.set_exception(exc)
+        else:
+            fut.set_result(result)
+
+    def complete(self, kwargs: Dict[str, Any], *, timeout: Optional[float] = None, tag: str = "") -> Any:
+        """litellm.completion(**kwargs) through the gateway (non-streaming)."""
+        from litellm import completion
+
+        provider = provider_for_model(str(kwargs.get("model") or ""), str(kwargs.get("api_base") or ""))
+        temperature = kwargs.get("temperature")
+        cacheable = isinstance(temperature, (int, float)) and float(temperature) == 0.0
+        return self.call(
+            lambda: completion(**kwargs),
+            provider=provider,
+            key=request_fingerprint({"kind": "completion", **kwargs}),
+            timeout=timeout,
+            tag=tag or "completion",
+            cacheable=cacheable,
+        )
+
+    def stream(self, kwargs: Dict[str, Any], *, tag: str = "") -> Iterator[Any]:
+        """Streaming litellm.completion; the provider slot is held until the stream ends or is closed."""
+        from litellm import completion
+
+        provider = self._provider(provider_for_model(str(kwargs.get("model") or ""), str(kwargs.get("api_base") or "")))
+        wait_ms = self._acquire(provider)
+        t0 = time.perf_counter()
+        try:
+            inner = completion(**dict(kwargs, stream=True))
+        except Exception:
+            self._release(provider)
+            self._record(tag or "stream", latency_ms=(time.perf_counter() - t0) * 1000, wait_ms=wait_ms, error=True)
+            raise
+        return _MeteredStream(self, inner, provider, tag or "stream", t0, wait_ms)
+
+    def clear_cache(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "providers": {
+                    name: {"limit": p.limit, "in_flight": p.in_flight}
+                    for name, p in self._providers.items()
+                },
+                "in_flight_requests": len(self._inflight),
+                "cache": {"enabled": env_flag("LLM_RESPONSE_CACHE", "0"), "entries": len(self._cache)},
+                "tags": {tag: st.as_dict() for tag, st in sorted(self._tags.items())},
+            }
+
+
+llm_gateway = LLMGateway()
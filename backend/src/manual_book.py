@@ -1,10 +1,16 @@
 import json
 import os
-from typing import Optional, Tuple, List, Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Optional, Tuple, List, Dict, Any
 import re
 from pathlib import Path
 from datetime import datetime
 
+from src import graph_version
+
 from src.rag_specsheet import (
     _build_context_from_ocr_documents,
     _run_completion_with_timeout,
@@ -15,6 +21,7 @@ from src.specsheet_models import ManualBookData, ManualBookFromOcrRequest, Manua
 from src.api_queries import BACKEND_ROOT, upsert_product_has_doc, get_kb_overview_by_product_id
 from src.rag_bom import decode_bom_code
 from src.rag_specsheet import _summarize_bom
+from src.env import env_int
 
 # 固定页顺序（需与前端 manualPages 一致）
 TARGET_HEADERS = [
@@ -292,54 +299,72 @@ def _truncate_text(value: str, max_chars: int = 8000) -> str:
     return v[:max_chars] + "\n...(truncated)..."
 
 
+# 说明书生成引擎的可选环境变量：
+#   MANUAL_BOOK_PARALLEL_GROUPS          设为 0 时回退为整本 13 页一次生成
+#   MANUAL_BOOK_GROUP_WORKERS            并发生成的章节组数（默认 6）
+#   MANUAL_BOOK_GROUP_RETRIES            每组只重试未通过校验的页面的次数（默认 1）
+#   MANUAL_PRODUCT_CONTEXT_TTL_SECONDS   (product, bom) 共享上下文缓存时长（默认 600）
+#   MANUAL_PRODUCT_CONTEXT_CACHE_MAX     共享上下文缓存条数（默认 64）
+
+
+def _manual_group_key(header: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", (header or "").lower()).strip("_")
+
+
+def _build_page_groups() -> List[Tuple[str, str, int]]:
+    """(group_key, header, page count) in TARGET_HEADERS order; repeated headers form one group."""
+    groups: List[Tuple[str, str, int]] = []
+    for hdr in TARGET_HEADERS:
+        if groups and groups[-1][1] == hdr:
+            key, header, count = groups[-1]
+            groups[-1] = (key, header, count + 1)
+        else:
+            groups.append((_manual_group_key(hdr), hdr, 1))
+    return groups
+
+
+MANUAL_PAGE_GROUPS = _build_page_groups()
+_GROUP_SPECS: Dict[str, Tuple[str, int]] = {key: (header, count) for key, header, count in MANUAL_PAGE_GROUPS}
+# 这些页面没有图片槽位，生成时不附带候选图片
+_TEXT_ONLY_GROUPS = {"contents", "installation_user_manual", "how_to_set_up"}
+
+
+def _page_ok(page: Any, header: str) -> bool:
+    return (
+        page is not None
+        and (getattr(page, "header", None) or "").strip() == header
+        and isinstance(getattr(page, "blocks", None), list)
+    )
+
+
+def _split_group_pages(group_key: str, pages: List[Optional[ManualBookData]]) -> Tuple[Dict[int, ManualBookData], List[int]]:
+    """Check a group's pages slot by slot: (valid pages by slot, failed slots)."""
+    spec = _GROUP_SPECS.get(group_key)
+    if not spec:
+        return {}, []
+    header, count = spec
+    pages = list(pages or [])
+    valid = {idx: pages[idx] for idx in range(min(count, len(pages))) if _page_ok(pages[idx], header)}
+    return valid, [idx for idx in range(count) if idx not in valid]
+
+
 def _validate_generated_group_pages(group_key: str, pages: List[ManualBookData]) -> List[ManualBookData]:
-    header_by_group = {
-        "embrace_the_revitalizing_chill": "Embrace the Revitalizing Chill",
-        "premium_materials": "Premium Materials",
-        "how_to_set_up": "How To Set Up",
-        "important_safety_instructions": "Important Safety Instructions",
-        "touchscreen_control_panel": "Touchscreen Control Panel",
-        "troubleshooting": "Troubleshooting",
-    }
-    expected_counts = {
-        "embrace_the_revitalizing_chill": 1,
-        "premium_materials": 1,
-        "how_to_set_up": 1,
-        "important_safety_instructions": 2,
-        "touchscreen_control_panel": 1,
-        "troubleshooting": 3,
-    }
-    expected_header = header_by_group.get(group_key)
-    if not expected_header:
-        return []
-    exp_n = expected_counts.get(group_key, 0)
-    if exp_n <= 0:
-        return []
     cleaned = [p for p in (pages or []) if p and getattr(p, "header", None)]
-    if len(cleaned) != exp_n:
+    valid, failed = _split_group_pages(group_key, cleaned)
+    if failed or not valid or len(valid) != len(cleaned):
         return []
-    for p in cleaned:
-        if (p.header or "").strip() != expected_header:
-            return []
-        if not isinstance(getattr(p, "blocks", None), list):
-            return []
-    return cleaned
+    return [valid[idx] for idx in sorted(valid)]
 
 
-def plan_manual_variants_from_context(
-    payload: ManualBookVariantPlanRequest,
-) -> Tuple[Dict[str, str], Dict[str, List[ManualBookData]], str]:
-    """LLM selects variant for each group key based on product category + BOM/config.
+_PRODUCT_CONTEXT_CACHE: "OrderedDict[Tuple[str, str], Tuple[float, int, Dict[str, str]]]" = OrderedDict()
+_PRODUCT_CONTEXT_LOCK = threading.Lock()
+_PRODUCT_CONTEXT_BUILDING: Dict[Tuple[str, str], threading.Lock] = {}
 
-    Returns:
-        variants: dict[group_key] -> A/B/C/GENERATE
-        generated_pages: dict[group_key] -> pages (when GENERATE)
-        user_prompt: str
-    """
 
+def _load_manual_product_context(product_name: str, bom_code: str) -> Dict[str, str]:
     product_id = ""
-    if payload.product_name and payload.bom_code:
-        product_id = f"{payload.product_name.strip()}_{payload.bom_code.strip()}".strip("_")
+    if product_name and bom_code:
+        product_id = f"{product_name}_{bom_code}".strip("_")
 
     product_category = ""
     config_text_zh = ""
@@ -353,9 +378,9 @@ def plan_manual_variants_from_context(
             config_text_zh = ""
 
     accessory_glossary_text = ""
-    if payload.product_name and payload.bom_code:
+    if product_name and bom_code:
         try:
-            cfg2, glossary2 = _get_product_config_and_accessory_glossary(payload.product_name, payload.bom_code)
+            cfg2, glossary2 = _get_product_config_and_accessory_glossary(product_name, bom_code)
             if cfg2:
                 config_text_zh = cfg2
             accessory_glossary_text = glossary2 or ""
@@ -364,15 +389,79 @@ def plan_manual_variants_from_context(
 
     bom_summary = ""
     try:
-        decoded = decode_bom_code(payload.bom_code or "") if payload.bom_code else None
+        decoded = decode_bom_code(bom_code) if bom_code else None
         bom_summary = _summarize_bom(decoded) or ""
     except Exception:
         bom_summary = ""
 
-    product_category = (product_category or "").strip()
-    config_text_zh = _truncate_text(config_text_zh, 12000)
-    bom_summary = _truncate_text(bom_summary, 4000)
-    accessory_glossary_text = _truncate_text(accessory_glossary_text, 2400)
+    return {
+        "product_category": (product_category or "").strip(),
+        "config_text_zh": _truncate_text(config_text_zh, 12000),
+        "bom_summary": _truncate_text(bom_summary, 4000),
+        "accessory_glossary_text": _truncate_text(accessory_glossary_text, 2400),
+    }
+
+
+def _manual_product_context(product_name: Optional[str], bom_code: Optional[str]) -> Dict[str, str]:
+    """Product category / config / glossary / BOM summary shared by variant plan and one-shot.
+
+    Built once per (product, bom) and cached until the TTL passes or the graph is written.
+    """
+    key = ((product_name or "").strip(), (bom_code or "").strip())
+    ttl = max(0, env_int("MANUAL_PRODUCT_CONTEXT_TTL_SECONDS", 600))
+
+    def _cached() -> Optional[Dict[str, str]]:
+        with _PRODUCT_CONTEXT_LOCK:
+            entry = _PRODUCT_CONTEXT_CACHE.get(key)
+            if entry is None:
+                return None
+            built_at, version, ctx = entry
+            if time.time() - built_at > ttl or version != graph_version.current():
+                _PRODUCT_CONTEXT_CACHE.pop(key, None)
+                return None
+            _PRODUCT_CONTEXT_CACHE.move_to_end(key)
+            return dict(ctx)
+
+    hit = _cached()
+    if hit is not None:
+        return hit
+    with _PRODUCT_CONTEXT_LOCK:
+        build_lock = _PRODUCT_CONTEXT_BUILDING.setdefault(key, threading.Lock())
+    # 同一产品的并发请求（variant_plan 与 one_shot）只查询一次
+    with build_lock:
+        hit = _cached()
+        if hit is not None:
+            return hit
+        version = graph_version.current()
+        ctx = _load_manual_product_context(*key)
+        if ttl > 0:
+            with _PRODUCT_CONTEXT_LOCK:
+                _PRODUCT_CONTEXT_CACHE[key] = (time.time(), version, ctx)
+                _PRODUCT_CONTEXT_CACHE.move_to_end(key)
+                limit = max(1, env_int("MANUAL_PRODUCT_CONTEXT_CACHE_MAX", 64))
+                while len(_PRODUCT_CONTEXT_CACHE) > limit:
+                    _PRODUCT_CONTEXT_CACHE.popitem(last=False)
+    with _PRODUCT_CONTEXT_LOCK:
+        _PRODUCT_CONTEXT_BUILDING.pop(key, None)
+    return dict(ctx)
+
+
+def plan_manual_variants_from_context(
+    payload: ManualBookVariantPlanRequest,
+) -> Tuple[Dict[str, str], Dict[str, List[ManualBookData]], str]:
+    """LLM selects variant for each group key based on product category + BOM/config.
+
+    Returns:
+        variants: dict[group_key] -> A/B/C/GENERATE
+        generated_pages: dict[group_key] -> pages (when GENERATE)
+        user_prompt: str
+    """
+
+    shared = _manual_product_context(payload.product_name, payload.bom_code)
+    product_category = shared["product_category"]
+    config_text_zh = shared["config_text_zh"]
+    bom_summary = shared["bom_summary"]
+    accessory_glossary_text = shared["accessory_glossary_text"]
 
     variant_meanings = {
         "embrace_the_revitalizing_chill": {"A": "冰水缸通用", "B": "其他"},
@@ -427,7 +516,7 @@ def plan_manual_variants_from_context(
             kwargs["api_key"] = llm_config.api_key
         if llm_config.base_url:
             kwargs["api_base"] = llm_config.base_url
-        response = _run_completion_with_timeout(kwargs, None)
+        response = _run_completion_with_timeout(kwargs, None, tag="manual_book")
         return response.choices[0].message.content.strip()
 
     allowed = {
@@ -601,38 +690,11 @@ def generate_manual_one_shot(
     if not getattr(payload, "product_name", None) or not getattr(payload, "bom_code", None):
         raise ValueError("product_name 与 bom_code 不能为空")
 
-    product_id = f"{payload.product_name.strip()}_{payload.bom_code.strip()}".strip("_")
-
-    product_category = ""
-    config_text_zh = ""
-    try:
-        overview = get_kb_overview_by_product_id(product_id)
-        product_category = (overview.get("product") or {}).get("product_type_zh") or ""
-        config_text_zh = (overview.get("config") or {}).get("config_text_zh") or ""
-    except Exception:
-        product_category = ""
-        config_text_zh = ""
-
-    accessory_glossary_text = ""
-    try:
-        cfg2, glossary2 = _get_product_config_and_accessory_glossary(payload.product_name, payload.bom_code)
-        if cfg2:
-            config_text_zh = cfg2
-        accessory_glossary_text = glossary2 or ""
-    except Exception:
-        accessory_glossary_text = ""
-
-    bom_summary = ""
-    try:
-        decoded = decode_bom_code(payload.bom_code or "") if payload.bom_code else None
-        bom_summary = _summarize_bom(decoded) or ""
-    except Exception:
-        bom_summary = ""
-
-    product_category = (product_category or "").strip()
-    config_text_zh = _truncate_text(config_text_zh, 12000)
-    bom_summary = _truncate_text(bom_summary, 4000)
-    accessory_glossary_text = _truncate_text(accessory_glossary_text, 2400)
+    shared = _manual_product_context(payload.product_name, payload.bom_code)
+    product_category = shared["product_category"]
+    config_text_zh = shared["config_text_zh"]
+    bom_summary = shared["bom_summary"]
+    accessory_glossary_text = shared["accessory_glossary_text"]
 
     variant_meanings = {
         "embrace_the_revitalizing_chill": {"A": "冰水缸通用", "B": "其他"},
@@ -688,7 +750,7 @@ def generate_manual_one_shot(
             kwargs["api_key"] = llm_config.api_key
         if llm_config.base_url:
             kwargs["api_base"] = llm_config.base_url
-        response = _run_completion_with_timeout(kwargs, None)
+        response = _run_completion_with_timeout(kwargs, None, tag="manual_book")
         return response.choices[0].message.content.strip()
 
     allowed = {
@@ -1054,9 +1116,109 @@ def _apply_manual_book_overrides(manual_book: List[ManualBookData]) -> List[Manu
     return manual_book
 
 
-def generate_manual_book_from_ocr(payload: ManualBookFromOcrRequest) -> Tuple[List[ManualBookData], str]:
+_GROUP_POOL: Optional[ThreadPoolExecutor] = None
+_GROUP_POOL_LOCK = threading.Lock()
+
+
+def _manual_group_pool() -> ThreadPoolExecutor:
+    global _GROUP_POOL
+    with _GROUP_POOL_LOCK:
+        if _GROUP_POOL is None:
+            workers = max(1, env_int("MANUAL_BOOK_GROUP_WORKERS", 6))
+            _GROUP_POOL = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="manual-group")
+        return _GROUP_POOL
+
+
+def _parse_group_pages(llm_output: str) -> List[Optional[ManualBookData]]:
+    """Parse one group's output into pages, keeping a None slot for every page that fails to load."""
+    try:
+        parsed = json.loads(_extract_json_or_convert(llm_output))
+    except Exception as exc:  # noqa: BLE001
+        print(f"[ManualBook] Group output is not JSON: {exc}")
+        return []
+    if isinstance(parsed, dict):
+        items = parsed.get("pages") if isinstance(parsed.get("pages"), list) else [parsed]
+    elif isinstance(parsed, list):
+        items = parsed
+    else:
+        return []
+    pages: List[Optional[ManualBookData]] = []
+    for item in items:
+        try:
+            pages.append(ManualBookData(**item) if isinstance(item, dict) else None)
+        except Exception:
+            pages.append(None)
+    return pages
+
+
+def _group_instruction(header: str, count: int, missing: Optional[List[int]] = None, error: Optional[str] = None) -> str:
+    if not missing:
+        return (
+            f"本次只生成 header 为 \"{header}\" 的页面（忽略上面“数组长度必须是 13”的要求）：\n"
+            f"请仅输出 JSON 数组纯文本，长度为 {count}，每个元素的 header 都必须是 \"{header}\"，"
+            "blocks 结构参照系统提示中该 header 的示例（同名多页按示例顺序）。"
+        )
+    slots = "、".join(str(i + 1) for i in missing)
+    note = (
+        f"header 为 \"{header}\" 的第 {slots} 页（共 {count} 页）上次无法解析或结构不符合要求，"
+        f"请只重新输出这 {len(missing)} 页：JSON 数组，按页序排列，header 都必须是 \"{header}\"，"
+        "不要输出其他页，无 markdown/代码块/说明文字。"
+    )
+    if error:
+        note += f"错误提示：{error}"
+    return note
+
+
+def _generate_manual_group(
+    call_llm: Callable[[Optional[str], bool], str],
+    group_key: str,
+    header: str,
+    count: int,
+) -> Tuple[List[ManualBookData], List[int]]:
+    """Generate one page group; on retry only the failed slots are requested again.
+
+    Returns the group's pages (failed slots filled with the default page) and the slots that fell back.
+    """
+    with_images = group_key not in _TEXT_ONLY_GROUPS
+    pages: Dict[int, ManualBookData] = {}
+    missing = list(range(count))
+    error: Optional[str] = None
+    attempts = 1 + max(0, env_int("MANUAL_BOOK_GROUP_RETRIES", 1))
+    for attempt in range(attempts):
+        try:
+            raw = call_llm(_group_instruction(header, count, missing if attempt else None, error), with_images)
+        except Exception as exc:  # noqa: BLE001
+            error = str(exc)
+            print(f"[ManualBook] Group {group_key} attempt {attempt + 1} failed: {exc}")
+            continue
+        print(f"[ManualBook] Raw LLM output ({group_key}, attempt {attempt + 1}):\n{raw}")  # debug log
+        candidates = _parse_group_pages(raw)
+        still_missing: List[int] = []
+        for pos, slot in enumerate(missing):
+            page = candidates[pos] if pos < len(candidates) else None
+            if _page_ok(page, header):
+                pages[slot] = page
+            else:
+                still_missing.append(slot)
+        if still_missing:
+            error = f"缺少或无法解析第 {'、'.join(str(i + 1) for i in still_missing)} 页"
+        missing = still_missing
+        if not missing:
+            break
+    for slot in missing:
+        pages[slot] = ManualBookData(**_default_page_for_header(header))
+    return [pages[idx] for idx in range(count)], missing
+
+
+def generate_manual_book_from_ocr(
+    payload: ManualBookFromOcrRequest,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Tuple[List[ManualBookData], str]:
     """Generate manual book data from OCR docs.
 
+    The page groups of TARGET_HEADERS are generated concurrently; every call shares the
+    same system prompt + context prefix and only the trailing group instruction differs.
+
     Returns:
         manual_book: ManualBookData
         user_prompt: str (for debugging/display)
@@ -1066,7 +1228,10 @@ def generate_manual_book_from_ocr(payload: ManualBookFromOcrRequest) -> Tuple[Li
     if not payload.documents:
         raise ValueError("请至少提供一个 OCR 文档")
 
-    context_text, pseudo_chunks, _multimodal_segments = _build_context_from_ocr_documents(payload.documents)
+    context_text, pseudo_chunks, _multimodal_segments = _build_context_from_ocr_documents(
+        payload.documents,
+        session_id=getattr(payload, "session_id", None),
+    )
     if not context_text.strip():
         raise ValueError("未提供可用于生成的 OCR 文档内容")
 
@@ -1076,6 +1241,7 @@ def generate_manual_book_from_ocr(payload: ManualBookFromOcrRequest) -> Tuple[Li
     )
     title_hint = payload.product_name or payload.bom_code or "Instruction Book"
     user_prompt = build_manual_user_prompt(context_text, title_hint) + _build_manual_image_prompt(_multimodal_segments)
+    image_payloads = [seg.get("image") for seg in (_multimodal_segments or []) if seg.get("image")]
 
     def _build_messages(extra_instruction: Optional[str] = None) -> list[dict]:
         messages = [
@@ -1086,46 +1252,68 @@ def generate_manual_book_from_ocr(payload: ManualBookFromOcrRequest) -> Tuple[Li
             messages.append({"role": "user", "content": extra_instruction})
         return messages
 
-    def _call_llm(messages: list[dict]) -> str:
+    def _call_llm(extra_instruction: Optional[str] = None, with_images: bool = True) -> str:
         kwargs = {
             "model": llm_config.model,
-            "messages": messages,
+            "messages": _build_messages(extra_instruction),
             "temperature": 0.2,
         }
-        if _multimodal_segments:
-            image_payloads = [seg.get("image") for seg in _multimodal_segments if seg.get("image")]
-            if image_payloads:
-                kwargs["images"] = image_payloads
+        if with_images and image_payloads:
+            kwargs["images"] = image_payloads
         if llm_config.api_key:
             kwargs["api_key"] = llm_config.api_key
         if llm_config.base_url:
             kwargs["api_base"] = llm_config.base_url
-        response = _run_completion_with_timeout(kwargs, None)
+        response = _run_completion_with_timeout(kwargs, None, tag="manual_book")
         return response.choices[0].message.content.strip()
 
     manual_book: Optional[List[ManualBookData]] = None
-    errors: list[str] = []
-
-    for attempt in range(2):
-        extra_note = None
-        if attempt == 1 and errors:
-            extra_note = (
-                "上次输出无法解析或缺少必填字段。请仅返回 JSON 数组，无 markdown/代码块/说明文字，"
-                "数组长度为 13，header 依次为："
-                f"{', '.join(TARGET_HEADERS)}。错误提示：{errors[-1]}"
-            )
-        try:
-            llm_output = _call_llm(_build_messages(extra_note))
-            print(f"[ManualBook] Raw LLM output (attempt {attempt+1}):\n{llm_output}")  # debug log
-            manual_book = _parse_and_validate_manual_book(llm_output)
-            break
-        except Exception as exc:  # noqa: BLE001
-            errors.append(str(exc))
-            manual_book = None
 
-    if manual_book is None:
-        print(f"[ManualBook] LLM fallback after retries: {errors}")
-        manual_book = _default_manual_book(title_hint)
+    if env_int("MANUAL_BOOK_PARALLEL_GROUPS", 1) > 0:
+        started = time.perf_counter()
+        pool = _manual_group_pool()
+        futures = {
+            pool.submit(_generate_manual_group, _call_llm, key, header, count): key
+            for key, header, count in MANUAL_PAGE_GROUPS
+        }
+        by_group: Dict[str, List[ManualBookData]] = {}
+        fallback_slots = 0
+        for done, fut in enumerate(as_completed(futures), start=1):
+            pages, missing = fut.result()
+            by_group[futures[fut]] = pages
+            fallback_slots += len(missing)
+            if progress is not None:
+                try:
+                    progress(done, len(futures))
+                except Exception:
+                    pass
+        manual_book = [page for key, _header, _count in MANUAL_PAGE_GROUPS for page in by_group[key]]
+        print(
+            f"[ManualBook] {len(futures)} groups generated in {time.perf_counter() - started:.1f}s, "
+            f"{fallback_slots} page(s) fell back to defaults"
+        )
+    else:
+        errors: list[str] = []
+        for attempt in range(2):
+            extra_note = None
+            if attempt == 1 and errors:
+                extra_note = (
+                    "上次输出无法解析或缺少必填字段。请仅返回 JSON 数组，无 markdown/代码块/说明文字，"
+                    "数组长度为 13，header 依次为："
+                    f"{', '.join(TARGET_HEADERS)}。错误提示：{errors[-1]}"
+                )
+            try:
+                llm_output = _call_llm(extra_note)
+                print(f"[ManualBook] Raw LLM output (attempt {attempt+1}):\n{llm_output}")  # debug log
+                manual_book = _parse_and_validate_manual_book(llm_output)
+                break
+            except Exception as exc:  # noqa: BLE001
+                errors.append(str(exc))
+                manual_book = None
+
+        if manual_book is None:
+            print(f"[ManualBook] LLM fallback after retries: {errors}")
+            manual_book = _default_manual_book(title_hint)
 
     manual_book = _normalize_manual_book(manual_book)
     manual_book = _apply_manual_book_overrides(manual_book)
@@ -2,21 +2,24 @@
 
 from __future__ import annotations
 
-import asyncio
 import json
 import mimetypes
 import os
 import re
 import shutil
 import subprocess
+import queue
 import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Tuple
 from uuid import uuid4
 
 from fastapi import UploadFile
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 
 from src.api_queries import (
     BACKEND_ROOT,
@@ -26,14 +29,18 @@ from src.api_queries import (
     upsert_manual_document,
     upsert_manual_folder,
 )
-from src.run_deepseekocr import IMG_EXTS, run_ocr
+from src.run_deepseekocr import IMG_EXTS, _ensure_model, infer_image
+from src.executors import run_db, run_llm, run_session
+from src.ocr_worker import ocr_worker, ocr_worker_enabled
 from src.manual_progress import progress_manager
+from src.context_bundle import context_bundles
 from src.prompt_reverse import (
     DEFAULT_USER_PROMPT,
     run_prompt_reverse_for_entries,
-    generate_prompt_for_image,
+    map_reverse_prompts,
 )
 from src.rag_bom import decode_bom_code
+from src.env import env_int
 
 MANUAL_UPLOAD_ROOT = BACKEND_ROOT / "manual_uploads"
 MANUAL_OCR_ROOT = BACKEND_ROOT / "manual_ocr_results"
@@ -51,6 +58,17 @@ OFFICE_DOC_EXTS = frozenset({".doc", ".docx", ".ppt", ".pptx", ".xls", ".xlsx"})
 LIBREOFFICE_CMD = os.getenv("LIBREOFFICE_CMD", "libreoffice")
 
 
+# Rasterization: pages per pdftoppm call, concurrent conversions, render DPI.
+MANUAL_RASTER_PAGE_CHUNK = max(1, env_int("MANUAL_RASTER_PAGE_CHUNK", 4))
+MANUAL_RASTER_WORKERS = max(1, env_int("MANUAL_RASTER_WORKERS", min(4, os.cpu_count() or 1)))
+MANUAL_RASTER_DPI = max(50, env_int("MANUAL_RASTER_DPI", 200))
+# Pipelined sessions: rasterized pages buffered ahead of OCR, concurrent prompt-reverse calls.
+MANUAL_PIPELINE_QUEUE_SIZE = max(1, env_int("MANUAL_PIPELINE_QUEUE_SIZE", 16))
+MANUAL_PROMPT_REVERSE_WORKERS = max(1, env_int("MANUAL_PROMPT_REVERSE_WORKERS", 4))
+
+_PIPELINE_DONE = object()
+
+
 # ---------------------------------------------------------------------------
 # Filesystem helpers
 # ---------------------------------------------------------------------------
@@ -163,6 +181,7 @@ def delete_manual_session(session_id: str) -> bool:
         deleted = True
 
     progress_manager.delete(session_id)
+    context_bundles.invalidate(session_id, "delete_session")
     return deleted
 
 
@@ -503,7 +522,7 @@ async def create_manual_session_entry(
     accessory_files: List[UploadFile],
     bom_type: str | None = None,
 ) -> dict:
-    return _create_manual_session_entry_sync(product_name, bom_code, product_files, accessory_files, bom_type)
+    return await run_db(_create_manual_session_entry_sync, product_name, bom_code, product_files, accessory_files, bom_type)
 
 
 # ---------------------------------------------------------------------------
@@ -511,37 +530,86 @@ async def create_manual_session_entry(
 # ---------------------------------------------------------------------------
 
 
-def convert_pdf_to_images(pdf_path: Path, output_dir: Path, source_name: str | None = None) -> List[dict]:
+def _pdf_page_count(pdf_path: Path) -> int:
+    info = pdfinfo_from_path(str(pdf_path))
+    return int(info.get("Pages") or 0)
+
+
+def _page_ranges(page_count: int, chunk: int | None = None) -> List[Tuple[int, int]]:
+    step = max(1, chunk or MANUAL_RASTER_PAGE_CHUNK)
+    return [(first, min(first + step - 1, page_count)) for first in range(1, page_count + 1, step)]
+
+
+def rasterize_pdf_pages(
+    pdf_path: Path,
+    output_dir: Path,
+    first_page: int,
+    last_page: int,
+    source_name: str | None = None,
+) -> List[dict]:
+    """Render pages [first_page, last_page] of a PDF straight to PNG files.
+
+    pdftoppm writes the PNGs itself (``paths_only``), so no page is ever held in
+    memory as a PIL image; the files are then moved into the per-page layout OCR
+    expects.
+    """
+
     pages_dir = output_dir / pdf_path.stem
     pages_dir.mkdir(parents=True, exist_ok=True)
+    source_size = pdf_path.stat().st_size
+    source_mime = guess_mime(pdf_path)
 
-    images = convert_from_path(str(pdf_path))
     entries: List[dict] = []
-    for index, image in enumerate(images, start=1):
-        page_stem = f"{pdf_path.stem}__page{index:03d}"
-        page_dir = pages_dir / page_stem
-        page_dir.mkdir(parents=True, exist_ok=True)
-        image_path = page_dir / f"{page_stem}.png"
-        image.save(image_path, "PNG")
-        entries.append(
-            {
-                "source_name": source_name or pdf_path.name,
-                "source_size": pdf_path.stat().st_size,
-                "source_mime": guess_mime(pdf_path),
-                "page_number": index,
-                "image_stem": page_stem,
-                "image_path": image_path,
-                "relative_dir": page_dir.relative_to(output_dir).as_posix(),
-            }
+    with tempfile.TemporaryDirectory(prefix="manual_raster_") as scratch:
+        rendered = convert_from_path(
+            str(pdf_path),
+            dpi=MANUAL_RASTER_DPI,
+            first_page=first_page,
+            last_page=last_page,
+            output_folder=scratch,
+            fmt="png",
+            output_file="page",
+            paths_only=True,
         )
+        for index, rendered_path in enumerate(sorted(rendered), start=first_page):
+            page_stem = f"{pdf_path.stem}__page{index:03d}"
+            page_dir = pages_dir / page_stem
+            page_dir.mkdir(parents=True, exist_ok=True)
+            image_path = page_dir / f"{page_stem}.png"
+            shutil.move(str(rendered_path), image_path)
+            entries.append(
+                {
+                    "source_name": source_name or pdf_path.name,
+                    "source_size": source_size,
+                    "source_mime": source_mime,
+                    "page_number": index,
+                    "image_stem": page_stem,
+                    "image_path": image_path,
+                    "relative_dir": page_dir.relative_to(output_dir).as_posix(),
+                }
+            )
+    return entries
+
+
+def convert_pdf_to_images(pdf_path: Path, output_dir: Path, source_name: str | None = None) -> List[dict]:
+    entries: List[dict] = []
+    for first_page, last_page in _page_ranges(_pdf_page_count(pdf_path)):
+        entries.extend(rasterize_pdf_pages(pdf_path, output_dir, first_page, last_page, source_name=source_name))
     return entries
 
 
+def _libreoffice_profile_dir() -> Path:
+    # soffice refuses to run twice against one user profile, so every raster
+    # thread converts with its own (reused) profile directory.
+    return Path(tempfile.gettempdir()) / f"manual_ocr_lo_profile_{threading.get_ident()}"
+
+
 def convert_office_to_pdf(source_path: Path, temp_dir: Path) -> Path:
     temp_dir.mkdir(parents=True, exist_ok=True)
     result = subprocess.run(
         [
             LIBREOFFICE_CMD,
+            f"-env:UserInstallation={_libreoffice_profile_dir().as_uri()}",
             "--headless",
             "--convert-to",
             "pdf",
@@ -562,62 +630,113 @@ def convert_office_to_pdf(source_path: Path, temp_dir: Path) -> Path:
     return converted
 
 
-def prepare_images_for_directory(label: str, source_dir: Path, prepared_dir: Path) -> Tuple[List[dict], List[str]]:
-    """Convert uploaded files under source_dir into page-level image entries for OCR."""
-    prepared_entries: List[dict] = []
-    errors: List[str] = []
+def _copy_image_upload(file_path: Path, prepared_dir: Path) -> dict:
+    page_stem = file_path.stem
+    page_dir = prepared_dir / file_path.stem / page_stem
+    page_dir.mkdir(parents=True, exist_ok=True)
+    target_path = page_dir / file_path.name
+    shutil.copy2(file_path, target_path)
+    return {
+        "source_name": file_path.name,
+        "source_size": file_path.stat().st_size,
+        "source_mime": guess_mime(file_path),
+        "page_number": 1,
+        "image_stem": page_stem,
+        "image_path": target_path,
+        "relative_dir": page_dir.relative_to(prepared_dir).as_posix(),
+    }
+
+
+def iter_prepared_images(
+    label: str,
+    source_dir: Path,
+    prepared_dir: Path,
+    errors: List[str],
+) -> Iterator[dict]:
+    """Yield page-level image entries for OCR as soon as each one is on disk.
+
+    LibreOffice conversions and PDF page ranges (MANUAL_RASTER_PAGE_CHUNK pages
+    each) run on MANUAL_RASTER_WORKERS threads. The rendering itself happens in
+    the soffice/pdftoppm child processes, so several uploads rasterize in
+    parallel without forking the API process. Per-file failures are appended to
+    ``errors``.
+    """
 
     if not source_dir.exists():
-        return prepared_entries, errors
+        return
 
     prepared_dir.mkdir(parents=True, exist_ok=True)
     temp_dir = prepared_dir / "__office_pdf"
     temp_dir.mkdir(parents=True, exist_ok=True)
 
-    for file_path in sorted(p for p in source_dir.iterdir() if p.is_file()):
-        ext = file_path.suffix.lower()
-        try:
+    def _prepared(entry: dict, file_path: Path) -> dict:
+        return {
+            "label": label,
+            "relative_dir": entry.get("relative_dir"),
+            "image_stem": entry["image_stem"],
+            "image_path": entry.get("image_path"),
+            "page_number": entry.get("page_number"),
+            "source_name": entry.get("source_name") or file_path.name,
+            "source_size": entry.get("source_size", 0),
+            "source_mime": entry.get("source_mime", "application/octet-stream"),
+        }
+
+    files = sorted(p for p in source_dir.iterdir() if p.is_file())
+    failed: set[Path] = set()
+    executor = ThreadPoolExecutor(max_workers=MANUAL_RASTER_WORKERS, thread_name_prefix="manual-raster")
+    # future -> (stage, upload path, converted pdf path)
+    pending: Dict[Future, Tuple[str, Path, Path | None]] = {}
+    try:
+        for file_path in files:
+            ext = file_path.suffix.lower()
             if ext in PDF_EXTS:
-                entries = convert_pdf_to_images(file_path, prepared_dir, source_name=file_path.name)
+                pending[executor.submit(_pdf_page_count, file_path)] = ("count", file_path, file_path)
             elif ext in OFFICE_DOC_EXTS:
-                pdf_path = convert_office_to_pdf(file_path, temp_dir)
-                entries = convert_pdf_to_images(pdf_path, prepared_dir, source_name=file_path.name)
+                # Separate outdir per upload: a.docx and a.xlsx would both become a.pdf.
+                outdir = temp_dir / secure_filename(file_path.name)
+                pending[executor.submit(convert_office_to_pdf, file_path, outdir)] = ("office", file_path, None)
             elif ext in IMG_EXTS:
-                page_stem = file_path.stem
-                page_dir = prepared_dir / file_path.stem / page_stem
-                page_dir.mkdir(parents=True, exist_ok=True)
-                target_path = page_dir / file_path.name
-                shutil.copy2(file_path, target_path)
-                entries = [
-                    {
-                        "source_name": file_path.name,
-                        "source_size": file_path.stat().st_size,
-                        "source_mime": guess_mime(file_path),
-                        "page_number": 1,
-                        "image_stem": page_stem,
-                        "image_path": target_path,
-                        "relative_dir": page_dir.relative_to(prepared_dir).as_posix(),
-                    }
-                ]
-            else:
-                continue
+                try:
+                    yield _prepared(_copy_image_upload(file_path, prepared_dir), file_path)
+                except Exception as exc:  # noqa: BLE001
+                    errors.append(f"{file_path.name}: {exc}")
+
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for fut in done:
+                stage, file_path, pdf_path = pending.pop(fut)
+                try:
+                    result = fut.result()
+                except Exception as exc:  # noqa: BLE001
+                    if file_path not in failed:
+                        failed.add(file_path)
+                        errors.append(f"{file_path.name}: {exc}")
+                    continue
+                if stage == "office":
+                    pending[executor.submit(_pdf_page_count, result)] = ("count", file_path, result)
+                elif stage == "count":
+                    for first_page, last_page in _page_ranges(result):
+                        fut_pages = executor.submit(
+                            rasterize_pdf_pages,
+                            pdf_path,
+                            prepared_dir,
+                            first_page,
+                            last_page,
+                            file_path.name,
+                        )
+                        pending[fut_pages] = ("pages", file_path, pdf_path)
+                else:
+                    for entry in result:
+                        yield _prepared(entry, file_path)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
 
-            for entry in entries:
-                prepared_entries.append(
-                    {
-                        "label": label,
-                        "relative_dir": entry.get("relative_dir"),
-                        "image_stem": entry["image_stem"],
-                        "image_path": entry.get("image_path"),
-                        "page_number": entry.get("page_number"),
-                        "source_name": entry.get("source_name") or file_path.name,
-                        "source_size": entry.get("source_size", 0),
-                        "source_mime": entry.get("source_mime", "application/octet-stream"),
-                    }
-                )
-        except Exception as exc:  # noqa: BLE001
-            errors.append(f"{file_path.name}: {exc}")
 
+def prepare_images_for_directory(label: str, source_dir: Path, prepared_dir: Path) -> Tuple[List[dict], List[str]]:
+    """Convert uploaded files under source_dir into page-level image entries for OCR."""
+    errors: List[str] = []
+    prepared_entries = list(iter_prepared_images(label, source_dir, prepared_dir, errors))
+    prepared_entries.sort(key=lambda e: (e.get("source_name") or "", e.get("page_number") or 0))
     return prepared_entries, errors
 
 
@@ -772,25 +891,30 @@ def _run_prompt_reverse_for_original_uploads(session_id: str) -> Tuple[List[str]
 
         items = list(product_dir.glob("**/*"))
         images = [p for p in items if p.is_file() and p.suffix.lower() in IMG_EXTS]
+        todo: List[Path] = []
         for img_path in sorted(images):
+            txt_path = out_dir / f"{img_path.stem}.txt"
             try:
-                txt_path = out_dir / f"{img_path.stem}.txt"
-                try:
-                    if txt_path.exists() and txt_path.is_file() and txt_path.read_text(encoding="utf-8").strip():
-                        logs.append(
-                            {
-                                "image": str(img_path),
-                                "prompt_path": str(txt_path),
-                                "status": "cached",
-                                "message": "",
-                            }
-                        )
-                        continue
-                except Exception:
-                    # If cached read fails, regenerate.
-                    pass
+                if txt_path.exists() and txt_path.is_file() and txt_path.read_text(encoding="utf-8").strip():
+                    logs.append(
+                        {
+                            "image": str(img_path),
+                            "prompt_path": str(txt_path),
+                            "status": "cached",
+                            "message": "",
+                        }
+                    )
+                    continue
+            except Exception:
+                # If cached read fails, regenerate.
+                pass
+            todo.append(img_path)
 
-                text, _raw = generate_prompt_for_image(img_path)
+        for img_path, text, error, _hit in map_reverse_prompts(todo):
+            try:
+                if error is not None:
+                    raise error
+                txt_path = out_dir / f"{img_path.stem}.txt"
                 txt_path.write_text(text or "", encoding="utf-8")
                 logs.append(
                     {
@@ -821,17 +945,7 @@ def _run_prompt_reverse_for_original_uploads(session_id: str) -> Tuple[List[str]
 # ---------------------------------------------------------------------------
 
 
-def run_ocr_for_directory(
-    input_dir: Path,
-    output_dir: Path,
-    session_id: str,
-    label: str,
-) -> None:
-    if not input_dir.exists():
-        return
-
-    output_dir.mkdir(parents=True, exist_ok=True)
-
+def _ocr_progress_callback(session_id: str, label: str):
     def progress_callback(event: dict) -> None:
         event_type = event.get("event")
         if event_type == "before_image":
@@ -845,13 +959,209 @@ def run_ocr_for_directory(
         elif event_type == "complete":
             progress_manager.update(session_id, detail=f"{label} OCR 完成")
 
-    run_ocr(
-        input_dir=str(input_dir),
-        output_dir=str(output_dir / label),
-        allowed_exts=IMG_EXTS,
-        progress_callback=progress_callback,
+    return progress_callback
+
+
+def _ocr_target_dir(output_dir: Path, entry: dict) -> Path:
+    """Same layout run_ocr produces: <output>/<label>/<relative_dir>/<image stem>/."""
+    target = output_dir / (entry.get("label") or "products")
+    if entry.get("relative_dir"):
+        target = target / entry["relative_dir"]
+    return target / Path(entry["image_path"]).stem
+
+
+def _ocr_entry_inline(entry: dict, target_dir: Path, progress_callback) -> str | None:
+    """Fallback when OCR_WORKER=0: OCR one page in this process."""
+    tokenizer, model = _ensure_model()
+    event = {"index": 0, "total": 0, "image_path": str(entry["image_path"])}
+    progress_callback({"event": "before_image", "target_dir": str(target_dir), **event})
+    try:
+        infer_image(tokenizer, model, Path(entry["image_path"]), target_dir)
+    except Exception as exc:  # noqa: BLE001
+        progress_callback({"event": "after_image", "status": "error", "error": str(exc), **event})
+        return str(exc)
+    progress_callback({"event": "after_image", "status": "success", **event})
+    return None
+
+
+def _run_manual_pipeline(session_id: str, base_dir: Path, tmp_dir: Path, output_dir: Path) -> dict:
+    """Rasterize, OCR and prompt-reverse a session as overlapping stages.
+
+    A producer thread streams rasterized pages into a bounded queue; this thread
+    hands each page to the OCR worker as soon as it arrives (at most a few
+    batches in flight), and every page whose OCR finished is reverse-prompted on
+    a small thread pool. Stage timings are reported via progress_manager.
+    """
+
+    prepared_entries: List[dict] = []
+    errors: List[str] = []
+    raster_q: "queue.Queue" = queue.Queue(maxsize=MANUAL_PIPELINE_QUEUE_SIZE)
+    raster_failure: List[BaseException] = []
+    ocr_failure: List[BaseException] = []
+    ocr_futures: List[Future] = []
+    reverse_futures: Dict[int, Future] = {}
+    reverse_lock = threading.Lock()
+    use_worker = ocr_worker_enabled()
+    ocr_slots = threading.BoundedSemaphore(max(1, ocr_worker.batch_size * 2)) if use_worker else None
+    reverse_pool = (
+        ThreadPoolExecutor(max_workers=MANUAL_PROMPT_REVERSE_WORKERS, thread_name_prefix="manual-reverse")
+        if MANUAL_OCR_AUTO_PROMPT_REVERSE
+        else None
     )
 
+    def _timed_reverse(entry: dict) -> Tuple[List[str], List[dict]]:
+        started = time.perf_counter()
+        try:
+            return run_prompt_reverse_for_entries([entry], output_dir)
+        finally:
+            progress_manager.update_stage(
+                session_id, "prompt_reverse", items=1, busy_ms=(time.perf_counter() - started) * 1000
+            )
+
+    def _rasterize() -> None:
+        progress_manager.update_stage(session_id, "rasterize", status="running")
+        try:
+            for label in ("products", "accessories"):
+                pages = iter_prepared_images(label, base_dir / label, tmp_dir / label, errors)
+                while True:
+                    started = time.perf_counter()
+                    entry = next(pages, None)
+                    if entry is None:
+                        break
+                    progress_manager.update_stage(
+                        session_id, "rasterize", items=1, busy_ms=(time.perf_counter() - started) * 1000
+                    )
+                    raster_q.put(entry)
+        except BaseException as exc:  # noqa: BLE001
+            raster_failure.append(exc)
+        finally:
+            raster_q.put(_PIPELINE_DONE)
+            progress_manager.update_stage(session_id, "rasterize", status="done")
+
+    def _on_ocr_done(index: int, entry: dict, error: str | None, busy_ms: float) -> None:
+        progress_manager.update_stage(session_id, "ocr", items=1, busy_ms=busy_ms)
+        if error or reverse_pool is None:
+            return
+        with reverse_lock:
+            reverse_futures[index] = reverse_pool.submit(_timed_reverse, entry)
+
+    original_reverse: Future | None = None
+    if reverse_pool is not None:
+        progress_manager.update_stage(session_id, "prompt_reverse", status="running")
+        # Original uploads do not depend on OCR output; start them right away.
+        original_reverse = reverse_pool.submit(_run_prompt_reverse_for_original_uploads, session_id)
+
+    raster_thread = threading.Thread(target=_rasterize, name=f"manual-raster-{session_id}", daemon=True)
+    raster_thread.start()
+    progress_manager.update_stage(session_id, "ocr", status="running")
+
+    try:
+        while True:
+            entry = raster_q.get()
+            if entry is _PIPELINE_DONE:
+                break
+            index = len(prepared_entries)
+            prepared_entries.append(entry)
+            progress_manager.set_ocr_totals(session_id, len(prepared_entries))
+            if ocr_failure:
+                # Keep draining so the rasterizer can finish, but stop feeding OCR.
+                continue
+
+            label = entry.get("label") or "products"
+            target_dir = _ocr_target_dir(output_dir, entry)
+            callback = _ocr_progress_callback(session_id, label)
+            if not use_worker:
+                started = time.perf_counter()
+                error = _ocr_entry_inline(entry, target_dir, callback)
+                _on_ocr_done(index, entry, error, (time.perf_counter() - started) * 1000)
+                continue
+
+            ocr_slots.acquire()
+            try:
+                fut = ocr_worker.submit(entry["image_path"], target_dir, callback=callback, index=index + 1)
+            except BaseException:
+                ocr_slots.release()
+                raise
+
+            def _done(f: Future, index: int = index, entry: dict = entry) -> None:
+                ocr_slots.release()
+                exc = f.exception()
+                if exc is not None:
+                    ocr_failure.append(exc)
+                    return
+                result = f.result()
+                batch_ms = float(result.get("batch_ms") or 0.0)
+                _on_ocr_done(index, entry, result.get("error"), batch_ms / max(1, int(result.get("batch_size") or 1)))
+
+            fut.add_done_callback(_done)
+            ocr_futures.append(fut)
+
+        wait(ocr_futures)
+    except BaseException as exc:  # noqa: BLE001
+        ocr_failure.append(exc)
+        while raster_thread.is_alive():
+            try:
+                raster_q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    finally:
+        raster_thread.join()
+        progress_manager.update_stage(session_id, "ocr", status="done")
+
+    # Pages arrive in completion order; report them in upload/page order.
+    order = sorted(
+        range(len(prepared_entries)),
+        key=lambda i: (
+            prepared_entries[i].get("label") != "products",
+            prepared_entries[i].get("source_name") or "",
+            prepared_entries[i].get("page_number") or 0,
+        ),
+    )
+
+    reverse_warnings: List[str] = []
+    reverse_logs: List[dict] = []
+    original_warnings: List[str] = []
+    original_logs: List[dict] = []
+    if reverse_pool is not None:
+        try:
+            if not ocr_failure:
+                with reverse_lock:
+                    ordered = [reverse_futures[i] for i in order if i in reverse_futures]
+                for fut in ordered:
+                    try:
+                        w, logs = fut.result()
+                    except Exception as exc:  # noqa: BLE001
+                        errors.append(f"[提示词反推] 执行失败：{exc}")
+                        continue
+                    reverse_warnings.extend(w)
+                    reverse_logs.extend(logs)
+                try:
+                    original_warnings, original_logs = original_reverse.result()
+                except Exception as exc:  # noqa: BLE001
+                    errors.append(f"[原图提示词反推] 执行失败：{exc}")
+        finally:
+            reverse_pool.shutdown(wait=True, cancel_futures=bool(ocr_failure))
+            progress_manager.update_stage(session_id, "prompt_reverse", status="done")
+
+    if raster_failure and not ocr_failure:
+        ocr_failure.extend(raster_failure)
+    if ocr_failure:
+        raise ocr_failure[0]
+
+    for label in ("products", "accessories"):
+        if any(entry.get("label") == label for entry in prepared_entries):
+            progress_manager.update(session_id, detail=f"{label} OCR 完成")
+            progress_manager.increment_processed_files(session_id, 1)
+
+    return {
+        "prepared_entries": [prepared_entries[i] for i in order],
+        "errors": errors,
+        "reverse_warnings": reverse_warnings,
+        "reverse_logs": reverse_logs,
+        "original_warnings": original_warnings,
+        "original_logs": original_logs,
+    }
+
 
 def _append_uploads_to_session(
     session_record: dict,
@@ -875,6 +1185,8 @@ def _append_uploads_to_session(
         session_record["accessory_upload_count"] = session_record.get("accessory_upload_count", 0) + len(new_accessory_paths)
 
     save_session_record(session_record)
+    if new_product_paths or new_accessory_paths:
+        context_bundles.invalidate(session_id, "upload")
     _sync_uploaded_files_to_graph(session_record, label="products", paths=new_product_paths)
     _sync_uploaded_files_to_graph(session_record, label="accessories", paths=new_accessory_paths)
     return session_record
@@ -885,10 +1197,10 @@ async def append_manual_session_uploads(
     product_files: List[UploadFile],
     accessory_files: List[UploadFile],
 ) -> dict:
-    record = load_session_record(session_id)
+    record = await run_db(load_session_record, session_id)
     if not record:
         raise ValueError("Manual OCR session not found")
-    return _append_uploads_to_session(record, product_files, accessory_files)
+    return await run_db(_append_uploads_to_session, record, product_files, accessory_files)
 
 
 def delete_manual_session_upload(session_id: str, relative_path: str) -> dict:
@@ -1022,6 +1334,7 @@ def delete_manual_session_upload(session_id: str, relative_path: str) -> dict:
             delete_manual_contains_and_gc_document(folder_path=ocr_folder_path, doc_path=p)
 
     save_session_record(record)
+    context_bundles.invalidate(session_id, "delete_upload")
     return record
 
 
@@ -1079,8 +1392,8 @@ def _run_manual_session_sync(session_id: str) -> dict:
     output_dir = ocr_dir(session_id)
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    product_dir = base_dir / "products"
-    accessory_dir = base_dir / "accessories"
+    # OCR 输出即将改变，旧的上下文包作废
+    context_bundles.invalidate(session_id, "ocr_started")
 
     total_files = record.get("product_upload_count", 0) + record.get("accessory_upload_count", 0)
     progress_manager.start_session(
@@ -1089,31 +1402,9 @@ def _run_manual_session_sync(session_id: str) -> dict:
         total_files=total_files,
     )
 
-    prepared_entries: List[dict] = []
-    errors: List[str] = []
-
     with tempfile.TemporaryDirectory() as tmp_dir_str:
-        tmp_dir = Path(tmp_dir_str)
-        product_prepared, product_errors = prepare_images_for_directory("products", product_dir, tmp_dir / "products")
-        accessory_prepared, accessory_errors = prepare_images_for_directory(
-            "accessories",
-            accessory_dir,
-            tmp_dir / "accessories",
-        )
-        prepared_entries.extend(product_prepared)
-        prepared_entries.extend(accessory_prepared)
-        errors.extend(product_errors)
-        errors.extend(accessory_errors)
-
-        progress_manager.set_ocr_totals(session_id, len(prepared_entries))
-
         try:
-            run_ocr_for_directory(tmp_dir / "products", output_dir, session_id, "products")
-            if product_prepared:
-                progress_manager.increment_processed_files(session_id, 1)
-            run_ocr_for_directory(tmp_dir / "accessories", output_dir, session_id, "accessories")
-            if accessory_prepared:
-                progress_manager.increment_processed_files(session_id, 1)
+            outcome = _run_manual_pipeline(session_id, base_dir, Path(tmp_dir_str), output_dir)
         except Exception as exc:  # noqa: BLE001
             progress_manager.mark_complete(session_id, False, str(exc))
             record["status"] = "exception"
@@ -1121,24 +1412,19 @@ def _run_manual_session_sync(session_id: str) -> dict:
             save_session_record(record)
             raise
 
-        if MANUAL_OCR_AUTO_PROMPT_REVERSE:
-            try:
-                reverse_warnings, reverse_logs = run_prompt_reverse_for_entries(prepared_entries, output_dir)
-                if reverse_warnings:
-                    errors.extend([f"[提示词反推]{w}" for w in reverse_warnings])
-                if reverse_logs:
-                    record["prompt_reverse_logs"] = reverse_logs
-            except Exception as exc:  # noqa: BLE001
-                errors.append(f"[提示词反推] 执行失败：{exc}")
-
-            try:
-                ow, ol = _run_prompt_reverse_for_original_uploads(session_id)
-                if ow:
-                    errors.extend([f"[原图提示词反推]{w}" for w in ow])
-                if ol:
-                    record["prompt_reverse_original_logs"] = ol
-            except Exception as exc:  # noqa: BLE001
-                errors.append(f"[原图提示词反推] 执行失败：{exc}")
+    prepared_entries: List[dict] = outcome["prepared_entries"]
+    errors: List[str] = list(outcome["errors"])
+    if outcome["reverse_warnings"]:
+        errors.extend([f"[提示词反推]{w}" for w in outcome["reverse_warnings"]])
+    if outcome["reverse_logs"]:
+        record["prompt_reverse_logs"] = outcome["reverse_logs"]
+    if outcome["original_warnings"]:
+        errors.extend([f"[原图提示词反推]{w}" for w in outcome["original_warnings"]])
+    if outcome["original_logs"]:
+        record["prompt_reverse_original_logs"] = outcome["original_logs"]
+    state = progress_manager.get_state(session_id) or {}
+    if state.get("stages"):
+        record["stage_timings"] = state["stages"]
 
     product_groups = assemble_ocr_groups(output_dir, [entry for entry in prepared_entries if entry["label"] == "products"])
     accessory_groups = assemble_ocr_groups(output_dir, [entry for entry in prepared_entries if entry["label"] == "accessories"])
@@ -1152,12 +1438,23 @@ def _run_manual_session_sync(session_id: str) -> dict:
 
     save_session_record(record)
     _sync_ocr_outputs_to_graph(record)
+    _prebuild_context_bundle(session_id, record)
     progress_manager.mark_complete(session_id, True)
     return record
 
 
+def _prebuild_context_bundle(session_id: str, record: dict) -> None:
+    """Precompute the generation context bundle so later specsheet/manual runs skip file I/O."""
+    try:
+        from src.rag_specsheet import prebuild_context_bundle  # local import to avoid heavy deps at import-time
+
+        prebuild_context_bundle(session_id, record)
+    except Exception as exc:  # noqa: BLE001
+        print(f"[ContextBundle] Prebuild skipped for {session_id}: {exc}")
+
+
 async def run_manual_session(session_id: str) -> dict:
-    return await asyncio.to_thread(_run_manual_session_sync, session_id)
+    return await run_session(_run_manual_session_sync, session_id)
 
 
 def _run_prompt_reverse_only(session_id: str, user_prompt: str | None = None) -> dict:
@@ -1203,11 +1500,14 @@ def _run_prompt_reverse_only(session_id: str, user_prompt: str | None = None) ->
         record["warnings"].append(f"[原图提示词反推] 执行失败：{exc}")
 
     save_session_record(record)
+    # 反推提示词写入了新的 .txt，候选图片描述需要重建
+    context_bundles.invalidate(session_id, "prompt_reverse")
+    _prebuild_context_bundle(session_id, record)
     return record
 
 
 async def run_prompt_reverse_only(session_id: str, user_prompt: str | None = None) -> dict:
-    return await asyncio.to_thread(_run_prompt_reverse_only, session_id, user_prompt)
+    return await run_llm(_run_prompt_reverse_only, session_id, user_prompt)
 
 
 async def handle_manual_ocr(
@@ -1235,4 +1535,4 @@ async def handle_manual_ocr(
         record = _create_manual_session_entry_sync(product_name, bom_code, product_files, accessory_files, inferred_type)
         session_id = record["session_id"]
 
-    return await asyncio.to_thread(_run_manual_session_sync, session_id)
+    return await run_session(_run_manual_session_sync, session_id)
@@ -27,11 +27,50 @@ class ManualOcrProgressManager:
             "ocr_completed": 0,
             "ocr_total": 0,
             "result": None,
+            "stages": {},
             "updated_at": time.time(),
         }
         with self._lock:
             self._states[session_id] = state
 
+    def update_stage(
+        self,
+        session_id: str,
+        stage: str,
+        *,
+        status: str | None = None,
+        items: int = 0,
+        busy_ms: float = 0.0,
+    ) -> None:
+        """Accumulate per-stage timings (rasterize / ocr / prompt_reverse) for pipelined sessions."""
+        with self._lock:
+            state = self._states.get(session_id)
+            if not state:
+                return
+            now = time.time()
+            stage_state = state.setdefault("stages", {}).setdefault(
+                stage,
+                {
+                    "status": "pending",
+                    "items": 0,
+                    "busy_ms": 0.0,
+                    "started_at": None,
+                    "finished_at": None,
+                    "wall_ms": None,
+                },
+            )
+            if status == "running" and stage_state["started_at"] is None:
+                stage_state["started_at"] = now
+            if status:
+                stage_state["status"] = status
+            if status == "done":
+                stage_state["finished_at"] = now
+                if stage_state["started_at"] is not None:
+                    stage_state["wall_ms"] = round((now - stage_state["started_at"]) * 1000, 2)
+            stage_state["items"] += items
+            stage_state["busy_ms"] = round(stage_state["busy_ms"] + busy_ms, 2)
+            state["updated_at"] = now
+
     def update(self, session_id: str, **payload) -> None:
         with self._lock:
             state = self._states.get(session_id)
@@ -15,6 +15,9 @@ from litellm import completion, embedding
 from dotenv import load_dotenv
 from src.models_litellm import *
 from src.dataclass import LLMConfig, Neo4jConfig
+from src.embedding_cache import embedding_cache, embedding_cache_enabled
+from src.embedding_client import BatchEmbeddingClient, embedding_serial_mode_enabled
+from src.graph_version import bumps_graph_version
 
 # 加载 .env 文件
 load_dotenv()
@@ -956,7 +959,60 @@ def stable_chunk_id(file_path: str, chunk_index: int, text: str) -> str:
     return h.hexdigest()
 
 
-def embed_texts(texts: List[str], embedding_config: LLMConfig) -> List[List[float]]:
+def embed_texts(
+    texts: List[str],
+    embedding_config: LLMConfig,
+    serial: Optional[bool] = None,
+    use_cache: Optional[bool] = None,
+) -> List[List[float]]:
+    """
+    文本向量化，返回与输入顺序一致的向量列表。
+
+    先查 (embedding_model, sha256(text)) 向量缓存，只对未命中的去重文本发起请求。
+    默认走 BatchEmbeddingClient（批量请求 + 有界并发 + 重试）；
+    serial=True 或环境变量 EMBEDDING_SERIAL=1 时使用逐条请求的旧路径（便于基准对比）。
+    use_cache=False 或环境变量 EMBEDDING_CACHE=0 时跳过缓存。
+    """
+    if not texts:
+        return []
+    if serial is None:
+        serial = embedding_serial_mode_enabled()
+    if use_cache is None:
+        use_cache = embedding_cache_enabled()
+
+    model = embedding_config.model
+    cached: List[Optional[List[float]]] = [None] * len(texts)
+    if use_cache:
+        try:
+            cached = embedding_cache.get_many(model, texts)
+        except Exception as e:
+            print(f"Warning: Embedding cache lookup failed: {e}")
+            cached = [None] * len(texts)
+
+    missing = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+    fresh: Dict[str, List[float]] = {}
+    if missing:
+        if serial:
+            vectors = embed_texts_serial(missing, embedding_config)
+        else:
+            on_progress = None
+            if is_progress_enabled():
+                def on_progress(done: int, total: int) -> None:
+                    progress_bar(done, total, prefix=f"Embedding ({model})")
+
+            vectors = BatchEmbeddingClient(embedding_config).embed(missing, on_progress=on_progress)
+        fresh = dict(zip(missing, vectors))
+        if use_cache:
+            try:
+                embedding_cache.put_many(model, missing, vectors)
+            except Exception as e:
+                print(f"Warning: Embedding cache write failed: {e}")
+
+    return [v if v is not None else fresh[t] for t, v in zip(texts, cached)]
+
+
+def embed_texts_serial(texts: List[str], embedding_config: LLMConfig) -> List[List[float]]:
+    """逐条调用 litellm.embedding 的旧实现。"""
     res: List[List[float]] = []
     total = len(texts)
     
@@ -1131,6 +1187,104 @@ def create_unknown_node(session, file_path: str, file_type: str) -> None:
     )
 
 
+def _chunk_write_batch_size() -> int:
+    try:
+        return max(1, int(os.getenv("NEO4J_CHUNK_WRITE_BATCH_SIZE", "200")))
+    except Exception:
+        return 200
+
+
+def write_chunk_nodes_bulk(
+    session,
+    description_node_id: str,
+    description_label: str,
+    texts: List[str],
+    vectors: List[List[float]],
+    embedding_model: str,
+    source_path: str,
+    batch_size: Optional[int] = None,
+    replace: bool = False,
+    indices: Optional[List[int]] = None,
+    delete_ids: Optional[List[str]] = None,
+) -> int:
+    """
+    在单个写事务内用分批 `UNWIND $rows` 写入某个描述节点下的全部 Chunk。
+
+    Args:
+        session: Neo4j session
+        description_node_id: 描述节点的唯一标识符（用于匹配）
+        description_label: 描述节点的标签（TextDescription, ImageDescription, TableDescription）
+        texts: 文本块列表
+        vectors: 向量列表
+        embedding_model: 向量模型名称
+        source_path: 源文件路径（作为属性）
+        batch_size: 每条 UNWIND 语句携带的行数，默认取 NEO4J_CHUNK_WRITE_BATCH_SIZE（200）
+        replace: 为 True 时先删除该描述节点下已有的全部 Chunk（删除与重建在同一事务内）
+        indices: 每个文本块在文档中的序号（增量写入部分 Chunk 时使用），默认 0..n-1
+        delete_ids: 需要在同一事务内删除的 Chunk id 列表（增量刷新时使用）
+
+    Returns:
+        写入的 Chunk 数量
+    """
+    size = batch_size or _chunk_write_batch_size()
+    now = datetime.utcnow().isoformat()
+    if indices is None:
+        indices = list(range(len(texts)))
+    rows = [
+        {
+            "id": stable_chunk_id(source_path, idx, text),
+            "text": text,
+            "index": idx,
+            "embedding": vec,
+        }
+        for idx, text, vec in zip(indices, texts, vectors)
+    ]
+
+    def _work(tx) -> None:
+        if replace:
+            tx.run(
+                f"""
+                MATCH (desc:{description_label} {{id: $desc_id}})-[:HAS_CHUNK]->(c:Chunk)
+                DETACH DELETE c
+                """,
+                {"desc_id": description_node_id},
+            ).consume()
+        if delete_ids:
+            tx.run(
+                """
+                UNWIND $ids AS cid
+                MATCH (c:Chunk {id: cid})
+                DETACH DELETE c
+                """,
+                {"ids": list(delete_ids)},
+            ).consume()
+        for start in range(0, len(rows), size):
+            tx.run(
+                f"""
+                MATCH (desc:{description_label} {{id: $desc_id}})
+                UNWIND $rows AS row
+                MERGE (c:Chunk {{id: row.id}})
+                ON CREATE SET c.created_at = datetime($now)
+                ON MATCH SET  c.updated_at = datetime($now)
+                SET c.text = row.text, c.index = row.index,
+                    c.embedding = row.embedding, c.embedding_model = $embedding_model,
+                    c.source_path = $source_path
+                MERGE (desc)-[:HAS_CHUNK]->(c)
+                """,
+                {
+                    "desc_id": description_node_id,
+                    "rows": rows[start : start + size],
+                    "embedding_model": embedding_model,
+                    "source_path": source_path,
+                    "now": now,
+                },
+            ).consume()
+
+    if rows or replace or delete_ids:
+        session.execute_write(_work)
+    return len(rows)
+
+
 def create_chunk_nodes(
     session,
     description_node_id: str,
@@ -1138,7 +1292,8 @@ def create_chunk_nodes(
     texts: List[str],
     vectors: List[List[float]],
     embedding_model: str,
-    source_path: str
+    source_path: str,
+    batch_size: Optional[int] = None,
 ) -> None:
     """
     批量创建 Chunk 节点，关联到描述节点。
@@ -1151,36 +1306,18 @@ def create_chunk_nodes(
         vectors: 向量列表
         embedding_model: 向量模型名称
         source_path: 源文件路径（作为属性）
+        batch_size: 每条 UNWIND 语句携带的行数（可选）
     """
-    for idx, (text, vec) in enumerate(zip(texts, vectors)):
-        cid = stable_chunk_id(source_path, idx, text)
-        now = datetime.utcnow().isoformat()
-        session.run(
-            f"""
-            MATCH (desc:{description_label} {{id: $desc_id}})
-            MERGE (c:Chunk {{id: $id}})
-            ON CREATE SET c.text = $text, c.index = $index,
-                          c.embedding = $embedding, c.embedding_model = $embedding_model,
-                          c.source_path = $source_path,
-                          c.created_at = datetime($now)
-            ON MATCH SET  c.text = $text, c.index = $index,
-                          c.embedding = $embedding, c.embedding_model = $embedding_model,
-                          c.source_path = $source_path,
-                          c.updated_at = datetime($now)
-            WITH c, desc
-            MERGE (desc)-[:HAS_CHUNK]->(c)
-            """,
-            {
-                "id": cid,
-                "desc_id": description_node_id,
-                "text": text,
-                "index": idx,
-                "embedding": vec,
-                "embedding_model": embedding_model,
-                "source_path": source_path,
-                "now": now,
-            }
-        )
+    write_chunk_nodes_bulk(
+        session,
+        description_node_id,
+        description_label,
+        texts,
+        vectors,
+        embedding_model,
+        source_path,
+        batch_size=batch_size,
+    )
 
 
 def create_image_node(
@@ -1426,6 +1563,7 @@ def create_document_node(
                     )
 
 
+@bumps_graph_version
 def insert_file_into_neo4j(
     file_path: str,
     output_dir: str,
@@ -1700,6 +1838,7 @@ def insert_file_into_neo4j(
     return result
 
 
+@bumps_graph_version
 def batch_insert_files_into_neo4j(
     folder_path: str,
     output_dir: str,
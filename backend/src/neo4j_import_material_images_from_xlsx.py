@@ -19,6 +19,7 @@ if str(BACKEND_ROOT) not in sys.path:
     sys.path.insert(0, str(BACKEND_ROOT))
 
 from src.dataclass import Neo4jConfig
+from src.graph_version import bumps_graph_version
 from src.neo4j_file_add_neo4j import get_neo4j_driver
 
 
@@ -855,6 +856,7 @@ def _build_mappings(
     return mappings
 
 
+@bumps_graph_version
 def main() -> None:
     load_dotenv()
 
@@ -8,6 +8,14 @@ from typing import Any, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 from neo4j import GraphDatabase
 
+# Ensure backend root (the parent of 'src') is on sys.path so this script can be
+# executed from either repo root or backend/.
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+from src.graph_version import bumps_graph_version
+
 load_dotenv()
 
 
@@ -109,6 +117,7 @@ def _ensure_constraints(session) -> None:
         session.run(stmt)
 
 
+@bumps_graph_version
 def import_products_json(
     input_json_path: str,
     *,
@@ -0,0 +1,307 @@
+"""
+Process-wide pooled Neo4j driver.
+
+`get_neo4j_driver()` opens a brand-new driver (TCP + Bolt handshake + auth)
+every time it is called. Query helpers used by the API instead borrow sessions
+from a single long-lived driver managed here; the FastAPI app starts and stops
+it, and CLI scripts get it lazily on first use.
+"""
+from __future__ import annotations
+
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from neo4j import GraphDatabase
+
+from src.dataclass import Neo4jConfig
+from src.env import env_float, env_int
+
+
+def _config_key(neo4j_config: Neo4jConfig) -> Tuple[str, str]:
+    return (str(neo4j_config.uri or ""), str(neo4j_config.user or ""))
+
+
+def _return_lease(pool: "Neo4jDriverPool", session: Any, lease_started: float, leaked: bool) -> None:
+    try:
+        session.close()
+    except Exception as exc:  # noqa: BLE001
+        if leaked:
+            print(f"[Neo4jPool] Failed to close leaked session: {exc}")
+        else:
+            raise
+    finally:
+        pool._release(lease_started, leaked=leaked)
+
+
+class _PooledSession:
+    """Session proxy that returns its lease to the pool when closed.
+
+    A session that is garbage-collected without `close()` still gives its lease
+    back (through a finalizer) and is counted as leaked in the pool metrics.
+    """
+
+    def __init__(self, pool: "Neo4jDriverPool", session: Any, lease_started: float) -> None:
+        self._session = session
+        self._on_close: Optional[Callable[["_PooledSession"], None]] = None
+        # The finalizer must not reference self, or the proxy would never be collected.
+        self._finalizer = weakref.finalize(self, _return_lease, pool, session, lease_started, True)
+        self._finalizer.atexit = False
+
+    def close(self) -> None:
+        info = self._finalizer.detach()
+        if info is None:
+            return
+        pool, session, lease_started, _leaked = info[2]
+        try:
+            _return_lease(pool, session, lease_started, False)
+        finally:
+            if self._on_close is not None:
+                self._on_close(self)
+
+    @property
+    def closed(self) -> bool:
+        return not self._finalizer.alive
+
+    def __enter__(self) -> "_PooledSession":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._session, name)
+
+
+class PooledDriver:
+    """Drop-in replacement for the object returned by `get_neo4j_driver()`.
+
+    `session()` borrows a session from the shared driver. `close()` only gives
+    back sessions this handle still holds; the shared driver stays open. Open
+    sessions are tracked weakly and dropped as soon as they are closed.
+    """
+
+    def __init__(self, pool: "Neo4jDriverPool", neo4j_config: Optional[Neo4jConfig]) -> None:
+        self._pool = pool
+        self._config = neo4j_config
+        self._sessions: "weakref.WeakSet[_PooledSession]" = weakref.WeakSet()
+
+    def session(self, **kwargs: Any) -> _PooledSession:
+        sess = self._pool.session(self._config, **kwargs)
+        sess._on_close = self._sessions.discard
+        self._sessions.add(sess)
+        return sess
+
+    def close(self) -> None:
+        for sess in list(self._sessions):
+            try:
+                sess.close()
+            except Exception:
+                pass
+        self._sessions.clear()
+
+
+class Neo4jDriverPool:
+    """Lifecycle-managed singleton driver with lease accounting.
+
+    Pool size, acquisition timeout and connection lifetime come from env vars:
+      - NEO4J_MAX_CONNECTION_POOL_SIZE (default 50)
+      - NEO4J_CONNECTION_ACQUISITION_TIMEOUT_SECONDS (default 60)
+      - NEO4J_MAX_CONNECTION_LIFETIME_SECONDS (default 3600)
+      - NEO4J_CONNECTION_TIMEOUT_SECONDS (default 15, same as get_neo4j_driver)
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._drivers: Dict[Tuple[str, str], Any] = {}
+        self._default_config: Optional[Neo4jConfig] = None
+        self._max_pool_size = 0
+        self._acquisition_timeout = 0.0
+        self._leases: Optional[threading.BoundedSemaphore] = None
+        self._reset_metrics()
+
+    def _reset_metrics(self) -> None:
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._acquisitions = 0
+        self._acquisition_timeouts = 0
+        self._wait_total_s = 0.0
+        self._wait_max_s = 0.0
+        self._lease_total_s = 0.0
+        self._drivers_created = 0
+        self._drivers_closed = 0
+        self._sessions_opened = 0
+        self._sessions_closed = 0
+        self._sessions_leaked = 0
+
+    # ------------------------------------------------------------------
+    # lifecycle
+    # ------------------------------------------------------------------
+    def start(self, neo4j_config: Optional[Neo4jConfig] = None) -> None:
+        """Create the shared driver. Safe to call more than once."""
+
+        if neo4j_config is None:
+            from src.api_queries import get_neo4j_config
+
+            neo4j_config = get_neo4j_config()
+        with self._lock:
+            self._default_config = neo4j_config
+            self._ensure_settings_locked()
+            self._get_or_create_driver_locked(neo4j_config)
+
+    def stop(self) -> None:
+        """Close every shared driver (called on application shutdown)."""
+
+        with self._lock:
+            drivers = list(self._drivers.values())
+            self._drivers = {}
+            self._default_config = None
+        for drv in drivers:
+            try:
+                drv.close()
+            except Exception as exc:  # noqa: BLE001
+                print(f"[Neo4jPool] Failed to close driver: {exc}")
+            with self._lock:
+                self._drivers_closed += 1
+
+    @property
+    def started(self) -> bool:
+        with self._lock:
+            return bool(self._drivers)
+
+    def _ensure_settings_locked(self) -> None:
+        if self._leases is not None:
+            return
+        self._max_pool_size = max(1, env_int("NEO4J_MAX_CONNECTION_POOL_SIZE", 50))
+        self._acquisition_timeout = max(0.0, env_float("NEO4J_CONNECTION_ACQUISITION_TIMEOUT_SECONDS", 60.0))
+        self._leases = threading.BoundedSemaphore(self._max_pool_size)
+
+    def _get_or_create_driver_locked(self, neo4j_config: Neo4jConfig) -> Any:
+        key = _config_key(neo4j_config)
+        drv = self._drivers.get(key)
+        if drv is not None:
+            return drv
+        drv = GraphDatabase.driver(
+            neo4j_config.uri,
+            auth=(neo4j_config.user, neo4j_config.password),
+            connection_timeout=env_int("NEO4J_CONNECTION_TIMEOUT_SECONDS", 15),
+            max_connection_pool_size=self._max_pool_size,
+            connection_acquisition_timeout=self._acquisition_timeout or 60.0,
+            max_connection_lifetime=env_int("NEO4J_MAX_CONNECTION_LIFETIME_SECONDS", 3600),
+        )
+        self._drivers[key] = drv
+        self._drivers_created += 1
+        return drv
+
+    def get_driver(self, neo4j_config: Optional[Neo4jConfig] = None) -> Any:
+        """Return the shared driver, creating it lazily if needed."""
+
+        with self._lock:
+            cfg = neo4j_config or self._default_config
+        if cfg is None:
+            from src.api_queries import get_neo4j_config
+
+            cfg = get_neo4j_config()
+        with self._lock:
+            self._ensure_settings_locked()
+            return self._get_or_create_driver_locked(cfg)
+
+    # ------------------------------------------------------------------
+    # leases
+    # ------------------------------------------------------------------
+    def session(self, neo4j_config: Optional[Neo4jConfig] = None, **kwargs: Any) -> _PooledSession:
+        """Borrow a session; closing it (or leaving the `with`) returns the lease."""
+
+        drv = self.get_driver(neo4j_config)
+        leases = self._leases
+        assert leases is not None
+
+        started = time.perf_counter()
+        timeout = self._acquisition_timeout if self._acquisition_timeout > 0 else None
+        if not leases.acquire(timeout=timeout):
+            with self._lock:
+                self._acquisition_timeouts += 1
+            raise TimeoutError(
+                f"Neo4j 连接池获取超时（{self._acquisition_timeout:.0f}s，pool size={self._max_pool_size}）"
+            )
+        waited = time.perf_counter() - started
+
+        try:
+            raw = drv.session(**kwargs)
+        except Exception:
+            leases.release()
+            raise
+
+        now = time.perf_counter()
+        with self._lock:
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+            self._acquisitions += 1
+            self._wait_total_s += waited
+            self._wait_max_s = max(self._wait_max_s, waited)
+            self._sessions_opened += 1
+        return _PooledSession(self, raw, now)
+
+    def _release(self, lease_started: float, leaked: bool = False) -> None:
+        held = time.perf_counter() - lease_started
+        with self._lock:
+            self._in_use = max(0, self._in_use - 1)
+            self._sessions_closed += 1
+            self._lease_total_s += held
+            if leaked:
+                self._sessions_leaked += 1
+        if self._leases is not None:
+            try:
+                self._leases.release()
+            except ValueError:
+                pass
+
+    # ------------------------------------------------------------------
+    # metrics
+    # ------------------------------------------------------------------
+    def _open_connections_locked(self) -> Optional[int]:
+        # Best effort: the driver does not expose pool stats publicly.
+        total = 0
+        found = False
+        for drv in self._drivers.values():
+            try:
+                conns = drv._pool.connections  # type: ignore[attr-defined]
+                total += sum(len(v) for v in conns.values())
+                found = True
+            except Exception:
+                continue
+        return total if found else None
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            acq = self._acquisitions
+            closed = self._sessions_closed
+            return {
+                "started": bool(self._drivers),
+                "max_pool_size": self._max_pool_size,
+                "in_use": self._in_use,
+                "peak_in_use": self._peak_in_use,
+                "acquisitions": acq,
+                "acquisition_timeouts": self._acquisition_timeouts,
+                "acquisition_wait_ms_avg": round((self._wait_total_s / acq) * 1000, 3) if acq else 0.0,
+                "acquisition_wait_ms_max": round(self._wait_max_s * 1000, 3),
+                "lease_ms_avg": round((self._lease_total_s / closed) * 1000, 3) if closed else 0.0,
+                "open_connections": self._open_connections_locked(),
+                "churn": {
+                    "drivers_created": self._drivers_created,
+                    "drivers_closed": self._drivers_closed,
+                    "sessions_opened": self._sessions_opened,
+                    "sessions_closed": closed,
+                    "sessions_leaked": self._sessions_leaked,
+                },
+            }
+
+
+neo4j_pool = Neo4jDriverPool()
+
+
+def get_pooled_driver(neo4j_config: Optional[Neo4jConfig] = None) -> PooledDriver:
+    """Borrow the shared driver; a drop-in for `get_neo4j_driver()` in request paths."""
+
+    return PooledDriver(neo4j_pool, neo4j_config)
@@ -0,0 +1,462 @@
+"""
+Long-lived OCR worker process.
+
+`run_ocr` used to load DeepSeek-OCR lazily inside whichever request thread got
+there first and swap `sys.stdout` around every `model.infer` call. The worker
+owns the model in a dedicated process instead: manual sessions submit page
+images to one shared job queue, the process drains it in micro-batches and
+streams per-image events back. Concurrent sessions therefore share a single
+loaded model, and stdout capture never touches the API process.
+
+Env knobs (all optional):
+  - OCR_WORKER                    "0" to run OCR in-process via run_ocr (default enabled)
+  - OCR_WORKER_BACKEND            "deepseek" (default) or "stub" (CPU stub, no model)
+  - OCR_WORKER_BATCH_SIZE         images per micro-batch (default 4)
+  - OCR_WORKER_BATCH_WAIT_MS      how long to wait for a batch to fill (default 20)
+  - OCR_WORKER_STUB_LATENCY_MS    per-image sleep of the stub backend (default 0)
+  - OCR_WORKER_PRELOAD            "1" to start the worker (and load the model) at API startup
+"""
+from __future__ import annotations
+
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from src.env import env_flag, env_int
+from src.run_deepseekocr import IMG_EXTS, iter_images
+
+
+def ocr_worker_enabled() -> bool:
+    return env_flag("OCR_WORKER", "1")
+
+
+def ocr_worker_preload_enabled() -> bool:
+    return env_flag("OCR_WORKER_PRELOAD", "0")
+
+
+# ---------------------------------------------------------------------------
+# Backends (run inside the worker process)
+# ---------------------------------------------------------------------------
+
+
+class StubOcrBackend:
+    """CPU stand-in for DeepSeek-OCR: writes a predictable markdown file per image."""
+
+    def __init__(self, latency_ms: Optional[int] = None) -> None:
+        ms = latency_ms if latency_ms is not None else env_int("OCR_WORKER_STUB_LATENCY_MS", 0)
+        self.latency_s = max(0, ms) / 1000.0
+
+    def infer_batch(self, tasks: List[dict]) -> List[Optional[str]]:
+        errors: List[Optional[str]] = []
+        for task in tasks:
+            try:
+                if self.latency_s:
+                    time.sleep(self.latency_s)
+                img_path = Path(task["image_path"])
+                if not img_path.exists():
+                    raise FileNotFoundError(f"Image not found: {img_path}")
+                target_dir = Path(task["target_dir"])
+                target_dir.mkdir(parents=True, exist_ok=True)
+                (target_dir / f"{img_path.stem}.stdout.md").write_text(
+                    f"# {img_path.stem}\n\nstub OCR output for {img_path.name}\n",
+                    encoding="utf-8",
+                )
+                errors.append(None)
+            except Exception as exc:  # noqa: BLE001
+                errors.append(str(exc))
+        return errors
+
+
+class DeepSeekOcrBackend:
+    """DeepSeek-OCR loaded once for the lifetime of the worker process."""
+
+    def __init__(self) -> None:
+        from src.run_deepseekocr import _ensure_model
+
+        self._tokenizer, self._model = _ensure_model()
+
+    def infer_batch(self, tasks: List[dict]) -> List[Optional[str]]:
+        import torch
+
+        from src.run_deepseekocr import infer_image
+
+        # DeepSeek-OCR's remote code only exposes single-image `infer`, so a
+        # micro-batch runs back to back under one inference_mode context.
+        errors: List[Optional[str]] = []
+        with torch.inference_mode():
+            for task in tasks:
+                img_path = Path(task["image_path"])
+                print(f"▶ Processing: {img_path}")
+                try:
+                    infer_image(
+                        self._tokenizer,
+                        self._model,
+                        img_path,
+                        Path(task["target_dir"]),
+                        **(task.get("options") or {}),
+                    )
+                except Exception as exc:  # noqa: BLE001
+                    print(f"⚠️ Failed on {img_path}: {exc}")
+                    errors.append(str(exc))
+                else:
+                    errors.append(None)
+        return errors
+
+
+def _load_backend(name: str):
+    if name == "stub":
+        return StubOcrBackend()
+    if name == "deepseek":
+        return DeepSeekOcrBackend()
+    raise ValueError(f"Unknown OCR backend: {name}")
+
+
+def _worker_main(task_q, event_q, backend_name: str, batch_size: int, batch_wait_s: float) -> None:
+    """Worker process entry point: load the backend once, then drain the queue in batches."""
+
+    try:
+        backend = _load_backend(backend_name)
+    except Exception as exc:  # noqa: BLE001
+        event_q.put(("fatal", None, f"OCR backend '{backend_name}' failed to load: {exc}"))
+        return
+    event_q.put(("ready", None, backend_name))
+
+    stopping = False
+    while not stopping:
+        task = task_q.get()
+        if task is None:
+            break
+        batch = [task]
+        deadline = time.monotonic() + batch_wait_s
+        while len(batch) < batch_size:
+            try:
+                nxt = task_q.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if nxt is None:
+                stopping = True
+                break
+            batch.append(nxt)
+
+        for item in batch:
+            event_q.put(("before", item["task_id"], None))
+        started = time.perf_counter()
+        try:
+            errors = backend.infer_batch(batch)
+        except Exception as exc:  # noqa: BLE001
+            errors = [str(exc)] * len(batch)
+        batch_ms = round((time.perf_counter() - started) * 1000, 2)
+        for item, error in zip(batch, errors):
+            event_q.put(("after", item["task_id"], {"error": error, "batch_size": len(batch), "batch_ms": batch_ms}))
+
+    event_q.put(("stopped", None, None))
+
+
+# ---------------------------------------------------------------------------
+# Client (runs in the API process)
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class _PendingTask:
+    future: Future
+    image_path: str
+    target_dir: str
+    callback: Optional[Callable[[dict], None]] = None
+    index: int = 0
+    total: int = 0
+    submitted_at: float = field(default_factory=time.perf_counter)
+
+
+class OcrWorkerClient:
+    """Submit page images to the shared OCR worker process and await per-image results."""
+
+    def __init__(
+        self,
+        backend: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        batch_wait_ms: Optional[int] = None,
+    ) -> None:
+        self._backend = backend
+        self._batch_size = batch_size
+        self._batch_wait_ms = batch_wait_ms
+        self._lock = threading.Lock()
+        self._process = None
+        self._task_q = None
+        self._pending: Dict[int, _PendingTask] = {}
+        self._ids = itertools.count(1)
+        self._ready = False
+        self._last_error: Optional[str] = None
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._batches = 0
+        self._batched_images = 0
+        self._queue_wait_ms_total = 0.0
+        self._restarts = 0
+
+    @property
+    def backend(self) -> str:
+        return (self._backend or os.getenv("OCR_WORKER_BACKEND", "deepseek") or "deepseek").strip().lower()
+
+    @property
+    def batch_size(self) -> int:
+        return max(1, self._batch_size or env_int("OCR_WORKER_BATCH_SIZE", 4))
+
+    @property
+    def batch_wait_ms(self) -> int:
+        return max(0, self._batch_wait_ms if self._batch_wait_ms is not None else env_int("OCR_WORKER_BATCH_WAIT_MS", 20))
+
+    def start(self) -> None:
+        with self._lock:
+            self._start_locked()
+
+    def _start_locked(self) -> None:
+        if self._process is not None and self._process.is_alive():
+            return
+        if self._process is not None:
+            self._restarts += 1
+        # spawn: CUDA cannot be re-initialised in a forked child.
+        ctx = mp.get_context("spawn")
+        task_q = ctx.Queue()
+        event_q = ctx.Queue()
+        process = ctx.Process(
+            target=_worker_main,
+            args=(task_q, event_q, self.backend, self.batch_size, self.batch_wait_ms / 1000.0),
+            name="ocr-worker",
+            daemon=True,
+        )
+        process.start()
+        pending: Dict[int, _PendingTask] = {}
+        self._process = process
+        self._task_q = task_q
+        self._pending = pending
+        self._ready = False
+        threading.Thread(
+            target=self._dispatch_loop,
+            args=(process, event_q, pending),
+            name="ocr-worker-dispatch",
+            daemon=True,
+        ).start()
+        print(f"[OcrWorker] started pid={process.pid} backend={self.backend} batch_size={self.batch_size}")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        with self._lock:
+            process, task_q = self._process, self._task_q
+            self._process = None
+            self._task_q = None
+        if process is None:
+            return
+        try:
+            task_q.put(None)
+        except Exception:
+            pass
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join(1.0)
+
+    def submit(
+        self,
+        image_path: str | os.PathLike,
+        target_dir: str | os.PathLike,
+        *,
+        options: Optional[Dict[str, Any]] = None,
+        callback: Optional[Callable[[dict], None]] = None,
+        index: int = 0,
+        total: int = 0,
+    ) -> Future:
+        """Queue one image; the future resolves to ``{"status", "error", ...}`` once it is OCR'd."""
+
+        future: Future = Future()
+        with self._lock:
+            self._start_locked()
+            task_id = next(self._ids)
+            self._pending[task_id] = _PendingTask(
+                future=future,
+                image_path=str(image_path),
+                target_dir=str(target_dir),
+                callback=callback,
+                index=index,
+                total=total,
+            )
+            self._submitted += 1
+            self._task_q.put(
+                {
+                    "task_id": task_id,
+                    "image_path": str(image_path),
+                    "target_dir": str(target_dir),
+                    "options": dict(options or {}),
+                }
+            )
+        return future
+
+    def run_directory(
+        self,
+        input_dir: str | os.PathLike,
+        output_dir: str | os.PathLike,
+        *,
+        allowed_exts: Iterable[str] | None = None,
+        progress_callback: Optional[Callable[[dict], None]] = None,
+        options: Optional[Dict[str, Any]] = None,
+    ) -> dict:
+        """Drop-in for ``run_ocr``: same output layout and progress events, executed by the worker."""
+
+        input_dir = Path(input_dir).expanduser().resolve()
+        output_dir = Path(output_dir).expanduser().resolve()
+        if not input_dir.exists():
+            raise FileNotFoundError(f"Input directory not found: {input_dir}")
+
+        images = list(iter_images(input_dir, set(allowed_exts or IMG_EXTS)))
+        total = len(images)
+        if progress_callback:
+            progress_callback({"event": "start", "total": total, "input_dir": str(input_dir)})
+
+        futures = []
+        for idx, img_path in enumerate(images, start=1):
+            target_dir = output_dir / img_path.parent.relative_to(input_dir) / img_path.stem
+            futures.append(
+                self.submit(
+                    img_path,
+                    target_dir,
+                    options=options,
+                    callback=progress_callback,
+                    index=idx,
+                    total=total,
+                )
+            )
+
+        errors: List[str] = []
+        for img_path, fut in zip(images, futures):
+            result = fut.result()
+            if result.get("status") != "success":
+                errors.append(f"{img_path.name}: {result.get('error')}")
+
+        if progress_callback:
+            progress_callback({"event": "complete", "total": total, "input_dir": str(input_dir)})
+        return {"total": total, "succeeded": total - len(errors), "failed": len(errors), "errors": errors}
+
+    @staticmethod
+    def _emit(task: _PendingTask, event: dict) -> None:
+        if not task.callback:
+            return
+        try:
+            task.callback(event)
+        except Exception as exc:  # noqa: BLE001
+            print(f"[OcrWorker] progress callback failed: {exc}")
+
+    def _fail_all(self, pending: Dict[int, _PendingTask], message: str) -> None:
+        with self._lock:
+            tasks = list(pending.values())
+            pending.clear()
+            self._failed += len(tasks)
+        for task in tasks:
+            if not task.future.done():
+                task.future.set_exception(RuntimeError(message))
+
+    def _dispatch_loop(self, process, event_q, pending: Dict[int, _PendingTask]) -> None:
+        while True:
+            try:
+                kind, task_id, payload = event_q.get(timeout=0.5)
+            except queue.Empty:
+                if not process.is_alive():
+                    self._fail_all(pending, f"OCR worker exited (exitcode={process.exitcode})")
+                    return
+                continue
+
+            if kind == "ready":
+                with self._lock:
+                    self._ready = True
+                print(f"[OcrWorker] backend ready: {payload}")
+            elif kind == "fatal":
+                with self._lock:
+                    self._last_error = payload
+                print(f"[OcrWorker] {payload}")
+                self._fail_all(pending, payload)
+                return
+            elif kind == "stopped":
+                self._fail_all(pending, "OCR worker stopped")
+                return
+            elif kind == "before":
+                with self._lock:
+                    task = pending.get(task_id)
+                if task is not None:
+                    self._emit(
+                        task,
+                        {
+                            "event": "before_image",
+                            "index": task.index,
+                            "total": task.total,
+                            "image_path": task.image_path,
+                            "target_dir": task.target_dir,
+                        },
+                    )
+            elif kind == "after":
+                with self._lock:
+                    task = pending.pop(task_id, None)
+                    if task is None:
+                        continue
+                    error = (payload or {}).get("error")
+                    if error:
+                        self._failed += 1
+                        self._last_error = error
+                    else:
+                        self._completed += 1
+                    batch_size = int((payload or {}).get("batch_size") or 1)
+                    # Every image of a batch reports the batch size; count the batch once per image share.
+                    self._batches += 1.0 / batch_size
+                    self._batched_images += 1
+                    self._queue_wait_ms_total += (time.perf_counter() - task.submitted_at) * 1000
+                event = {
+                    "event": "after_image",
+                    "index": task.index,
+                    "total": task.total,
+                    "image_path": task.image_path,
+                    "status": "error" if error else "success",
+                }
+                if error:
+                    event["error"] = error
+                self._emit(task, event)
+                task.future.set_result(
+                    {
+                        "status": event["status"],
+                        "error": error,
+                        "image_path": task.image_path,
+                        "target_dir": task.target_dir,
+                        "batch_size": batch_size,
+                        "batch_ms": (payload or {}).get("batch_ms"),
+                    }
+                )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            process = self._process
+            done = self._batched_images
+            return {
+                "enabled": ocr_worker_enabled(),
+                "backend": self.backend,
+                "alive": bool(process is not None and process.is_alive()),
+                "pid": process.pid if process is not None else None,
+                "ready": self._ready,
+                "batch_size": self.batch_size,
+                "batch_wait_ms": self.batch_wait_ms,
+                "queued": len(self._pending),
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "batches": int(round(self._batches)),
+                "avg_batch_size": round(done / self._batches, 2) if self._batches else 0.0,
+                "avg_turnaround_ms": round(self._queue_wait_ms_total / done, 2) if done else 0.0,
+                "restarts": self._restarts,
+                "last_error": self._last_error,
+            }
+
+
+ocr_worker = OcrWorkerClient()
@@ -9,9 +9,10 @@ from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 from fastapi import HTTPException
-from litellm import completion
 
 from src.api_queries import BACKEND_ROOT
+from src.executors import run_db, run_llm
+from src.llm_gateway import llm_gateway, request_fingerprint
 from src.rag_bom import decode_bom_code
 from src.rag_specsheet import _get_product_config_and_accessory_glossary
 
@@ -527,9 +528,24 @@ def _dashscope_native_vl_call(
         method="POST",
     )
 
-    try:
+    def _send() -> Dict[str, Any]:
         with urllib.request.urlopen(req, timeout=120) as resp:  # noqa: S310
             body = resp.read().decode("utf-8", errors="replace")
+        try:
+            return json.loads(body)
+        except Exception:  # noqa: BLE001
+            raise ValueError(body[:500]) from None
+
+    try:
+        # Parsed inside the gateway call so its token metrics see the response `usage`.
+        return llm_gateway.call(
+            _send,
+            provider="dashscope",
+            key=request_fingerprint({"kind": "dashscope_native_vl", **payload}),
+            timeout=135,
+            tag="poster.native_vl",
+            cacheable=temperature == 0,
+        )
     except urllib.error.HTTPError as e:  # noqa: BLE001
         body = ""
         try:
@@ -537,14 +553,11 @@ def _dashscope_native_vl_call(
         except Exception:
             pass
         raise RuntimeError(f"DashScope native HTTPError {e.code}: {body[:500]}") from e
+    except ValueError as e:
+        raise RuntimeError(f"DashScope native response is not JSON: {e}") from e
     except Exception as e:  # noqa: BLE001
         raise RuntimeError(f"DashScope native request failed: {e}") from e
 
-    try:
-        return json.loads(body)
-    except Exception as e:  # noqa: BLE001
-        raise RuntimeError(f"DashScope native response is not JSON: {body[:500]}") from e
-
 
 def _dashscope_native_extract_text(resp_json: Dict[str, Any]) -> str:
     """Extract assistant text from DashScope native response."""
@@ -621,7 +634,7 @@ async def analyze_reference(
 
     api_base = os.getenv("DASHSCOPE_BASE_URL") or "https://dashscope.aliyuncs.com/compatible-mode/v1"
 
-    resolved = resolve_image_url_to_data_url(image_url)
+    resolved = await run_llm(resolve_image_url_to_data_url, image_url)
     data_url = resolved if isinstance(resolved, str) and resolved.startswith("data:") else None
     content_url = None if data_url else resolved
 
@@ -669,7 +682,8 @@ async def analyze_reference(
 
     # 1) Prefer DashScope native multimodal endpoint to reduce "image dropped" issues.
     try:
-        native_json = _dashscope_native_vl_call(
+        native_json = await run_llm(
+            _dashscope_native_vl_call,
             api_key=api_key,
             model=vision_model,
             image_url_value=image_for_model,
@@ -699,7 +713,7 @@ async def analyze_reference(
 
     # 2) Fallback to compatible-mode via litellm.
     try:
-        resp = completion(**kwargs)
+        resp = await run_llm(llm_gateway.complete, kwargs, tag="poster.analyze")
         raw = (resp.choices[0].message.content or "").strip()
     except Exception as exc:  # noqa: BLE001
         raw = ""
@@ -727,7 +741,9 @@ async def analyze_reference(
             debug_parse = {**debug, "parse_error": str(parse_exc), "fallback": "litellm"}
             if _looks_like_no_image_reply(raw):
                 try:
-                    fb_raw = _dashscope_openai_fallback(image_for_model, resolved_prompt, api_key, api_base, vision_model)
+                    fb_raw = await run_llm(
+                        _dashscope_openai_fallback, image_for_model, resolved_prompt, api_key, api_base, vision_model
+                    )
                     debug_fb = {**debug_parse, "fallback": "openai_sdk"}
                     try:
                         fb_validated = _try_parse(fb_raw)
@@ -889,7 +905,8 @@ async def generate_copy(
     glossary_text = ""
     if (product_name or "").strip() and (bom_code or "").strip():
         try:
-            cfg_text, glossary_text = _get_product_config_and_accessory_glossary(
+            cfg_text, glossary_text = await run_db(
+                _get_product_config_and_accessory_glossary,
                 (product_name or "").strip(),
                 (bom_code or "").strip(),
             )
@@ -900,7 +917,7 @@ async def generate_copy(
     bom_context_text = ""
     if (bom_code or "").strip():
         try:
-            decoded = decode_bom_code((bom_code or "").strip(), bom_type=(bom_type or None))
+            decoded = await run_db(decode_bom_code, (bom_code or "").strip(), bom_type=(bom_type or None))
             bom_context_text = (decoded or {}).get("context_text") or ""
         except Exception:
             bom_context_text = ""
@@ -949,7 +966,7 @@ async def generate_copy(
     }
 
     try:
-        resp = completion(**kwargs)
+        resp = await run_llm(llm_gateway.complete, kwargs, tag="poster.copy")
         raw = (resp.choices[0].message.content or "").strip()
     except Exception as exc:  # noqa: BLE001
         raise HTTPException(status_code=500, detail=f"Step2 生成失败: {exc}") from exc
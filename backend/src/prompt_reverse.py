@@ -3,16 +3,24 @@
 from __future__ import annotations
 
 import base64
+import hashlib
 import json
 import mimetypes
 import os
 import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Iterable, List, Tuple
+from typing import Iterable, Iterator, List, Tuple
 
 from openai import OpenAI
 
+from src.env import env_float, env_int
+
 DASHSCOPE_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 DEFAULT_MODEL = "qwen3-vl-plus-2025-12-19"
 DEFAULT_USER_PROMPT = (
@@ -68,11 +76,107 @@ def _normalize_reverse_prompt(text: str, *, max_chars: int = MAX_REVERSE_PROMPT_
     return content
 
 
+# Executor knobs: in-flight VL calls across all sessions, token bucket (requests/s
+# + burst), retries with exponential backoff, and the content-hash cache.
+PROMPT_REVERSE_CONCURRENCY = max(1, env_int("PROMPT_REVERSE_CONCURRENCY", 4))
+PROMPT_REVERSE_RATE_PER_SEC = max(0.0, env_float("PROMPT_REVERSE_RATE_PER_SEC", 2.0))
+PROMPT_REVERSE_BURST = max(1, env_int("PROMPT_REVERSE_BURST", 4))
+PROMPT_REVERSE_MAX_RETRIES = max(0, env_int("PROMPT_REVERSE_MAX_RETRIES", 2))
+PROMPT_REVERSE_RETRY_BACKOFF = max(0.0, env_float("PROMPT_REVERSE_RETRY_BACKOFF", 1.0))
+PROMPT_REVERSE_CACHE = (os.getenv("PROMPT_REVERSE_CACHE", "1") or "1").strip().lower() not in {
+    "0",
+    "false",
+    "no",
+    "off",
+}
+
+
+class _TokenBucket:
+    """Blocking token bucket; rate <= 0 disables limiting."""
+
+    def __init__(self, rate_per_sec: float, burst: int) -> None:
+        self.rate = rate_per_sec
+        self.capacity = float(max(1, burst))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+_RATE_LIMITER = _TokenBucket(PROMPT_REVERSE_RATE_PER_SEC, PROMPT_REVERSE_BURST)
+_INFLIGHT = threading.BoundedSemaphore(PROMPT_REVERSE_CONCURRENCY)
+
+
+class _PromptCache:
+    """SQLite map of sha256(image bytes, model, prompt) -> normalized reverse prompt."""
+
+    def __init__(self) -> None:
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            path = (os.getenv("PROMPT_REVERSE_CACHE_DB_PATH") or "").strip() or os.path.join(
+                os.path.dirname(os.path.dirname(__file__)), "data_storage", "prompt_reverse_cache.sqlite3"
+            )
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS prompts (key TEXT PRIMARY KEY, text TEXT NOT NULL, created_at_ms INTEGER NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._connection().execute("SELECT text FROM prompts WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, text: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO prompts(key, text, created_at_ms) VALUES(?,?,?)",
+                (key, text, int(time.time() * 1000)),
+            )
+            conn.commit()
+
+
+_PROMPT_CACHE = _PromptCache()
+
+
+def _content_key(image_bytes: bytes, model: str, user_prompt: str) -> str:
+    h = hashlib.sha256()
+    h.update(image_bytes)
+    h.update(b"\0" + model.encode("utf-8") + b"\0" + user_prompt.encode("utf-8"))
+    return h.hexdigest()
+
+
+@lru_cache(maxsize=4)
+def _client_for_key(api_key: str) -> OpenAI:
+    return OpenAI(api_key=api_key, base_url=DASHSCOPE_BASE_URL)
+
+
 def _ensure_client() -> OpenAI:
     api_key = os.getenv("DASHSCOPE_API_KEY")
     if not api_key:
         raise RuntimeError("缺少 DASHSCOPE_API_KEY，无法调用 qwen3-vl-plus")
-    return OpenAI(api_key=api_key, base_url=DASHSCOPE_BASE_URL)
+    return _client_for_key(api_key)
 
 
 def _guess_mime(path: Path) -> str:
@@ -80,13 +184,65 @@ def _guess_mime(path: Path) -> str:
     return mime or "application/octet-stream"
 
 
-def _image_to_data_url(image_path: Path) -> str:
+def _image_to_data_url(image_path: Path, data: bytes | None = None) -> str:
     mime = _guess_mime(image_path)
-    data = image_path.read_bytes()
+    if data is None:
+        data = image_path.read_bytes()
     b64 = base64.b64encode(data).decode("utf-8")
     return f"data:{mime};base64,{b64}"
 
 
+def _request_reverse_prompt(client: OpenAI, data_url: str, *, model: str, user_prompt: str):
+    """One rate-limited VL request, retried with exponential backoff."""
+    last_error: Exception | None = None
+    for attempt in range(PROMPT_REVERSE_MAX_RETRIES + 1):
+        if attempt > 0:
+            time.sleep(PROMPT_REVERSE_RETRY_BACKOFF * (2 ** (attempt - 1)))
+        _RATE_LIMITER.acquire()
+        try:
+            with _INFLIGHT:
+                return client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": [
+                                {"type": "image_url", "image_url": {"url": data_url}},
+                                {"type": "text", "text": user_prompt},
+                            ],
+                        }
+                    ],
+                    max_tokens=MAX_REVERSE_PROMPT_TOKENS,
+                    stream=False,
+                )
+        except Exception as exc:  # noqa: BLE001
+            last_error = exc
+    raise last_error  # type: ignore[misc]
+
+
+def _reverse_prompt_cached(
+    client: OpenAI,
+    image_path: Path,
+    *,
+    model: str,
+    user_prompt: str,
+) -> Tuple[str, dict, bool]:
+    """Return (text, raw_response, cache_hit); identical image bytes are only sent once."""
+    data = image_path.read_bytes()
+    key = _content_key(data, model, user_prompt) if PROMPT_REVERSE_CACHE else ""
+    if key:
+        cached = _PROMPT_CACHE.get(key)
+        if cached is not None:
+            return cached, {"cached": True, "content_sha256": key}, True
+
+    completion = _request_reverse_prompt(client, _image_to_data_url(image_path, data), model=model, user_prompt=user_prompt)
+    choice = completion.choices[0].message
+    content_text = _normalize_reverse_prompt(choice.content or "")
+    if key and content_text:
+        _PROMPT_CACHE.put(key, content_text)
+    return content_text, completion.model_dump(), False
+
+
 def generate_prompt_for_image(
     image_path: Path,
     *,
@@ -99,27 +255,39 @@ def generate_prompt_for_image(
     Returns (text_content, raw_response_dict)
     """
     client = _ensure_client()
-    data_url = _image_to_data_url(image_path)
+    text, raw, _hit = _reverse_prompt_cached(client, image_path, model=model, user_prompt=user_prompt)
+    return text, raw
 
-    completion = client.chat.completions.create(
-        model=model,
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "image_url", "image_url": {"url": data_url}},
-                    {"type": "text", "text": user_prompt},
-                ],
-            }
-        ],
-        max_tokens=MAX_REVERSE_PROMPT_TOKENS,
-        stream=False,
-    )
 
-    choice = completion.choices[0].message
-    content_text = _normalize_reverse_prompt(choice.content or "")
-    raw = completion.model_dump()
-    return content_text, raw
+def map_reverse_prompts(
+    image_paths: List[Path],
+    *,
+    model: str = DEFAULT_MODEL,
+    user_prompt: str = DEFAULT_USER_PROMPT,
+    client: OpenAI | None = None,
+) -> Iterator[Tuple[Path, str | None, Exception | None, bool]]:
+    """
+    Reverse-prompt many images concurrently.
+
+    Yields (image_path, text, error, cache_hit) in input order, so callers can
+    write results deterministically while later requests are still in flight.
+    """
+    if not image_paths:
+        return
+    client = client or _ensure_client()
+    workers = min(PROMPT_REVERSE_CONCURRENCY, len(image_paths))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prompt-reverse") as pool:
+        futures = [
+            pool.submit(_reverse_prompt_cached, client, path, model=model, user_prompt=user_prompt)
+            for path in image_paths
+        ]
+        for path, fut in zip(image_paths, futures):
+            try:
+                text, _raw, hit = fut.result()
+            except Exception as exc:  # noqa: BLE001
+                yield path, None, exc, False
+            else:
+                yield path, text, None, hit
 
 
 def run_prompt_reverse_for_entries(
@@ -133,6 +301,9 @@ def run_prompt_reverse_for_entries(
     For each prepared entry (contains label, relative_dir, image_stem, image_path),
     call qwen3-vl-plus and store outputs alongside OCR artifacts.
 
+    Requests for all images run concurrently (see map_reverse_prompts); prompt
+    files, warnings and logs are still produced in entry/image order.
+
     Returns (warnings, logs) where logs is a list of dict entries.
     """
     warnings: List[str] = []
@@ -142,6 +313,9 @@ def run_prompt_reverse_for_entries(
     except Exception as exc:  # noqa: BLE001
         return [f"提示词反推已跳过：{exc}"], logs
 
+    # Plan in entry order: either a ready-made (warning, log) or an image job.
+    plan: List[Tuple[str, object]] = []
+    jobs: List[Tuple[dict, Path, Path]] = []
     for entry in prepared_entries or []:
         try:
             label = entry["label"]
@@ -161,66 +335,83 @@ def run_prompt_reverse_for_entries(
                 )
 
             if not image_candidates:
-                warnings.append(f"{image_stem}: images/ 目录下未找到可用于提示词反推的图片")
-                logs.append(
-                    {
-                        "label": label,
-                        "image_stem": image_stem,
-                        "image": str(images_dir),
-                        "status": "error",
-                        "prompt_path": "",
-                        "message": "images/ 目录无图片，已跳过",
-                    }
+                plan.append(
+                    (
+                        "skip",
+                        (
+                            f"{image_stem}: images/ 目录下未找到可用于提示词反推的图片",
+                            {
+                                "label": label,
+                                "image_stem": image_stem,
+                                "image": str(images_dir),
+                                "status": "error",
+                                "prompt_path": "",
+                                "message": "images/ 目录无图片，已跳过",
+                            },
+                        ),
+                    )
                 )
                 continue
 
-            entry_page_stem = entry.get("image_stem") or ""
             for target_image_path in image_candidates:
-                log_item = {
-                    "label": label,
-                    # Use page-level stem from prepared entry to avoid collisions across images named 0/1/2
-                    "image_stem": entry_page_stem or target_image_path.stem,
-                    "image": str(target_image_path),
-                    "status": "processing",
-                    "prompt_path": "",
-                    "message": "",
-                }
-
-                data_url = _image_to_data_url(target_image_path)
-                completion = client.chat.completions.create(
-                    model=model,
-                    messages=[
+                plan.append(("job", len(jobs)))
+                jobs.append((entry, images_dir, target_image_path))
+        except Exception as exc:  # noqa: BLE001
+            plan.append(
+                (
+                    "skip",
+                    (
+                        f"{entry.get('image_stem')}: {exc}",
                         {
-                            "role": "user",
-                            "content": [
-                                {"type": "image_url", "image_url": {"url": data_url}},
-                                {"type": "text", "text": user_prompt},
-                            ],
-                        }
-                    ],
-                    max_tokens=MAX_REVERSE_PROMPT_TOKENS,
-                    stream=False,
+                            "label": entry.get("label"),
+                            "image_stem": entry.get("image_stem"),
+                            "image": str(entry.get("image_path")),
+                            "status": "error",
+                            "prompt_path": "",
+                            "message": str(exc),
+                        },
+                    ),
                 )
+            )
 
-                choice = completion.choices[0].message
-                content_text = _normalize_reverse_prompt(choice.content or "")
-
-                prompt_txt_path = images_dir / f"{target_image_path.stem}.txt"
-                prompt_txt_path.write_text(content_text, encoding="utf-8")
-                log_item["status"] = "success"
-                log_item["prompt_path"] = str(prompt_txt_path)
-                log_item["message"] = content_text[:200]
-                logs.append(log_item)
+    results = map_reverse_prompts(
+        [job[2] for job in jobs],
+        model=model,
+        user_prompt=user_prompt,
+        client=client,
+    )
+    for kind, payload in plan:
+        if kind == "skip":
+            warning, log_item = payload
+            warnings.append(warning)
+            logs.append(log_item)
+            continue
+        entry, images_dir, target_image_path = jobs[payload]
+        _path, content_text, error, cache_hit = next(results)
+        entry_page_stem = entry.get("image_stem") or ""
+        log_item = {
+            "label": entry.get("label"),
+            # Use page-level stem from prepared entry to avoid collisions across images named 0/1/2
+            "image_stem": entry_page_stem or target_image_path.stem,
+            "image": str(target_image_path),
+            "status": "processing",
+            "prompt_path": "",
+            "message": "",
+        }
+        try:
+            if error is not None:
+                raise error
+            prompt_txt_path = images_dir / f"{target_image_path.stem}.txt"
+            prompt_txt_path.write_text(content_text or "", encoding="utf-8")
+            log_item["status"] = "success"
+            log_item["prompt_path"] = str(prompt_txt_path)
+            log_item["message"] = (content_text or "")[:200]
+            if cache_hit:
+                log_item["cached"] = True
         except Exception as exc:  # noqa: BLE001
             warnings.append(f"{entry.get('image_stem')}: {exc}")
-            log_item = {
-                "label": entry.get("label"),
-                "image_stem": entry.get("image_stem"),
-                "image": str(entry.get("image_path")),
-                "status": "error",
-                "prompt_path": "",
-                "message": str(exc),
-            }
-            logs.append(log_item)
+            log_item["status"] = "error"
+            log_item["message"] = str(exc)
+        logs.append(log_item)
 
     return warnings, logs
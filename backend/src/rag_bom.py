@@ -284,7 +284,7 @@ def generate_bom_from_ocr_request(
     if llm_config.base_url:
         kwargs["api_base"] = llm_config.base_url
 
-    response = _run_completion_with_timeout(kwargs, None)
+    response = _run_completion_with_timeout(kwargs, None, tag="bom")
     llm_output = response.choices[0].message.content.strip()
 
     if "```json" in llm_output:
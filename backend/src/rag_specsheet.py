@@ -2,15 +2,15 @@ import os
 import sys
 import json
 import re
-import signal
 import base64
+import hashlib
 import mimetypes
+import time
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple, Union
 from dotenv import load_dotenv
 from neo4j import GraphDatabase
 from litellm import completion, embedding
-import numpy as np
 
 
 # 若设为 <=0 则不截断上下文，默认不截断
@@ -109,22 +109,15 @@ def _get_spec_playbook_rules_text(limit: int = 0) -> str:
     return "【ACE Playbook Rules（必须遵守）】\n" + "\n".join(lines) + "\n\n"
 
 
-def _run_completion_with_timeout(kwargs: Dict[str, Any], timeout: int) -> Any:
-    """Run litellm completion with a hard timeout (POSIX only)."""
+def _run_completion_with_timeout(kwargs: Dict[str, Any], timeout: Optional[int], tag: str = "specsheet") -> Any:
+    """Run litellm completion through the shared LLM gateway with a hard timeout.
 
-    if timeout is None or timeout <= 0:
-        return completion(**kwargs)
-
-    def _timeout_handler(_signum, _frame):
-        raise TimeoutError("LLM specsheet generation timed out")
+    The timeout is enforced by waiting on a future, so this works from worker
+    threads too (the old SIGALRM version only worked on the main thread).
+    None/<=0 falls back to LLM_GATEWAY_TIMEOUT_SECONDS.
+    """
 
-    old_handler = signal.signal(signal.SIGALRM, _timeout_handler)
-    signal.alarm(max(timeout, 1))
-    try:
-        return completion(**kwargs)
-    finally:
-        signal.alarm(0)
-        signal.signal(signal.SIGALRM, old_handler)
+    return llm_gateway.complete(kwargs, timeout=float(timeout) if timeout and timeout > 0 else None, tag=tag)
 """
 RAG query module for retrieving specsheet content from Neo4j.
 Uses vector search to find relevant chunks and LLM to extract structured data.
@@ -132,13 +125,11 @@ Uses vector search to find relevant chunks and LLM to extract structured data.
 import os
 import sys
 import json
-import signal
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple, Union
 from dotenv import load_dotenv
 from neo4j import GraphDatabase
 from litellm import completion, embedding
-import numpy as np
 
 # 添加项目根目录到 Python 路径
 project_root = Path(__file__).parent.parent
@@ -146,7 +137,12 @@ if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
 
 from src.dataclass import Neo4jConfig, LLMConfig
-from src.neo4j_file_add_neo4j import embed_texts, get_neo4j_driver
+from src.neo4j_file_add_neo4j import embed_texts
+from src.graph_version import bumps_graph_version
+from src.llm_gateway import llm_gateway
+from src.context_bundle import context_bundle_enabled, context_bundles
+from src.neo4j_pool import get_pooled_driver
+from src.scoped_retrieval import scoped_retriever
 from src.models_litellm import (
     Qwen_API_KEY,
     Qwen_URL_BASE,
@@ -279,92 +275,18 @@ def retrieve_chunks_by_product_bom(
     Returns:
         List of chunk dictionaries with text, source_path, and similarity score
     """
+    # 在产品自身的 Chunk 矩阵上做一次矩阵乘法排序，避免全局向量索引 topK 过滤后为空
     try:
-        # Try using vector index query (Neo4j 5.x+)
-        result = session.run(
-            """
-            MATCH (p:Product {english_name: $product_name, bom_version: $bom_version})
-            OPTIONAL MATCH (p)-[:HAS_DOCUMENT]->(doc_p:Document)
-            OPTIONAL MATCH (p)-[:HAS]->(a:Accessory)-[:HAS_DOCUMENT]->(doc_a:Document)
-            WITH collect(DISTINCT doc_p) + collect(DISTINCT doc_a) AS all_docs
-            UNWIND all_docs AS doc
-            MATCH (doc)-[:HAS_TEXT_DESCRIPTION|HAS_IMAGE_DESCRIPTION|HAS_TABLE_DESCRIPTION]->(desc)
-            MATCH (desc)-[:HAS_CHUNK]->(c:Chunk)
-            WITH collect(DISTINCT c) AS product_chunks
-            CALL db.index.vector.queryNodes('chunk_embedding', $topK, $queryVector)
-            YIELD node AS chunk, score
-            WHERE chunk IN product_chunks AND score >= $threshold
-            RETURN chunk.text AS text, 
-                   chunk.source_path AS source_path,
-                   score AS similarity
-            ORDER BY score DESC
-            LIMIT $topK
-            """,
-            {
-                "product_name": product_name,
-                "bom_version": bom_version,
-                "topK": top_k * 2,  # Query more to filter by product
-                "queryVector": query_vector,
-                "threshold": similarity_threshold
-            }
+        return scoped_retriever.search(
+            session,
+            product_name,
+            bom_version,
+            query_vector,
+            top_k=top_k,
+            similarity_threshold=similarity_threshold,
         )
-        
-        chunks = []
-        for record in result:
-            chunks.append({
-                "text": record["text"],
-                "source_path": record.get("source_path", "unknown"),
-                "similarity": float(record["similarity"])
-            })
-        
-        if chunks:
-            return chunks[:top_k]
-    except Exception as e:
-        print(f"Warning: Vector index query failed ({e}), using Python-based similarity calculation")
-    
-    # Fallback: Python-based similarity calculation
-    try:
-        # First, get all chunks for this product
-        result = session.run(
-            """
-            MATCH (p:Product {english_name: $product_name, bom_version: $bom_version})
-            OPTIONAL MATCH (p)-[:HAS_DOCUMENT]->(doc_p:Document)
-            OPTIONAL MATCH (p)-[:HAS]->(a:Accessory)-[:HAS_DOCUMENT]->(doc_a:Document)
-            WITH collect(DISTINCT doc_p) + collect(DISTINCT doc_a) AS all_docs
-            UNWIND all_docs AS doc
-            MATCH (doc)-[:HAS_TEXT_DESCRIPTION|HAS_IMAGE_DESCRIPTION|HAS_TABLE_DESCRIPTION]->(desc)
-            MATCH (desc)-[:HAS_CHUNK]->(c:Chunk)
-            WHERE c.embedding IS NOT NULL AND c.text IS NOT NULL
-            RETURN c.text AS text,
-                   c.source_path AS source_path,
-                   c.embedding AS embedding
-            """,
-            {
-                "product_name": product_name,
-                "bom_version": bom_version
-            }
-        )
-        
-        query_vec = np.array(query_vector)
-        candidates = []
-        
-        for record in result:
-            chunk_vec = np.array(record["embedding"])
-            # Calculate cosine similarity
-            similarity = np.dot(query_vec, chunk_vec) / (np.linalg.norm(query_vec) * np.linalg.norm(chunk_vec))
-            
-            if similarity >= similarity_threshold:
-                candidates.append({
-                    "text": record["text"],
-                    "source_path": record.get("source_path", "unknown"),
-                    "similarity": float(similarity)
-                })
-        
-        # Sort by similarity and return top_k
-        candidates.sort(key=lambda x: x["similarity"], reverse=True)
-        return candidates[:top_k]
     except Exception as e:
-        print(f"Warning: Python-based similarity calculation failed: {e}")
+        print(f"Warning: Scoped chunk retrieval failed: {e}")
         return []
 
 
@@ -507,7 +429,7 @@ def _get_product_config_and_accessory_glossary(
     pid = f"{name}_{bom}".strip()
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     config_text_zh = ""
     glossary_lines: List[str] = []
@@ -810,7 +732,7 @@ def _get_specsheet_and_chunks_by_product_bom(
     neo4j_config = get_neo4j_config()
     embedding_config = get_embedding_config()
     
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
     try:
         with driver.session() as session:
             product_record = session.run(
@@ -1150,13 +1072,95 @@ def _sanitize_ocr_markdown_text(text: str) -> str:
     return sanitized.strip()
 
 
+_IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp"}
+
+
+def _backend_file_stamp(path: Optional[str]) -> Optional[List[int]]:
+    """[mtime_ns, size] of a backend-relative file, None when it is missing."""
+    if not path:
+        return None
+    try:
+        st = (BACKEND_ROOT / path).resolve().stat()
+    except (OSError, ValueError):
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _reverse_prompt_path(doc: SpecsheetOcrDocument) -> Optional[str]:
+    """Prompt-reverse .txt next to an OCR image, if the image qualifies as a candidate."""
+    normalized = (doc.path or "").replace("\\", "/")
+    p = Path(normalized)
+    if normalized and "/images/" in normalized and p.suffix.lower() in _IMAGE_SUFFIXES:
+        return (p.parent / f"{p.stem}.txt").as_posix()
+    return None
+
+
+def _ocr_document_key(doc: SpecsheetOcrDocument, mime_type: Optional[str]) -> str:
+    """Cache key of a document's processed form (name/type only affect the header, rebuilt per call).
+
+    Includes the stamp of the file that processing reads (the .mmd when no inline
+    text is sent, the reverse .txt for images), so edits made after the bundle
+    was built produce a new key instead of a stale body.
+    """
+    if mime_type and mime_type.startswith("image/"):
+        stamp = _backend_file_stamp(_reverse_prompt_path(doc))
+    else:
+        stamp = None if doc.text else _backend_file_stamp(doc.path)
+    raw = json.dumps(
+        [doc.path or "", doc.mime_type or "", doc.summary or "", doc.text or "", stamp],
+        ensure_ascii=False,
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _process_ocr_document(doc: SpecsheetOcrDocument, mime_type: Optional[str]) -> Dict[str, Any]:
+    """The file I/O + sanitizing part of building context for one document."""
+    is_image = bool(mime_type and mime_type.startswith("image/"))
+    if is_image:
+        segment = None
+        reverse_path = _reverse_prompt_path(doc)
+        # 只有已做过提示词反推（同名 .txt 非空）的 OCR 图片才作为候选图片
+        if reverse_path:
+            reverse_txt = _read_text_from_backend(reverse_path)
+            if reverse_txt and reverse_txt.strip():
+                if len(reverse_txt) > 800:
+                    reverse_txt = reverse_txt[:800] + "..."
+                public_path = doc.path if doc.path.startswith("/api/files/") else f"/api/files/{doc.path}"
+                segment = {
+                    "description": reverse_txt.strip(),
+                    "image_path": public_path,
+                    "mime_type": mime_type,
+                }
+        return {"kind": "image", "path": doc.path or "", "segment": segment}
+
+    summary_text = _sanitize_ocr_markdown_text(doc.summary or doc.text or "")
+    file_text = _sanitize_ocr_markdown_text(doc.text or _read_text_from_backend(doc.path))
+    body_parts = []
+    if summary_text:
+        body_parts.append(summary_text)
+    if file_text and file_text != summary_text:
+        body_parts.append(file_text)
+    return {"kind": "text", "path": doc.path or "", "body": body_parts}
+
+
 def _build_context_from_ocr_documents(
     documents: List[SpecsheetOcrDocument],
+    session_id: Optional[str] = None,
 ) -> Tuple[str, List[Dict[str, Any]], List[Dict[str, str]]]:
+    """Build (context_text, pseudo_chunks, multimodal_segments) from OCR documents.
+
+    With a session_id the processed documents are served from / added to the session's
+    context bundle (see src.context_bundle).
+    """
     context_parts: List[str] = []
     pseudo_chunks: List[Dict[str, Any]] = []
     multimodal_segments: List[Dict[str, str]] = []
 
+    bundle_gen = context_bundles.generation(session_id)
+    bundle = context_bundles.get(session_id) if session_id else None
+    cached_docs: Dict[str, Any] = dict((bundle or {}).get("docs") or {})
+    added: Dict[str, Any] = {}
+
     # 保留 .mmd 和图片（用于候选产品图），其余过滤
     def is_allowed(doc: SpecsheetOcrDocument) -> bool:
         path = (doc.path or "").lower()
@@ -1168,18 +1172,6 @@ def _build_context_from_ocr_documents(
         path = (doc.path or "").replace("\\", "/")
         return path.startswith("manual_uploads/")
 
-    def is_prompt_reversed_image(doc_path: str | None) -> bool:
-        if not doc_path:
-            return False
-        normalized = doc_path.replace("\\", "/")
-        if "/images/" not in normalized:
-            return False
-        p = Path(normalized)
-        if p.suffix.lower() not in {".png", ".jpg", ".jpeg", ".webp"}:
-            return False
-        reverse_txt = _read_text_from_backend((p.parent / f"{p.stem}.txt").as_posix())
-        return bool(reverse_txt and reverse_txt.strip())
-
     for idx, doc in enumerate(documents, 1):
         if not is_allowed(doc):
             continue
@@ -1188,35 +1180,21 @@ def _build_context_from_ocr_documents(
         owner = doc.type or f"OCR文档{idx}"
         header = f"[{owner}] {doc.name or doc.path or owner}"
         mime_type = doc.mime_type or (mimetypes.guess_type(doc.path or "")[0] if doc.path else None)
-        is_image = bool(mime_type and mime_type.startswith("image/"))
 
-        if is_image:
-            if doc.path and is_prompt_reversed_image(doc.path):
-                p = Path(doc.path.replace("\\", "/"))
-                reverse_txt = _read_text_from_backend((p.parent / f"{p.stem}.txt").as_posix())
-                if reverse_txt and len(reverse_txt) > 800:
-                    reverse_txt = reverse_txt[:800] + "..."
-                candidate_desc = (reverse_txt or "").strip()
-                public_path = doc.path if doc.path.startswith("/api/files/") else f"/api/files/{doc.path}"
-                multimodal_segments.append(
-                    {
-                        "description": candidate_desc,
-                        "image_path": public_path,
-                        "mime_type": mime_type,
-                    }
-                )
+        key = _ocr_document_key(doc, mime_type)
+        entry = cached_docs.get(key)
+        if entry is None:
+            entry = _process_ocr_document(doc, mime_type)
+            cached_docs[key] = entry
+            added[key] = entry
+
+        if entry.get("kind") == "image":
+            if doc.path and entry.get("segment"):
+                multimodal_segments.append(dict(entry["segment"]))
             continue
 
         # 构造上下文文本：图片不再读二进制，仅引用占位
-        summary_text = doc.summary or ("" if is_image else doc.text) or ""
-        file_text = "" if is_image else (doc.text or _read_text_from_backend(doc.path))
-        summary_text = _sanitize_ocr_markdown_text(summary_text)
-        file_text = _sanitize_ocr_markdown_text(file_text)
-        body_parts = []
-        if summary_text:
-            body_parts.append(summary_text)
-        if file_text and file_text != summary_text:
-            body_parts.append(file_text)
+        body_parts = list(entry.get("body") or [])
         if not body_parts:
             body_parts.append(f"[{mime_type or 'file'}] {doc.path or doc.name or owner}")
 
@@ -1230,9 +1208,110 @@ def _build_context_from_ocr_documents(
             }
         )
 
+    if session_id and added:
+        def _merge(latest: Dict[str, Any]) -> None:
+            docs = latest.setdefault("docs", {})
+            # 同一路径的旧版本（文件已被编辑）不再保留
+            replaced = {e.get("path") for e in added.values() if e.get("path")}
+            for stale_key in [k for k, e in docs.items() if k not in added and e.get("path") in replaced]:
+                docs.pop(stale_key, None)
+            docs.update(added)
+
+        # 在会话锁内合并到副本，避免覆盖并发请求刚写入的条目
+        context_bundles.update(session_id, _merge, generation=bundle_gen)
+
     return "\n\n".join(context_parts), pseudo_chunks, multimodal_segments
 
 
+def _load_original_upload_segments(session_id: str) -> List[Dict[str, str]]:
+    """Candidate segments for the session's original product image uploads (with reverse prompts)."""
+    from src.manual_ocr import load_session_record, session_dir  # local import to avoid heavy deps at import-time
+
+    record = load_session_record(session_id)
+    if not record:
+        return []
+    base_dir = session_dir(session_id)
+    out_dir = base_dir / "reverse_prompts" / "products"
+    orig_segments: List[Dict[str, str]] = []
+    seen = set()
+    for f in (record.get("product_files") or []):
+        try:
+            rel = (f.get("path") or "").strip()
+            if not rel:
+                continue
+            suffix = Path(rel).suffix.lower()
+            if suffix not in {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif"}:
+                continue
+            public_path = rel if rel.startswith("/api/files/") else f"/api/files/{rel}"
+            if public_path in seen:
+                continue
+            seen.add(public_path)
+            desc = ""
+            try:
+                txt_path = out_dir / f"{Path(rel).stem}.txt"
+                if txt_path.exists() and txt_path.is_file():
+                    desc = (txt_path.read_text(encoding="utf-8") or "").strip()
+            except Exception:
+                desc = ""
+            mime = (f.get("type") or "").strip() or mimetypes.guess_type(rel)[0] or "image/*"
+            orig_segments.append(
+                {
+                    "description": desc,
+                    "image_path": public_path,
+                    "mime_type": mime,
+                    "source": "original_upload",
+                }
+            )
+        except Exception:
+            continue
+    return orig_segments
+
+
+def _original_upload_segments(session_id: str) -> List[Dict[str, str]]:
+    bundle_gen = context_bundles.generation(session_id)
+    bundle = context_bundles.get(session_id)
+    if bundle is not None and isinstance(bundle.get("original_segments"), list):
+        return [dict(seg) for seg in bundle["original_segments"]]
+    segments = _load_original_upload_segments(session_id)
+    def _merge(latest: Dict[str, Any]) -> None:
+        latest["original_segments"] = segments
+
+    # 读取上传文件期间若会话被失效（新上传），不写回旧的片段
+    context_bundles.update(session_id, _merge, generation=bundle_gen)
+    return [dict(seg) for seg in segments]
+
+
+def prebuild_context_bundle(session_id: str, record: Optional[Dict[str, Any]] = None) -> None:
+    """Build a session's bundle from its OCR artifacts right after OCR / prompt reverse finishes."""
+    if not session_id or not context_bundle_enabled():
+        return
+    started = time.perf_counter()
+    if record is None:
+        from src.manual_ocr import load_session_record  # local import to avoid heavy deps at import-time
+
+        record = load_session_record(session_id) or {}
+    bundle = context_bundles.empty(session_id)
+    for group in (record.get("product_ocr_groups") or []) + (record.get("accessory_ocr_groups") or []):
+        for page in group.get("pages") or []:
+            for artifact in page.get("artifacts") or []:
+                path = (artifact.get("path") or "").lower()
+                if not (path.endswith(".mmd") or path.endswith(tuple(_IMAGE_SUFFIXES))):
+                    continue
+                doc = SpecsheetOcrDocument(
+                    name=artifact.get("name"),
+                    path=artifact.get("path"),
+                    mime_type=artifact.get("type"),
+                )
+                mime_type = doc.mime_type or (mimetypes.guess_type(doc.path or "")[0] if doc.path else None)
+                bundle["docs"][_ocr_document_key(doc, mime_type)] = _process_ocr_document(doc, mime_type)
+    bundle["original_segments"] = _load_original_upload_segments(session_id)
+    context_bundles.put(session_id, bundle)
+    print(
+        f"[ContextBundle] Prebuilt {session_id}: {len(bundle['docs'])} docs in "
+        f"{(time.perf_counter() - started) * 1000:.0f}ms"
+    )
+
+
 def get_specsheet_from_provided_docs(
     product_name: str,
     bom_version: str,
@@ -1264,54 +1343,20 @@ def get_specsheet_from_provided_docs(
 def generate_specsheet_from_ocr_request(
     request: SpecsheetFromOcrRequest,
 ) -> Tuple[SpecsheetData, List[Dict[str, Any]], str, str, str]:
-    context_text, pseudo_chunks, multimodal_segments = _build_context_from_ocr_documents(request.documents)
+    context_text, pseudo_chunks, multimodal_segments = _build_context_from_ocr_documents(
+        request.documents,
+        session_id=getattr(request, "session_id", None),
+    )
 
     # Prepend original uploaded product images as better candidates than OCR artifacts.
     if getattr(request, "session_id", None):
         try:
-            from src.manual_ocr import load_session_record, session_dir  # local import to avoid heavy deps at import-time
-
-            record = load_session_record(request.session_id)
-            if record:
-                base_dir = session_dir(request.session_id)
-                out_dir = base_dir / "reverse_prompts" / "products"
-                orig_segments: List[Dict[str, str]] = []
-                seen = set()
-                for f in (record.get("product_files") or []):
-                    try:
-                        rel = (f.get("path") or "").strip()
-                        if not rel:
-                            continue
-                        suffix = Path(rel).suffix.lower()
-                        if suffix not in {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif"}:
-                            continue
-                        public_path = rel if rel.startswith("/api/files/") else f"/api/files/{rel}"
-                        if public_path in seen:
-                            continue
-                        seen.add(public_path)
-                        desc = ""
-                        try:
-                            txt_path = out_dir / f"{Path(rel).stem}.txt"
-                            if txt_path.exists() and txt_path.is_file():
-                                desc = (txt_path.read_text(encoding="utf-8") or "").strip()
-                        except Exception:
-                            desc = ""
-                        mime = (f.get("type") or "").strip() or mimetypes.guess_type(rel)[0] or "image/*"
-                        orig_segments.append(
-                            {
-                                "description": desc,
-                                "image_path": public_path,
-                                "mime_type": mime,
-                                "source": "original_upload",
-                            }
-                        )
-                    except Exception:
-                        continue
-                if orig_segments:
-                    multimodal_segments = orig_segments + [
-                        {**seg, "source": seg.get("source") or "ocr_artifact"}
-                        for seg in (multimodal_segments or [])
-                    ]
+            orig_segments = _original_upload_segments(request.session_id)
+            if orig_segments:
+                multimodal_segments = orig_segments + [
+                    {**seg, "source": seg.get("source") or "ocr_artifact"}
+                    for seg in (multimodal_segments or [])
+                ]
         except Exception:
             # Best-effort only; keep existing OCR-derived candidates.
             pass
@@ -1374,6 +1419,7 @@ def generate_specsheet_from_ocr_request(
     return specsheet_data, chunks, prompt_text, system_prompt, context_text
 
 
+@bumps_graph_version
 def save_specsheet_for_product_bom(
     product_name: str,
     bom_version: str,
@@ -1389,7 +1435,7 @@ def save_specsheet_for_product_bom(
     serialized = json.dumps(specsheet_data.dict(), ensure_ascii=False)
 
     neo4j_config = get_neo4j_config()
-    driver = get_neo4j_driver(neo4j_config)
+    driver = get_pooled_driver(neo4j_config)
 
     try:
         with driver.session() as session:
@@ -11,9 +11,6 @@ import sys
 from pathlib import Path
 from typing import Callable, Iterable
 
-from transformers import AutoModel, AutoTokenizer
-import torch
-
 # ---------------------------------------------------------------------------
 # Model bootstrap
 # ---------------------------------------------------------------------------
@@ -39,6 +36,11 @@ def _ensure_model():
 
     global _TOKENIZER, _MODEL
     if _TOKENIZER is None or _MODEL is None:
+        # Heavy imports live here so the OCR worker's stub backend and helpers
+        # such as iter_images can be imported without torch.
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
         model_source = (
             str(LOCAL_MODEL_DIR)
             if LOCAL_MODEL_DIR.exists()
@@ -92,6 +94,44 @@ def iter_images(base_dir: Path, allowed_exts: set[str]):
                 yield Path(root) / filename
 
 
+def infer_image(
+    tokenizer,
+    model,
+    img_path: Path,
+    target_dir: Path,
+    *,
+    prompt: str = PROMPT,
+    base_size: int = BASE_SIZE,
+    image_size: int = IMAGE_SIZE,
+    crop_mode: bool = CROP_MODE,
+    save_results: bool = SAVE_RESULTS,
+    test_compress: bool = TEST_COMPRESS,
+) -> Path | None:
+    """OCR a single image and persist DeepSeek's captured stdout as markdown."""
+
+    target_dir.mkdir(parents=True, exist_ok=True)
+    with capture_stdout() as buf:
+        _ = model.infer(
+            tokenizer,
+            prompt=prompt,
+            image_file=str(img_path),
+            output_path=str(target_dir),
+            base_size=base_size,
+            image_size=image_size,
+            crop_mode=crop_mode,
+            save_results=save_results,
+            test_compress=test_compress,
+        )
+
+    raw_stdout = buf.getvalue().strip()
+    if not raw_stdout:
+        return None
+    stdout_path = target_dir / f"{img_path.stem}.stdout.md"
+    stdout_path.write_text(raw_stdout, encoding="utf-8")
+    print(f"  ↳ saved stdout: {stdout_path}")
+    return stdout_path
+
+
 def run_ocr(
     input_dir: str | os.PathLike,
     output_dir: str | os.PathLike,
@@ -142,25 +182,18 @@ def run_ocr(
                 "target_dir": str(target_dir),
             })
         try:
-            with capture_stdout() as buf:
-                _ = model.infer(
-                    tokenizer,
-                    prompt=prompt,
-                    image_file=str(img_path),
-                    output_path=str(target_dir),
-                    base_size=base_size,
-                    image_size=image_size,
-                    crop_mode=crop_mode,
-                    save_results=save_results,
-                    test_compress=test_compress,
-                )
-
-            raw_stdout = buf.getvalue().strip()
-            if raw_stdout:
-                stdout_path = target_dir / f"{img_stem}.stdout.md"
-                stdout_path.write_text(raw_stdout, encoding="utf-8")
-                print(f"  ↳ saved stdout: {stdout_path}")
-
+            infer_image(
+                tokenizer,
+                model,
+                img_path,
+                target_dir,
+                prompt=prompt,
+                base_size=base_size,
+                image_size=image_size,
+                crop_mode=crop_mode,
+                save_results=save_results,
+                test_compress=test_compress,
+            )
         except Exception as exc:  # noqa: BLE001 - surface any failure
             print(f"⚠️ Failed on {img_path}: {exc}")
             if progress_callback:
@@ -0,0 +1,235 @@
+"""
+Product-scoped vector retrieval.
+
+`db.index.vector.queryNodes('chunk_embedding', k, …)` ranks the whole graph and
+only then filters to the product, so a product whose chunks are not in the
+global top-k gets nothing back. Here every product's chunk embeddings are
+loaded once into a normalized float32 matrix and ranked with a single matmul.
+Matrices are cached per (product, bom) and rebuilt when the product's chunk
+fingerprint (count + latest created/updated timestamp) changes.
+
+Env knobs (all optional):
+  - RAG_SCOPED_CACHE_MAX_PRODUCTS   cached product matrices (default 64)
+  - RAG_SCOPED_CACHE_TTL_SECONDS    max age before re-checking the fingerprint (default 30)
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.env import env_int
+
+
+PRODUCT_CHUNKS_MATCH = """
+MATCH (p:Product {english_name: $product_name, bom_version: $bom_version})
+OPTIONAL MATCH (p)-[:HAS_DOCUMENT]->(doc_p:Document)
+OPTIONAL MATCH (p)-[:HAS]->(a:Accessory)-[:HAS_DOCUMENT]->(doc_a:Document)
+WITH collect(DISTINCT doc_p) + collect(DISTINCT doc_a) AS all_docs
+UNWIND all_docs AS doc
+MATCH (doc)-[:HAS_TEXT_DESCRIPTION|HAS_IMAGE_DESCRIPTION|HAS_TABLE_DESCRIPTION]->(desc)
+MATCH (desc)-[:HAS_CHUNK]->(c:Chunk)
+WHERE c.embedding IS NOT NULL AND c.text IS NOT NULL
+WITH DISTINCT c
+"""
+
+
+def normalize_rows(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms = np.where(norms == 0, 1.0, norms)
+    return mat / norms
+
+
+@dataclass
+class ProductChunkMatrix:
+    """Normalized embeddings of one product's chunks plus their metadata."""
+
+    texts: List[str]
+    source_paths: List[str]
+    matrix: np.ndarray
+    fingerprint: Tuple[Any, ...] = ()
+    checked_at: float = field(default_factory=time.time)
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Dict[str, Any]], fingerprint: Tuple[Any, ...] = ()) -> "ProductChunkMatrix":
+        texts: List[str] = []
+        paths: List[str] = []
+        vecs: List[Sequence[float]] = []
+        # Mixed embedding models under one product: keep the most common dim
+        # (ties go to the dim seen first) and skip the other chunks.
+        dims = Counter(len(row["embedding"]) for row in rows if row.get("embedding"))
+        dim = dims.most_common(1)[0][0] if dims else None
+        for row in rows:
+            vec = row.get("embedding")
+            if not vec or len(vec) != dim:
+                continue
+            texts.append(row.get("text") or "")
+            paths.append(row.get("source_path") or "unknown")
+            vecs.append(vec)
+        if vecs:
+            matrix = normalize_rows(np.asarray(vecs, dtype=np.float32))
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        return cls(texts=texts, source_paths=paths, matrix=matrix, fingerprint=fingerprint)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def search(
+        self,
+        query_vector: Sequence[float],
+        top_k: int = 10,
+        similarity_threshold: float = 0,
+    ) -> List[Dict[str, Any]]:
+        if len(self) == 0 or top_k <= 0:
+            return []
+        q = np.asarray(query_vector, dtype=np.float32)
+        if q.shape[0] != self.matrix.shape[1]:
+            print(
+                f"Warning: query vector dim {q.shape[0]} != chunk dim {self.matrix.shape[1]}, skip scoped retrieval"
+            )
+            return []
+        q_norm = float(np.linalg.norm(q))
+        if q_norm == 0:
+            return []
+        scores = self.matrix @ (q / q_norm)
+
+        k = min(top_k, scores.shape[0])
+        if k < scores.shape[0]:
+            idx = np.argpartition(-scores, k - 1)[:k]
+        else:
+            idx = np.arange(scores.shape[0])
+        idx = idx[np.argsort(-scores[idx], kind="stable")]
+
+        out: List[Dict[str, Any]] = []
+        for i in idx:
+            score = float(scores[i])
+            if score < similarity_threshold:
+                continue
+            out.append(
+                {
+                    "text": self.texts[i],
+                    "source_path": self.source_paths[i],
+                    "similarity": score,
+                }
+            )
+        return out
+
+
+class ScopedChunkRetriever:
+    """LRU cache of per-product chunk matrices."""
+
+    def __init__(self, max_products: Optional[int] = None, ttl_seconds: Optional[int] = None) -> None:
+        self._max_products = max_products
+        self._ttl_seconds = ttl_seconds
+        self._cache: "OrderedDict[Tuple[str, str], ProductChunkMatrix]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._builds = 0
+
+    @property
+    def max_products(self) -> int:
+        return max(1, self._max_products or env_int("RAG_SCOPED_CACHE_MAX_PRODUCTS", 64))
+
+    @property
+    def ttl_seconds(self) -> int:
+        return max(0, self._ttl_seconds if self._ttl_seconds is not None else env_int("RAG_SCOPED_CACHE_TTL_SECONDS", 30))
+
+    @staticmethod
+    def _fingerprint(session, product_name: str, bom_version: str) -> Tuple[Any, ...]:
+        record = session.run(
+            PRODUCT_CHUNKS_MATCH
+            + """
+            RETURN count(c) AS cnt,
+                   toString(max(coalesce(c.updated_at, c.created_at))) AS latest
+            """,
+            {"product_name": product_name, "bom_version": bom_version},
+        ).single()
+        if not record:
+            return (0, None)
+        return (int(record.get("cnt") or 0), record.get("latest"))
+
+    @staticmethod
+    def _load_rows(session, product_name: str, bom_version: str) -> List[Dict[str, Any]]:
+        result = session.run(
+            PRODUCT_CHUNKS_MATCH
+            + """
+            RETURN c.text AS text,
+                   c.source_path AS source_path,
+                   c.embedding AS embedding
+            """,
+            {"product_name": product_name, "bom_version": bom_version},
+        )
+        return [
+            {
+                "text": record.get("text"),
+                "source_path": record.get("source_path"),
+                "embedding": record.get("embedding"),
+            }
+            for record in result
+        ]
+
+    def get_matrix(self, session, product_name: str, bom_version: str) -> ProductChunkMatrix:
+        key = (product_name, bom_version)
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        if cached is not None and (now - cached.checked_at) < self.ttl_seconds:
+            with self._lock:
+                self._hits += 1
+            return cached
+
+        fingerprint = self._fingerprint(session, product_name, bom_version)
+        if cached is not None and cached.fingerprint == fingerprint:
+            cached.checked_at = now
+            with self._lock:
+                self._hits += 1
+            return cached
+
+        rows = self._load_rows(session, product_name, bom_version)
+        built = ProductChunkMatrix.from_rows(rows, fingerprint=fingerprint)
+        with self._lock:
+            self._builds += 1
+            self._cache[key] = built
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_products:
+                self._cache.popitem(last=False)
+        return built
+
+    def search(
+        self,
+        session,
+        product_name: str,
+        bom_version: str,
+        query_vector: Sequence[float],
+        top_k: int = 10,
+        similarity_threshold: float = 0,
+    ) -> List[Dict[str, Any]]:
+        matrix = self.get_matrix(session, product_name, bom_version)
+        return matrix.search(query_vector, top_k=top_k, similarity_threshold=similarity_threshold)
+
+    def invalidate(self, product_name: Optional[str] = None, bom_version: Optional[str] = None) -> None:
+        with self._lock:
+            if product_name is None:
+                self._cache.clear()
+                return
+            for key in [k for k in self._cache if k[0] == product_name and (bom_version is None or k[1] == bom_version)]:
+                self._cache.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "cached_products": len(self._cache),
+                "cached_chunks": sum(len(m) for m in self._cache.values()),
+                "hits": self._hits,
+                "builds": self._builds,
+            }
+
+
+scoped_retriever = ScopedChunkRetriever()
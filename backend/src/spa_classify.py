@@ -29,6 +29,14 @@ except Exception:  # pragma: no cover
     except Exception:  # pragma: no cover
         chat_json = None  # type: ignore
 
+try:
+    from src.llm_gateway import llm_gateway, request_fingerprint  # type: ignore
+except Exception:  # pragma: no cover
+    try:
+        from llm_gateway import llm_gateway, request_fingerprint  # type: ignore
+    except Exception:  # pragma: no cover
+        llm_gateway = None  # type: ignore
+
 from openai import OpenAI
 
 
@@ -641,6 +649,19 @@ def _chat_json_fallback_openai(messages: List[Dict[str, Any]], model: Optional[s
     }
 
 
+def _via_gateway(fn: Any, provider: str, payload: Dict[str, Any], timeout_s: Optional[float]) -> Dict[str, Any]:
+    """Run a raw provider call under the shared LLM gateway limits (direct call if unavailable)."""
+    if llm_gateway is None:
+        return fn()
+    return llm_gateway.call(
+        fn,
+        provider=provider,
+        key=request_fingerprint(payload),
+        timeout=timeout_s,
+        tag="spa_classify",
+    )
+
+
 def _chat_json(messages: List[Dict[str, Any]], model: Optional[str]) -> Dict[str, Any]:
     base_url = (os.getenv("DASHSCOPE_BASE_URL") or "").strip()
     if _is_ollama_base_url(base_url):
@@ -650,7 +671,12 @@ def _chat_json(messages: List[Dict[str, Any]], model: Optional[str]) -> Dict[str
         except Exception:
             timeout_s = 300
         try:
-            return _ollama_chat_json(messages=messages, model=model, timeout_s=timeout_s)
+            return _via_gateway(
+                lambda: _ollama_chat_json(messages=messages, model=model, timeout_s=timeout_s),
+                "ollama",
+                {"kind": "ollama_chat", "model": model, "messages": messages},
+                timeout_s + 15,
+            )
         except Exception:
             # Fall back to OpenAI-compatible path.
             pass
@@ -660,7 +686,12 @@ def _chat_json(messages: List[Dict[str, Any]], model: Optional[str]) -> Dict[str
             return chat_json(messages=messages, model=model)  # type: ignore
         except Exception:
             pass
-    return _chat_json_fallback_openai(messages=messages, model=model)
+    return _via_gateway(
+        lambda: _chat_json_fallback_openai(messages=messages, model=model),
+        "dashscope",
+        {"kind": "openai_chat", "model": model, "messages": messages},
+        None,
+    )
 
 
 def _resolve_fallback_vision_model(primary: str) -> Optional[str]:
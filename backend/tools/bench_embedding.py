@@ -0,0 +1,83 @@
+"""
+对比 embed_texts 的逐条路径（serial=True，旧实现）与批量客户端路径的耗时。
+
+用法（在 backend 目录下）：
+    python tools/bench_embedding.py --texts 200
+    python tools/bench_embedding.py --texts 200 --fake-latency-ms 80   # 不连模型，模拟每次请求 80ms
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.environ.setdefault("PROGRESS", "0")
+# 基准只比较请求路径，关闭向量缓存
+os.environ["EMBEDDING_CACHE"] = "0"
+
+import src.embedding_client as embedding_client
+import src.neo4j_file_add_neo4j as neo4j_file_add_neo4j
+from src.dataclass import LLMConfig
+from src.models_litellm import Ollama_BASE_URL, Ollama_QWEN3_EMBEDDING
+
+
+def _fake_embedding(latency_s: float, dim: int = 8):
+    def _fn(**kwargs):
+        time.sleep(latency_s)
+        inputs = kwargs["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        return {
+            "data": [
+                {"index": i, "embedding": [float(len(t) % 7)] * dim}
+                for i, t in enumerate(inputs)
+            ]
+        }
+
+    return _fn
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark serial vs batched embedding")
+    parser.add_argument("--texts", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-inflight", type=int, default=4)
+    parser.add_argument("--fake-latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    cfg = LLMConfig(
+        model=os.getenv("EMBEDDING_MODEL", Ollama_QWEN3_EMBEDDING),
+        api_key=None,
+        base_url=os.getenv("EMBEDDING_BASE_URL", Ollama_BASE_URL),
+    )
+    texts = [f"第 {i} 段测试文本：按摩浴缸喷嘴与水泵配置说明。" for i in range(args.texts)]
+    if args.fake_latency_ms > 0:
+        fake = _fake_embedding(args.fake_latency_ms / 1000.0)
+        neo4j_file_add_neo4j.embedding = fake
+        embedding_client.embedding = fake
+    os.environ["EMBEDDING_BATCH_SIZE"] = str(args.batch_size)
+    os.environ["EMBEDDING_MAX_INFLIGHT"] = str(args.max_inflight)
+
+    t0 = time.perf_counter()
+    serial_vecs = neo4j_file_add_neo4j.embed_texts(texts, cfg, serial=True)
+    serial_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    batch_vecs = neo4j_file_add_neo4j.embed_texts(texts, cfg, serial=False)
+    batch_s = time.perf_counter() - t0
+
+    same = len(serial_vecs) == len(batch_vecs) and all(
+        len(a) == len(b) for a, b in zip(serial_vecs, batch_vecs)
+    )
+    print(f"texts={len(texts)} model={cfg.model}")
+    print(f"serial : {serial_s:.3f}s")
+    print(f"batched: {batch_s:.3f}s (batch_size={args.batch_size}, inflight={args.max_inflight})")
+    if batch_s > 0:
+        print(f"speedup: {serial_s / batch_s:.1f}x")
+    print(f"shape match: {same}")
+
+
+if __name__ == "__main__":
+    main()
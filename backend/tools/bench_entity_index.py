@@ -0,0 +1,167 @@
+"""
+实体检索基准：n-gram 实体索引 vs 旧的 CONTAINS 扫描。
+
+默认在合成数据上对比（不需要 Neo4j）：
+  1. contains_scan：按旧逻辑对每个节点的多个字段做 lower() + 子串判断（等价于 Neo4j 的标签扫描）
+  2. entity_index：EntityIndex.search（n-gram 候选 + 排序），同时统计
+     - CONTAINS 命中在索引结果中的召回率
+     - 带拼写错误的关键词，索引能额外找回的比例（CONTAINS 为 0）
+
+--neo4j 时对真实图谱分别用 KBCHAT_ENTITY_INDEX=0/1 调 _list_products / _list_material_codes，
+关键词取自图里已有的产品名及其 _keyword_variants。
+
+用法（在 backend 目录下）：
+    python tools/bench_entity_index.py --products 20000 --materials 50000 --queries 200
+    python tools/bench_entity_index.py --neo4j --queries 50
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.kb_chat.entity_index import ENTITY_KINDS, EntityIndex
+
+_SERIES = ["Atlantic", "Otranto", "Pacific", "Baltic", "Aegean", "Caspian", "Ionian", "Adriatic", "Coral", "Tasman"]
+_SYLLABLES = ["ra", "no", "ti", "ka", "lo", "ve", "mi", "sa", "tor", "lan", "del", "mar", "cor", "ven", "ost"]
+_ZH = ["浴缸", "按摩浴缸", "淋浴房", "台盆", "马桶", "龙头", "花洒", "镜柜", "浴室柜", "恒温阀"]
+
+
+def _synthetic(n_products: int, n_materials: int, n_accessories: int, seed: int):
+    rng = random.Random(seed)
+
+    def code():
+        return "11" + "".join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(10))
+
+    def series_name():
+        return "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+    series_pool = _SERIES + [series_name() for _ in range(max(10, n_products // 20))]
+
+    products = []
+    for i in range(n_products):
+        series = rng.choice(series_pool)
+        size = rng.randint(10, 30)
+        products.append({
+            "product_id": f"{series}{size}_{code()}",
+            "name": f"{series}{size}",
+            "display_name_en": f"{series} {size} Whirlpool",
+            "display_name_zh": f"{series}{size} {rng.choice(_ZH)}",
+        })
+    materials = [
+        {"material_code": code(), "name": f"{rng.choice(series_pool)}{rng.randint(10, 30)}", "name_zh": rng.choice(_ZH)}
+        for _ in range(n_materials)
+    ]
+    accessories = [
+        {"name": f"{rng.choice(['Pump', 'Heater', 'Jet', 'Pillow', 'Light'])} {i}", "name_zh": f"{rng.choice(_ZH)}配件{i}"}
+        for i in range(n_accessories)
+    ]
+    return {"Product": products, "Material": materials, "Accessory": accessories}
+
+
+def _contains_scan(rows, fields, kw):
+    k = kw.lower()
+    return [r for r in rows if any(k in str(r.get(f) or "").lower() for f in fields)]
+
+
+def _typo(rng: random.Random, word: str) -> str:
+    if len(word) < 5:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1:]
+
+
+def run_synthetic(args) -> None:
+    data = _synthetic(args.products, args.materials, args.accessories, args.seed)
+    idx = EntityIndex(loader=lambda label: data[label])
+    t0 = time.perf_counter()
+    idx.rebuild()
+    build_ms = (time.perf_counter() - t0) * 1000
+
+    rng = random.Random(args.seed + 1)
+    label, row_key, fields, _sort = ENTITY_KINDS["product"]
+    rows = data[label]
+    queries = []
+    for _ in range(args.queries):
+        r = rng.choice(rows)
+        queries.append(rng.choice([r["name"], r["product_id"][:12], r["display_name_zh"].split()[-1], r["name"][:5]]))
+
+    t0 = time.perf_counter()
+    contains_results = [_contains_scan(rows, fields, q) for q in queries]
+    contains_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    index_results = [idx.search("product", q, limit=args.limit) for q in queries]
+    index_s = time.perf_counter() - t0
+
+    recall_num = recall_den = 0
+    for c_rows, i_rows in zip(contains_results, index_results):
+        got = {id(r[row_key]) for r in i_rows}
+        want = [id(r) for r in c_rows]
+        # 只比较 CONTAINS 命中数不超过 limit 的查询：超过时两边截断的位置不同是正常的
+        if len(want) <= args.limit:
+            recall_num += sum(1 for w in want if w in got)
+            recall_den += len(want)
+
+    typo_queries = [_typo(rng, rng.choice(rows)["name"]) for _ in range(args.queries)]
+    typo_contains = sum(1 for q in typo_queries if _contains_scan(rows, fields, q))
+    typo_index = sum(1 for q in typo_queries if idx.search("product", q, limit=1))
+
+    n = args.queries
+    print(f"entities: {idx.stats()['entities']}  index build: {build_ms:.0f} ms")
+    print(f"contains_scan : {contains_s / n * 1000:8.3f} ms/query")
+    print(f"entity_index  : {index_s / n * 1000:8.3f} ms/query")
+    print(f"recall of CONTAINS hits: {recall_num}/{recall_den}")
+    print(f"typo queries answered: contains={typo_contains}/{n}  index={typo_index}/{n}")
+
+
+def run_neo4j(args) -> None:
+    from src.kb_chat import service
+
+    products = service.run_cypher("MATCH (p:Product) RETURN p.name AS name LIMIT $limit", {"limit": args.queries})
+    keywords = [str(r.get("name")) for r in products if r.get("name")]
+    if not keywords:
+        print("no products in graph")
+        return
+
+    def timed(enabled: str):
+        os.environ["KBCHAT_ENTITY_INDEX"] = enabled
+        t0 = time.perf_counter()
+        for kw in keywords:
+            for v in service._keyword_variants(kw):
+                service._list_products(keyword=v, limit=args.limit)
+                service._list_material_codes(keyword=v, limit=args.limit)
+        return (time.perf_counter() - t0) / len(keywords) * 1000
+
+    contains_ms = timed("0")
+    t0 = time.perf_counter()
+    service.entity_index.rebuild()
+    build_ms = (time.perf_counter() - t0) * 1000
+    index_ms = timed("1")
+    print(f"keywords: {len(keywords)}  index build: {build_ms:.0f} ms  {service.entity_index.stats()['entities']}")
+    print(f"CONTAINS path : {contains_ms:8.2f} ms per message (all variants, products+materials)")
+    print(f"entity index  : {index_ms:8.2f} ms per message")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark entity n-gram index against CONTAINS scans")
+    parser.add_argument("--products", type=int, default=20_000)
+    parser.add_argument("--materials", type=int, default=50_000)
+    parser.add_argument("--accessories", type=int, default=2_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--neo4j", action="store_true", help="benchmark against the configured Neo4j instead of synthetic data")
+    args = parser.parse_args()
+    if args.neo4j:
+        run_neo4j(args)
+    else:
+        run_synthetic(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+负载测试：长时间 LLM 请求进行中时，/api/products 的 p50/p99 延迟是否保持平稳。
+
+在进程内启动 uvicorn，把 Neo4j 查询、LLM 生成、手动 OCR 会话和 ACE 绘图替换成
+固定耗时的假实现（不需要 Neo4j / 模型），然后：
+  1. 基线：只压 /api/products
+  2. 同时有 --llm-concurrency 个 /api/specsheet/from_ocr_docs 长请求在跑
+  3. 同时有 --sessions 个 /api/manual-sessions/{id}/ocr 长会话在跑，
+     并探测走 cpu 池的 /api/prompt-playbooks/plots/accuracy
+
+--inline 会把 run_db/run_llm 换成直接在事件循环上调用，用来复现旧行为；
+--sessions-on-cpu 让会话编排占用 cpu 池（旧行为），用来复现绘图等 cpu 调用被饿死。
+
+用法（在 backend 目录下）：
+    python tools/load_test_products.py --llm-seconds 20 --llm-concurrency 4
+    python tools/load_test_products.py --inline
+    python tools/load_test_products.py --sessions-on-cpu
+"""
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import uvicorn
+
+import api_server
+from src import executors, manual_ocr
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def _get(url: str) -> float:
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=120) as resp:
+        resp.read()
+    return (time.perf_counter() - t0) * 1000
+
+
+def _post(url: str, payload: dict) -> None:
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=600) as resp:
+            resp.read()
+    except Exception:
+        # 假的生成结果不一定能通过 response_model 校验，这里只关心占用时长
+        pass
+
+
+def _hammer(base: str, seconds: float, clients: int, path: str = "/api/products"):
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+
+    def _worker():
+        while time.time() < deadline:
+            ms = _get(f"{base}{path}")
+            with lock:
+                latencies.append(ms)
+
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for _ in range(clients):
+            pool.submit(_worker)
+    return latencies
+
+
+def _report(name: str, latencies):
+    print(
+        f"{name:<22} n={len(latencies):5d}  p50={_percentile(latencies, 50):8.1f} ms  "
+        f"p99={_percentile(latencies, 99):8.1f} ms  max={max(latencies or [0]):8.1f} ms"
+        + (f"  mean={statistics.mean(latencies):.1f} ms" if latencies else "")
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test /api/products during long LLM calls")
+    parser.add_argument("--port", type=int, default=18081)
+    parser.add_argument("--db-ms", type=float, default=5.0, help="fake Neo4j latency for /api/products")
+    parser.add_argument("--llm-seconds", type=float, default=10.0, help="fake LLM generation time")
+    parser.add_argument("--llm-concurrency", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=8.0)
+    parser.add_argument("--inline", action="store_true", help="run blocking calls on the event loop (old behaviour)")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent fake manual OCR sessions")
+    parser.add_argument("--session-seconds", type=float, default=10.0, help="fake manual OCR session duration")
+    parser.add_argument("--plot-ms", type=float, default=20.0, help="fake plot render time (cpu pool probe)")
+    parser.add_argument(
+        "--sessions-on-cpu", action="store_true", help="run session orchestrators on the cpu pool (old behaviour)"
+    )
+    args = parser.parse_args()
+
+    def fake_products():
+        time.sleep(args.db_ms / 1000.0)
+        return [f"product-{i}" for i in range(50)]
+
+    def fake_specsheet(_payload):
+        time.sleep(args.llm_seconds)
+        raise ValueError("load-test fake generation")
+
+    def fake_session(session_id):
+        time.sleep(args.session_seconds)
+        return {"session_id": session_id}
+
+    plot_dir = Path(tempfile.mkdtemp(prefix="load-test-plots-"))
+
+    class _FakeAceManager:
+        def render_plot(self, kind):
+            time.sleep(args.plot_ms / 1000.0)
+            path = plot_dir / f"{kind}.png"
+            path.write_bytes(b"\x89PNG\r\n\x1a\n")
+            return path
+
+    api_server.get_all_product_names = fake_products
+    api_server.generate_specsheet_from_ocr_request = fake_specsheet
+    api_server.get_ace_manager = lambda _playbook_type: _FakeAceManager()
+    manual_ocr._run_manual_session_sync = fake_session
+    if args.sessions_on_cpu:
+        manual_ocr.run_session = executors.run_cpu
+    if args.inline:
+        async def _inline(fn, *a, **kw):
+            return fn(*a, **kw)
+
+        api_server.run_db = _inline
+        api_server.run_llm = _inline
+
+    config = uvicorn.Config(api_server.app, host="127.0.0.1", port=args.port, log_level="warning", lifespan="off")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    base = f"http://127.0.0.1:{args.port}"
+
+    print(
+        f"mode={'inline' if args.inline else 'pooled'} db={args.db_ms}ms llm={args.llm_seconds}s x{args.llm_concurrency} "
+        f"sessions={args.session_seconds}s x{args.sessions} on {'cpu' if args.sessions_on_cpu else 'session'} pool"
+    )
+    plot_path = "/api/prompt-playbooks/plots/accuracy"
+    _report("baseline", _hammer(base, args.duration, args.clients))
+    _report("plot baseline", _hammer(base, min(args.duration, 3.0), 1, plot_path))
+
+    # 不同的 product_name，避免任务队列把相同请求合并成一个任务
+    llm_threads = [
+        threading.Thread(
+            target=_post,
+            args=(
+                f"{base}/api/specsheet/from_ocr_docs",
+                {"documents": [{"name": "doc.md", "text": "x"}], "product_name": f"load-test-{i}"},
+            ),
+            daemon=True,
+        )
+        for i in range(args.llm_concurrency)
+    ]
+    for t in llm_threads:
+        t.start()
+    time.sleep(0.2)
+    _report("during long LLM calls", _hammer(base, min(args.duration, args.llm_seconds), args.clients))
+    for t in llm_threads:
+        t.join()
+
+    if args.sessions > 0:
+        session_threads = [
+            threading.Thread(target=_post, args=(f"{base}/api/manual-sessions/load-test-{i}/ocr", {}), daemon=True)
+            for i in range(args.sessions)
+        ]
+        for t in session_threads:
+            t.start()
+        time.sleep(0.2)
+        window = min(args.duration, args.session_seconds)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            products = pool.submit(_hammer, base, window, args.clients)
+            plots = pool.submit(_hammer, base, window, 1, plot_path)
+            _report("during OCR sessions", products.result())
+            _report("plot during sessions", plots.result())
+        for t in session_threads:
+            t.join()
+
+    print(json.dumps(executors.executor_stats(), ensure_ascii=False))
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()